@@ -5,7 +5,7 @@ import asyncio
 import json
 import random
 from concurrent.futures import ThreadPoolExecutor
-from typing import Any, AsyncGenerator, Dict, Iterator, Tuple, Union
+from typing import Any, AsyncGenerator, Dict, Iterator, List, Tuple, Union, cast
 
 from django.conf import settings
 
@@ -14,6 +14,7 @@ from ...utils.appserver import (
     AppserverRequestError,
     appserver_open_http_request,
     appserver_open_websocket,
+    appserver_run_job,
     iter_pingable_appservers,
 )
 from ...utils.balancer import balancer_open_http_request, iter_pingable_balancers
@@ -35,10 +36,10 @@ def reload_nginx_on_appservers(
     with ThreadPoolExecutor(max_workers=len(appserver_list)) as executor:
         future_map = {
             executor.submit(
-                appserver_open_http_request,
+                appserver_run_job,
                 appserver,
-                "/sites/reload-nginx",
-                method="POST",
+                "reload-nginx",
+                {},
                 timeout=timeout,
             ): appserver
             for appserver in appserver_list
@@ -64,6 +65,31 @@ def find_pingable_appservers(  # pylint: disable=unused-argument
     scope["pingable_appservers"] = pingable_appservers
 
 
+def run_site_batch(
+    appserver: int,
+    site: Site,
+    steps: List[Dict[str, Any]],
+    *,
+    timeout: Union[int, float] = 180,
+) -> List[Dict[str, Any]]:
+    """Runs several actions on the given site on one appserver, in order, stopping at the first
+    one that fails. The site's data is only sent once. Each step is a dictionary with an "op" key
+    (like "update-nginx" or "reload-nginx") and any extra parameters that step needs.
+
+    Returns one {"status": "ok"|"error"|"skipped"} dictionary (with an "error" message for
+    failures) per step.
+
+    """
+    job = appserver_run_job(
+        appserver,
+        "site-batch",
+        {"site_id": site.id, "data": site.serialize_for_appserver(), "steps": steps},
+        timeout=timeout,
+    )
+
+    return cast(List[Dict[str, Any]], job["output"]["results"])
+
+
 def update_appserver_nginx_config(
     site: Site, scope: Dict[str, Any]
 ) -> Iterator[Union[Tuple[str, str], str]]:
@@ -72,13 +98,12 @@ def update_appserver_nginx_config(
     try:
         yield "Connecting to appserver {} to update Nginx config".format(appserver)
 
-        appserver_open_http_request(
-            appserver,
-            "/sites/{}/update-nginx".format(site.id),
-            method="POST",
-            data={"data": json.dumps(site.serialize_for_appserver())},
-            timeout=60,
+        # Update the config and reload Nginx on this appserver in one round trip
+        update_result, reload_result = run_site_batch(
+            appserver, site, [{"op": "update-nginx"}, {"op": "reload-nginx"}], timeout=180
         )
+        if update_result["status"] != "ok":
+            raise AppserverProtocolError(update_result["error"])
     except AppserverRequestError as ex:
         # If an error occurs, disable the Nginx config
         yield "Error updating Nginx config: {}: {}".format(ex.__class__.__name__, ex)
@@ -101,7 +126,16 @@ def update_appserver_nginx_config(
         try:
             for i in scope["pingable_appservers"]:
                 yield "Reloading Nginx config on appserver {}".format(i)
-            reload_nginx_on_appservers(scope["pingable_appservers"], timeout=180)
+
+            if reload_result["status"] != "ok":
+                raise AppserverProtocolError(
+                    "appserver {}: {}".format(appserver, reload_result["error"])
+                )
+
+            # It was already reloaded on the appserver that updated the config
+            reload_nginx_on_appservers(
+                (i for i in scope["pingable_appservers"] if i != appserver), timeout=180
+            )
         except AppserverRequestError as ex:
             # Error reloading; disable config
             # We're probably fine not reloading Nginx
@@ -153,11 +187,11 @@ def update_docker_service(
     appserver = random.choice(scope["pingable_appservers"])
 
     yield "Connecting to appserver {} to create/update Docker service".format(appserver)
-    appserver_open_http_request(
+    appserver_run_job(
         appserver,
-        "/sites/{}/update-docker-service".format(site.id),
-        method="POST",
-        data={"data": json.dumps(site.serialize_for_appserver())},
+        "update-docker-service",
+        {"site_id": site.id, "data": site.serialize_for_appserver()},
+        timeout=60,
     )
 
     yield "Created/updated Docker service"
@@ -250,21 +284,11 @@ def remove_docker_image(  # pylint: disable=unused-argument
     for i in range(settings.DIRECTOR_NUM_APPSERVERS):
         yield "Removing Docker image on appserver {}".format(i)
 
-        appserver_open_http_request(
-            i,
-            "/sites/remove-docker-image",
-            params={"name": site.docker_image.name},
-            method="POST",
-        )
+        appserver_run_job(i, "remove-docker-image", {"name": site.docker_image.name}, timeout=60)
 
         yield "Removing Docker image from registry on appserver {}".format(i)
 
-        appserver_open_http_request(
-            i,
-            "/sites/remove-registry-image",
-            params={"name": site.docker_image.name},
-            method="POST",
-        )
+        appserver_run_job(i, "remove-registry-image", {"name": site.docker_image.name}, timeout=60)
 
 
 def ensure_site_directories_exist(
@@ -373,11 +397,10 @@ def delete_site_database_and_object(  # pylint: disable=unused-argument
     appserver_num = random.choice(scope["pingable_appservers"])
 
     yield "Connecting to appserver {} to delete real database".format(appserver_num)
-    appserver_open_http_request(
+    appserver_run_job(
         appserver_num,
-        "/sites/databases/delete",
-        method="POST",
-        data={"data": json.dumps(site.database.serialize_for_appserver())},
+        "delete-database",
+        {"data": site.database.serialize_for_appserver()},
         timeout=30,
     )
 
@@ -392,11 +415,10 @@ def create_real_site_database(site: Site, scope: Dict[str, Any]):  # pylint: dis
 
     yield "Connecting to appserver {} to create real site database".format(appserver_num)
 
-    appserver_open_http_request(
+    appserver_run_job(
         appserver_num,
-        "/sites/databases/create",
-        method="POST",
-        data={"data": json.dumps(site.database.serialize_for_appserver())},
+        "create-database",
+        {"data": site.database.serialize_for_appserver()},
         timeout=30,
     )
 
@@ -413,10 +435,9 @@ def regen_database_password(site: Site, scope: Dict[str, Any]):  # pylint: disab
 
     yield "Connecting to appserver {} to update real password".format(appserver_num)
 
-    appserver_open_http_request(
+    appserver_run_job(
         appserver_num,
-        "/sites/databases/create",
-        method="POST",
-        data={"data": json.dumps(site.database.serialize_for_appserver())},
+        "create-database",
+        {"data": site.database.serialize_for_appserver()},
         timeout=30,
     )
@@ -3,6 +3,8 @@
 
 import asyncio
 import json
+import logging
+import random
 import urllib.parse
 from typing import Any, Dict, List, Optional, Union, cast
 
@@ -14,12 +16,16 @@ from websockets.legacy.client import WebSocketClientProtocol
 from django.conf import settings
 
 from ...utils.appserver import (
+    AppserverRequestError,
+    appserver_open_http_request,
     appserver_open_websocket,
     iter_pingable_appservers,
     iter_random_pingable_appservers,
 )
 from .models import Action, Database, Site
 
+logger = logging.getLogger(__name__)
+
 
 def serialize_action_for_user(action: Action, datetime_format: str) -> Dict[str, Any]:
     """Serialize an Action for the site owner's site-info view.
@@ -41,6 +47,36 @@ def serialize_action_for_user(action: Action, datetime_format: str) -> Dict[str,
     }
 
 
+def fetch_multi_site_status(site_ids: List[int]) -> List[Dict[str, Any]]:
+    """Fetches the current statuses of the given sites from an appserver in one request.
+
+    Returns a list of {"site_id": ..., "status": ...} dictionaries (the same format as the
+    messages from the multi-status websocket), or an empty list if no appserver could provide them.
+    """
+    if not site_ids:
+        return []
+
+    appserver = next(iter_random_pingable_appservers(timeout=0.5), None)
+    if appserver is None:
+        return []
+
+    try:
+        # The IDs are sent in the body; there can be too many to fit in the request line
+        return cast(
+            List[Dict[str, Any]],
+            appserver_open_http_request(
+                appserver,
+                "/sites/status",
+                method="POST",
+                data={"site_ids": json.dumps(site_ids)},
+                timeout=5,
+            ).json(),
+        )
+    except (AppserverRequestError, ValueError):
+        logger.exception("Error fetching the statuses of %d sites", len(site_ids))
+        return []
+
+
 @database_sync_to_async
 def get_recoverable_failed_operation_type(site: Site) -> Optional[str]:
     operation = site.get_operation()
@@ -411,6 +447,129 @@ class SiteTerminalConsumer(AsyncWebsocketConsumer):
                 await self.close()
 
 
+class SiteDatabaseConsoleConsumer(AsyncWebsocketConsumer):
+    """Proxies an SQL console session to an appserver, which keeps one connection to the site's
+    database open for as long as the websocket is (see the orchestrator's
+    database_console_handler() for the protocol)."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.site: Optional[Site] = None
+        self.connected = False
+
+        self.console_websock: Optional[WebSocketClientProtocol] = None
+
+    async def connect(self) -> None:
+        if not self.scope["user"].is_authenticated:
+            await self.close()
+            return
+
+        site_id = int(self.scope["url_route"]["kwargs"]["site_id"])
+        try:
+            self.site = await get_site_for_user(
+                self.scope["user"], id=site_id, database__isnull=False
+            )
+        except Site.DoesNotExist:
+            await self.close()
+            return
+
+        assert self.site is not None
+        await self.channel_layer.group_add(
+            self.site.channels_group_name,
+            self.channel_name,
+        )
+
+        self.connected = True
+        await self.accept()
+
+        await self.open_console_connection()
+
+        if self.connected:
+            loop = asyncio.get_event_loop()
+            loop.create_task(self.mainloop())
+
+    async def open_console_connection(self) -> None:
+        assert self.site is not None
+
+        database_info = await serialize_site_database_for_appserver(self.site)
+
+        # Any appserver will do, so start with a random one and move on to the next if it can't be
+        # reached (without pinging them all first)
+        appserver_num = random.randrange(settings.DIRECTOR_NUM_APPSERVERS)
+
+        for i in range(settings.DIRECTOR_NUM_APPSERVERS):
+            try:
+                console_websock = await asyncio.wait_for(
+                    appserver_open_websocket(
+                        (appserver_num + i) % settings.DIRECTOR_NUM_APPSERVERS,
+                        "/ws/sites/{}/database/console".format(self.site.id),
+                    ),
+                    timeout=1,
+                )
+                break
+            except (OSError, asyncio.TimeoutError, websocket_exceptions.InvalidHandshake):
+                pass
+        else:
+            self.connected = False
+            await self.close()
+            return
+
+        try:
+            await console_websock.send(json.dumps(database_info))
+
+            # See SiteTerminalConsumer.open_terminal_connection()
+            self.console_websock = console_websock
+        except (OSError, asyncio.TimeoutError, websocket_exceptions.WebSocketException):
+            self.connected = False
+            await self.close()
+
+    async def mainloop(self) -> None:
+        assert self.console_websock is not None
+
+        while True:
+            try:
+                msg = await self.console_websock.recv()
+            except websocket_exceptions.ConnectionClosed:
+                await self.close()
+                break
+
+            if isinstance(msg, str):
+                await self.send(text_data=msg)
+
+    async def site_updated(self, event: Dict[str, Any]) -> None:  # pylint: disable=unused-argument
+        if self.site is not None:
+            await database_sync_to_async(self.site.refresh_from_db)()
+
+            if self.site.database_id is None or not await database_sync_to_async(
+                self.site.can_be_edited_by
+            )(self.scope["user"]):
+                await self.close()
+
+    async def operation_updated(
+        self,
+        event: Dict[str, Any],  # pylint: disable=unused-argument
+    ) -> None:
+        pass
+
+    async def disconnect(self, code: int) -> None:  # pylint: disable=unused-argument
+        self.site = None
+        self.connected = False
+
+        # This closes the connection to the database too
+        if self.console_websock is not None:
+            await self.console_websock.close()
+            self.console_websock = None
+
+    async def receive(
+        self, text_data: Optional[str] = None, bytes_data: Optional[bytes] = None
+    ) -> None:
+        if self.connected and self.console_websock is not None and text_data is not None:
+            try:
+                await self.console_websock.send(text_data)
+            except websocket_exceptions.ConnectionClosed:
+                await self.close()
+
+
 class SiteMonitorConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args: Any, **kwargs: Any):
         super().__init__(*args, **kwargs)
@@ -766,3 +925,9 @@ class MultiSiteStatusConsumer(AsyncWebsocketConsumer):
 @database_sync_to_async
 def get_site_for_user(user, **kwargs: Any) -> Site:
     return cast(Site, Site.objects.editable_by_user(user).get(**kwargs))
+
+
+@database_sync_to_async
+def serialize_site_database_for_appserver(site: Site) -> Dict[str, Any]:
+    assert site.database is not None
+    return site.database.serialize_for_appserver()
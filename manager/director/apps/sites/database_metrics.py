@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .database_placement import (
+    COUNTER_CACHE_TIME,
+    calculate_counter_rate,
+    request_database_host_stats,
+)
+from .models import DatabaseHost, Site
+
+SITE_DATABASE_STATS_CACHE_KEY = "site_database_stats"
+TRANSACTION_COUNTERS_CACHE_KEY = "site_database_transaction_counters"
+
+SITE_DATABASE_NAME_REGEX = re.compile(r"^site_(\d+)$")
+
+
+def fetch_site_database_stats() -> Dict[int, Dict[str, Any]]:
+    """Collects statistics on all the site databases from an appserver (with one query per database
+    host) and caches them (see get_site_database_stats()).
+
+    Returns a dictionary mapping site IDs to their databases' statistics. Sites whose databases'
+    statistics couldn't be collected are left out.
+
+    """
+    hosts: List[DatabaseHost] = list(
+        DatabaseHost.objects.filter(database__isnull=False).distinct().order_by("id")
+    )
+    if not hosts:
+        return {}
+
+    results = request_database_host_stats("/sites/databases/stats", hosts, timeout=60)
+    if results is None:
+        return {}
+
+    # Databases left over on a host after being moved or deleted are ignored
+    site_database_hosts: Dict[int, int] = dict(
+        Site.objects.filter(database__isnull=False).values_list("id", "database__host_id")
+    )
+
+    now = time.time()
+
+    previous_counters: Dict[Tuple[int, int], Tuple[float, int]] = (
+        cache.get(TRANSACTION_COUNTERS_CACHE_KEY) or {}
+    )
+    counters: Dict[Tuple[int, int], Tuple[float, int]] = {}
+
+    stats: Dict[int, Dict[str, Any]] = {}
+
+    for host, result in zip(hosts, results):
+        if result.get("status") != "ok":
+            continue
+
+        for database_stats in result["databases"]:
+            match = SITE_DATABASE_NAME_REGEX.match(database_stats["db_name"])
+            if match is None:
+                continue
+
+            site_id = int(match.group(1))
+            if site_database_hosts.get(site_id) != host.id:
+                continue
+
+            site_stats = {
+                "host_id": host.id,
+                "size": database_stats["size"],
+                "connections": database_stats["connections"],
+                "slow_queries": database_stats["slow_queries"],
+                "transactions_per_second": None,
+                "updated_time": now,
+            }
+
+            transactions = database_stats["transactions"]
+            if transactions is not None:
+                site_stats["transactions_per_second"] = calculate_counter_rate(
+                    previous_counters.get((host.id, site_id)), now, transactions
+                )
+                counters[(host.id, site_id)] = (now, transactions)
+
+            stats[site_id] = site_stats
+
+    cache.set(TRANSACTION_COUNTERS_CACHE_KEY, counters, timeout=COUNTER_CACHE_TIME)
+    cache.set(
+        SITE_DATABASE_STATS_CACHE_KEY,
+        stats,
+        timeout=settings.DIRECTOR_SITE_DATABASE_STATS_CACHE_TIME,
+    )
+
+    return stats
+
+
+def get_site_database_stats() -> Dict[int, Dict[str, Any]]:
+    """Gets statistics on all the site databases: their size in bytes ("size"), the number of
+    connections to them ("connections"), the number of queries that have been running for more
+    than a few seconds ("slow_queries"), and the number of transactions run per second
+    ("transactions_per_second", which is None until there are two samples and always None for
+    MySQL databases).
+
+    Statistics are collected periodically by Celery beat (see refresh_site_database_stats()) and
+    cached for ``settings.DIRECTOR_SITE_DATABASE_STATS_CACHE_TIME`` seconds. This never queries the
+    databases itself; if none are cached, it returns an empty dictionary.
+
+    Returns a dictionary mapping site IDs to their databases' statistics.
+
+    """
+    stats: Dict[int, Dict[str, Any]] = cache.get(SITE_DATABASE_STATS_CACHE_KEY) or {}
+    return stats
+
+
+def refresh_site_database_stats() -> None:
+    """Collects statistics on all the site databases, so they're always cached (and so transaction
+    rates are computed over regular intervals)."""
+    fetch_site_database_stats()
@@ -0,0 +1,219 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from ...utils.appserver import (
+    AppserverRequestError,
+    appserver_open_http_request,
+    iter_random_pingable_appservers,
+)
+from .models import DatabaseHost
+
+logger = logging.getLogger(__name__)
+
+# Counters are kept for longer than the statistics computed from them, so there's a previous
+# sample to compute a rate from when they're refreshed
+COUNTER_CACHE_TIME = 24 * 60 * 60
+
+
+def get_stats_cache_key(host_id: int) -> str:
+    return "database_host_stats:{}".format(host_id)
+
+
+def get_query_counter_cache_key(host_id: int) -> str:
+    return "database_host_query_counter:{}".format(host_id)
+
+
+def calculate_counter_rate(
+    previous: Optional[Tuple[float, int]], now: float, value: int
+) -> Optional[float]:
+    """Turns a counter into a rate per second since the previous sample (a (time, value) tuple, as
+    cached for ``COUNTER_CACHE_TIME`` seconds).
+
+    Returns None if there is no previous sample, or if the counter went backwards (because the
+    database server was restarted).
+
+    """
+    if previous is None:
+        return None
+
+    previous_time, previous_value = previous
+    if now <= previous_time or value < previous_value:
+        return None
+
+    return (value - previous_value) / (now - previous_time)
+
+
+def request_database_host_stats(
+    path: str, hosts: Sequence[DatabaseHost], *, timeout: int
+) -> Optional[List[Dict[str, Any]]]:
+    """Sends the given hosts to an orchestrator endpoint that collects statistics on each of them
+    (like /sites/databases/host-stats) on a random appserver.
+
+    Returns the list of per-host results, in the same order as ``hosts``, or None if they couldn't
+    be collected.
+
+    """
+    appserver = next(iter_random_pingable_appservers(timeout=0.5), None)
+    if appserver is None:
+        return None
+
+    try:
+        results: List[Dict[str, Any]] = appserver_open_http_request(
+            appserver,
+            path,
+            method="POST",
+            data={"hosts": json.dumps([host.serialize_for_appserver() for host in hosts])},
+            timeout=timeout,
+        ).json()["results"]
+    except (AppserverRequestError, ValueError, KeyError, TypeError):
+        logger.exception("Error collecting database statistics from %s", path)
+        return None
+
+    return results
+
+
+def fetch_database_host_stats(
+    hosts: Sequence[DatabaseHost],
+) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Collects statistics on the site databases on the given hosts from an appserver and caches
+    them (see get_database_host_stats()).
+
+    Returns a dictionary mapping the hosts' IDs to their statistics, or to None if they couldn't
+    be collected.
+
+    """
+    stats: Dict[int, Optional[Dict[str, Any]]] = {host.id: None for host in hosts}
+    if not hosts:
+        return stats
+
+    results = request_database_host_stats("/sites/databases/host-stats", hosts, timeout=30)
+    if results is None:
+        return stats
+
+    now = time.time()
+
+    for host, result in zip(hosts, results):
+        if result.get("status") != "ok":
+            continue
+
+        host_stats = dict(result["stats"])
+        queries = host_stats.pop("queries")
+
+        host_stats["queries_per_second"] = calculate_counter_rate(
+            cache.get(get_query_counter_cache_key(host.id)), now, queries
+        )
+        host_stats["updated_time"] = now
+
+        cache.set(get_query_counter_cache_key(host.id), (now, queries), timeout=COUNTER_CACHE_TIME)
+        cache.set(
+            get_stats_cache_key(host.id),
+            host_stats,
+            timeout=settings.DIRECTOR_DATABASE_HOST_STATS_CACHE_TIME,
+        )
+
+        stats[host.id] = host_stats
+
+    return stats
+
+
+def get_database_host_stats(
+    hosts: Sequence[DatabaseHost], *, fetch_missing: bool = True
+) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Gets statistics on the site databases on the given hosts: the number of databases
+    ("num_databases"), their total size in bytes ("total_size"), the number of connections to them
+    ("connections") and how many are running a query ("active_connections"), and the number of
+    transactions (Postgres) or statements (MySQL) run per second ("queries_per_second", which is
+    None until there are two samples).
+
+    Statistics are cached for ``settings.DIRECTOR_DATABASE_HOST_STATS_CACHE_TIME`` seconds. If
+    ``fetch_missing`` is True, they are collected for any hosts that don't have any cached.
+
+    Returns a dictionary mapping the hosts' IDs to their statistics, or to None if they aren't
+    available.
+
+    """
+    cached = cache.get_many([get_stats_cache_key(host.id) for host in hosts])
+
+    stats: Dict[int, Optional[Dict[str, Any]]] = {
+        host.id: cached.get(get_stats_cache_key(host.id)) for host in hosts
+    }
+
+    if fetch_missing:
+        missing = [host for host in hosts if stats[host.id] is None]
+        if missing:
+            stats.update(fetch_database_host_stats(missing))
+
+    return stats
+
+
+def calculate_database_host_loads(stats: Dict[int, Dict[str, Any]]) -> Dict[int, float]:
+    """Calculates the load on each of the given hosts from their statistics, as a weighted sum (see
+    ``settings.DIRECTOR_DATABASE_HOST_LOAD_WEIGHTS``). Each statistic is scaled relative to the
+    highest value among the hosts first, so they can be compared."""
+    loads = {host_id: 0.0 for host_id in stats}
+
+    for name, weight in settings.DIRECTOR_DATABASE_HOST_LOAD_WEIGHTS.items():
+        values = {
+            host_id: float(host_stats.get(name) or 0) for host_id, host_stats in stats.items()
+        }
+
+        highest = max(values.values(), default=0)
+        if highest > 0:
+            for host_id, value in values.items():
+                loads[host_id] += weight * value / highest
+
+    return loads
+
+
+def choose_database_host(dbms: str) -> DatabaseHost:
+    """Chooses the least loaded database host of the given type to put a new database on (see
+    calculate_database_host_loads()).
+
+    Hosts whose statistics can't be collected are skipped. If none of them can be collected, the
+    host with the fewest databases (going by our own records) is chosen.
+
+    Raises DatabaseHost.DoesNotExist if there are no hosts of the given type.
+
+    """
+    hosts: List[DatabaseHost] = list(
+        DatabaseHost.objects.filter(dbms=dbms)
+        .annotate(num_databases=Count("database"))
+        .order_by("num_databases", "id")
+    )
+
+    if not hosts:
+        raise DatabaseHost.DoesNotExist("No {} database hosts".format(dbms))
+
+    if len(hosts) == 1:
+        return hosts[0]
+
+    stats = get_database_host_stats(hosts)
+
+    available_stats = {
+        host_id: host_stats for host_id, host_stats in stats.items() if host_stats is not None
+    }
+    if not available_stats:
+        logger.warning("No statistics available for %s database hosts", dbms)
+        return hosts[0]
+
+    loads = calculate_database_host_loads(available_stats)
+
+    return min(
+        (host for host in hosts if host.id in loads),
+        key=lambda host: (loads[host.id], host.id),
+    )
+
+
+def refresh_database_host_stats() -> None:
+    """Collects statistics on all the database hosts, so they're always cached (and so query rates
+    are computed over regular intervals)."""
+    fetch_database_host_stats(list(DatabaseHost.objects.order_by("id")))
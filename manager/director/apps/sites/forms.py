@@ -3,15 +3,17 @@
 
 import re
 import string
-from typing import Any, Dict
+from typing import Any, Dict, Union, cast
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core import validators
 from django.core.exceptions import ValidationError
+from django.template.defaultfilters import filesizeformat
 from django.utils.safestring import mark_safe
 
+from .database_placement import get_database_host_stats
 from .models import (
     DatabaseHost,
     DockerImage,
@@ -253,9 +255,58 @@ class SiteMetaForm(forms.ModelForm):
 
 
 class DatabaseCreateForm(forms.Form):
-    host = forms.ModelChoiceField(
-        queryset=DatabaseHost.objects.all(), widget=forms.RadioSelect(), empty_label=None
-    )
+    """Lets the user pick a database type, in which case the least loaded host of that type is
+    chosen when the database is created, or a specific database host. The cleaned "host" is either
+    a DBMS name (like "postgres") or a DatabaseHost."""
+
+    AUTOMATIC_HOST_PREFIX = "auto-"
+
+    host = forms.ChoiceField(widget=forms.RadioSelect())
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+
+        hosts = list(DatabaseHost.objects.order_by("dbms", "id"))
+        # Only show statistics that have already been collected; this shouldn't be slow
+        stats = get_database_host_stats(hosts, fetch_missing=False)
+
+        choices = [
+            (
+                self.AUTOMATIC_HOST_PREFIX + dbms,
+                "{} (on the least loaded server)".format(dbms_display),
+            )
+            for dbms, dbms_display in DatabaseHost.DBMS_TYPES
+            if any(host.dbms == dbms for host in hosts)
+        ]
+
+        for host in hosts:
+            host_stats = stats.get(host.id)
+            if host_stats is not None:
+                label = "{} - {} databases, {}, {} active connections".format(
+                    host,
+                    host_stats["num_databases"],
+                    filesizeformat(host_stats["total_size"]),
+                    host_stats["active_connections"],
+                )
+            else:
+                label = str(host)
+
+            choices.append((str(host.id), label))
+
+        cast(forms.ChoiceField, self.fields["host"]).choices = choices
+        if choices:
+            self.fields["host"].initial = choices[0][0]
+
+    def clean_host(self) -> Union[str, DatabaseHost]:
+        value = self.cleaned_data["host"]
+
+        if value.startswith(self.AUTOMATIC_HOST_PREFIX):
+            return value[len(self.AUTOMATIC_HOST_PREFIX) :]
+
+        try:
+            return DatabaseHost.objects.get(id=int(value))
+        except (ValueError, DatabaseHost.DoesNotExist) as ex:
+            raise ValidationError("Invalid database host") from ex
 
 
 class ImageSelectForm(forms.Form):
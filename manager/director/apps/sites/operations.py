@@ -1,7 +1,7 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
-from typing import List
+from typing import List, Optional
 
 from .helpers import send_operation_updated_message
 from .models import DatabaseHost, Operation, Site
@@ -37,9 +37,16 @@ def regen_nginx_config(site: Site) -> None:
     send_operation_updated_message(site)
 
 
-def create_database(site: Site, database_host: DatabaseHost) -> None:
+def create_database(
+    site: Site, database_host: Optional[DatabaseHost] = None, *, dbms: Optional[str] = None
+) -> None:
+    """Creates a database for the site on the given host, or on the least loaded host of the given
+    type if ``database_host`` is None."""
     operation = Operation.objects.create(site=site, type="create_site_database")
-    create_database_task.delay(operation.id, database_host.id)
+    if database_host is not None:
+        create_database_task.delay(operation.id, database_host.id)
+    else:
+        create_database_task.delay(operation.id, None, dbms)
 
     send_operation_updated_message(site)
 
@@ -3,7 +3,7 @@
 # pylint: disable=unused-variable
 
 import random
-from typing import Any, Dict, Iterator, List, Tuple, Union
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 from celery import shared_task
 
@@ -13,6 +13,8 @@ from django.contrib.auth import get_user_model
 from ...utils.appserver import appserver_open_http_request
 from ...utils.secret_generator import gen_database_password
 from . import actions
+from .database_metrics import refresh_site_database_stats
+from .database_placement import choose_database_host, refresh_database_host_stats
 from .helpers import auto_run_operation_wrapper, send_site_updated_message
 from .models import (
     Database,
@@ -151,14 +153,34 @@ def regen_nginx_config_task(operation_id: int) -> None:
 
 
 @shared_task
-def create_database_task(operation_id: int, database_host_id: int) -> None:
-    scope: Dict[str, Any] = {"database_host": DatabaseHost.objects.get(id=database_host_id)}
+def create_database_task(
+    operation_id: int, database_host_id: Optional[int], dbms: Optional[str] = None
+) -> None:
+    # If database_host_id is None, the least loaded host of type dbms is chosen
+    scope: Dict[str, Any] = {
+        "database_host": (
+            DatabaseHost.objects.get(id=database_host_id) if database_host_id is not None else None
+        ),
+        "dbms": dbms,
+    }
 
     site = Site.objects.get(operation__id=operation_id)
 
     with auto_run_operation_wrapper(operation_id, scope) as wrapper:
         wrapper.add_action("Pinging appservers", actions.find_pingable_appservers)
 
+        if database_host_id is None:
+
+            @wrapper.add_action("Choosing database host")
+            def choose_host(
+                site: Site, scope: Dict[str, Any]
+            ) -> Iterator[Union[Tuple[str, str], str]]:
+                yield "Choosing the least loaded {} host".format(scope["dbms"])
+
+                scope["database_host"] = choose_database_host(scope["dbms"])
+
+                yield "Chose {}".format(scope["database_host"].hostname)
+
         @wrapper.add_action("Creating database object")
         def create_database_object(
             site: Site,
@@ -180,6 +202,16 @@ def create_database_task(operation_id: int, database_host_id: int) -> None:
             wrapper.add_action("Updating Docker service", actions.update_docker_service)
 
 
+@shared_task
+def refresh_database_host_stats_task() -> None:
+    refresh_database_host_stats()
+
+
+@shared_task
+def refresh_site_database_stats_task() -> None:
+    refresh_site_database_stats()
+
+
 @shared_task
 def update_resource_limits_task(
     operation_id: int, cpus: float, mem_limit: str, client_body_limit: str, notes: str
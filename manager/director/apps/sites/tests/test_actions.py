@@ -52,7 +52,10 @@ class ActionsTestCase(DirectorTestCase):
             mock_ping.assert_called()
 
     def test_update_appserver_nginx_config(self):
-        with self.settings(DIRECTOR_APPSERVER_HOSTS=["director-apptest1:8000"]):
+        with self.settings(
+            DIRECTOR_APPSERVER_HOSTS=["director-apptest1:8000"],
+            DIRECTOR_APPSERVER_WS_HOSTS=["director-apptest1:8000"],
+        ):
             result = update_appserver_nginx_config(self.site, {"pingable_appservers": [0]})
 
             # "director-apptest1:8000" obviously isn't pingable.
@@ -67,9 +70,15 @@ class ActionsTestCase(DirectorTestCase):
                 next(result)
 
         # Now, patch that method to bypass it
-        with patch(
-            "director.apps.sites.actions.appserver_open_http_request", return_value=None
-        ) as mock_req:
+        with (
+            patch(
+                "director.apps.sites.actions.appserver_open_http_request", return_value=None
+            ) as mock_req,
+            patch(
+                "director.apps.sites.actions.appserver_run_job",
+                return_value={"output": {"results": [{"status": "ok"}, {"status": "ok"}]}},
+            ) as mock_job,
+        ):
             result = update_appserver_nginx_config(self.site, {"pingable_appservers": [0]})
 
             self.assertEqual("Connecting to appserver 0 to update Nginx config", next(result))
@@ -78,7 +87,50 @@ class ActionsTestCase(DirectorTestCase):
             self.assertEqual("Reloading Nginx config on appserver 0", next(result))
             self.assertEqual("Successfully reloaded configuration", next(result))
 
-            mock_req.assert_called()
+            # The config was updated and reloaded in one batch, so nothing else was needed
+            mock_req.assert_not_called()
+            mock_job.assert_called_once_with(
+                0,
+                "site-batch",
+                {
+                    "site_id": self.site.id,
+                    "data": self.site.serialize_for_appserver(),
+                    "steps": [{"op": "update-nginx"}, {"op": "reload-nginx"}],
+                },
+                timeout=180,
+            )
+
+        # If the reload fails, the config is disabled
+        with (
+            patch(
+                "director.apps.sites.actions.appserver_open_http_request", return_value=None
+            ) as mock_req,
+            patch(
+                "director.apps.sites.actions.appserver_run_job",
+                return_value={
+                    "output": {"results": [{"status": "ok"}, {"status": "error", "error": "Error"}]}
+                },
+            ),
+        ):
+            result = update_appserver_nginx_config(self.site, {"pingable_appservers": [0]})
+
+            self.assertEqual("Connecting to appserver 0 to update Nginx config", next(result))
+            self.assertEqual("Successfully updated Nginx config", next(result))
+            self.assertEqual("Reloading Nginx config on all appservers", next(result))
+            self.assertEqual("Reloading Nginx config on appserver 0", next(result))
+            self.assertEqual(
+                "Error reloading Nginx config: AppserverProtocolError: appserver 0: Error",
+                next(result),
+            )
+            self.assertEqual("Disabling site Nginx config", next(result))
+            self.assertEqual("Re-raising exception", next(result))
+
+            with self.assertRaises(AppserverProtocolError):
+                next(result)
+
+            mock_req.assert_called_once_with(
+                0, f"/sites/{self.site.id}/disable-nginx", method="POST", timeout=120
+            )
 
     def test_remove_appserver_nginx_config(self):
         with self.settings(DIRECTOR_APPSERVER_HOSTS=["director-apptest1:8000"]):
@@ -91,9 +143,12 @@ class ActionsTestCase(DirectorTestCase):
                 next(result)
 
         # Now, patch that method to bypass it
-        with patch(
-            "director.apps.sites.actions.appserver_open_http_request", return_value=None
-        ) as mock_req:
+        with (
+            patch(
+                "director.apps.sites.actions.appserver_open_http_request", return_value=None
+            ) as mock_req,
+            patch("director.apps.sites.actions.appserver_run_job", return_value={}) as mock_job,
+        ):
             result = remove_appserver_nginx_config(self.site, {"pingable_appservers": [0]})
 
             self.assertEqual("Connecting to appserver 0 to remove Nginx config", next(result))
@@ -102,6 +157,7 @@ class ActionsTestCase(DirectorTestCase):
             self.assertEqual("Done", next(result))
 
             mock_req.assert_called()
+            mock_job.assert_called_once_with(0, "reload-nginx", {}, timeout=180)
 
     def test_update_docker_service(self):
         # First, make sure that a disabled site removes the Docker service
@@ -119,7 +175,10 @@ class ActionsTestCase(DirectorTestCase):
         self.site.availability = "enabled"
         self.site.save()
 
-        with self.settings(DIRECTOR_APPSERVER_HOSTS=["director-apptest1:8000"]):
+        with self.settings(
+            DIRECTOR_APPSERVER_HOSTS=["director-apptest1:8000"],
+            DIRECTOR_APPSERVER_WS_HOSTS=["director-apptest1:8000"],
+        ):
             result = update_docker_service(self.site, {"pingable_appservers": [0]})
 
             # "director-apptest1:8000" obviously isn't pingable.
@@ -131,9 +190,7 @@ class ActionsTestCase(DirectorTestCase):
                 next(result)
 
         # Now, patch that method to bypass it
-        with patch(
-            "director.apps.sites.actions.appserver_open_http_request", return_value=None
-        ) as mock_req:
+        with patch("director.apps.sites.actions.appserver_run_job", return_value={}) as mock_job:
             result = update_docker_service(self.site, {"pingable_appservers": [0]})
 
             self.assertEqual(
@@ -141,7 +198,12 @@ class ActionsTestCase(DirectorTestCase):
             )
             self.assertEqual("Created/updated Docker service", next(result))
 
-            mock_req.assert_called()
+            mock_job.assert_called_once_with(
+                0,
+                "update-docker-service",
+                {"site_id": self.site.id, "data": self.site.serialize_for_appserver()},
+                timeout=60,
+            )
 
     def test_restart_docker_service(self):
         # First, make sure that a disabled site does nothing
@@ -230,7 +292,10 @@ class ActionsTestCase(DirectorTestCase):
         self.site.docker_image.is_custom = True
         self.site.docker_image.save()
 
-        with self.settings(DIRECTOR_APPSERVER_HOSTS=["director-apptest1:8000"]):
+        with self.settings(
+            DIRECTOR_APPSERVER_HOSTS=["director-apptest1:8000"],
+            DIRECTOR_APPSERVER_WS_HOSTS=["director-apptest1:8000"],
+        ):
             result = remove_docker_image(self.site, {"pingable_appservers": [0]})
 
             # "director-apptest1:8000" obviously isn't pingable.
@@ -240,16 +305,14 @@ class ActionsTestCase(DirectorTestCase):
                 next(result)
 
         # Now, patch that method to bypass it
-        with patch(
-            "director.apps.sites.actions.appserver_open_http_request", return_value=True
-        ) as mock_req:
+        with patch("director.apps.sites.actions.appserver_run_job", return_value={}) as mock_job:
             result = remove_docker_image(self.site, {"pingable_appservers": [0]})
 
             self.assertEqual("Removing Docker image on appserver 0", next(result))
             self.assertEqual("Removing Docker image from registry on appserver 0", next(result))
 
-            mock_req.assert_called_with(
-                0, "/sites/remove-docker-image", method="POST", params={"name": "alpine:latest"}
+            mock_job.assert_called_with(
+                0, "remove-docker-image", {"name": "alpine:latest"}, timeout=60
             )
 
             try:
@@ -257,8 +320,8 @@ class ActionsTestCase(DirectorTestCase):
             except StopIteration:
                 pass
 
-            mock_req.assert_called_with(
-                0, "/sites/remove-registry-image", method="POST", params={"name": "alpine:latest"}
+            mock_job.assert_called_with(
+                0, "remove-registry-image", {"name": "alpine:latest"}, timeout=60
             )
 
     def test_ensure_site_directories_exist(self):
@@ -419,9 +482,7 @@ class ActionsTestCase(DirectorTestCase):
             next(result)
 
         # Patch it
-        with patch(
-            "director.apps.sites.actions.appserver_open_http_request", return_value=True
-        ) as mock_req:
+        with patch("director.apps.sites.actions.appserver_run_job", return_value={}) as mock_job:
             result = delete_site_database_and_object(
                 site=self.site, scope={"pingable_appservers": [0]}
             )
@@ -434,11 +495,10 @@ class ActionsTestCase(DirectorTestCase):
             except StopIteration:
                 pass
 
-            mock_req.assert_called_once_with(
+            mock_job.assert_called_once_with(
                 0,
-                "/sites/databases/delete",
-                method="POST",
-                data={"data": json.dumps(self.site.database.serialize_for_appserver())},
+                "delete-database",
+                {"data": self.site.database.serialize_for_appserver()},
                 timeout=30,
             )
 
@@ -462,9 +522,7 @@ class ActionsTestCase(DirectorTestCase):
             next(result)
 
         # Patch it
-        with patch(
-            "director.apps.sites.actions.appserver_open_http_request", return_value=True
-        ) as mock_req:
+        with patch("director.apps.sites.actions.appserver_run_job", return_value={}) as mock_job:
             result = create_real_site_database(site=self.site, scope={"pingable_appservers": [0]})
 
             self.assertEqual("Connecting to appserver 0 to create real site database", next(result))
@@ -474,11 +532,10 @@ class ActionsTestCase(DirectorTestCase):
             except StopIteration:
                 pass
 
-            mock_req.assert_called_once_with(
+            mock_job.assert_called_once_with(
                 0,
-                "/sites/databases/create",
-                method="POST",
-                data={"data": json.dumps(self.site.database.serialize_for_appserver())},
+                "create-database",
+                {"data": self.site.database.serialize_for_appserver()},
                 timeout=30,
             )
 
@@ -504,9 +561,7 @@ class ActionsTestCase(DirectorTestCase):
         self.assertNotEqual("x", new_password)
 
         # Patch it
-        with patch(
-            "director.apps.sites.actions.appserver_open_http_request", return_value=True
-        ) as mock_req:
+        with patch("director.apps.sites.actions.appserver_run_job", return_value={}) as mock_job:
             result = regen_database_password(site=self.site, scope={"pingable_appservers": [0]})
 
             self.assertEqual("Updating password in database model", next(result))
@@ -517,11 +572,10 @@ class ActionsTestCase(DirectorTestCase):
             except StopIteration:
                 pass
 
-            mock_req.assert_called_once_with(
+            mock_job.assert_called_once_with(
                 0,
-                "/sites/databases/create",
-                method="POST",
-                data={"data": json.dumps(self.site.database.serialize_for_appserver())},
+                "create-database",
+                {"data": self.site.database.serialize_for_appserver()},
                 timeout=30,
             )
 
@@ -1,9 +1,11 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
+from unittest.mock import MagicMock, patch
+
 from django.test import SimpleTestCase
 
-from director.apps.sites.consumers import serialize_action_for_user
+from director.apps.sites.consumers import fetch_multi_site_status, serialize_action_for_user
 from director.apps.sites.models import Action
 
 
@@ -29,3 +31,39 @@ class SiteInfoActionSerializationTest(SimpleTestCase):
         # these to the site-info payload, this test should fail.
         for sensitive_field in ("message", "before_state", "after_state"):
             self.assertNotIn(sensitive_field, data)
+
+
+class MultiSiteStatusSnapshotTest(SimpleTestCase):
+    def test_fetch_multi_site_status(self) -> None:
+        statuses = [{"site_id": 1, "status": {"running": True}}, {"site_id": 2, "status": None}]
+
+        with (
+            patch(
+                "director.apps.sites.consumers.iter_random_pingable_appservers",
+                return_value=iter([3]),
+            ),
+            patch(
+                "director.apps.sites.consumers.appserver_open_http_request",
+                return_value=MagicMock(json=MagicMock(return_value=statuses)),
+            ) as mock_req,
+        ):
+            self.assertEqual(statuses, fetch_multi_site_status([1, 2]))
+
+            mock_req.assert_called_once()
+            self.assertEqual(3, mock_req.call_args.args[0])
+            self.assertEqual("/sites/status", mock_req.call_args.args[1])
+            self.assertEqual("POST", mock_req.call_args.kwargs["method"])
+            self.assertEqual({"site_ids": "[1, 2]"}, mock_req.call_args.kwargs["data"])
+
+    def test_fetch_multi_site_status_no_appservers(self) -> None:
+        with patch(
+            "director.apps.sites.consumers.iter_random_pingable_appservers",
+            return_value=iter([]),
+        ):
+            self.assertEqual([], fetch_multi_site_status([1, 2]))
+
+    def test_fetch_multi_site_status_no_sites(self) -> None:
+        with patch("director.apps.sites.consumers.iter_random_pingable_appservers") as mock_iter:
+            self.assertEqual([], fetch_multi_site_status([]))
+
+            mock_iter.assert_not_called()
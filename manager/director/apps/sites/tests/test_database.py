@@ -1,10 +1,13 @@
+import io
+import time
 from unittest.mock import patch
 
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 
 from ....test.director_test import DirectorTestCase
-from .. import operations, tasks
-from ..models import DatabaseHost, DockerImage, Operation, Site
+from .. import database_metrics, database_placement, operations, tasks
+from ..models import Database, DatabaseHost, DockerImage, Operation, Site
 
 
 class DatabaseTest(DirectorTestCase):
@@ -42,6 +45,243 @@ class DatabaseTest(DirectorTestCase):
             self.assertEqual(200, response.status_code)
             cd_patch.assert_called_with(self.site, self.db_host)
 
+    def test_create_database_view_automatic_host(self):
+        with patch("director.apps.sites.operations.create_database") as cd_patch:
+            response = self.client.post(
+                reverse("sites:create_database", kwargs={"site_id": self.site.id}),
+                follow=True,
+                data={"host": "auto-postgres"},
+            )
+            self.assertEqual(200, response.status_code)
+            cd_patch.assert_called_with(self.site, dbms="postgres")
+
+    def test_create_database_operation_automatic_host(self):
+        with patch("director.apps.sites.tasks.create_database_task.delay") as cdt_patch:
+            operations.create_database(self.site, dbms="postgres")
+
+        ops = Operation.objects.filter(site=self.site)
+        self.assertEqual(1, len(ops))
+        cdt_patch.assert_called_with(ops[0].id, None, "postgres")
+
+    def test_choose_database_host(self):
+        other_host = DatabaseHost.objects.create(
+            hostname="director-postgres-test-2",
+            port=1234,
+            dbms="postgres",
+            admin_username="test",
+            admin_password="test",
+        )
+        DatabaseHost.objects.create(
+            hostname="director-mysql-test",
+            port=1234,
+            dbms="mysql",
+            admin_username="test",
+            admin_password="test",
+        )
+
+        stats = {
+            self.db_host.id: {
+                "num_databases": 100,
+                "total_size": 10 * 1000 * 1000,
+                "active_connections": 5,
+                "queries_per_second": 50.0,
+            },
+            other_host.id: {
+                "num_databases": 120,
+                "total_size": 1000 * 1000,
+                "active_connections": 0,
+                "queries_per_second": None,
+            },
+        }
+
+        with patch(
+            "director.apps.sites.database_placement.get_database_host_stats", return_value=stats
+        ) as stats_patch:
+            self.assertEqual(other_host, database_placement.choose_database_host("postgres"))
+
+            # Only hosts of the requested type are considered
+            self.assertEqual(
+                {self.db_host.id, other_host.id},
+                {host.id for host in stats_patch.call_args.args[0]},
+            )
+
+        # Hosts whose statistics are unavailable are skipped
+        stats[other_host.id] = None
+        with patch(
+            "director.apps.sites.database_placement.get_database_host_stats", return_value=stats
+        ):
+            self.assertEqual(self.db_host, database_placement.choose_database_host("postgres"))
+
+        # If none are available, the host with the fewest databases is chosen
+        self.site.database = Database.objects.create(host=self.db_host, password="test")
+        self.site.save()
+        with patch(
+            "director.apps.sites.database_placement.get_database_host_stats",
+            return_value={self.db_host.id: None, other_host.id: None},
+        ):
+            self.assertEqual(other_host, database_placement.choose_database_host("postgres"))
+
+        with self.assertRaises(DatabaseHost.DoesNotExist):
+            database_placement.choose_database_host("nonexistent")
+
+    def test_calculate_counter_rate(self):
+        self.assertIsNone(database_placement.calculate_counter_rate(None, 100.0, 50))
+        self.assertEqual(2.0, database_placement.calculate_counter_rate((90.0, 30), 100.0, 50))
+        # The counter went backwards (the database server was restarted)
+        self.assertIsNone(database_placement.calculate_counter_rate((90.0, 60), 100.0, 50))
+        self.assertIsNone(database_placement.calculate_counter_rate((100.0, 30), 100.0, 50))
+
+    def test_fetch_site_database_stats(self):
+        # Cache expiry uses the real time
+        now = time.time()
+
+        self.site.database = Database.objects.create(host=self.db_host, password="test")
+        self.site.save()
+
+        def make_results(transactions):
+            return {
+                "results": [
+                    {
+                        "status": "ok",
+                        "databases": [
+                            {
+                                "db_name": "site_{}".format(self.site.id),
+                                "size": 1000,
+                                "connections": 2,
+                                "transactions": transactions,
+                                "slow_queries": 1,
+                            },
+                            # Not the database of any site
+                            {
+                                "db_name": "site_{}".format(self.site.id + 1),
+                                "size": 1000,
+                                "connections": 0,
+                                "transactions": 0,
+                                "slow_queries": 0,
+                            },
+                        ],
+                    }
+                ]
+            }
+
+        with (
+            patch(
+                "director.apps.sites.database_placement.iter_random_pingable_appservers",
+                return_value=iter([0]),
+            ),
+            patch(
+                "director.apps.sites.database_placement.appserver_open_http_request"
+            ) as request_patch,
+            patch("director.apps.sites.database_metrics.time.time", return_value=now),
+        ):
+            request_patch.return_value.json.return_value = make_results(500)
+            stats = database_metrics.fetch_site_database_stats()
+
+        self.assertEqual({self.site.id}, set(stats.keys()))
+        self.assertEqual(1000, stats[self.site.id]["size"])
+        self.assertEqual(2, stats[self.site.id]["connections"])
+        self.assertEqual(1, stats[self.site.id]["slow_queries"])
+        # There's no previous sample to compute a rate from
+        self.assertIsNone(stats[self.site.id]["transactions_per_second"])
+        self.assertEqual(stats, database_metrics.get_site_database_stats())
+
+        with (
+            patch(
+                "director.apps.sites.database_placement.iter_random_pingable_appservers",
+                return_value=iter([0]),
+            ),
+            patch(
+                "director.apps.sites.database_placement.appserver_open_http_request"
+            ) as request_patch,
+            patch("director.apps.sites.database_metrics.time.time", return_value=now + 60),
+        ):
+            request_patch.return_value.json.return_value = make_results(1100)
+            stats = database_metrics.fetch_site_database_stats()
+
+        self.assertEqual(10.0, stats[self.site.id]["transactions_per_second"])
+
+        response = self.client.get(reverse("sites:info", kwargs={"site_id": self.site.id}))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(stats[self.site.id], response.context["database_stats"])
+
+    def test_export_database_view(self):
+        # No database
+        response = self.client.get(
+            reverse("sites:export_database", kwargs={"site_id": self.site.id})
+        )
+        self.assertEqual(302, response.status_code)
+
+        self.site.database = Database.objects.create(host=self.db_host, password="test")
+        self.site.save()
+
+        with (
+            patch(
+                "director.apps.sites.views.database.iter_random_pingable_appservers",
+                return_value=iter([0]),
+            ),
+            patch(
+                "director.apps.sites.views.database.appserver_open_http_request"
+            ) as request_patch,
+        ):
+            request_patch.return_value.response = io.BytesIO(b"dump" * 100000)
+            response = self.client.get(
+                reverse("sites:export_database", kwargs={"site_id": self.site.id})
+            )
+
+            self.assertEqual(200, response.status_code)
+            self.assertEqual("application/gzip", response["Content-Type"])
+            self.assertIn(".sql.gz", response["Content-Disposition"])
+            self.assertEqual(b"dump" * 100000, b"".join(response.streaming_content))
+
+        self.assertEqual("/sites/databases/export", request_patch.call_args.args[1])
+
+    def test_import_database_view(self):
+        self.site.database = Database.objects.create(host=self.db_host, password="test")
+        self.site.save()
+
+        url = reverse("sites:import_database", kwargs={"site_id": self.site.id})
+
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+
+        uploaded = []
+
+        def fake_request(appserver, path, **kwargs):
+            self.assertEqual("/sites/databases/import", path)
+            self.assertIn("Director-Database-Info", kwargs["headers"])
+            uploaded.append(b"".join(kwargs["data"]))
+
+        with (
+            patch(
+                "director.apps.sites.views.database.iter_random_pingable_appservers",
+                return_value=iter([0, 0]),
+            ),
+            patch(
+                "director.apps.sites.views.database.appserver_open_http_request",
+                side_effect=fake_request,
+            ),
+        ):
+            # Uploaded with the form
+            response = self.client.post(
+                url, data={"dump": SimpleUploadedFile("dump.sql", b"SELECT 1;")}, follow=True
+            )
+            self.assertEqual(200, response.status_code)
+
+            # Sent as the raw request body
+            response = self.client.post(
+                url, data=b"SELECT 2;", content_type="application/octet-stream"
+            )
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(b"Success", response.content)
+
+        self.assertEqual([b"SELECT 1;", b"SELECT 2;"], uploaded)
+
+        with self.settings(DIRECTOR_MAX_DATABASE_IMPORT_BYTES=5):
+            response = self.client.post(
+                url, data=b"SELECT 2;", content_type="application/octet-stream"
+            )
+            self.assertEqual(413, response.status_code)
+
     def test_create_database_operation(self):
         with patch("director.apps.sites.tasks.create_database_task.delay") as cdt_patch:
             operations.create_database(self.site, self.db_host)
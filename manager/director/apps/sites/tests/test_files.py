@@ -37,6 +37,40 @@ class FilesTest(DirectorTestCase):
         )
         self.assertEqual(500, response.status_code)  # no appservers online
 
+    def test_list_many_directories_view(self):
+        response = self.client.get(
+            reverse("sites:list_many_directories", kwargs={"site_id": self.site.id}), follow=True
+        )
+        self.assertEqual(400, response.status_code)  # `path` not supplied
+
+        response = self.client.get(
+            reverse("sites:list_many_directories", kwargs={"site_id": self.site.id}),
+            data={"path": ["public", "private"]},
+            follow=True,
+        )
+        self.assertEqual(500, response.status_code)  # no appservers online
+
+    def test_list_directory_tree_view(self):
+        response = self.client.get(
+            reverse("sites:list_directory_tree", kwargs={"site_id": self.site.id}),
+            data={"path": "public", "max_depth": "3"},
+            follow=True,
+        )
+        self.assertEqual(500, response.status_code)  # no appservers online
+
+    def test_search_files_view(self):
+        response = self.client.get(
+            reverse("sites:search_files", kwargs={"site_id": self.site.id}), follow=True
+        )
+        self.assertEqual(400, response.status_code)  # `q` not supplied
+
+        response = self.client.get(
+            reverse("sites:search_files", kwargs={"site_id": self.site.id}),
+            data={"q": "hello", "path": "public", "exclude": ["node_modules", ".git"]},
+            follow=True,
+        )
+        self.assertEqual(500, response.status_code)  # no appservers online
+
     def test_download_zip_view(self):
         response = self.client.get(
             reverse("sites:download_zip", kwargs={"site_id": self.site.id}), follow=True
@@ -58,6 +92,53 @@ class FilesTest(DirectorTestCase):
         )
         self.assertEqual(500, response.status_code)  # no appservers online
 
+    def test_upload_file_view(self):
+        response = self.client.post(
+            reverse("sites:upload_file", kwargs={"site_id": self.site.id}),
+            data=b"hello",
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(400, response.status_code)  # `path` not supplied
+
+        response = self.client.post(
+            reverse("sites:upload_file", kwargs={"site_id": self.site.id}) + "?path=hello.txt",
+            data=b"x" * (2 * 1024 * 1024 + 1),
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(413, response.status_code)  # larger than the default client body limit
+
+        response = self.client.post(
+            reverse("sites:upload_file", kwargs={"site_id": self.site.id}) + "?path=hello.txt",
+            data=b"hello",
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(500, response.status_code)  # no appservers online
+
+    def test_upload_archive_view(self):
+        response = self.client.post(
+            reverse("sites:upload_archive", kwargs={"site_id": self.site.id}) + "?format=rar",
+            data=b"archive",
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(400, response.status_code)  # unsupported format
+
+        with self.settings(DIRECTOR_MAX_ARCHIVE_UPLOAD_BYTES=5):
+            response = self.client.post(
+                reverse("sites:upload_archive", kwargs={"site_id": self.site.id})
+                + "?format=zip&path=public",
+                data=b"archive",
+                content_type="application/octet-stream",
+            )
+            self.assertEqual(413, response.status_code)
+
+        response = self.client.post(
+            reverse("sites:upload_archive", kwargs={"site_id": self.site.id})
+            + "?format=tar.gz&path=public",
+            data=b"archive",
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(500, response.status_code)  # no appservers online
+
     def test_create_file_view(self):
         response = self.client.post(
             reverse("sites:create_file", kwargs={"site_id": self.site.id}), follow=True
@@ -71,6 +152,22 @@ class FilesTest(DirectorTestCase):
         )
         self.assertEqual(500, response.status_code)  # no appservers online
 
+    def test_batch_file_operations_view(self):
+        response = self.client.post(
+            reverse("sites:batch_file_operations", kwargs={"site_id": self.site.id}), follow=True
+        )
+        self.assertEqual(400, response.status_code)  # `operations` not supplied
+
+        response = self.client.post(
+            reverse("sites:batch_file_operations", kwargs={"site_id": self.site.id}),
+            data={
+                "operations": '[{"op": "rm", "path": "public/a.txt"}]',
+                "mode": "atomic",
+            },
+            follow=True,
+        )
+        self.assertEqual(500, response.status_code)  # no appservers online
+
     def test_remove_file_view(self):
         response = self.client.post(
             reverse("sites:remove_file", kwargs={"site_id": self.site.id}), follow=True
@@ -26,6 +26,62 @@ class MaintenanceTest(DirectorTestCase):
         self.assertNotEqual(200, response.status_code)  # Shouldn't be 200
         self.assertNotIn("director4_sites_failed_actions 0", str(response.content))
 
+    def test_prometheus_metrics_view_database_stats(self):
+        stats = {
+            self.site.id: {
+                "host_id": 1,
+                "size": 1000,
+                "connections": 2,
+                "slow_queries": 1,
+                "transactions_per_second": None,
+                "updated_time": 0,
+            }
+        }
+
+        with patch(
+            "director.apps.sites.views.maintenance.get_site_database_stats", return_value=stats
+        ):
+            response = self.client.get(reverse("sites:prometheus-metrics"))
+
+        self.assertEqual(200, response.status_code)
+        labels = '{{site_id="{}",site="{}"}}'.format(self.site.id, self.site.name)
+        self.assertIn(
+            "director4_site_database_size_bytes{} 1000".format(labels), response.content.decode()
+        )
+        self.assertIn(
+            "director4_site_database_connections{} 2".format(labels), response.content.decode()
+        )
+        self.assertIn(
+            "director4_site_database_slow_queries{} 1".format(labels), response.content.decode()
+        )
+        self.assertNotIn(
+            "director4_site_database_transactions_per_second", response.content.decode()
+        )
+
+    def test_database_stats_view(self):
+        with patch(
+            "director.apps.sites.views.maintenance.get_site_database_stats", return_value={}
+        ):
+            response = self.client.get(reverse("sites:database_stats"))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], response.context["sites_with_stats"])
+
+        stats = {
+            "host_id": 1,
+            "size": 1000,
+            "connections": 2,
+            "slow_queries": 1,
+            "transactions_per_second": 3.0,
+            "updated_time": 0,
+        }
+        with patch(
+            "director.apps.sites.views.maintenance.get_site_database_stats",
+            return_value={self.site.id: stats},
+        ):
+            response = self.client.get(reverse("sites:database_stats"))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([(self.site, stats)], response.context["sites_with_stats"])
+
     def test_management_view(self):
         response = self.client.get(reverse("sites:management"))
         self.assertEqual(200, response.status_code)
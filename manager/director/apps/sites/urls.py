@@ -24,6 +24,7 @@ urlpatterns: List[Union[URLResolver, URLPattern]] = [
         views.maintenance.custom_resource_limits_list_view,
         name="custom_resource_limits_list",
     ),
+    path("database-stats/", views.maintenance.database_stats_view, name="database_stats"),
     path("management/", views.maintenance.management_view, name="management"),
     path("create/", views.sites.create_view, name="create"),
     path("create/webdocs/", views.sites.create_webdocs_view, name="create_webdocs"),
@@ -39,14 +40,22 @@ edit_patterns: List[URLPattern] = [
 database_patterns: List[URLPattern] = [
     path("create/", views.database.create_database_view, name="create_database"),
     path("shell/", views.database.database_shell_view, name="database_shell"),
+    path("export/", views.database.export_database_view, name="export_database"),
+    path("import/", views.database.import_database_view, name="import_database"),
     path("delete/", views.database.delete_database_view, name="delete_database"),
 ]
 
 file_patterns: List[URLPattern] = [
     path("", views.files.editor_view, name="editor"),
     path("get/", views.files.get_file_view, name="get_file"),
+    path("ls-many/", views.files.list_many_directories_view, name="list_many_directories"),
+    path("ls-tree/", views.files.list_directory_tree_view, name="list_directory_tree"),
+    path("search/", views.files.search_files_view, name="search_files"),
     path("create/", views.files.create_file_view, name="create_file"),
     path("write/", views.files.write_file_view, name="write_file"),
+    path("upload/", views.files.upload_file_view, name="upload_file"),
+    path("upload-archive/", views.files.upload_archive_view, name="upload_archive"),
+    path("batch/", views.files.batch_file_operations_view, name="batch_file_operations"),
     path("rm/", views.files.remove_file_view, name="remove_file"),
     path("rmdir-recur/", views.files.remove_directory_recur_view, name="remove_directory_recur"),
     path("mkdir/", views.files.make_directory_view, name="mkdir"),
@@ -2,17 +2,26 @@
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
 import json
+from typing import Generator, Iterable, Union
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-
-from ....utils.appserver import appserver_open_http_request, iter_random_pingable_appservers
+from django.utils import timezone
+
+from ....utils.appserver import (
+    AppserverProtocolError,
+    AppserverRequestError,
+    appserver_open_http_request,
+    iter_random_pingable_appservers,
+)
 from ...auth.decorators import require_accept_guidelines
 from .. import operations
 from ..forms import DatabaseCreateForm
-from ..models import Site
+from ..models import DatabaseHost, Site
+from .files import UPLOAD_CHUNK_SIZE, UploadTooLargeError, iter_request_body
 
 
 @login_required
@@ -28,7 +37,11 @@ def create_database_view(request: HttpRequest, site_id: int) -> HttpResponse:
         if site.has_operation:
             messages.error(request, "An operation is already being performed on this site")
         elif form.is_valid():
-            operations.create_database(site, form.cleaned_data["host"])
+            host = form.cleaned_data["host"]
+            if isinstance(host, DatabaseHost):
+                operations.create_database(site, host)
+            else:
+                operations.create_database(site, dbms=host)
             return redirect("sites:info", site.id)
     else:
         form = DatabaseCreateForm()
@@ -57,7 +70,9 @@ def delete_database_view(request: HttpRequest, site_id: int) -> HttpResponse:
 
 @login_required
 @require_accept_guidelines
-def database_shell_view(request: HttpRequest, site_id: int) -> HttpResponse:
+def database_shell_view(
+    request: HttpRequest, site_id: int
+) -> Union[HttpResponse, StreamingHttpResponse]:
     site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
 
     if site.database is None:
@@ -79,11 +94,142 @@ def database_shell_view(request: HttpRequest, site_id: int) -> HttpResponse:
                     "database_info": json.dumps(site.database.serialize_for_appserver()),
                     "sql": sql,
                 },
-                timeout=30,
+                # The appserver cancels statements that run for longer than 30 seconds
+                timeout=45,
             )
 
-            return HttpResponse(res.text, content_type="text/plain")
+            # The appserver limits the size of the output, but it can still be large, so pass it
+            # through as it comes in
+            def stream() -> Generator[bytes, None, None]:
+                while True:
+                    chunk = res.response.read(64 * 1024)
+                    if not chunk:
+                        break
+
+                    yield chunk
+
+            return StreamingHttpResponse(stream(), content_type="text/plain")
         else:
             return HttpResponse("", content_type="text/plain")
 
     return render(request, "sites/databases/shell.html", {"site": site})
+
+
+@login_required
+@require_accept_guidelines
+def export_database_view(
+    request: HttpRequest, site_id: int
+) -> Union[HttpResponse, StreamingHttpResponse]:
+    site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
+
+    if site.database is None:
+        return redirect("sites:info", site.id)
+
+    try:
+        appserver = next(iter_random_pingable_appservers(timeout=0.5))
+    except StopIteration:
+        return HttpResponse("No appservers online", content_type="text/plain", status=500)
+
+    try:
+        res = appserver_open_http_request(
+            appserver,
+            "/sites/databases/export",
+            method="POST",
+            data={"database_info": json.dumps(site.database.serialize_for_appserver())},
+            timeout=120,
+        )
+    except AppserverProtocolError as ex:
+        return HttpResponse(str(ex), status=500, content_type="text/plain")
+
+    # The dump is compressed on the appserver and can be large, so pass it through as it comes in
+    def stream() -> Generator[bytes, None, None]:
+        while True:
+            chunk = res.response.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            yield chunk
+
+    response = StreamingHttpResponse(stream(), content_type="application/gzip")
+    response["Content-Disposition"] = "attachment; filename={}-{}.sql.gz".format(
+        site.name, timezone.localdate().isoformat()
+    )
+
+    return response
+
+
+@login_required
+@require_accept_guidelines
+def import_database_view(request: HttpRequest, site_id: int) -> HttpResponse:
+    """Loads an SQL dump (optionally gzip-compressed) into a site's database.
+
+    The dump can be uploaded with the form on this page, or sent as the raw request body (which is
+    streamed through to the appserver chunk by chunk, and gets a plain text response).
+
+    """
+    site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
+
+    if site.database is None:
+        return redirect("sites:info", site.id)
+
+    if request.method != "POST":
+        return render(request, "sites/databases/import.html", {"site": site})
+
+    is_multipart = request.content_type == "multipart/form-data"
+
+    def error(msg: str, status: int = 500) -> HttpResponse:
+        if is_multipart:
+            messages.error(request, msg)
+            return render(request, "sites/databases/import.html", {"site": site})
+
+        return HttpResponse(msg, content_type="text/plain", status=status)
+
+    if site.has_operation:
+        return error("An operation is already being performed on this site", 409)
+
+    max_size = settings.DIRECTOR_MAX_DATABASE_IMPORT_BYTES
+
+    data: Iterable[bytes]
+    if is_multipart:
+        f_obj = request.FILES.get("dump")
+        if f_obj is None:
+            return error("No file uploaded", 400)
+        if (f_obj.size or 0) > max_size:
+            return error("Database dump too large", 413)
+
+        data = f_obj.chunks(UPLOAD_CHUNK_SIZE)
+    else:
+        content_length = request.META.get("CONTENT_LENGTH")
+        if content_length and content_length.isdigit() and int(content_length) > max_size:
+            return error("Database dump too large", 413)
+
+        data = iter_request_body(request, max_size)
+
+    try:
+        appserver = next(iter_random_pingable_appservers(timeout=0.5))
+    except StopIteration:
+        return error("No appservers online")
+
+    try:
+        appserver_open_http_request(
+            appserver,
+            "/sites/databases/import",
+            method="POST",
+            params={"max_size": str(max_size)},
+            headers={
+                "Director-Database-Info": json.dumps(site.database.serialize_for_appserver()),
+            },
+            data=data,
+            # The appserver gives up on imports that take longer than 30 minutes
+            timeout=35 * 60,
+        )
+    except UploadTooLargeError:
+        return error("Database dump too large", 413)
+    except AppserverRequestError as ex:
+        return error(str(ex))
+
+    if is_multipart:
+        messages.success(request, "Database dump imported")
+        return redirect("sites:info", site.id)
+
+    return HttpResponse("Success", content_type="text/plain")
@@ -2,8 +2,10 @@
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
 import os
-from typing import Generator, Union
+import urllib.parse
+from typing import Generator, Iterator, Union
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
@@ -17,6 +19,44 @@ from ....utils.appserver import (
 from ...auth.decorators import require_accept_guidelines, require_accept_guidelines_no_redirect
 from ..models import Site
 
+# Size of the chunks read from the request body when streaming uploads to the appservers
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+def get_upload_size_limit(site: Site) -> int:
+    """Returns the site's client body limit (which uses Nginx's size syntax) in bytes."""
+    limit = str(site.serialize_resource_limits()["client_body_limit"]).strip()
+
+    # Nginx treats both the lowercase and uppercase suffixes as powers of 1024
+    factors = {"k": 1024, "m": 1024**2}
+    if limit[-1:].lower() in factors:
+        return int(limit[:-1]) * factors[limit[-1].lower()]
+
+    return int(limit)
+
+
+def iter_request_body(request: HttpRequest, max_size: int) -> Iterator[bytes]:
+    """Yields the raw request body in chunks without ever reading it all into memory.
+
+    Raises UploadTooLargeError once more than ``max_size`` bytes have been read.
+
+    """
+    size = 0
+    while True:
+        chunk = request.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        size += len(chunk)
+        if size > max_size:
+            raise UploadTooLargeError
+
+        yield chunk
+
 
 @require_GET
 @login_required
@@ -73,6 +113,111 @@ def get_file_view(request: HttpRequest, site_id: int) -> Union[HttpResponse, Str
     return response
 
 
+@require_GET
+@login_required
+@require_accept_guidelines_no_redirect
+def list_many_directories_view(request: HttpRequest, site_id: int) -> HttpResponse:
+    site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
+
+    paths = request.GET.getlist("path")
+    if not paths:
+        return HttpResponse(status=400)
+
+    try:
+        appserver = next(iter_random_pingable_appservers(timeout=0.5))
+    except StopIteration:
+        return HttpResponse("No appservers online", content_type="text/plain", status=500)
+
+    try:
+        res = appserver_open_http_request(
+            appserver,
+            "/sites/{}/files/ls-many".format(site.id),
+            method="POST",
+            data=urllib.parse.urlencode([("path", path) for path in paths]).encode(),
+            timeout=30,
+        )
+    except AppserverProtocolError as ex:
+        return HttpResponse(str(ex), status=500, content_type="text/plain")
+
+    return HttpResponse(res.response.read(), content_type="application/json")
+
+
+@require_GET
+@login_required
+@require_accept_guidelines_no_redirect
+def list_directory_tree_view(request: HttpRequest, site_id: int) -> HttpResponse:
+    site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
+
+    params = {"path": request.GET.get("path", "")}
+    for name in ["max_depth", "max_entries"]:
+        if request.GET.get(name, ""):
+            params[name] = request.GET[name]
+
+    try:
+        appserver = next(iter_random_pingable_appservers(timeout=0.5))
+    except StopIteration:
+        return HttpResponse("No appservers online", content_type="text/plain", status=500)
+
+    try:
+        res = appserver_open_http_request(
+            appserver,
+            "/sites/{}/files/ls-tree".format(site.id),
+            method="GET",
+            params=params,
+            timeout=60,
+        )
+    except AppserverProtocolError as ex:
+        return HttpResponse(str(ex), status=500, content_type="text/plain")
+
+    return HttpResponse(res.response.read(), content_type="application/json")
+
+
+@require_GET
+@login_required
+@require_accept_guidelines_no_redirect
+def search_files_view(
+    request: HttpRequest, site_id: int
+) -> Union[HttpResponse, StreamingHttpResponse]:
+    site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
+
+    if not request.GET.get("q", ""):
+        return HttpResponse(status=400)
+
+    params = [
+        (name, request.GET[name])
+        for name in ["path", "q", "regex", "ignore_case"]
+        if request.GET.get(name, "")
+    ]
+    params.extend(("exclude", name) for name in request.GET.getlist("exclude"))
+
+    try:
+        appserver = next(iter_random_pingable_appservers(timeout=0.5))
+    except StopIteration:
+        return HttpResponse("No appservers online", content_type="text/plain", status=500)
+
+    try:
+        res = appserver_open_http_request(
+            appserver,
+            "/sites/{}/files/search".format(site.id),
+            method="GET",
+            params=params,
+            timeout=60,
+        )
+    except AppserverProtocolError as ex:
+        return HttpResponse(str(ex), status=500, content_type="text/plain")
+
+    def stream() -> Generator[bytes, None, None]:
+        # Pass each result on as soon as it arrives
+        while True:
+            line = res.response.readline()
+            if not line:
+                break
+
+            yield line
+
+    return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+
 @require_GET
 @login_required
 @require_accept_guidelines_no_redirect
@@ -173,6 +318,131 @@ def write_file_view(request: HttpRequest, site_id: int) -> HttpResponse:
         return HttpResponse("Success")
 
 
+@require_POST
+@login_required
+@require_accept_guidelines_no_redirect
+def upload_file_view(request: HttpRequest, site_id: int) -> HttpResponse:
+    """Uploads a file, enforcing the site's client body limit.
+
+    Raw request bodies (the editor sends one request per file, with the path in the ``path``
+    parameter) are streamed through to the appserver chunk by chunk. Multipart bodies with
+    ``files[]`` fields are also accepted; Django spools those to temporary files before the view
+    runs, so they are streamed from there.
+
+    """
+    site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
+
+    max_size = get_upload_size_limit(site)
+
+    content_length = request.META.get("CONTENT_LENGTH")
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        return HttpResponse("File too large", content_type="text/plain", status=413)
+
+    is_multipart = request.content_type == "multipart/form-data"
+
+    if is_multipart:
+        files = request.FILES.getlist("files[]")
+        if not files or any(f_obj.name is None for f_obj in files):
+            return HttpResponse(status=400)
+
+        if sum(f_obj.size or 0 for f_obj in files) > max_size:
+            return HttpResponse("File too large", content_type="text/plain", status=413)
+    elif "path" not in request.GET:
+        return HttpResponse(status=400)
+
+    try:
+        appserver = next(iter_random_pingable_appservers(timeout=0.5))
+    except StopIteration:
+        return HttpResponse("No appservers online", content_type="text/plain", status=500)
+
+    try:
+        if is_multipart:
+            basepath = request.GET.get("basepath") or ""
+
+            for f_obj in files:
+                assert f_obj.name is not None
+                appserver_open_http_request(
+                    appserver,
+                    "/sites/{}/files/write".format(site.id),
+                    method="POST",
+                    params={
+                        "path": os.path.join(basepath, f_obj.name),
+                        "max_size": str(max_size),
+                    },
+                    data=f_obj.chunks(UPLOAD_CHUNK_SIZE),
+                    timeout=600,
+                )
+        else:
+            params = {"path": request.GET["path"], "max_size": str(max_size)}
+            if request.GET.get("mode", ""):
+                params["mode"] = request.GET["mode"]
+
+            appserver_open_http_request(
+                appserver,
+                "/sites/{}/files/write".format(site.id),
+                method="POST",
+                params=params,
+                data=iter_request_body(request, max_size),
+                timeout=600,
+            )
+    except UploadTooLargeError:
+        return HttpResponse("File too large", content_type="text/plain", status=413)
+    except AppserverProtocolError as ex:
+        return HttpResponse(str(ex), status=500, content_type="text/plain")
+
+    return HttpResponse("Success", content_type="text/plain")
+
+
+@require_POST
+@login_required
+@require_accept_guidelines_no_redirect
+def upload_archive_view(
+    request: HttpRequest, site_id: int
+) -> Union[HttpResponse, StreamingHttpResponse]:
+    """Streams an uploaded .zip, .tar, or .tar.gz archive (sent as the raw request body) to an
+    appserver to be extracted into the directory given by ``path``. The appserver's progress
+    reports are passed back as newline-delimited JSON."""
+    site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
+
+    if request.GET.get("format", "") not in ("zip", "tar", "tar.gz"):
+        return HttpResponse(status=400)
+
+    max_size = settings.DIRECTOR_MAX_ARCHIVE_UPLOAD_BYTES
+
+    content_length = request.META.get("CONTENT_LENGTH")
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        return HttpResponse("Archive too large", content_type="text/plain", status=413)
+
+    try:
+        appserver = next(iter_random_pingable_appservers(timeout=0.5))
+    except StopIteration:
+        return HttpResponse("No appservers online", content_type="text/plain", status=500)
+
+    try:
+        res = appserver_open_http_request(
+            appserver,
+            "/sites/{}/files/extract".format(site.id),
+            method="POST",
+            params={"path": request.GET.get("path", ""), "format": request.GET["format"]},
+            data=iter_request_body(request, max_size),
+            timeout=600,
+        )
+    except UploadTooLargeError:
+        return HttpResponse("Archive too large", content_type="text/plain", status=413)
+    except AppserverProtocolError as ex:
+        return HttpResponse(str(ex), status=500, content_type="text/plain")
+
+    def stream() -> Generator[bytes, None, None]:
+        while True:
+            line = res.response.readline()
+            if not line:
+                break
+
+            yield line
+
+    return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+
 @require_POST
 @login_required
 @require_accept_guidelines_no_redirect
@@ -205,6 +475,43 @@ def create_file_view(request: HttpRequest, site_id: int) -> HttpResponse:
     return HttpResponse("Success")
 
 
+@require_POST
+@login_required
+@require_accept_guidelines_no_redirect
+def batch_file_operations_view(request: HttpRequest, site_id: int) -> HttpResponse:
+    """Performs a list of file operations with one request to the appserver.
+
+    ``operations`` is a JSON list of operations (see ``run_batch_file_operations()`` in the
+    orchestrator for the format), and ``mode`` is "continue", "stop", or "atomic".
+
+    """
+    site = get_object_or_404(Site.objects.editable_by_user(request.user), id=site_id)
+
+    if "operations" not in request.POST:
+        return HttpResponse(status=400)
+
+    try:
+        appserver = next(iter_random_pingable_appservers(timeout=0.5))
+    except StopIteration:
+        return HttpResponse("No appservers online", content_type="text/plain", status=500)
+
+    try:
+        res = appserver_open_http_request(
+            appserver,
+            "/sites/{}/files/batch".format(site.id),
+            method="POST",
+            data={
+                "operations": request.POST["operations"],
+                "mode": request.POST.get("mode", "continue"),
+            },
+            timeout=60,
+        )
+    except AppserverProtocolError as ex:
+        return HttpResponse(str(ex), status=500, content_type="text/plain")
+
+    return HttpResponse(res.response.read(), content_type="application/json")
+
+
 @require_POST
 @login_required
 @require_accept_guidelines_no_redirect
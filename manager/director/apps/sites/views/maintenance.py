@@ -12,6 +12,7 @@ from ...auth.decorators import (
     superuser_required,
 )
 from .. import operations
+from ..database_metrics import get_site_database_stats
 from ..forms import SiteAvailabilityForm, SiteResourceLimitsForm
 from ..models import Action, Operation, Site, SiteResourceLimits
 
@@ -37,6 +38,24 @@ def prometheus_metrics_view(request: HttpRequest) -> HttpResponse:
             ).count(),
         }
 
+        # Only the cached statistics, so scrapes never wait on (or add load to) the databases
+        database_stats = get_site_database_stats()
+        site_names = dict(
+            Site.objects.filter(id__in=database_stats.keys()).values_list("id", "name")
+        )
+        for site_id, site_stats in sorted(database_stats.items()):
+            if site_id not in site_names:
+                continue
+
+            labels = '{{site_id="{}",site="{}"}}'.format(site_id, site_names[site_id])
+            metrics["director4_site_database_size_bytes" + labels] = site_stats["size"]
+            metrics["director4_site_database_connections" + labels] = site_stats["connections"]
+            metrics["director4_site_database_slow_queries" + labels] = site_stats["slow_queries"]
+            if site_stats["transactions_per_second"] is not None:
+                metrics["director4_site_database_transactions_per_second" + labels] = site_stats[
+                    "transactions_per_second"
+                ]
+
         return render(
             request, "prometheus-metrics.txt", {"metrics": metrics}, content_type="text/plain"
         )
@@ -103,6 +122,24 @@ def custom_resource_limits_list_view(request: HttpRequest) -> HttpResponse:
     return render(request, "sites/management/custom_resource_limits_list.html", context)
 
 
+@superuser_required
+@require_accept_guidelines
+def database_stats_view(request: HttpRequest) -> HttpResponse:
+    database_stats = get_site_database_stats()
+
+    sites = Site.objects.filter(id__in=database_stats.keys()).select_related("database__host")
+
+    context = {
+        "sites_with_stats": sorted(
+            ((site, database_stats[site.id]) for site in sites),
+            key=lambda item: item[1]["size"],
+            reverse=True,
+        ),
+    }
+
+    return render(request, "sites/management/database_stats.html", context)
+
+
 @superuser_required
 @require_accept_guidelines
 def resource_limits_view(request: HttpRequest, site_id: int) -> HttpResponse:
@@ -18,6 +18,7 @@ from django.views.decorators.http import require_POST
 from ....utils.pagination import paginate
 from ...auth.decorators import require_accept_guidelines
 from .. import operations
+from ..database_metrics import get_site_database_stats
 from ..forms import ImageSelectForm, SiteCreateForm
 from ..helpers import send_new_site_email
 from ..models import DockerImage, Site
@@ -238,7 +239,13 @@ def info_view(request: HttpRequest, site_id: int) -> HttpResponse:
 
     site = get_object_or_404(Site.objects.listable_by_user(request.user), id=site_id)
 
-    context = {"site": site, "can_edit": site.can_be_edited_by(request.user)}
+    context = {
+        "site": site,
+        "can_edit": site.can_be_edited_by(request.user),
+        "database_stats": (
+            get_site_database_stats().get(site.id) if site.database is not None else None
+        ),
+    }
     return render(request, "sites/info.html", context)
 
 
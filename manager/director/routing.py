@@ -14,6 +14,7 @@ from django.urls import path
 from director.apps.sites.consumers import (
     MultiSiteStatusConsumer,
     SiteConsumer,
+    SiteDatabaseConsoleConsumer,
     SiteLogsConsumer,
     SiteMonitorConsumer,
     SiteTerminalConsumer,
@@ -45,6 +46,10 @@ application = ProtocolTypeRouter(
                         path("sites/<int:site_id>/terminal/", SiteTerminalConsumer.as_asgi()),
                         path("sites/<int:site_id>/files/monitor/", SiteMonitorConsumer.as_asgi()),
                         path("sites/<int:site_id>/logs/", SiteLogsConsumer.as_asgi()),
+                        path(
+                            "sites/<int:site_id>/database/console/",
+                            SiteDatabaseConsoleConsumer.as_asgi(),
+                        ),
                         path("sites/multi-status/", MultiSiteStatusConsumer.as_asgi()),
                         path("<path:path>", WebsocketCloseConsumer.as_asgi()),
                     ]
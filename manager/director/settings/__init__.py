@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 import sys
-from typing import Container, Iterable, List, Pattern, Union
+from typing import Container, Dict, Iterable, List, Pattern, Union
 
 import Crypto.PublicKey.RSA
 
@@ -192,6 +192,19 @@ CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 # If a task is not in a director/apps/<app name>/tasks.py, it should
 # be added here
 CELERY_IMPORTS = ["director.utils.emails"]
+# Periodic tasks, for when "celery beat" is running
+CELERY_BEAT_SCHEDULE = {
+    "refresh-database-host-stats": {
+        "task": "director.apps.sites.tasks.refresh_database_host_stats_task",
+        # Should be less than DIRECTOR_DATABASE_HOST_STATS_CACHE_TIME
+        "schedule": 4 * 60,
+    },
+    "refresh-site-database-stats": {
+        "task": "director.apps.sites.tasks.refresh_site_database_stats_task",
+        # Should be less than DIRECTOR_SITE_DATABASE_STATS_CACHE_TIME
+        "schedule": 60,
+    },
+}
 
 # Channels
 CHANNEL_LAYERS = {
@@ -278,6 +291,10 @@ DIRECTOR_APPSERVER_SSL = None
 # The default timeout to use when connecting to the appservers.
 DIRECTOR_APPSERVER_DEFAULT_TIMEOUT = 15
 
+# Whether to offer permessage-deflate compression on websocket connections to the appservers.
+# This helps a lot with bulk terminal output, at some CPU cost on both ends.
+DIRECTOR_APPSERVER_WEBSOCKET_COMPRESSION = True
+
 # These are the same as DIRECTOR_APPSERVER_HOSTS, DIRECTOR_APPSERVER_SSL, and
 # DIRECTOR_BALANCER_DEFAULT_TIMEOUT above,
 # but for connecting to the balancers.
@@ -294,6 +311,23 @@ DIRECTOR_APPLICATION_NAME = "Director"
 # All generated database passwords will be this long.
 DIRECTOR_DATABASE_PASSWORD_LENGTH = 50
 
+# Statistics on the load on each database host are cached for this many seconds. They're used to
+# put new databases on the least loaded host of the requested type.
+DIRECTOR_DATABASE_HOST_STATS_CACHE_TIME = 5 * 60
+# How much each statistic (see director.apps.sites.database_placement.get_database_host_stats())
+# counts toward a host's load. Each one is scaled relative to the highest among the hosts first.
+DIRECTOR_DATABASE_HOST_LOAD_WEIGHTS: Dict[str, float] = {
+    "num_databases": 1,
+    "total_size": 1,
+    "active_connections": 1,
+    "queries_per_second": 2,
+}
+
+# Statistics on each site's database (see
+# director.apps.sites.database_metrics.get_site_database_stats()) are cached for this many seconds.
+# They're shown in the Prometheus metrics and on the site info and management pages.
+DIRECTOR_SITE_DATABASE_STATS_CACHE_TIME = 3 * 60
+
 # All new sites will be assigned this Docker image. It should be
 # "docker pull"-able from each appserver somehow (from Docker Hub, locally built,
 # or in a registry).
@@ -320,6 +354,14 @@ DIRECTOR_RESOURCES_DEFAULT_MEMORY_LIMIT: int = 100 * 1000 * 1000
 # typos breaking sites.
 DIRECTOR_RESOURCES_DEFAULT_CLIENT_BODY_LIMIT: Union[int, str] = 2 * 1024 * 1024
 
+# The maximum size of an archive uploaded through the editor to be extracted into a site.
+# (The appservers separately limit the total size of the extracted files.)
+DIRECTOR_MAX_ARCHIVE_UPLOAD_BYTES = 100 * 1000 * 1000
+
+# The maximum size of an SQL dump (compressed or not) uploaded to be imported into a site's
+# database. (The appservers separately limit the size of the decompressed dump.)
+DIRECTOR_MAX_DATABASE_IMPORT_BYTES = 500 * 1000 * 1000
+
 DIRECTOR_SITE_STUDENT_AGREEMENT_HELP_TEXT = (
     "I have read, understood, and agree to abide by the rules outlined in the "
     "Computer Systems Lab Policy, the "
@@ -1,9 +1,19 @@
-function setupSQLConsole(uri, wrapper) {
+// If wsUri is given, all the commands are run in one session (over one database connection, so
+// transactions work) on a websocket. Otherwise, each one is POSTed to uri separately.
+function setupSQLConsole(uri, wrapper, wsUri) {
     var output_pre = wrapper.find(".output");
     var input_container_div = wrapper.find(".input-container");
     var prompt_div = wrapper.find(".prompt");
     var sql_input = wrapper.find(".input");
 
+    var ws = null;
+    var wsConnected = false;
+    // Sent once the websocket connects
+    var pendingSQL = null;
+    // Where the output of the running command goes (null if no command is running)
+    var commandOutput = null;
+    var cancelLink = null;
+
     var history = [];
     // A value < 0 indicates that the "current"
     var historyIndex = -1;
@@ -19,6 +29,100 @@ function setupSQLConsole(uri, wrapper) {
         }, 0);
     }
 
+    function showInput() {
+        input_container_div.show();
+        sql_input.focus();
+    }
+
+    function showError(message) {
+        output_pre.append($("<div>").css("color", "#cc0000").text(message));
+    }
+
+    function runSQLPost(sql) {
+        $.post(
+            uri,
+            {"sql": sql},
+        ).done(function(data) {
+            output_pre.append($("<div>").text(data));
+        }).fail(function() {
+            showError("Server Error");
+        }).always(showInput);
+    }
+
+    function finishWSCommand() {
+        commandOutput = null;
+        cancelLink.remove();
+        cancelLink = null;
+        showInput();
+    }
+
+    function runSQLWS(sql) {
+        commandOutput = $("<div>").appendTo(output_pre);
+        cancelLink = $("<a href=\"#\" class=\"cancel-query\">").text("Cancel").click(function(e) {
+            e.preventDefault();
+            if(ws !== null && wsConnected) {
+                ws.send(JSON.stringify({"cancel": true}));
+            }
+        }).appendTo(output_pre);
+
+        if(ws !== null && wsConnected) {
+            ws.send(JSON.stringify({"query": sql}));
+        }
+        else {
+            pendingSQL = sql;
+            if(ws === null) {
+                openWS();
+            }
+        }
+    }
+
+    function openWS() {
+        ws = new WebSocket(wsUri);
+        wsConnected = false;
+
+        ws.onmessage = function(e) {
+            var data = JSON.parse(e.data);
+
+            if(data.connected) {
+                wsConnected = true;
+                if(pendingSQL !== null) {
+                    ws.send(JSON.stringify({"query": pendingSQL}));
+                    pendingSQL = null;
+                }
+            }
+            else if(data.output !== undefined) {
+                if(commandOutput !== null) {
+                    commandOutput.append(document.createTextNode(data.output));
+                }
+            }
+            else if(data.error !== undefined) {
+                showError(data.error);
+            }
+            else if(data.done) {
+                if(commandOutput !== null) {
+                    finishWSCommand();
+                }
+            }
+        };
+
+        ws.onclose = function() {
+            var wasConnected = wsConnected;
+
+            ws = null;
+            wsConnected = false;
+            pendingSQL = null;
+
+            if(commandOutput !== null) {
+                showError(wasConnected ? "Connection lost" : "Error connecting to database");
+                finishWSCommand();
+            }
+            else if(wasConnected) {
+                // Idle sessions are closed after a while. Any transaction was rolled back.
+                showError("Session closed; the next command will start a new one");
+            }
+        };
+    }
+
     sql_input.keydown(function(e) {
         if(e.keyCode == 13) {  // Return
             e.preventDefault();
@@ -36,17 +140,12 @@ function setupSQLConsole(uri, wrapper) {
 
             input_container_div.hide();
 
-            $.post(
-                uri,
-                {"sql": sql},
-            ).done(function(data) {
-                output_pre.append($("<div>").text(data));
-            }).fail(function() {
-                output_pre.append($("<div>").css("color", "#cc0000").text("Server Error"),);
-            }).always(function() {
-                input_container_div.show();
-                sql_input.focus();
-            });
+            if(wsUri) {
+                runSQLWS(sql);
+            }
+            else {
+                runSQLPost(sql);
+            }
         }
         else if(e.keyCode == 38) {  // Up Arrow
             if(historyIndex < 0) {
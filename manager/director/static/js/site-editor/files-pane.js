@@ -65,6 +65,16 @@ function FilesPane(container, uri, callbacks) {
             return;
         }
 
+        // File events arrive in batches
+        if(Array.isArray(data)) {
+            data.forEach(handleFileEvent);
+        }
+        else {
+            handleFileEvent(data);
+        }
+    }
+
+    function handleFileEvent(data) {
         if(data.fname) {
             // Trim trailing slashes
             // They cause all kinds of trouble
@@ -709,11 +719,6 @@ function FilesPane(container, uri, callbacks) {
     });
 
     function uploadFiles(basepath, files) {
-        var formData = new FormData();
-        for(var i = 0; i < files.length; i++) {
-            formData.append("files[]", files[i], files[i].name);
-        }
-
         var msg_obj = Messenger().info({
             message: (files.length == 1 ? "Uploading 1 file..." : "Uploading " + files.length + " files..."),
             hideAfter: false,
@@ -721,28 +726,39 @@ function FilesPane(container, uri, callbacks) {
 
         var numFiles = files.length;
 
-        $.post({
-            url: file_endpoints.write + "?" + $.param({basepath: basepath}),
-            data: formData,
-            processData: false,
-            contentType: false,
-        }).then(function(data) {
-            if(basepath != "") {
-                self.openDir(basepath);
+        // Each file is sent as a raw request body so it can be streamed straight through to the
+        // appserver. They're uploaded one at a time to avoid opening too many connections at once.
+        function uploadFile(i) {
+            if(i >= numFiles) {
+                if(basepath != "") {
+                    self.openDir(basepath);
+                }
+
+                msg_obj.update({
+                    type: "success",
+                    message: (numFiles == 1 ? "Uploaded 1 file successfully" : "Uploaded " + numFiles + " files successfully"),
+                    hideAfter: 5,
+                });
+                return;
             }
 
-            msg_obj.update({
-                type: "success",
-                message: (numFiles == 1 ? "Uploaded 1 file successfully" : "Uploaded " + numFiles + " files successfully"),
-                hideAfter: 5,
-            });
-        }).fail(function(data) {
-            msg_obj.update({
-                type: "error",
-                message: "Error uploading file: " + (data.responseText || "Unknown error"),
-                hideAfter: 5,
+            $.post({
+                url: file_endpoints.upload + "?" + $.param({path: joinPaths([basepath || "", files[i].name])}),
+                data: files[i],
+                processData: false,
+                contentType: "application/octet-stream",
+            }).then(function() {
+                uploadFile(i + 1);
+            }).fail(function(data) {
+                msg_obj.update({
+                    type: "error",
+                    message: "Error uploading " + files[i].name + ": " + (data.responseText || "Unknown error"),
+                    hideAfter: 5,
+                });
             });
-        });
+        }
+
+        uploadFile(0);
     }
 
     // Shows the "new file" dialog and creates the file in the given element
@@ -223,7 +223,11 @@ $(function() {
         container.setTitle("<span class='fas fa-database'></span> SQL");
 
         container.getElement().html($("#database-shell-template").html());
-        setupSQLConsole(db_shell_endpoint, container.getElement().children(".sql-console-wrapper"));
+        setupSQLConsole(
+            db_shell_endpoint,
+            container.getElement().children(".sql-console-wrapper"),
+            ws_endpoints.database_console,
+        );
 
         // Same as above
         setTimeout(function() {
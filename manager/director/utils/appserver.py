@@ -1,17 +1,20 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
+import asyncio
 import http.client
 import json
 import logging
 import random
 import re
 import socket
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
-from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union, cast
 
+from websockets.exceptions import WebSocketException
 from websockets.legacy.client import Connect as WebSocketConnect
 from websockets.legacy.client import connect as websocket_connect
 
@@ -309,6 +312,7 @@ def appserver_open_websocket(
     ping_interval: Union[int, float] = 20,
     ping_timeout: Union[int, float] = 20,
     close_timeout: Union[int, float, None] = None,
+    compression: Optional[bool] = None,
 ) -> WebSocketConnect:
     assert path[0] == "/"
 
@@ -320,6 +324,9 @@ def appserver_open_websocket(
     if params is None:
         params = {}
 
+    if compression is None:
+        compression = settings.DIRECTOR_APPSERVER_WEBSOCKET_COMPRESSION
+
     full_url = "{}://{}{}{}".format(
         "wss" if settings.DIRECTOR_APPSERVER_SSL else "ws",
         appserver,
@@ -333,5 +340,86 @@ def appserver_open_websocket(
         ping_interval=ping_interval,
         ping_timeout=ping_timeout,
         close_timeout=close_timeout,
+        compression="deflate" if compression else None,
         ssl=appserver_ssl_context,
     )
+
+
+async def appserver_submit_job_async(
+    appserver: Union[int, str],
+    job_type: str,
+    params: Dict[str, Any],
+) -> str:
+    """Submits a job to the given appserver's job runner and returns its ID. See
+    ``appserver_run_job()``."""
+    async with appserver_open_websocket(appserver, "/ws/jobs/submit") as websock:
+        await websock.send(json.dumps({"type": job_type, "params": params}))
+        result = json.loads(await websock.recv())
+
+    if "job_id" not in result:
+        raise AppserverProtocolError(result.get("error", "Error submitting job"))
+
+    return cast(str, result["job_id"])
+
+
+def appserver_run_job(
+    appserver: Union[int, str],
+    job_type: str,
+    params: Dict[str, Any],
+    *,
+    timeout: Union[int, float],
+    poll_interval: Union[int, float] = 1,
+) -> Dict[str, Any]:
+    """Runs a long-running action (like reloading Nginx) as a job on the given appserver and waits
+    for it to finish.
+
+    Unlike a regular HTTP request, this doesn't hold a connection (and a worker on the appserver)
+    open while the action runs. The job is submitted over a websocket, and then its state is
+    polled for every ``poll_interval`` seconds.
+
+    Args:
+        appserver: The appserver to run the job on. See ``get_appserver_addr()``.
+        job_type: The type of job to run (like "reload-nginx").
+        params: The parameters to pass to the job.
+        timeout: How long to wait (in seconds) for the job to finish. The job is not stopped if
+            this is exceeded.
+        poll_interval: How often to poll for the job's state.
+
+    Returns:
+        The final state of the job, as returned by the appserver.
+
+    """
+    # Make sure we submit the job and poll for it on the same appserver
+    appserver = get_appserver_addr(appserver, allow_random=True, websocket=True)
+
+    # Use a separate event loop so we don't disturb the thread's current one (if any)
+    loop = asyncio.new_event_loop()
+    try:
+        job_id = loop.run_until_complete(
+            asyncio.wait_for(
+                appserver_submit_job_async(appserver, job_type, params),
+                timeout=settings.DIRECTOR_APPSERVER_DEFAULT_TIMEOUT,
+            )
+        )
+    except asyncio.TimeoutError as ex:
+        raise AppserverTimeoutError("Timed out submitting job") from ex
+    except ConnectionError as ex:
+        raise AppserverConnectionError(str(ex)) from ex
+    except (OSError, WebSocketException, json.JSONDecodeError) as ex:
+        raise AppserverProtocolError(str(ex)) from ex
+    finally:
+        loop.close()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        job = appserver_open_http_request(appserver, "/jobs/{}".format(job_id)).json()
+
+        if job["state"] == "succeeded":
+            return cast(Dict[str, Any], job)
+        elif job["state"] == "failed":
+            raise AppserverProtocolError(job["result"])
+
+        if time.monotonic() >= deadline:
+            raise AppserverTimeoutError("Timed out waiting for job {}".format(job_id))
+
+        time.sleep(poll_interval)
@@ -1,10 +1,14 @@
+from unittest.mock import MagicMock, patch
+
 from websockets.legacy.client import Connect as WebSocketConnect
 
 from ...test.director_test import DirectorTestCase
 from ..appserver import (
     AppserverProtocolError,
+    AppserverTimeoutError,
     appserver_open_http_request,
     appserver_open_websocket,
+    appserver_run_job,
     get_appserver_addr,
     iter_pingable_appservers,
     iter_random_pingable_appservers,
@@ -63,3 +67,52 @@ class UtilsAppserverTestCase(DirectorTestCase):
             WebSocketConnect,
             type(appserver_open_websocket("director-apptest1", "/test", ping_timeout=1)),
         )
+
+    def test_appserver_run_job(self):
+        async def submit_job(appserver, job_type, params):  # pylint: disable=unused-argument
+            return "abc123"
+
+        def make_response(state, result=None):
+            response = MagicMock()
+            response.json.return_value = {"job_id": "abc123", "state": state, "result": result}
+            return response
+
+        with (
+            patch(
+                "director.utils.appserver.appserver_submit_job_async", side_effect=submit_job
+            ) as mock_submit,
+            patch(
+                "director.utils.appserver.appserver_open_http_request",
+                side_effect=[make_response("pending"), make_response("succeeded", "Success")],
+            ) as mock_req,
+        ):
+            job = appserver_run_job(
+                "director-apptest1:8000", "reload-nginx", {}, timeout=10, poll_interval=0
+            )
+            self.assertEqual("succeeded", job["state"])
+
+            mock_submit.assert_called_once_with("director-apptest1:8000", "reload-nginx", {})
+            mock_req.assert_called_with("director-apptest1:8000", "/jobs/abc123")
+            self.assertEqual(2, mock_req.call_count)
+
+        with (
+            patch("director.utils.appserver.appserver_submit_job_async", side_effect=submit_job),
+            patch(
+                "director.utils.appserver.appserver_open_http_request",
+                return_value=make_response("failed", "Error"),
+            ),
+        ):
+            with self.assertRaises(AppserverProtocolError):
+                appserver_run_job("director-apptest1:8000", "reload-nginx", {}, timeout=10)
+
+        with (
+            patch("director.utils.appserver.appserver_submit_job_async", side_effect=submit_job),
+            patch(
+                "director.utils.appserver.appserver_open_http_request",
+                return_value=make_response("running"),
+            ),
+        ):
+            with self.assertRaises(AppserverTimeoutError):
+                appserver_run_job(
+                    "director-apptest1:8000", "reload-nginx", {}, timeout=0, poll_interval=0
+                )
@@ -26,7 +26,8 @@ def runserver(c, port=8080):
 
 @task
 def celery(c):
-    c.run("pipenv run celery -A director worker", env=env, pty=True)
+    # Run beat in the worker, so periodic tasks (see CELERY_BEAT_SCHEDULE) run in development
+    c.run("pipenv run celery -A director worker --beat", env=env, pty=True)
 
 
 @task
@@ -1,23 +1,50 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
+import codecs
 import importlib
 import importlib.util
 import json
+import math
 import os
+import re
 import resource
 import select
 import shutil
+import signal
 import stat
 import string
 import sys
-from typing import Any, Dict, List, Optional
+import tarfile
+import tempfile
+import time
+import zipfile
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
 
 
 SPECIAL_EXIT_CODE = 145  # Denotes that the text shown on stderr is safe to show to the user
 
 BUFSIZE = 4096
 
+# Larger reads for uploads; the data is not flushed until the whole file has been received
+WRITE_BUFSIZE = 64 * 1024
+
+# File events seen by the monitor within this many seconds of each other are sent together
+MONITOR_BATCH_WINDOW = 0.05
+# ...unless there are more than this many of them
+MONITOR_MAX_BATCH_SIZE = 1000
+
+# Minimum number of seconds between progress reports while extracting an archive
+EXTRACT_PROGRESS_INTERVAL = 0.5
+# Symlink targets in zip files are stored as the "contents" of the link; refuse anything longer
+EXTRACT_MAX_SYMLINK_LENGTH = 4096
+
+# Files with a NUL byte in this many leading bytes are treated as binary and not searched
+GREP_BINARY_CHECK_SIZE = 8192
+# Matching lines are truncated to this many characters in the output
+GREP_MAX_LINE_LENGTH = 500
+
 
 def chroot_into(directory: str) -> None:
     """Enter a chroot jail for this site and set cwd to its root."""
@@ -29,16 +56,29 @@ def chroot_into(directory: str) -> None:
     os.chdir("/")
 
 
+def is_valid_mode_str(mode_str: str) -> bool:
+    """Check whether a mode string is one get_new_mode() can parse."""
+    return set(mode_str) < set("01234567") or (
+        mode_str.startswith(("+", "-")) and set(mode_str[1:]) < set("rwx")
+    )
+
+
 # Later, this function may support more complicated strings
 def get_new_mode(old_mode: int, mode_str: Optional[str]) -> int:
-    """Parse octal or +/-rwx syntax and return resulting permission bits."""
+    """Parse octal or +/-rwx syntax and return resulting permission bits.
+
+    Raises ValueError if the mode string is invalid.
+
+    """
     if not mode_str:
         return old_mode
+    elif not is_valid_mode_str(mode_str):
+        raise ValueError("Invalid mode string")
     elif set(mode_str) < set("01234567"):
         # Mask to the low 9 permission bits so setuid/setgid/sticky can never be set on
         # site files (users have no legitimate reason to, and it is an escalation footgun).
         return int(mode_str, base=8) & 0o777
-    elif mode_str.startswith(("+", "-")) and set(mode_str[1:]) < set("rwx"):
+    else:
         mode_masks = {
             "r": stat.S_IRUSR + stat.S_IRGRP + stat.S_IROTH,
             "w": stat.S_IWUSR + stat.S_IWGRP + stat.S_IWOTH,
@@ -50,9 +90,6 @@ def get_new_mode(old_mode: int, mode_str: Optional[str]) -> int:
                 mask |= mode_masks[ch]
 
         return (old_mode | mask) if mode_str[0] == "+" else (old_mode & (0o777 ^ mask))
-    else:
-        print("Invalid mode string", file=sys.stderr)
-        sys.exit(SPECIAL_EXIT_CODE)
 
 
 def update_mode(path: str, mode_str: str) -> None:
@@ -61,42 +98,63 @@ def update_mode(path: str, mode_str: str) -> None:
     os.chmod(path, new_mode)
 
 
+def construct_scandir_entry_dict(dirpath: str, entry: "os.DirEntry[str]") -> Dict[str, Any]:
+    """Return JSON-safe metadata for one ``os.scandir()`` entry found in ``dirpath``."""
+    fname = os.path.join(dirpath, entry.name)
+    item: Dict[str, Any] = {
+        "fname": fname,
+        "filetype": "unknown",
+        "dest": None,
+        "mode": None,
+    }
+
+    try:
+        item["mode"] = entry.stat(follow_symlinks=False).st_mode
+    except OSError:
+        pass
+
+    try:
+        if entry.is_symlink():
+            item["filetype"] = "link"
+            try:
+                item["dest"] = os.readlink(fname)
+            except OSError:
+                pass
+        elif entry.is_dir():
+            item["filetype"] = "dir"
+        elif entry.is_file():
+            item["filetype"] = "file"
+        else:
+            item["filetype"] = "other"
+    except OSError:
+        pass
+
+    return item
+
+
 def construct_scandir_file_dicts(dirpath: str) -> List[Dict[str, Optional[str]]]:
     """Return JSON-safe metadata for direct children of ``dirpath``."""
-    items = []
-    for entry in os.scandir(dirpath or "."):
-        fname = os.path.join(dirpath, entry.name)
-        item = {
-            "fname": fname,
-            "filetype": "unknown",
-            "dest": None,
-            "mode": None,
-        }
+    return [construct_scandir_entry_dict(dirpath, entry) for entry in os.scandir(dirpath or ".")]
 
-        try:
-            item["mode"] = entry.stat(follow_symlinks=False).st_mode
-        except OSError:
-            pass
 
-        try:
-            if entry.is_symlink():
-                item["filetype"] = "link"
-                try:
-                    item["dest"] = os.readlink(fname)
-                except OSError:
-                    pass
-            elif entry.is_dir():
-                item["filetype"] = "dir"
-            elif entry.is_file():
-                item["filetype"] = "file"
-            else:
-                item["filetype"] = "other"
-        except OSError:
-            pass
+# The keys of the dicts returned by construct_scandir_entry_dict(), in the order they are
+# emitted as columns by the bulk listing commands.
+FILE_COLUMNS = ("fname", "filetype", "mode", "dest")
+
+
+def new_file_columns() -> Dict[str, List[Any]]:
+    """Return an empty columnar listing (one list per key in ``FILE_COLUMNS``).
+
+    Bulk listings are returned as columns instead of a list of dicts so the keys are not
+    repeated for every entry.
 
-        items.append(item)
+    """
+    return {key: [] for key in FILE_COLUMNS}
 
-    return items
+
+def append_file_columns(columns: Dict[str, List[Any]], item: Dict[str, Any]) -> None:
+    for key in FILE_COLUMNS:
+        columns[key].append(item[key])
 
 
 def construct_file_event_dict(fname: str) -> Dict[str, Optional[str]]:
@@ -154,6 +212,103 @@ def ls_cmd(site_directory: str, relpath: str) -> None:
     print(json.dumps(construct_scandir_file_dicts(relpath)))
 
 
+def ls_many_cmd(site_directory: str) -> None:
+    """List the direct children of each relpath given on stdin (one per line).
+
+    Prints a JSON object mapping each relpath to either a columnar listing or an
+    ``{"error": ...}`` object if that directory could not be listed.
+
+    """
+    relpaths = [line.rstrip("\n") for line in sys.stdin]
+
+    if any(relpath.startswith("/") for relpath in relpaths):
+        print("Invalid path", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    chroot_into(site_directory)
+
+    listings: Dict[str, Dict[str, Any]] = {}
+    for relpath in relpaths:
+        if relpath in listings:
+            continue
+
+        columns = new_file_columns()
+        try:
+            with os.scandir(relpath or ".") as entries:
+                for entry in entries:
+                    append_file_columns(columns, construct_scandir_entry_dict(relpath, entry))
+        except OSError as ex:
+            listings[relpath] = {"error": str(ex)}
+        else:
+            listings[relpath] = columns
+
+    print(json.dumps(listings, separators=(",", ":")))
+
+
+def ls_tree_cmd(
+    site_directory: str,
+    relpath: str,
+    max_depth_str: str,
+    max_entries_str: str,
+    max_time_str: str,
+) -> None:
+    """Walk ``relpath`` breadth-first and print a columnar listing of everything under it.
+
+    The walk stops (and ``truncated`` is set in the output) once ``max_entries`` entries have
+    been listed or ``max_time`` seconds have passed. Directories deeper than ``max_depth`` levels
+    below ``relpath`` are listed but not descended into. Symlinks are never followed.
+
+    """
+    if relpath.startswith("/"):
+        print("Invalid path", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    max_depth = int(max_depth_str)
+    max_entries = int(max_entries_str)
+    deadline = time.monotonic() + float(max_time_str)
+
+    chroot_into(site_directory)
+
+    if not os.path.isdir(relpath or "."):
+        print("Not a directory", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    columns = new_file_columns()
+    errors: Dict[str, str] = {}
+    truncated = False
+    num_entries = 0
+
+    queue: Deque[Tuple[str, int]] = deque([(relpath, 1)])
+    while queue and not truncated:
+        dirpath, depth = queue.popleft()
+
+        try:
+            with os.scandir(dirpath or ".") as entries:
+                for entry in entries:
+                    if num_entries >= max_entries or time.monotonic() > deadline:
+                        truncated = True
+                        break
+
+                    item = construct_scandir_entry_dict(dirpath, entry)
+                    append_file_columns(columns, item)
+                    num_entries += 1
+
+                    if item["filetype"] == "dir" and depth < max_depth:
+                        queue.append((item["fname"], depth + 1))
+        except OSError as ex:
+            errors[dirpath] = str(ex)
+
+    # If we stopped early, any directories still waiting in the queue have not been listed
+    truncated = truncated or bool(queue)
+
+    print(
+        json.dumps(
+            {"files": columns, "errors": errors, "truncated": truncated},
+            separators=(",", ":"),
+        )
+    )
+
+
 def chmod_cmd(site_directory: str, relpath: str, mode_str: str) -> None:
     if relpath.startswith("/"):
         print("Invalid path", file=sys.stderr)
@@ -163,7 +318,7 @@ def chmod_cmd(site_directory: str, relpath: str, mode_str: str) -> None:
 
     try:
         update_mode(relpath, mode_str)
-    except OSError as ex:
+    except (OSError, ValueError) as ex:
         print(ex, file=sys.stderr)
         sys.exit(SPECIAL_EXIT_CODE)
 
@@ -200,7 +355,7 @@ def mkdir_cmd(site_directory: str, relpath: str, mode_str: Optional[str] = None)
     try:
         # Keep the mode as 0o777! This is safe; the umask will be subtracted from it.
         os.makedirs(relpath, mode=get_new_mode(0o777, mode_str), exist_ok=False)
-    except OSError as ex:
+    except (OSError, ValueError) as ex:
         print(ex, file=sys.stderr)
         sys.exit(SPECIAL_EXIT_CODE)
 
@@ -216,7 +371,7 @@ def create_cmd(site_directory: str, relpath: str, mode_str: Optional[str] = None
         # This combination of flags will make the call fail if the file already exists.
         # Keep the mode as 0o666! This is safe; the umask will be subtracted from it.
         fd = os.open(relpath, os.O_RDWR | os.O_CREAT | os.O_EXCL, get_new_mode(0o666, mode_str))
-    except OSError as ex:
+    except (OSError, ValueError) as ex:
         print(ex, file=sys.stderr)
         sys.exit(SPECIAL_EXIT_CODE)
     else:
@@ -253,6 +408,188 @@ def rmdir_recur_cmd(site_directory: str, relpath: str) -> None:
         sys.exit(SPECIAL_EXIT_CODE)
 
 
+BATCH_MODES = ("continue", "stop", "atomic")
+
+# Maps each batch operation to the keys it requires and the keys it optionally accepts
+BATCH_OPERATION_KEYS = {
+    "rm": (["path"], []),
+    "rmdir-recur": (["path"], []),
+    "rename": (["path", "newpath"], []),
+    "chmod": (["path", "mode"], []),
+    "mkdir": (["path"], ["mode"]),
+    "create": (["path"], ["mode"]),
+}
+
+
+def is_valid_batch_operation(operation: Any) -> bool:
+    if not isinstance(operation, dict) or operation.get("op") not in BATCH_OPERATION_KEYS:
+        return False
+
+    required_keys, optional_keys = BATCH_OPERATION_KEYS[operation["op"]]
+
+    if not all(isinstance(operation.get(key), str) for key in required_keys) or not all(
+        isinstance(operation.get(key, ""), str) for key in optional_keys
+    ):
+        return False
+
+    # Reject bad modes up front instead of failing partway through the batch
+    mode_str = operation.get("mode")
+    return not mode_str or is_valid_mode_str(mode_str)
+
+
+def run_batch_operation(
+    operation: Dict[str, str],
+    undo_log: Optional[List[Callable[[], None]]],
+    stage_path: Callable[[str], str],
+) -> None:
+    """Perform one operation from a batch. Raises OSError or ValueError on failure.
+
+    If ``undo_log`` is not None, a callable that reverts the operation is appended to it after the
+    operation succeeds, and removals move files aside with ``stage_path()`` instead of deleting
+    them so that they can be restored.
+
+    """
+    op = operation["op"]
+    relpath = operation["path"]
+
+    for path in [relpath, operation.get("newpath", "")]:
+        if path.startswith("/"):
+            raise ValueError("Invalid path")
+
+    if op == "rm":
+        if os.path.exists(relpath) or os.path.islink(relpath):
+            if undo_log is None:
+                os.remove(relpath)
+            else:
+                if os.path.isdir(relpath) and not os.path.islink(relpath):
+                    raise IsADirectoryError("Is a directory: {!r}".format(relpath))
+
+                staged = stage_path(relpath)
+                undo_log.append(lambda: os.rename(staged, relpath))
+    elif op == "rmdir-recur":
+        if os.path.isdir(relpath):
+            if undo_log is None:
+                shutil.rmtree(relpath)
+            else:
+                if os.path.islink(relpath):
+                    raise OSError("Cannot call rmtree on a symbolic link")
+
+                staged = stage_path(relpath)
+                undo_log.append(lambda: os.rename(staged, relpath))
+    elif op == "rename":
+        newpath = operation["newpath"]
+        if os.path.exists(newpath) or os.path.islink(newpath):
+            raise FileExistsError("File already exists")
+
+        os.rename(relpath, newpath)
+        if undo_log is not None:
+            undo_log.append(lambda: os.rename(newpath, relpath))
+    elif op == "chmod":
+        old_mode = os.stat(relpath).st_mode
+        update_mode(relpath, operation["mode"])
+        if undo_log is not None:
+            undo_log.append(lambda: os.chmod(relpath, stat.S_IMODE(old_mode)))
+    elif op == "mkdir":
+        # Find the directories that makedirs() will create so they can be removed again
+        created = []
+        parent = os.path.normpath(relpath)
+        while parent not in ("", ".") and not os.path.lexists(parent):
+            created.append(parent)
+            parent = os.path.dirname(parent)
+
+        # Keep the mode as 0o777! This is safe; the umask will be subtracted from it.
+        os.makedirs(relpath, mode=get_new_mode(0o777, operation.get("mode")), exist_ok=False)
+        if undo_log is not None:
+            undo_log.extend(lambda path=path: os.rmdir(path) for path in reversed(created))
+    elif op == "create":
+        # Keep the mode as 0o666! This is safe; the umask will be subtracted from it.
+        fd = os.open(
+            relpath,
+            os.O_RDWR | os.O_CREAT | os.O_EXCL,
+            get_new_mode(0o666, operation.get("mode")),
+        )
+        os.close(fd)
+        if undo_log is not None:
+            undo_log.append(lambda: os.remove(relpath))
+
+
+def batch_cmd(site_directory: str, mode: str) -> None:
+    """Perform a JSON list of file operations read from stdin.
+
+    In "continue" mode, every operation is attempted. In "stop" mode, the operations after the
+    first failure are skipped. In "atomic" mode, the operations after the first failure are
+    skipped and the ones that succeeded are reverted. Removals are staged by renaming the files
+    into a temporary directory, which is only deleted once every operation has succeeded.
+
+    Prints a JSON object with a "results" list (one entry per operation, with a "status" of
+    "ok", "error", or "skipped") and a "reverted" flag.
+
+    """
+    if mode not in BATCH_MODES:
+        print("Invalid mode", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    try:
+        operations = json.load(sys.stdin)
+    except ValueError:
+        print("Invalid operations", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    if not isinstance(operations, list) or not all(map(is_valid_batch_operation, operations)):
+        print("Invalid operations", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    chroot_into(site_directory)
+
+    undo_log: Optional[List[Callable[[], None]]] = [] if mode == "atomic" else None
+    staging_dir: Optional[str] = None
+
+    def stage_path(relpath: str) -> str:
+        nonlocal staging_dir
+        if staging_dir is None:
+            staging_dir = tempfile.mkdtemp(prefix=".director-batch-", dir=".")
+
+        staged = os.path.join(staging_dir, str(len(os.listdir(staging_dir))))
+        os.rename(relpath, staged)
+        return staged
+
+    results: List[Dict[str, str]] = []
+    failed = False
+    reverted = False
+    finished = False
+    try:
+        for operation in operations:
+            if failed and mode != "continue":
+                results.append({"status": "skipped"})
+                continue
+
+            try:
+                run_batch_operation(operation, undo_log, stage_path)
+            except (OSError, ValueError) as ex:
+                results.append({"status": "error", "error": str(ex)})
+                failed = True
+            else:
+                results.append({"status": "ok"})
+
+        finished = True
+    finally:
+        # If we are exiting early for any other reason, the batch must still be reverted (and the
+        # staged files restored) before the staging directory is removed.
+        if undo_log is not None and (failed or not finished):
+            for undo in reversed(undo_log):
+                try:
+                    undo()
+                except OSError:
+                    pass
+
+            reverted = True
+
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    print(json.dumps({"results": results, "reverted": reverted}))
+
+
 def get_cmd(site_directory: str, relpath: str, max_size_str: str) -> None:
     """Stream a file to stdout after path and max-size validation."""
     if relpath.startswith("/"):
@@ -289,34 +626,333 @@ def get_cmd(site_directory: str, relpath: str, max_size_str: str) -> None:
         sys.exit(SPECIAL_EXIT_CODE)
 
 
-def write_cmd(site_directory: str, relpath: str, mode_str: Optional[str] = None) -> None:
-    """Write stdin bytes to a file and optionally update permissions."""
+def write_cmd(
+    site_directory: str,
+    relpath: str,
+    mode_str: Optional[str] = None,
+    max_size_str: Optional[str] = None,
+) -> None:
+    """Stream stdin into a temporary file, then atomically rename it over ``relpath``.
+
+    The target is never left partially written: if the write fails, the upload exceeds
+    ``max_size_str`` bytes or this process is terminated, the temporary file is removed.
+    """
     if relpath.startswith("/"):
         print("Invalid path", file=sys.stderr)
         sys.exit(SPECIAL_EXIT_CODE)
 
+    max_size = None
+    if max_size_str:
+        try:
+            max_size = int(max_size_str)
+        except ValueError:
+            print("Invalid max size", file=sys.stderr)
+            sys.exit(SPECIAL_EXIT_CODE)
+
     chroot_into(site_directory)
 
+    # The orchestrator sends SIGTERM to abort an upload. Turn that into a SystemExit so the
+    # cleanup below runs.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(SPECIAL_EXIT_CODE))
+
+    tmp_path = None
     try:
-        mode_updated = False
-        if mode_str is not None and os.path.exists(relpath):
-            update_mode(relpath, mode_str)
-            mode_updated = True
+        # Like open(relpath, "wb"), write through symlinks instead of replacing them.
+        target = os.path.realpath(relpath)
 
-        with open(relpath, "wb") as f_obj:
+        try:
+            # Keep the permissions of the file we are replacing
+            base_mode = stat.S_IMODE(os.stat(target).st_mode)
+        except FileNotFoundError:
+            # Keep the mode as 0o666! This is safe; the umask will be subtracted from it.
+            umask = os.umask(0)
+            os.umask(umask)
+            base_mode = 0o666 & ~umask
+
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".", suffix=".director-upload", dir=os.path.dirname(target)
+        )
+
+        with os.fdopen(fd, "wb") as f_obj:
+            written = 0
             while True:
-                chunk = sys.stdin.buffer.read1(BUFSIZE)
+                chunk = sys.stdin.buffer.read1(WRITE_BUFSIZE)
                 if not chunk:
                     break
 
+                written += len(chunk)
+                if max_size is not None and written > max_size:
+                    print("File too large", file=sys.stderr)
+                    sys.exit(SPECIAL_EXIT_CODE)
+
                 f_obj.write(chunk)
-                f_obj.flush()
 
-        if mode_str is not None and not mode_updated:
-            update_mode(relpath, mode_str)
-    except OSError as ex:
+            f_obj.flush()
+            os.fsync(f_obj.fileno())
+            os.fchmod(f_obj.fileno(), get_new_mode(base_mode, mode_str))
+
+        os.replace(tmp_path, target)
+        tmp_path = None
+    except (OSError, ValueError) as ex:
+        print(ex, file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+    finally:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+class ExtractError(Exception):
+    pass
+
+
+class GrepTimeoutError(Exception):
+    pass
+
+
+def raise_grep_timeout(signum: int, frame: Any) -> None:
+    raise GrepTimeoutError
+
+
+class SizeLimitedReader:
+    """Wraps a file object, raising ExtractError once more than ``max_size`` bytes have been read
+    from it."""
+
+    def __init__(self, f_obj: Any, max_size: int) -> None:
+        self.f_obj = f_obj
+        self.max_size = max_size
+        self.num_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data: bytes = self.f_obj.read(size)
+
+        self.num_bytes += len(data)
+        if self.num_bytes > self.max_size:
+            raise ExtractError("Archive is too large")
+
+        return data
+
+
+class ArchiveExtractor:
+    """Extracts archive members into ``dest``, refusing to write anywhere outside it.
+
+    Member names are normalized and rejected if they are absolute or contain "..". Symlinks
+    already on disk are never followed: any parent directory of a member that turns out to be a
+    symlink (or a file) is an error, and files are opened with O_NOFOLLOW. Symlinks in the
+    archive are only created if they point to somewhere inside the archive; others (along with
+    hard links, devices, and FIFOs) are skipped.
+
+    The total number of bytes written and the number of members extracted are capped, and the
+    process umask (which was set from the site's umask) applies to everything created.
+
+    """
+
+    def __init__(self, dest: str, max_size: int, max_files: int) -> None:
+        self.dest = dest
+        self.max_size = max_size
+        self.max_files = max_files
+
+        self.num_files = 0
+        self.num_bytes = 0
+        self.num_skipped = 0
+        self.last_report = time.monotonic()
+
+    def report_progress(self, *, done: bool = False) -> None:
+        if not done and time.monotonic() - self.last_report < EXTRACT_PROGRESS_INTERVAL:
+            return
+
+        progress: Dict[str, Any] = {"files": self.num_files, "bytes": self.num_bytes}
+        if done:
+            progress.update({"done": True, "skipped": self.num_skipped})
+
+        print(json.dumps(progress), flush=True)
+        self.last_report = time.monotonic()
+
+    def get_member_path(self, name: str) -> Optional[str]:
+        """Return the normalized path of a member relative to ``dest``, or None for the root."""
+        norm = os.path.normpath(name)
+        if os.path.isabs(norm) or norm == ".." or norm.startswith("../"):
+            raise ExtractError("Invalid path in archive: {!r}".format(name))
+
+        return None if norm == "." else norm
+
+    def prepare_target(self, norm: str) -> str:
+        """Create the parent directories of a member (checking that none of them are symlinks)
+        and return the path to extract it to."""
+        self.num_files += 1
+        if self.num_files > self.max_files:
+            raise ExtractError("Too many files in archive")
+
+        parent = self.dest
+        for part in filter(None, os.path.dirname(norm).split("/")):
+            parent = os.path.join(parent, part)
+            if os.path.islink(parent) or (os.path.lexists(parent) and not os.path.isdir(parent)):
+                raise ExtractError("{!r} exists and is not a directory".format(parent))
+            if not os.path.lexists(parent):
+                # Keep the mode as 0o777! This is safe; the umask will be subtracted from it.
+                os.mkdir(parent, 0o777)
+
+        return os.path.join(self.dest, norm)
+
+    def extract_dir(self, name: str) -> None:
+        norm = self.get_member_path(name)
+        if norm is None:
+            return
+
+        target = self.prepare_target(norm)
+        if os.path.islink(target) or (os.path.lexists(target) and not os.path.isdir(target)):
+            raise ExtractError("{!r} exists and is not a directory".format(target))
+        if not os.path.lexists(target):
+            # Keep the mode as 0o777! This is safe; the umask will be subtracted from it.
+            os.mkdir(target, 0o777)
+
+        self.report_progress()
+
+    def extract_file(self, name: str, f_obj: Any, executable: bool) -> None:
+        norm = self.get_member_path(name)
+        if norm is None:
+            raise ExtractError("Invalid path in archive: {!r}".format(name))
+
+        target = self.prepare_target(norm)
+        if os.path.isdir(target) and not os.path.islink(target):
+            raise ExtractError("{!r} is a directory".format(target))
+        if os.path.islink(target):
+            # Replace the link instead of writing through it
+            os.remove(target)
+
+        # Keep the mode as 0o666/0o777! This is safe; the umask will be subtracted from it.
+        fd = os.open(
+            target,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW,
+            0o777 if executable else 0o666,
+        )
+        with os.fdopen(fd, "wb") as out_f_obj:
+            while True:
+                chunk = f_obj.read(WRITE_BUFSIZE)
+                if not chunk:
+                    break
+
+                # Count the bytes actually written rather than trusting the archive's headers
+                self.num_bytes += len(chunk)
+                if self.num_bytes > self.max_size:
+                    raise ExtractError("Archive too large")
+
+                out_f_obj.write(chunk)
+
+                self.report_progress()
+
+    def extract_symlink(self, name: str, link_dest: str) -> None:
+        norm = self.get_member_path(name)
+        if norm is None:
+            raise ExtractError("Invalid path in archive: {!r}".format(name))
+
+        resolved = os.path.normpath(os.path.join(os.path.dirname(norm), link_dest))
+        if os.path.isabs(link_dest) or resolved == ".." or resolved.startswith("../"):
+            self.num_skipped += 1
+            return
+
+        target = self.prepare_target(norm)
+        if os.path.isdir(target) and not os.path.islink(target):
+            raise ExtractError("{!r} is a directory".format(target))
+        if os.path.lexists(target):
+            os.remove(target)
+
+        os.symlink(link_dest, target)
+        self.report_progress()
+
+    def extract_tar(self, f_obj: Any, compression: str) -> None:
+        # Stream mode ("r|") reads the archive sequentially, so it never has to be stored
+        with tarfile.open(fileobj=f_obj, mode="r|" + compression) as tar:
+            for member in tar:
+                if member.isdir():
+                    self.extract_dir(member.name)
+                elif member.isfile():
+                    member_f_obj = tar.extractfile(member)
+                    assert member_f_obj is not None
+                    self.extract_file(member.name, member_f_obj, bool(member.mode & 0o111))
+                elif member.issym():
+                    self.extract_symlink(member.name, member.linkname)
+                else:
+                    self.num_skipped += 1
+
+    def extract_zip(self, f_obj: Any) -> None:
+        # Zip files keep their index at the end, so spool the upload to an (unnamed) temporary
+        # file before reading it.
+        with tempfile.TemporaryFile(dir=self.dest) as tmp_f_obj:
+            shutil.copyfileobj(f_obj, tmp_f_obj, WRITE_BUFSIZE)
+            tmp_f_obj.seek(0)
+
+            with zipfile.ZipFile(tmp_f_obj) as zip_file:
+                for info in zip_file.infolist():
+                    unix_mode = info.external_attr >> 16
+                    if info.is_dir():
+                        self.extract_dir(info.filename)
+                    elif stat.S_ISLNK(unix_mode):
+                        with zip_file.open(info) as member_f_obj:
+                            link_dest = member_f_obj.read(EXTRACT_MAX_SYMLINK_LENGTH + 1)
+                        if len(link_dest) > EXTRACT_MAX_SYMLINK_LENGTH:
+                            raise ExtractError("Invalid symlink in archive")
+                        self.extract_symlink(info.filename, link_dest.decode())
+                    else:
+                        with zip_file.open(info) as member_f_obj:
+                            self.extract_file(info.filename, member_f_obj, bool(unix_mode & 0o111))
+
+
+def extract_cmd(
+    site_directory: str,
+    relpath: str,
+    archive_format: str,
+    max_archive_size_str: str,
+    max_size_str: str,
+    max_files_str: str,
+) -> None:
+    """Extract a .zip, .tar, or .tar.gz archive read from stdin into ``relpath``.
+
+    The archive itself may be at most ``max_archive_size_str`` bytes (zip files are spooled to
+    disk before being extracted).
+
+    Progress is reported on stdout as JSON lines; the last one has ``"done": true``.
+
+    """
+    if relpath.startswith("/"):
+        print("Invalid path", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    if archive_format not in ("zip", "tar", "tar.gz"):
+        print("Unsupported archive format", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    # zipfile decodes legacy filenames with cp437, which is loaded lazily. Make sure it has been
+    # loaded before we chroot and lose access to the standard library.
+    codecs.lookup("cp437")
+
+    chroot_into(site_directory)
+
+    # The orchestrator sends SIGTERM to abort an upload
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(SPECIAL_EXIT_CODE))
+
+    dest = os.path.normpath(relpath or ".")
+    extractor = ArchiveExtractor(dest, int(max_size_str), int(max_files_str))
+    archive_f_obj = SizeLimitedReader(sys.stdin.buffer, int(max_archive_size_str))
+
+    try:
+        if os.path.islink(dest) or not os.path.isdir(dest):
+            raise ExtractError("Not a directory")
+
+        if archive_format == "zip":
+            extractor.extract_zip(archive_f_obj)
+        else:
+            extractor.extract_tar(archive_f_obj, "gz" if archive_format == "tar.gz" else "")
+    except (ExtractError, OSError, UnicodeDecodeError) as ex:
         print(ex, file=sys.stderr)
         sys.exit(SPECIAL_EXIT_CODE)
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as ex:
+        print("Invalid archive: {}".format(ex), file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    extractor.report_progress(done=True)
 
 
 def download_zip_cmd(
@@ -369,8 +1005,279 @@ def download_zip_cmd(
         sys.exit(SPECIAL_EXIT_CODE)
 
 
+def grep_cmd(
+    site_directory: str,
+    relpath: str,
+    pattern: str,
+    flags: str,
+    exclude_dirs_str: str,
+    max_file_size_str: str,
+    max_matches_str: str,
+    max_time_str: str,
+) -> None:
+    """Search the files under ``relpath`` for lines matching ``pattern``.
+
+    ``flags`` may contain "r" (treat the pattern as a regular expression instead of a literal
+    string) and "i" (ignore case). ``exclude_dirs_str`` is a "/"-separated list of directory
+    names that are never descended into.
+
+    Each match is printed as one JSON object per line. The last line is always a summary with
+    ``"done": true``, which records why the search stopped early (if it did).
+
+    """
+    if relpath.startswith("/"):
+        print("Invalid path", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    if not pattern:
+        print("Empty search pattern", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    if set(flags) - {"r", "i"}:
+        print("Invalid flags", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    try:
+        regex = re.compile(
+            pattern if "r" in flags else re.escape(pattern),
+            re.IGNORECASE if "i" in flags else 0,
+        )
+    except re.error as ex:
+        print("Invalid regular expression: {}".format(ex), file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    exclude_dirs = set(filter(None, exclude_dirs_str.split("/")))
+    max_file_size = int(max_file_size_str)
+    max_matches = int(max_matches_str)
+    max_time = float(max_time_str)
+
+    deadline = time.monotonic() + max_time
+
+    # The deadline is only checked between lines, so a pathological regex could run for much
+    # longer. Cap the CPU time as well. Reaching the soft limit interrupts the search (the regex
+    # engine checks for signals), which leaves a second to print the summary before the kernel
+    # kills us at the hard limit.
+    cpu_limit = math.ceil(max_time) + 1
+    signal.signal(signal.SIGXCPU, raise_grep_timeout)
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+
+    chroot_into(site_directory)
+
+    if os.path.isdir(relpath or "."):
+
+        def iter_fnames() -> Iterator[str]:
+            for dirpath, dirnames, filenames in os.walk(relpath or "."):
+                dirnames[:] = sorted(name for name in dirnames if name not in exclude_dirs)
+
+                for name in sorted(filenames):
+                    yield os.path.normpath(os.path.join(dirpath, name))
+
+        fnames = iter_fnames()
+    elif os.path.isfile(relpath):
+        fnames = iter([relpath])
+    else:
+        print("No such file or directory", file=sys.stderr)
+        sys.exit(SPECIAL_EXIT_CODE)
+
+    stop_reason = None
+    num_matches = 0
+    files_searched = 0
+    files_skipped = 0
+
+    try:
+        for fname in fnames:
+            if time.monotonic() > deadline:
+                stop_reason = "time"
+                break
+
+            try:
+                file_stat = os.lstat(fname)
+                # Symlinks are skipped so that nothing gets searched (or reported) twice
+                if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size > max_file_size:
+                    files_skipped += 1
+                    continue
+
+                with open(fname, "rb") as f_obj:
+                    if b"\0" in f_obj.read(GREP_BINARY_CHECK_SIZE):
+                        files_skipped += 1
+                        continue
+
+                    f_obj.seek(0)
+                    files_searched += 1
+
+                    for lineno, line in enumerate(f_obj, 1):
+                        text = line.decode(errors="replace").rstrip("\r\n")
+
+                        match = regex.search(text)
+                        if match is not None:
+                            print(
+                                json.dumps(
+                                    {
+                                        "fname": fname,
+                                        "line": lineno,
+                                        "col": match.start(),
+                                        "text": text[:GREP_MAX_LINE_LENGTH],
+                                    }
+                                )
+                            )
+
+                            num_matches += 1
+                            if num_matches >= max_matches:
+                                stop_reason = "matches"
+                                break
+
+                        if lineno % 1000 == 0 and time.monotonic() > deadline:
+                            stop_reason = "time"
+                            break
+            except OSError:
+                files_skipped += 1
+                continue
+            finally:
+                # Send results for each file as soon as we are done with it
+                sys.stdout.flush()
+
+            if stop_reason is not None:
+                break
+    except GrepTimeoutError:
+        # Don't let another signal interrupt the summary
+        signal.signal(signal.SIGXCPU, signal.SIG_IGN)
+        stop_reason = "time"
+
+    print(
+        json.dumps(
+            {
+                "done": True,
+                "stopped": stop_reason,
+                "matches": num_matches,
+                "files_searched": files_searched,
+                "files_skipped": files_skipped,
+            }
+        ),
+        flush=True,
+    )
+
+
+class WatchTrie:
+    """Maps watched directories to their watch descriptors.
+
+    Paths are indexed component by component, so a directory's watch and every watch beneath it
+    can be found (and removed) by walking down to it instead of scanning every watch.
+
+    """
+
+    class Node:
+        __slots__ = ("children", "wd")
+
+        def __init__(self) -> None:
+            self.children: Dict[str, "WatchTrie.Node"] = {}
+            self.wd: Optional[int] = None
+
+    def __init__(self) -> None:
+        self.root = WatchTrie.Node()
+
+    @staticmethod
+    def split_path(fname: str) -> List[str]:
+        return [part for part in fname.split("/") if part and part != "."]
+
+    def add(self, fname: str, wd: int) -> None:
+        node = self.root
+        for part in self.split_path(fname):
+            node = node.children.setdefault(part, WatchTrie.Node())
+
+        node.wd = wd
+
+    def pop(self, fname: str) -> Optional[int]:
+        """Remove the watch on ``fname`` (but not the ones beneath it) and return its descriptor."""
+        parts = self.split_path(fname)
+
+        path = [self.root]
+        for part in parts:
+            child = path[-1].children.get(part)
+            if child is None:
+                return None
+            path.append(child)
+
+        wd = path[-1].wd
+        path[-1].wd = None
+
+        # Prune the nodes that no longer lead to any watches
+        for part, parent, node in zip(reversed(parts), reversed(path[:-1]), reversed(path[1:])):
+            if node.wd is not None or node.children:
+                break
+            del parent.children[part]
+
+        return wd
+
+    def pop_subtree(self, fname: str) -> List[Tuple[str, int]]:
+        """Remove the watches on ``fname`` and everything beneath it.
+
+        Returns a list of (path, watch descriptor) pairs for the removed watches.
+
+        """
+        parts = self.split_path(fname)
+
+        if parts:
+            parent = self.root
+            for part in parts[:-1]:
+                child = parent.children.get(part)
+                if child is None:
+                    return []
+                parent = child
+
+            subtree = parent.children.pop(parts[-1], None)
+            if subtree is None:
+                return []
+        else:
+            subtree = self.root
+            self.root = WatchTrie.Node()
+
+        removed = []
+        stack = [("/".join(parts), subtree)]
+        while stack:
+            path, node = stack.pop()
+            if node.wd is not None:
+                removed.append((path, node.wd))
+
+            stack.extend(
+                (os.path.join(path, name), child) for name, child in node.children.items()
+            )
+
+        return removed
+
+
+def coalesce_file_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Collapse a batch of events so that each path appears at most once.
+
+    Only the last event for each path is kept (in the position of that last event), since it
+    describes the path's current state. An "update" to a path that was created earlier in the same
+    batch is sent as a "create", because the receiver has not seen the path yet.
+
+    """
+    latest: Dict[str, Dict[str, Any]] = {}
+
+    for event in events:
+        key = event["fname"].rstrip("/")
+
+        previous = latest.pop(key, None)
+        if previous is not None and previous["event"] == "create" and event["event"] == "update":
+            event = dict(event, event="create")
+
+        latest[key] = event
+
+    return list(latest.values())
+
+
 def monitor_cmd(site_directory: str) -> None:
-    """Emit JSON file events for directories managed via stdin commands."""
+    """Emit batches of JSON file events for directories managed via stdin commands.
+
+    Each line of output is a JSON object. ``{"listing": fname, "events": [...]}`` is sent in
+    response to each "+" command, with the directory's current contents as "create" events (or
+    an "error" event). ``{"events": [...]}`` carries the changes seen by the watches. Changes are
+    collected for MONITOR_BATCH_WINDOW seconds after the first one and coalesced before being
+    sent, so bursts of activity result in a few large messages instead of thousands of small
+    ones.
+
+    """
     chroot_into(site_directory)
 
     inotify = inotify_simple.INotify()
@@ -397,34 +1304,59 @@ def monitor_cmd(site_directory: str) -> None:
 
     stdin_data = b""
 
-    wds_by_fname: Dict[str, int] = {}
+    watches = WatchTrie()
     fnames_by_wd: Dict[int, str] = {}
 
+    pending_events: List[Dict[str, Any]] = []
+    batch_deadline = 0.0
+
+    def remove_watch(fname: str) -> None:
+        wd = watches.pop(fname)
+        if wd is not None:
+            try:
+                inotify.rm_watch(wd)
+            except OSError:
+                pass
+
+            fnames_by_wd.pop(wd, None)
+
     def remove_watch_and_subwatches(fname: str) -> None:
-        for wd, wd_fname in list(fnames_by_wd.items()):
-            # Remove for the directory itself, as well as all subdirectories
-            if os.path.commonpath([fname, wd_fname]) == fname:
-                try:
-                    inotify.rm_watch(wd)
-                except OSError:
-                    pass
+        # Remove for the directory itself, as well as all subdirectories
+        for _, wd in watches.pop_subtree(fname):
+            try:
+                inotify.rm_watch(wd)
+            except OSError:
+                pass
+
+            fnames_by_wd.pop(wd, None)
 
-                fnames_by_wd.pop(wd, None)
-                wds_by_fname.pop(wd_fname, None)
+    def flush_events() -> None:
+        if pending_events:
+            # flush=True is very important
+            print(json.dumps({"events": coalesce_file_events(pending_events)}), flush=True)
+            pending_events.clear()
 
     while True:
-        read_fds = select.select([inotify.fileno(), 0], [], [], 30)[0]
+        timeout = 30.0
+        if pending_events:
+            timeout = max(batch_deadline - time.monotonic(), 0)
+
+        read_fds = select.select([inotify.fileno(), 0], [], [], timeout)[0]
 
         for fd in read_fds:
             if fd == 0:
                 # Input formats:
-                # +<fname> -- begin watching the directory at fname
-                # -<fname> -- stop watching the directory at fname
+                # +<fname> -- begin watching the directory at fname and send its contents (if it
+                #             is already being watched, just send the contents again)
+                # -<fname> -- stop watching the directory at fname (but not its subdirectories)
                 # q -- quit
                 # Input format errors cause the program to exit with an error.
                 # Other errors (directories not existing, etc.) are silently
                 # ignored as they may have been caused by race conditions.
 
+                # Send any changes that are waiting first so they don't arrive after the listing
+                flush_events()
+
                 stdin_data += sys.stdin.buffer.read1(BUFSIZE)  # type: ignore
                 while b"\n" in stdin_data:
                     index = stdin_data.find(b"\n")
@@ -444,32 +1376,42 @@ def monitor_cmd(site_directory: str) -> None:
 
                     if operation == b"+":
                         # Add watch
+                        listing: List[Dict[str, Any]]
                         try:
                             watch_desc = inotify.add_watch(fname or ".", directory_watch_flags)
                         except OSError as ex:
-                            print(json.dumps({"event": "error", "fname": fname, "error": str(ex)}), flush=True)
+                            listing = [{"event": "error", "fname": fname, "error": str(ex)}]
                         else:
-                            wds_by_fname[fname] = watch_desc
+                            watches.add(fname, watch_desc)
                             fnames_by_wd[watch_desc] = fname
 
                             # Send the initial listing
                             # Sent as "create" events because there are only "create"
                             # and "delete" events
-                            for event_info in construct_scandir_file_dicts(fname):
-                                event_info["event"] = "create"
-
-                                # flush=True is very important
-                                print(json.dumps(event_info), flush=True)
+                            try:
+                                listing = construct_scandir_file_dicts(fname)
+                            except OSError as ex:
+                                listing = [{"event": "error", "fname": fname, "error": str(ex)}]
+                            else:
+                                for event_info in listing:
+                                    event_info["event"] = "create"
+
+                        # flush=True is very important
+                        print(json.dumps({"listing": fname, "events": listing}), flush=True)
                     elif operation == b"-":
                         # Remove watch
-                        remove_watch_and_subwatches(fname)
+                        remove_watch(fname)
                     elif operation == b"q":
                         # Quit
+                        flush_events()
                         sys.exit(0)
                     else:
                         print("Invalid input", file=sys.stderr)
                         sys.exit(SPECIAL_EXIT_CODE)
             elif fd == inotify.fileno():
+                if not pending_events:
+                    batch_deadline = time.monotonic() + MONITOR_BATCH_WINDOW
+
                 for event in inotify.read():
                     if event.wd not in fnames_by_wd:
                         continue
@@ -511,8 +1453,12 @@ def monitor_cmd(site_directory: str) -> None:
                         # that get triggered anyway.
                         continue
 
-                    # flush=True is very important
-                    print(json.dumps(event_info), flush=True)
+                    pending_events.append(event_info)
+
+        if pending_events and (
+            time.monotonic() >= batch_deadline or len(pending_events) >= MONITOR_MAX_BATCH_SIZE
+        ):
+            flush_events()
 
 
 def remove_all_site_files_dangerous_cmd(site_directory: str) -> None:
@@ -539,8 +1485,11 @@ def main(argv: List[str]) -> None:
     commands = {
         "ensure-directories-exist": (ensure_directories_exist_cmd, [1]),
         "ls": (ls_cmd, [2]),
+        "ls-many": (ls_many_cmd, [1]),
+        "ls-tree": (ls_tree_cmd, [5]),
         "get": (get_cmd, [3]),
-        "write": (write_cmd, [2, 3]),
+        "write": (write_cmd, [2, 3, 4]),
+        "extract": (extract_cmd, [6]),
         "monitor": (monitor_cmd, [1]),
         "remove-all-site-files-dangerous": (remove_all_site_files_dangerous_cmd, [1]),
         "rm": (rm_cmd, [2]),
@@ -550,6 +1499,8 @@ def main(argv: List[str]) -> None:
         "rename": (rename_cmd, [3]),
         "create": (create_cmd, [2, 3]),
         "download-zip": (download_zip_cmd, [4]),
+        "grep": (grep_cmd, [8]),
+        "batch": (batch_cmd, [2]),
     }
 
     if argv[1] in commands:
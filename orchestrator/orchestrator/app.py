@@ -4,9 +4,11 @@
 import logging
 import logging.handlers
 
-from flask import Flask, request
+from flask import Flask, Response, request
 
 from . import settings
+from .docker.utils import docker_client_manager
+from .views.batch import batch_blueprint
 from .views.database import database_blueprint
 from .views.docker import docker_blueprint
 from .views.files import files as files_blueprint
@@ -17,6 +19,7 @@ app.register_blueprint(docker_blueprint)
 app.register_blueprint(files_blueprint)
 app.register_blueprint(nginx_blueprint)
 app.register_blueprint(database_blueprint)
+app.register_blueprint(batch_blueprint)
 
 app.config.update(settings.FLASK_CONFIG)
 
@@ -69,5 +72,12 @@ def ping_page() -> str:
     return request.args.get("message", "Pong")
 
 
+@app.route("/metrics")
+def metrics_page() -> Response:
+    """Returns metrics about this process's use of the Docker API, in Prometheus's format."""
+
+    return Response(docker_client_manager.metrics.format_prometheus(), mimetype="text/plain")
+
+
 if __name__ == "__main__":
     app.run()
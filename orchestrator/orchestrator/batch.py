@@ -0,0 +1,156 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+# pylint: disable=unused-argument
+
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from docker.client import DockerClient
+
+from . import database as database_utils
+from .configs.nginx import disable_nginx_config, remove_nginx_config, update_nginx_config
+from .docker.services import (
+    reload_nginx_config,
+    remove_director_service,
+    restart_director_service,
+    update_director_service,
+)
+from .exceptions import OrchestratorActionError
+from .files import SiteFilesUserViewableException, ensure_site_directories_exist
+
+logger = logging.getLogger(__name__)
+
+# Steps are passed the Docker client, the site ID, the site's data, and the step itself (for any
+# extra parameters).
+SiteBatchStep = Callable[[DockerClient, int, Dict[str, Any], Dict[str, Any]], None]
+
+
+def update_nginx_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    update_nginx_config(site_id, site_data)
+
+
+def disable_nginx_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    disable_nginx_config(site_id)
+
+
+def remove_nginx_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    remove_nginx_config(site_id)
+
+
+def reload_nginx_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    reload_nginx_config(client)
+
+
+def update_docker_service_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    update_director_service(client, site_id, site_data)
+
+
+def restart_docker_service_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    restart_director_service(client, site_id)
+
+
+def remove_docker_service_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    remove_director_service(client, site_id)
+
+
+def ensure_directories_exist_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    ensure_site_directories_exist(site_id)
+
+
+# The database steps take the database's info (the same as /sites/databases/create and
+# /sites/databases/delete) in the step's "data" key
+
+
+def create_database_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    database_utils.create_database(step["data"])
+
+
+def delete_database_step(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any], step: Dict[str, Any]
+) -> None:
+    database_utils.delete_database(step["data"])
+
+
+SITE_BATCH_STEPS: Dict[str, SiteBatchStep] = {
+    "update-nginx": update_nginx_step,
+    "disable-nginx": disable_nginx_step,
+    "remove-nginx": remove_nginx_step,
+    "reload-nginx": reload_nginx_step,
+    "update-docker-service": update_docker_service_step,
+    "restart-docker-service": restart_docker_service_step,
+    "remove-docker-service": remove_docker_service_step,
+    "ensure-directories-exist": ensure_directories_exist_step,
+    "create-database": create_database_step,
+    "delete-database": delete_database_step,
+}
+
+
+def validate_site_batch_steps(steps: Any) -> bool:
+    return isinstance(steps, list) and all(
+        isinstance(step, dict) and step.get("op") in SITE_BATCH_STEPS for step in steps
+    )
+
+
+def run_site_batch(
+    client: DockerClient,
+    site_id: int,
+    site_data: Dict[str, Any],
+    steps: List[Dict[str, Any]],
+    *,
+    progress: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """Runs several actions on one site in order, stopping at the first one that fails. The site's
+    data (as passed to /sites/<site_id>/update-nginx, /sites/<site_id>/update-docker-service,
+    etc.) is only sent and parsed once for all of them.
+
+    Each step is a dictionary with an "op" key naming one of ``SITE_BATCH_STEPS``, plus any extra
+    parameters that step needs. Use ``validate_site_batch_steps()`` to check them first.
+
+    Returns a dictionary with a "results" list containing one {"status": "ok"|"error"|"skipped"}
+    dictionary (with an "error" message for failures) per step, like
+    ``files.run_batch_file_operations()``.
+
+    """
+    results: List[Dict[str, Any]] = []
+    failed = False
+
+    for step in steps:
+        if failed:
+            results.append({"status": "skipped"})
+            continue
+
+        if progress is not None:
+            progress("Running {}".format(step["op"]))
+
+        try:
+            SITE_BATCH_STEPS[step["op"]](client, site_id, site_data, step)
+        except (OrchestratorActionError, SiteFilesUserViewableException) as ex:
+            logger.exception("Error running %s for site %d", step["op"], site_id)
+            results.append({"status": "error", "error": str(ex)})
+            failed = True
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error running %s for site %d", step["op"], site_id)
+            results.append({"status": "error", "error": "Error"})
+            failed = True
+        else:
+            results.append({"status": "ok"})
+
+    return {"results": results}
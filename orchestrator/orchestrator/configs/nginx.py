@@ -1,10 +1,13 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
+import collections
+import json
 import os
 import re
 import shutil
-from typing import Any, Dict
+import tempfile
+from typing import Any, Dict, List, Optional
 
 import jinja2
 
@@ -16,6 +19,16 @@ TEMPLATE_DIRECTORY = os.path.join(os.path.dirname(__file__), "templates")
 
 jinja_env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE_DIRECTORY))
 nginx_template = jinja_env.get_template("nginx.conf")
+nginx_site_maps_template = jinja_env.get_template("nginx-site-maps.conf")
+nginx_shared_template = jinja_env.get_template("nginx-shared.conf")
+
+
+def get_site_nginx_config_path(site_id: int) -> str:
+    return os.path.join(settings.NGINX_CONFIG_DIRECTORY, "site-{}.conf".format(site_id))
+
+
+def get_site_nginx_data_path(site_id: int) -> str:
+    return os.path.join(settings.NGINX_SITE_DATA_DIRECTORY, "site-{}.json".format(site_id))
 
 
 def update_nginx_config(site_id: int, data: Dict[str, Any]) -> None:
@@ -70,19 +83,20 @@ def update_nginx_config(site_id: int, data: Dict[str, Any]) -> None:
         **new_data,
     }
 
+    if settings.NGINX_USE_SITE_MAPS and not new_data["custom_nginx_config"].strip():
+        # The site is served through the shared map config (see write_nginx_site_maps_config()),
+        # so it just needs an entry
+        write_nginx_site_data(site_id, variables)
+        _move_aside(
+            get_site_nginx_config_path(site_id), ".bak", "Error backing up old Nginx config"
+        )
+        return
+
     text = nginx_template.render(variables)
 
-    nginx_config_path = os.path.join(
-        settings.NGINX_CONFIG_DIRECTORY, "site-{}.conf".format(site_id)
-    )
+    nginx_config_path = get_site_nginx_config_path(site_id)
 
-    if os.path.exists(nginx_config_path):
-        try:
-            shutil.move(nginx_config_path, nginx_config_path + ".bak")
-        except OSError as ex:
-            raise OrchestratorActionError(
-                "Error backing up old Nginx config: {}".format(ex)
-            ) from ex
+    _move_aside(nginx_config_path, ".bak", "Error backing up old Nginx config")
 
     try:
         with open(nginx_config_path, "w") as f_obj:
@@ -90,32 +104,218 @@ def update_nginx_config(site_id: int, data: Dict[str, Any]) -> None:
     except OSError as ex:
         raise OrchestratorActionError("Error writing Nginx config: {}".format(ex)) from ex
 
+    # Sites with their own server blocks are left out of the shared map config anyway, but don't
+    # leave stale entries around
+    _move_aside(get_site_nginx_data_path(site_id), ".bak", "Error backing up old Nginx config")
 
-def disable_nginx_config(site_id: int) -> None:
-    """Returns None on success or a message on failure."""
-    nginx_config_path = os.path.join(
-        settings.NGINX_CONFIG_DIRECTORY, "site-{}.conf".format(site_id)
-    )
 
-    if os.path.exists(nginx_config_path):
+def _move_aside(path: str, suffix: str, error_msg: str) -> None:
+    if os.path.exists(path):
         try:
-            shutil.move(nginx_config_path, nginx_config_path + ".bad")
+            shutil.move(path, path + suffix)
         except OSError as ex:
-            raise OrchestratorActionError(
-                "Error moving old Nginx config out of the way: {}".format(ex)
-            ) from ex
+            raise OrchestratorActionError("{}: {}".format(error_msg, ex)) from ex
 
 
-def remove_nginx_config(site_id: int) -> None:
-    """Returns None on success or a message on failure."""
-    nginx_config_path = os.path.join(
-        settings.NGINX_CONFIG_DIRECTORY, "site-{}.conf".format(site_id)
+def _write_file_atomic(path: str, text: str) -> None:
+    # The temporary file's name doesn't end in .conf, so Nginx never includes it
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f_obj:
+            f_obj.write(text)
+
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+
+def write_nginx_site_data(site_id: int, variables: Dict[str, Any]) -> None:
+    """Saves a site's entry for the shared map config (see write_nginx_site_maps_config())."""
+    if not variables["is_being_served"]:
+        kind = "disabled"
+    elif variables["type"] == "static":
+        kind = "static"
+    else:
+        kind = "dynamic"
+
+    site_data = {
+        "id": site_id,
+        "hostname": "{}.{}".format(variables["name"], settings.SITES_DOMAIN),
+        "kind": kind,
+        "site_dir": variables["site_dir"],
+        "client_body_limit": variables["client_body_limit"],
+        "primary_url_base": variables["primary_url_base"],
+        "no_redirect_domains": sorted(variables["no_redirect_domains"]),
+    }
+
+    try:
+        os.makedirs(settings.NGINX_SITE_DATA_DIRECTORY, exist_ok=True)
+        _write_file_atomic(get_site_nginx_data_path(site_id), json.dumps(site_data))
+    except OSError as ex:
+        raise OrchestratorActionError("Error writing Nginx site entry: {}".format(ex)) from ex
+
+
+def _hash_bucket_size(longest_key: int) -> int:
+    # Each bucket has to fit at least one key, plus a pointer and some alignment
+    size = 64
+    while size < longest_key + 32:
+        size *= 2
+
+    return size
+
+
+def render_nginx_site_maps_config(sites: List[Dict[str, Any]]) -> str:
+    """Renders the shared map config for the given site entries (see write_nginx_site_data())."""
+    sites = sorted(sites, key=lambda site: int(site["id"]))
+
+    # client_max_body_size can't be set from a variable, so sites are split into server blocks by
+    # their kind and client body limit. There are only ever a few of those.
+    groups: Dict[Any, List[str]] = collections.defaultdict(list)
+    for site in sites:
+        groups[(site["kind"], site["client_body_limit"])].append(site["hostname"])
+
+    # The largest group is matched with a wildcard; the rest have to be listed
+    largest_group = max(groups, key=lambda key: len(groups[key]), default=None)
+
+    server_groups = []
+    for (kind, client_body_limit), hostnames in sorted(groups.items()):
+        server_groups.append(
+            {
+                "kind": kind,
+                "client_body_limit": client_body_limit,
+                "hostnames": (None if (kind, client_body_limit) == largest_group else hostnames),
+            }
+        )
+
+    listed_hostnames = [
+        hostname for group in server_groups for hostname in group["hostnames"] or []
+    ]
+
+    map_keys = [site["hostname"] for site in sites] + [
+        "{} {}".format(site["hostname"], domain)
+        for site in sites
+        if site["primary_url_base"]
+        for domain in site["no_redirect_domains"]
+    ]
+
+    return nginx_site_maps_template.render(
+        settings=settings,
+        sites=sites,
+        server_groups=server_groups,
+        map_hash_max_size=max(2048, 2 * len(map_keys)),
+        map_hash_bucket_size=_hash_bucket_size(max(map(len, map_keys), default=0)),
+        server_names_hash_max_size=max(512, 2 * len(listed_hostnames)),
+        server_names_hash_bucket_size=_hash_bucket_size(max(map(len, listed_hostnames), default=0)),
     )
 
-    if os.path.exists(nginx_config_path):
+
+def load_nginx_site_data() -> List[Dict[str, Any]]:
+    """Loads the entries of all the sites that are served through the shared map config.
+
+    Sites that have their own config file are skipped, in case they have entries left over from
+    before NGINX_USE_SITE_MAPS was turned off (or before they added custom config).
+
+    """
+    try:
+        filenames = os.listdir(settings.NGINX_SITE_DATA_DIRECTORY)
+    except FileNotFoundError:
+        return []
+
+    config_filenames = set(os.listdir(settings.NGINX_CONFIG_DIRECTORY))
+
+    sites = []
+    for filename in filenames:
+        match = re.search(r"^site-(\d+)\.json$", filename)
+        if match is None or "site-{}.conf".format(match.group(1)) in config_filenames:
+            continue
+
         try:
-            os.remove(nginx_config_path)
+            with open(os.path.join(settings.NGINX_SITE_DATA_DIRECTORY, filename)) as f_obj:
+                sites.append(json.load(f_obj))
+        except FileNotFoundError:
+            # Removed since we listed the directory
+            continue
+
+    return sites
+
+
+def write_nginx_site_maps_config() -> Optional[str]:
+    """Regenerates the shared map config from the sites' entries if NGINX_USE_SITE_MAPS is
+    enabled, or removes it if it isn't. This is done right before reloading Nginx, so updating
+    many sites' configs only rebuilds it once.
+
+    Returns the path to the config, or None if NGINX_USE_SITE_MAPS is disabled.
+
+    """
+    path = os.path.join(settings.NGINX_CONFIG_DIRECTORY, settings.NGINX_SITE_MAPS_CONFIG_NAME)
+
+    if not settings.NGINX_USE_SITE_MAPS:
+        # Don't leave a stale config from when it was enabled; it would serve old entries (and
+        # define the same upstream blocks as the sites' own configs)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
         except OSError as ex:
             raise OrchestratorActionError(
-                "Error moving old Nginx config out of the way: {}".format(ex)
+                "Error removing Nginx site maps config: {}".format(ex)
             ) from ex
+
+        return None
+
+    try:
+        text = render_nginx_site_maps_config(load_nginx_site_data())
+        _write_file_atomic(path, text)
+    except (OSError, ValueError) as ex:
+        raise OrchestratorActionError("Error writing Nginx site maps config: {}".format(ex)) from ex
+
+    return path
+
+
+def write_nginx_shared_config() -> str:
+    """Regenerates the config with the definitions shared by all the sites' configs. Like the
+    shared map config, this is done right before reloading Nginx.
+
+    Returns the path to the config.
+
+    """
+    path = os.path.join(settings.NGINX_CONFIG_DIRECTORY, settings.NGINX_SHARED_CONFIG_NAME)
+
+    try:
+        _write_file_atomic(path, nginx_shared_template.render(settings=settings))
+    except OSError as ex:
+        raise OrchestratorActionError("Error writing shared Nginx config: {}".format(ex)) from ex
+
+    return path
+
+
+def disable_nginx_config(site_id: int) -> None:
+    """Returns None on success or a message on failure."""
+    _move_aside(
+        get_site_nginx_config_path(site_id),
+        ".bad",
+        "Error moving old Nginx config out of the way",
+    )
+    _move_aside(
+        get_site_nginx_data_path(site_id),
+        ".bad",
+        "Error moving old Nginx config out of the way",
+    )
+
+
+def remove_nginx_config(site_id: int) -> None:
+    """Returns None on success or a message on failure."""
+    for path in [get_site_nginx_config_path(site_id), get_site_nginx_data_path(site_id)]:
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as ex:
+                raise OrchestratorActionError(
+                    "Error moving old Nginx config out of the way: {}".format(ex)
+                ) from ex
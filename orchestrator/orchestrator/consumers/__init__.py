@@ -1,8 +1,10 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
+from .database import database_console_handler
 from .files import file_monitor_handler, remove_all_site_files_dangerous_handler
 from .images import build_image_handler
+from .jobs import job_status_handler, submit_job_handler
 from .logs import logs_handler
 from .shell_server import ssh_shell_handler
 from .status import multi_status_handler, status_handler
@@ -10,11 +12,14 @@ from .web_terminal import web_terminal_handler
 
 __all__ = (
     "build_image_handler",
+    "database_console_handler",
     "file_monitor_handler",
+    "job_status_handler",
     "logs_handler",
     "multi_status_handler",
     "remove_all_site_files_dangerous_handler",
     "ssh_shell_handler",
     "status_handler",
+    "submit_job_handler",
     "web_terminal_handler",
 )
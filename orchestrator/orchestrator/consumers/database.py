@@ -0,0 +1,254 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Generator, Optional
+
+import websockets
+
+from .. import settings
+from ..database import DatabaseConsoleSession
+from ..websockets_types import WebSocketClientProtocol
+from .utils import mainloop_auto_cancel, wait_for_event
+
+logger = logging.getLogger(__name__)
+
+# Number of console sessions open in this process
+num_console_sessions = 0
+
+
+def is_valid_query_message(msg: Dict[str, Any]) -> bool:
+    """Checks the parameters of a "query" message: the query, its output format (see
+    database.QueryResultFormatter), and the optional positive integer "max_rows" and "max_bytes"
+    limits."""
+    if not isinstance(msg["query"], str) or msg.get("format", "tsv") not in {"tsv", "ndjson"}:
+        return False
+
+    for name in ["max_rows", "max_bytes"]:
+        value = msg.get(name)
+        if value is not None and (
+            not isinstance(value, int) or isinstance(value, bool) or value <= 0
+        ):
+            return False
+
+    return True
+
+
+async def database_console_handler(
+    websock: WebSocketClientProtocol,
+    params: Dict[str, Any],
+    stop_event: asyncio.Event,
+) -> None:
+    """Runs an SQL console on a site's database, using one connection for as long as the websocket
+    is open (see database.DatabaseConsoleSession).
+
+    The client first sends the database's info (the same as /sites/databases/query), and is sent
+    {"connected": true} (or {"error": ...}) once the connection is open. After that, it can send:
+    - {"query": <sql>, "format": "tsv"|"ndjson", "max_rows": ..., "max_bytes": ...} to run a
+      query (only "query" is required). The output is sent in {"output": <chunk>} messages,
+      followed by {"done": true}. Only one query can run at a time.
+    - {"cancel": true} to cancel the running query.
+    - {"heartbeat": ...}, which is sent back.
+
+    The session is closed after ``settings.DATABASE_CONSOLE_IDLE_TIMEOUT`` seconds without a query.
+
+    """
+    global num_console_sessions  # pylint: disable=global-statement
+
+    site_id = int(params["site_id"])
+
+    try:
+        database_info = json.loads(await websock.recv())
+        session = DatabaseConsoleSession(database_info)
+    except websockets.exceptions.ConnectionClosed:
+        return
+    except (json.JSONDecodeError, TypeError, KeyError):
+        await websock.close()
+        return
+
+    if num_console_sessions >= settings.DATABASE_CONSOLE_MAX_SESSIONS:
+        try:
+            await websock.send(json.dumps({"error": "Too many console sessions are open"}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        await websock.close()
+        return
+
+    num_console_sessions += 1
+    try:
+        await run_console_session(websock, site_id, session, stop_event)
+    finally:
+        num_console_sessions -= 1
+
+    await websock.close()
+
+
+async def run_console_session(
+    websock: WebSocketClientProtocol,
+    site_id: int,
+    session: DatabaseConsoleSession,
+    stop_event: asyncio.Event,
+) -> None:
+    loop = asyncio.get_running_loop()
+
+    try:
+        await loop.run_in_executor(None, session.open)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error opening database console for site %d", site_id)
+        try:
+            await websock.send(json.dumps({"error": "Error connecting to database"}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        return
+
+    logger.info("Opened database console for site %d", site_id)
+
+    # The query that's running, and the call to read its next chunk of output (which runs in an
+    # executor and can't be interrupted except by cancelling the query)
+    query_task: Optional[asyncio.Task[None]] = None
+    results: Optional[Generator[str, None, None]] = None
+    pending_read: Optional[asyncio.Future[Optional[str]]] = None
+
+    last_active = loop.time()
+
+    async def cancel_query() -> None:
+        try:
+            await loop.run_in_executor(None, session.cancel)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error cancelling query in database console for site %d", site_id)
+
+    async def run_query(msg: Dict[str, Any]) -> None:
+        nonlocal results, pending_read, last_active
+
+        results = session.iter_query_results(
+            msg["query"],
+            fmt=msg.get("format", "tsv"),
+            max_rows=msg.get("max_rows"),
+            max_bytes=msg.get("max_bytes"),
+        )
+
+        try:
+            try:
+                while True:
+                    pending_read = loop.run_in_executor(None, next, results, None)
+
+                    # The database should cancel statements after DATABASE_QUERY_TIMEOUT seconds,
+                    # but the user can change that setting for their session
+                    done, _ = await asyncio.wait(
+                        [pending_read], timeout=settings.DATABASE_QUERY_TIMEOUT + 5
+                    )
+                    if not done:
+                        await cancel_query()
+
+                    # If this task is cancelled, the read keeps running in the executor, so don't
+                    # let the cancellation mark it as done (see the cleanup below)
+                    chunk = await asyncio.shield(pending_read)
+                    if chunk is None:
+                        break
+
+                    await websock.send(json.dumps({"output": chunk}))
+            except websockets.exceptions.ConnectionClosed:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error running query in database console for site %d", site_id)
+                await websock.send(json.dumps({"error": "Error"}))
+            finally:
+                last_active = loop.time()
+
+            if not session.usable:
+                await websock.send(json.dumps({"error": "Database connection lost"}))
+                await websock.close()
+                return
+
+            await websock.send(json.dumps({"done": True}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def websock_loop() -> None:
+        nonlocal query_task, last_active
+
+        while True:
+            try:
+                frame = await websock.recv()
+            except websockets.exceptions.ConnectionClosed:
+                return
+
+            try:
+                msg = json.loads(frame)
+            except json.JSONDecodeError:
+                continue
+
+            if not isinstance(msg, dict):
+                continue
+
+            try:
+                if "query" in msg:
+                    if query_task is not None and not query_task.done():
+                        await websock.send(json.dumps({"error": "A query is already running"}))
+                    elif not is_valid_query_message(msg):
+                        await websock.send(json.dumps({"error": "Invalid query"}))
+                    else:
+                        last_active = loop.time()
+                        query_task = asyncio.ensure_future(run_query(msg))
+                elif msg.get("cancel"):
+                    if query_task is not None and not query_task.done():
+                        await cancel_query()
+                elif "heartbeat" in msg:
+                    await websock.send(frame)
+            except websockets.exceptions.ConnectionClosed:
+                return
+
+    async def idle_loop() -> None:
+        while True:
+            if query_task is not None and not query_task.done():
+                # The idle timeout starts over when the query finishes, so check back soon
+                timeout: float = settings.DATABASE_CONSOLE_IDLE_CHECK_INTERVAL
+            else:
+                timeout = last_active + settings.DATABASE_CONSOLE_IDLE_TIMEOUT - loop.time()
+                if timeout <= 0:
+                    logger.info("Database console for site %d timed out", site_id)
+                    return
+
+            await asyncio.sleep(timeout)
+
+    try:
+        await websock.send(json.dumps({"connected": True}))
+
+        await mainloop_auto_cancel(
+            [websock_loop(), idle_loop(), wait_for_event(stop_event)],
+        )
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        try:
+            if query_task is not None:
+                query_task.cancel()
+                try:
+                    await query_task
+                except asyncio.CancelledError:
+                    pass
+
+            # Wait for the database to finish whatever it was doing before closing the connection.
+            # The generator can't be closed while the executor is still inside next().
+            if pending_read is not None and not pending_read.done():
+                await cancel_query()
+                try:
+                    await pending_read
+                except Exception:  # pylint: disable=broad-except
+                    pass
+
+            if results is not None:
+                try:
+                    await loop.run_in_executor(None, results.close)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception(
+                        "Error finishing query in database console for site %d", site_id
+                    )
+        finally:
+            await loop.run_in_executor(None, session.close)
+
+            logger.info("Closed database console for site %d", site_id)
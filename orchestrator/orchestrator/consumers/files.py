@@ -11,7 +11,7 @@ from typing import Any, Dict
 import websockets
 
 from ..files import (
-    SiteFilesMonitor,
+    SharedSiteFilesMonitor,
     SiteFilesUserViewableException,
     remove_all_site_files_dangerous,
 )
@@ -28,8 +28,8 @@ async def file_monitor_handler(  # pylint: disable=unused-argument
 ) -> None:
     site_id = int(params["site_id"])
 
-    monitor = SiteFilesMonitor(site_id)
-    await monitor.start()
+    # All the clients watching this site's files share one helper process
+    monitor = await SharedSiteFilesMonitor.subscribe(site_id)
 
     async def websock_loop() -> None:
         while True:
@@ -56,16 +56,18 @@ async def file_monitor_handler(  # pylint: disable=unused-argument
                         return
 
     async def monitor_loop() -> None:
-        async for event in monitor.aiter_events():
+        async for events in monitor.aiter_events():
             try:
-                await websock.send(json.dumps(event))
+                await websock.send(json.dumps(events))
             except websockets.exceptions.ConnectionClosed:
                 break
 
-    await mainloop_auto_cancel([websock_loop(), monitor_loop(), wait_for_event(stop_event)])
+    try:
+        await mainloop_auto_cancel([websock_loop(), monitor_loop(), wait_for_event(stop_event)])
+    finally:
+        await monitor.close()
 
     await websock.close()
-    await monitor.stop_wait(timeout=3)
 
 
 async def remove_all_site_files_dangerous_handler(  # pylint: disable=unused-argument
@@ -12,9 +12,11 @@ from typing import Any, Dict, Iterator, Optional, TypeVar, cast
 
 import websockets
 
+from .. import settings
 from ..docker.images import build_custom_docker_image, push_custom_docker_image
-from ..docker.utils import create_client
+from ..docker.utils import get_shared_client
 from ..exceptions import OrchestratorActionError
+from ..terminal_pool import terminal_warm_pool
 from ..websockets_types import WebSocketClientProtocol
 
 logger = logging.getLogger(__name__)
@@ -47,7 +49,7 @@ async def build_image_handler(  # pylint: disable=unused-argument
     except (websockets.exceptions.ConnectionClosed, json.JSONDecodeError, asyncio.CancelledError):
         return
 
-    client = await loop.run_in_executor(image_executor, create_client)
+    client = await loop.run_in_executor(image_executor, get_shared_client)
 
     result = {"successful": True, "msg": "Success"}
 
@@ -126,6 +128,11 @@ async def build_image_handler(  # pylint: disable=unused-argument
             else:
                 logger.info("Pushed image %s", build_data["name"])
 
+                # Make terminals pick up the new image right away
+                terminal_warm_pool.invalidate_image(
+                    settings.DOCKER_REGISTRY_URL + "/" + build_data["name"]
+                )
+
     try:
         await websock.send(json.dumps(result))
     except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError):
@@ -0,0 +1,81 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import asyncio
+import json
+from typing import Any, Dict
+
+import websockets
+
+from ..exceptions import OrchestratorActionError
+from ..jobs import Job, job_runner
+from ..websockets_types import WebSocketClientProtocol
+from .utils import mainloop_auto_cancel, wait_for_event
+
+
+async def send_job_updates(
+    websock: WebSocketClientProtocol, job: Job, stop_event: asyncio.Event
+) -> None:
+    async def job_loop() -> None:
+        try:
+            async for data in job.aiter_updates():
+                await websock.send(json.dumps(data))
+        except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError):
+            pass
+
+    # The job keeps running if the client goes away
+    await mainloop_auto_cancel([websock.wait_closed(), job_loop(), wait_for_event(stop_event)])
+
+
+async def submit_job_handler(  # pylint: disable=unused-argument
+    websock: WebSocketClientProtocol,
+    params: Dict[str, Any],
+    stop_event: asyncio.Event,
+) -> None:
+    """Submits a job. The client sends {"type": ..., "params": {...}}, and is sent back
+    {"job_id": ...} (or {"error": ...}). After that, the client can close the connection and poll
+    for the job's state with GET /jobs/<job_id>, or stay connected to be sent the job's state every
+    time it changes (like with /ws/jobs/<job_id>)."""
+    try:
+        data = json.loads(await websock.recv())
+        job_type = data["type"]
+        job_params = data.get("params", {})
+    except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError):
+        return
+    except (json.JSONDecodeError, TypeError, KeyError):
+        await websock.close()
+        return
+
+    try:
+        job = job_runner.submit(job_type, job_params)
+    except OrchestratorActionError as ex:
+        result = {"error": str(ex)}
+    else:
+        result = {"job_id": job.id}
+
+    try:
+        await websock.send(json.dumps(result))
+    except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError):
+        return
+
+    if "job_id" in result:
+        await send_job_updates(websock, job, stop_event)
+
+    await websock.close()
+
+
+async def job_status_handler(
+    websock: WebSocketClientProtocol,
+    params: Dict[str, Any],
+    stop_event: asyncio.Event,
+) -> None:
+    """Sends the state of the given job every time it changes, and closes the connection once it
+    has finished."""
+    job = job_runner.get_job(params["job_id"])
+    if job is None:
+        await websock.close()
+        return
+
+    await send_job_updates(websock, job, stop_event)
+
+    await websock.close()
@@ -17,7 +17,7 @@ import websockets
 from directorutil import crypto
 
 from .. import settings
-from ..docker.utils import create_client
+from ..docker.utils import get_shared_client
 from ..terminal import TerminalContainer
 from ..websockets_types import WebSocketClientProtocol
 from .utils import mainloop_auto_cancel, wait_for_event
@@ -106,7 +106,7 @@ async def ssh_shell_handler(
     except websockets.exceptions.ConnectionClosed:
         return
 
-    client = create_client(timeout=60)
+    client = get_shared_client()
 
     try:
         terminal = TerminalContainer(client, site_id, site_data)
@@ -153,7 +153,7 @@ async def ssh_shell_handler(
     async def terminal_loop() -> None:
         while True:
             try:
-                chunk = await terminal.read(4096)
+                chunk = await terminal.read_coalesced()
             except OSError:
                 chunk = b""
 
@@ -181,5 +181,3 @@ async def ssh_shell_handler(
 
     await terminal.close()
     await websock.close()
-
-    client.close()
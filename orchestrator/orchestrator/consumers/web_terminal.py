@@ -12,7 +12,7 @@ import docker
 import websockets
 
 from .. import settings
-from ..docker.utils import create_client
+from ..docker.utils import get_shared_client
 from ..terminal import TerminalContainer
 from ..websockets_types import WebSocketClientProtocol
 from .utils import mainloop_auto_cancel, wait_for_event
@@ -36,7 +36,7 @@ async def web_terminal_handler(  # pylint: disable=unused-argument
 
     logger.info("Opening terminal for site %s", site_id)
 
-    client = create_client(timeout=60)
+    client = get_shared_client()
 
     try:
         terminal = TerminalContainer(client, site_id, site_data)
@@ -76,7 +76,7 @@ async def web_terminal_handler(  # pylint: disable=unused-argument
     async def terminal_loop() -> None:
         while True:
             try:
-                chunk = await terminal.read(4096)
+                chunk = await terminal.read_coalesced()
             except OSError:
                 chunk = b""
 
@@ -104,5 +104,3 @@ async def web_terminal_handler(  # pylint: disable=unused-argument
 
     await terminal.close()
     await websock.close()
-
-    client.close()
@@ -1,28 +1,57 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
+import collections
+import json
+import logging
+import math
+import os
+import re
+import selectors
 import string
+import subprocess
+import threading
+import time
+import zlib
 from contextlib import contextmanager
-from typing import Any, ContextManager, Dict, Optional
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    cast,
+)
 
 import MySQLdb
+import MySQLdb.cursors
 import psycopg2
 from psycopg2 import errorcodes
 from psycopg2 import sql as psql
 
+from . import settings
+from .exceptions import OrchestratorActionError
+from .sql_dumps import SQLDumpReader
+
+logger = logging.getLogger(__name__)
+
 
 def mysql_clean_identifier(identifier: str) -> str:
     return "".join(c for c in identifier if c in string.ascii_letters + string.digits + "_")
 
 
-@contextmanager
-def _open_cursor(
+def _connect(
     *, dbms: str, hostname: str, port: int, username: str, password: str, dbname: Optional[str]
 ) -> Any:
-    """Opens a cursor to the specified database host. Intended to be used as a context manager.
+    """Opens a new connection to the specified database host.
 
-    This will return different types depending on the value of dbms,
-    so make sure to check that before you try to run queries!
+    This will return different types depending on the value of dbms.
 
     """
 
@@ -37,10 +66,11 @@ def _open_cursor(
 
         try:
             conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-
-            yield conn.cursor()
-        finally:
+        except BaseException:
             conn.close()
+            raise
+
+        return conn
     elif dbms == "mysql":
         # For MySQL, we need to indicate Unix sockets specially
         kwargs = {}
@@ -48,7 +78,7 @@ def _open_cursor(
             kwargs["unix_socket"] = hostname
             hostname = "localhost"
 
-        conn = MySQLdb.connect(
+        return MySQLdb.connect(
             host=hostname,
             port=port,
             user=username,
@@ -56,16 +86,341 @@ def _open_cursor(
             db=dbname,
             **kwargs,
         )
+    else:
+        raise ValueError("Unknown DBMS {!r}".format(dbms))
+
+
+class ConnectionPool:
+    """A pool of connections to one database, as one user.
+
+    At most ``settings.DATABASE_POOL_MAX_SIZE`` connections are open at once; past that, callers
+    wait up to ``settings.DATABASE_POOL_ACQUIRE_TIMEOUT`` seconds for one to be returned.
+    Connections that have been idle for more than ``settings.DATABASE_POOL_CHECK_INTERVAL``
+    seconds are checked before being reused, and ones idle for more than
+    ``settings.DATABASE_POOL_IDLE_TIMEOUT`` seconds are closed.
+
+    Connections are only returned to the pool if they were used without errors and are in a clean
+    state; otherwise they are closed. This is only used for the administrator connections we run
+    our own statements on. A MySQL session can't be fully reset (variables, temporary tables and
+    table locks would carry over to the next user), so connections running site users' queries
+    are never pooled (see _open_unpooled_connection()).
+
+    """
+
+    def __init__(self, **connect_kwargs: Any) -> None:
+        self.dbms: str = connect_kwargs["dbms"]
+        self.connect_kwargs = connect_kwargs
+
+        self.lock = threading.Lock()
+        # (connection, time it was returned to the pool), oldest first
+        self.idle: Deque[Tuple[Any, float]] = collections.deque()
+        self.slots = threading.BoundedSemaphore(settings.DATABASE_POOL_MAX_SIZE)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        if not self.slots.acquire(timeout=settings.DATABASE_POOL_ACQUIRE_TIMEOUT):
+            raise OrchestratorActionError("Timed out waiting for a database connection")
 
         try:
-            yield conn.cursor()
+            conn = self._get_idle_connection()
+            if conn is None:
+                conn = _connect(**self.connect_kwargs)
 
-            conn.commit()
+            try:
+                yield conn
+            except BaseException:
+                self._close(conn)
+                raise
+
+            if self._reset(conn):
+                with self.lock:
+                    self.idle.append((conn, time.monotonic()))
+            else:
+                self._close(conn)
         finally:
+            self.slots.release()
+
+    def _get_idle_connection(self) -> Optional[Any]:
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+
+                # Reuse the most recently used connection, so the rest can age out
+                conn, idle_since = self.idle.pop()
+
+            if time.monotonic() - idle_since < settings.DATABASE_POOL_CHECK_INTERVAL:
+                return conn
+
+            if self._check(conn):
+                return conn
+
+            self._close(conn)
+
+    def _check(self, conn: Any) -> bool:
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+
+            if self.dbms == "mysql":
+                conn.commit()
+        except (psycopg2.Error, MySQLdb.Error):  # pylint: disable=no-member
+            return False
+
+        return True
+
+    def _reset(self, conn: Any) -> bool:
+        """Cleans up a connection before it goes back into the pool. Returns whether it can be
+        reused."""
+        try:
+            if self.dbms == "postgres":
+                if conn.closed or (
+                    conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                ):
+                    return False
+
+                cursor = conn.cursor()
+                try:
+                    # Throw away any session state (settings, temporary tables, prepared
+                    # statements, etc.)
+                    cursor.execute("DISCARD ALL")
+                finally:
+                    cursor.close()
+            else:
+                conn.commit()
+        except (psycopg2.Error, MySQLdb.Error):  # pylint: disable=no-member
+            return False
+
+        return True
+
+    def _close(self, conn: Any) -> None:
+        try:
             conn.close()
-    else:
+        except (psycopg2.Error, MySQLdb.Error):  # pylint: disable=no-member
+            pass
+
+    def evict_idle(self) -> None:
+        """Closes connections that have been idle for too long."""
+        cutoff = time.monotonic() - settings.DATABASE_POOL_IDLE_TIMEOUT
+
+        with self.lock:
+            expired = [conn for conn, idle_since in self.idle if idle_since < cutoff]
+            self.idle = collections.deque(
+                (conn, idle_since) for conn, idle_since in self.idle if idle_since >= cutoff
+            )
+
+        for conn in expired:
+            self._close(conn)
+
+    def close_oldest_idle(self) -> None:
+        """Closes the connection that has been idle the longest, if there is one."""
+        with self.lock:
+            if not self.idle:
+                return
+
+            conn, _ = self.idle.popleft()
+
+        self._close(conn)
+
+
+class ConnectionPoolManager:
+    """Keeps one ConnectionPool for each combination of database host, user, and database.
+
+    At most ``settings.DATABASE_POOL_MAX_IDLE`` idle connections are kept across all the pools;
+    past that, the ones that have been idle the longest are closed. A background thread cleans up
+    idle connections (and pools that are no longer being used) every
+    ``settings.DATABASE_POOL_EVICTION_INTERVAL`` seconds, so connections to databases that are no
+    longer being used don't stay open.
+
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.pools: Dict[Tuple[Any, ...], ConnectionPool] = {}
+        # The number of callers using (or waiting for a connection from) each pool
+        self.users: Dict[Tuple[Any, ...], int] = {}
+        self.eviction_thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def connection(self, **connect_kwargs: Any) -> Iterator[Any]:
+        key = tuple(sorted(connect_kwargs.items()))
+
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = self.pools[key] = ConnectionPool(**connect_kwargs)
+
+            self.users[key] = self.users.get(key, 0) + 1
+
+            # Started here instead of in __init__() so that it runs in each (forked) worker
+            if self.eviction_thread is None:
+                self.eviction_thread = threading.Thread(
+                    target=self._run_eviction, name="database-pool-eviction", daemon=True
+                )
+                self.eviction_thread.start()
+
+        try:
+            with pool.connection() as conn:
+                yield conn
+        finally:
+            with self.lock:
+                self.users[key] -= 1
+
+        self.limit_idle()
+
+    def limit_idle(self) -> None:
+        """Closes the connections that have been idle the longest until there are at most
+        ``settings.DATABASE_POOL_MAX_IDLE`` idle connections left across all the pools."""
+        with self.lock:
+            pools = list(self.pools.values())
+
+        while True:
+            total = 0
+            oldest_pool: Optional[ConnectionPool] = None
+            oldest_idle_since = math.inf
+
+            for pool in pools:
+                with pool.lock:
+                    total += len(pool.idle)
+                    if pool.idle and pool.idle[0][1] < oldest_idle_since:
+                        oldest_pool = pool
+                        oldest_idle_since = pool.idle[0][1]
+
+            if total <= settings.DATABASE_POOL_MAX_IDLE or oldest_pool is None:
+                return
+
+            oldest_pool.close_oldest_idle()
+
+    def evict_idle(self) -> None:
+        """Closes connections that have been idle for too long, and removes pools that are empty
+        and not being used."""
+        with self.lock:
+            pools = list(self.pools.values())
+
+        for pool in pools:
+            pool.evict_idle()
+
+        with self.lock:
+            for key, pool in list(self.pools.items()):
+                with pool.lock:
+                    unused = not pool.idle and not self.users[key]
+
+                if unused:
+                    del self.pools[key]
+                    del self.users[key]
+
+        self.limit_idle()
+
+    def _run_eviction(self) -> None:
+        while True:
+            time.sleep(settings.DATABASE_POOL_EVICTION_INTERVAL)
+
+            try:
+                self.evict_idle()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error evicting idle database connections")
+
+
+connection_pools = ConnectionPoolManager()
+
+
+def _open_connection(
+    *, dbms: str, hostname: str, port: int, username: str, password: str, dbname: Optional[str]
+) -> ContextManager[Any]:
+    """Gets a pooled connection to the specified database host. Intended to be used as a context
+    manager.
+
+    This will return different types depending on the value of dbms,
+    so make sure to check that before you try to run queries!
+
+    """
+
+    if dbms not in {"postgres", "mysql"}:
         raise ValueError("Unknown DBMS {!r}".format(dbms))
 
+    return connection_pools.connection(
+        dbms=dbms,
+        hostname=hostname,
+        port=port,
+        username=username,
+        password=password,
+        dbname=dbname,
+    )
+
+
+@contextmanager
+def _open_unpooled_connection(
+    *, dbms: str, hostname: str, port: int, username: str, password: str, dbname: Optional[str]
+) -> Iterator[Any]:
+    """Opens a new connection to the specified database host, and closes it afterward. Intended to
+    be used as a context manager.
+
+    If the block exits without an error, MySQL connections are committed before being closed (like
+    pooled connections are), unless they were already closed (for example, after a query's results
+    were cut short).
+
+    """
+
+    conn = _connect(
+        dbms=dbms,
+        hostname=hostname,
+        port=port,
+        username=username,
+        password=password,
+        dbname=dbname,
+    )
+
+    try:
+        yield conn
+
+        if dbms == "mysql" and conn.open:
+            conn.commit()
+    finally:
+        try:
+            conn.close()
+        except (psycopg2.Error, MySQLdb.Error):  # pylint: disable=no-member
+            pass
+
+
+@contextmanager
+def _open_cursor(
+    *,
+    dbms: str,
+    hostname: str,
+    port: int,
+    username: str,
+    password: str,
+    dbname: Optional[str],
+    pooled: bool = True,
+) -> Any:
+    """Opens a cursor to the specified database host, using a pooled connection unless ``pooled``
+    is False. Intended to be used as a context manager.
+
+    This will return different types depending on the value of dbms,
+    so make sure to check that before you try to run queries!
+
+    """
+
+    open_connection = _open_connection if pooled else _open_unpooled_connection
+
+    with open_connection(
+        dbms=dbms,
+        hostname=hostname,
+        port=port,
+        username=username,
+        password=password,
+        dbname=dbname,
+    ) as conn:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
 
 def open_admin_cursor(host_info: Dict[str, Any], dbname: str) -> ContextManager[Any]:
     """Opens a cursor to the specified database host as an administrator, connecting to the
@@ -102,6 +457,24 @@ def open_site_cursor(database_info: Dict[str, Any]) -> ContextManager[Any]:
         username=database_info["username"],
         password=database_info["password"],
         dbname=database_info["db_name"],
+        pooled=False,
+    )
+
+
+def open_site_connection(database_info: Dict[str, Any]) -> ContextManager[Any]:
+    """Like open_site_cursor(), but gets the connection itself.
+
+    Connections as site users aren't pooled (see ConnectionPool).
+
+    """
+
+    return _open_unpooled_connection(
+        dbms=database_info["db_type"],
+        hostname=database_info["host"]["admin_hostname"],
+        port=database_info["host"]["admin_port"],
+        username=database_info["username"],
+        password=database_info["password"],
+        dbname=database_info["db_name"],
     )
 
 
@@ -139,87 +512,140 @@ def _drop_postgres_database_force(cursor: Any, db_name: str) -> None:
         cursor.execute(psql.SQL("DROP DATABASE IF EXISTS {}").format(psql.Identifier(db_name)))
 
 
+def _create_postgres_database(cursor: Any, database_info: Dict[str, Any]) -> None:
+    cursor.execute(
+        "SELECT 1 FROM pg_catalog.pg_user WHERE usename = %s", (database_info["username"],)
+    )
+    if cursor.rowcount == 0:
+        cursor.execute(
+            psql.SQL("CREATE USER {} WITH PASSWORD %s").format(
+                psql.Identifier(database_info["username"])
+            ),
+            (database_info["password"],),
+        )
+    else:
+        cursor.execute(
+            psql.SQL("ALTER USER {} WITH PASSWORD %s").format(
+                psql.Identifier(database_info["username"])
+            ),
+            (database_info["password"],),
+        )
+
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (database_info["db_name"],))
+    if cursor.rowcount == 0:
+        cursor.execute(
+            psql.SQL("CREATE DATABASE {} WITH OWNER = %s").format(
+                psql.Identifier(database_info["db_name"])
+            ),
+            (database_info["host"]["admin_username"],),
+        )
+    cursor.execute(
+        psql.SQL("GRANT ALL PRIVILEGES ON DATABASE {} TO {}").format(
+            psql.Identifier(database_info["db_name"]),
+            psql.Identifier(database_info["username"]),
+        )
+    )
+
+    cursor.execute(
+        psql.SQL("GRANT ALL ON SCHEMA public TO {}").format(
+            psql.Identifier(database_info["username"])
+        )
+    )
+
+
+def _create_mysql_database(cursor: Any, database_info: Dict[str, Any]) -> None:
+    # The caller must run FLUSH PRIVILEGES afterward
+    cursor.execute(
+        "SELECT 1 FROM mysql.user WHERE user = %s;",
+        (mysql_clean_identifier(database_info["username"]),),
+    )
+    if cursor.rowcount == 0:
+        cursor.execute(
+            "CREATE USER '{}'@'%%' IDENTIFIED BY %s;".format(
+                mysql_clean_identifier(database_info["username"])
+            ),
+            (database_info["password"],),
+        )
+    else:
+        cursor.execute(
+            "SET PASSWORD FOR {}@'%%' = PASSWORD(%s);".format(
+                mysql_clean_identifier(database_info["username"])
+            ),
+            (database_info["password"],),
+        )
+
+    cursor.execute(
+        "CREATE DATABASE IF NOT EXISTS {}".format(mysql_clean_identifier(database_info["db_name"]))
+    )
+    cursor.execute(
+        "GRANT ALL ON {} . * TO {};".format(
+            mysql_clean_identifier(database_info["db_name"]),
+            mysql_clean_identifier(database_info["username"]),
+        )
+    )
+
+
 def create_database(database_info: Dict[str, Any]) -> None:
     if database_info["db_type"] == "postgres":
         with open_admin_cursor(database_info["host"], dbname="postgres") as cursor:
-            cursor.execute(
-                "SELECT 1 FROM pg_catalog.pg_user WHERE usename = %s", (database_info["username"],)
-            )
-            if cursor.rowcount == 0:
-                cursor.execute(
-                    psql.SQL("CREATE USER {} WITH PASSWORD %s").format(
-                        psql.Identifier(database_info["username"])
-                    ),
-                    (database_info["password"],),
-                )
-            else:
-                cursor.execute(
-                    psql.SQL("ALTER USER {} WITH PASSWORD %s").format(
-                        psql.Identifier(database_info["username"])
-                    ),
-                    (database_info["password"],),
-                )
-
-            cursor.execute(
-                "SELECT 1 FROM pg_database WHERE datname = %s", (database_info["db_name"],)
-            )
-            if cursor.rowcount == 0:
-                cursor.execute(
-                    psql.SQL("CREATE DATABASE {} WITH OWNER = %s").format(
-                        psql.Identifier(database_info["db_name"])
-                    ),
-                    (database_info["host"]["admin_username"],),
-                )
-            cursor.execute(
-                psql.SQL("GRANT ALL PRIVILEGES ON DATABASE {} TO {}").format(
-                    psql.Identifier(database_info["db_name"]),
-                    psql.Identifier(database_info["username"]),
-                )
-            )
-
-            cursor.execute(
-                psql.SQL("GRANT ALL ON SCHEMA public TO {}").format(
-                    psql.Identifier(database_info["username"])
-                )
-            )
+            _create_postgres_database(cursor, database_info)
     elif database_info["db_type"] == "mysql":
         with open_admin_cursor(database_info["host"], dbname="mysql") as cursor:
-            cursor.execute(
-                "SELECT 1 FROM mysql.user WHERE user = %s;",
-                (mysql_clean_identifier(database_info["username"]),),
-            )
-            if cursor.rowcount == 0:
-                cursor.execute(
-                    "CREATE USER '{}'@'%%' IDENTIFIED BY %s;".format(
-                        mysql_clean_identifier(database_info["username"])
-                    ),
-                    (database_info["password"],),
-                )
-            else:
-                cursor.execute(
-                    "SET PASSWORD FOR {}@'%%' = PASSWORD(%s);".format(
-                        mysql_clean_identifier(database_info["username"])
-                    ),
-                    (database_info["password"],),
-                )
-
-            cursor.execute(
-                "CREATE DATABASE IF NOT EXISTS {}".format(
-                    mysql_clean_identifier(database_info["db_name"])
-                )
-            )
-            cursor.execute(
-                "GRANT ALL ON {} . * TO {};".format(
-                    mysql_clean_identifier(database_info["db_name"]),
-                    mysql_clean_identifier(database_info["username"]),
-                )
-            )
+            _create_mysql_database(cursor, database_info)
 
             cursor.execute("FLUSH PRIVILEGES;")
     else:
         raise ValueError("Unknown DBMS {!r}".format(database_info["db_type"]))
 
 
+def create_many_databases(databases_info: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Creates (or updates the passwords of) many databases and their users, like calling
+    create_database() on each of them, but with one admin session per database host.
+
+    A failure for one database doesn't stop the others. Returns one {"status": "ok"|"error"}
+    dictionary (with an "error" message for failures) per database.
+
+    """
+    results: List[Dict[str, Any]] = [{"status": "ok"} for _ in databases_info]
+
+    # Group them by host so each host only needs one connection
+    indices_by_host: Dict[str, List[int]] = collections.defaultdict(list)
+    for i, database_info in enumerate(databases_info):
+        indices_by_host[json.dumps(database_info["host"], sort_keys=True)].append(i)
+
+    for indices in indices_by_host.values():
+        host_info = databases_info[indices[0]]["host"]
+
+        if host_info["dbms"] == "postgres":
+            create_func, admin_dbname = _create_postgres_database, "postgres"
+        elif host_info["dbms"] == "mysql":
+            create_func, admin_dbname = _create_mysql_database, "mysql"
+        else:
+            for i in indices:
+                results[i] = {"status": "error", "error": "Unknown DBMS"}
+            continue
+
+        try:
+            with open_admin_cursor(host_info, dbname=admin_dbname) as cursor:
+                for i in indices:
+                    try:
+                        create_func(cursor, databases_info[i])
+                    except (psycopg2.Error, MySQLdb.Error) as ex:  # pylint: disable=no-member
+                        logger.exception("Error creating database %s", databases_info[i]["db_name"])
+                        results[i] = {"status": "error", "error": str(ex)}
+
+                if host_info["dbms"] == "mysql":
+                    cursor.execute("FLUSH PRIVILEGES;")
+        except (psycopg2.Error, MySQLdb.Error, OrchestratorActionError) as ex:  # pylint: disable=no-member
+            # We couldn't connect to the host at all (or FLUSH PRIVILEGES failed)
+            logger.exception("Error creating databases on %s", host_info["admin_hostname"])
+            for i in indices:
+                if results[i]["status"] == "ok":
+                    results[i] = {"status": "error", "error": str(ex)}
+
+    return results
+
+
 def delete_database(database_info: Dict[str, Any]) -> None:
     if database_info["db_type"] == "postgres":
         with open_admin_cursor(database_info["host"], dbname="postgres") as cursor:
@@ -252,20 +678,852 @@ def delete_database(database_info: Dict[str, Any]) -> None:
         raise ValueError("Unknown DBMS {!r}".format(database_info["db_type"]))
 
 
-def run_single_query(database_info: Dict[str, Any], sql: str) -> str:
-    with open_site_cursor(database_info) as cursor:
+# Matches the names of site databases (see Database.db_name in the manager) in LIKE clauses
+SITE_DATABASE_NAME_PATTERN = "site\\_%"
+
+
+def get_database_host_stats(host_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Collects statistics on the site databases on a database host, so the manager can put new
+    databases on the least loaded host.
+
+    Returns a dictionary with the number of site databases ("num_databases"), their total size in
+    bytes ("total_size"), the number of connections to them ("connections") and how many of those
+    are running a query ("active_connections"), and a counter of the transactions (Postgres) or
+    statements (MySQL) the server has run ("queries"), which can be compared between calls to get
+    a rate.
+
+    """
+    if host_info["dbms"] == "postgres":
+        with open_admin_cursor(host_info, dbname="postgres") as cursor:
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(pg_database_size(datname)), 0) FROM pg_database "
+                "WHERE datname LIKE %s",
+                (SITE_DATABASE_NAME_PATTERN,),
+            )
+            num_databases, total_size = cursor.fetchone()
+
+            cursor.execute(
+                "SELECT COUNT(*), COUNT(*) FILTER (WHERE state = 'active') FROM pg_stat_activity "
+                "WHERE datname LIKE %s",
+                (SITE_DATABASE_NAME_PATTERN,),
+            )
+            connections, active_connections = cursor.fetchone()
+
+            cursor.execute(
+                "SELECT COALESCE(SUM(xact_commit + xact_rollback), 0) FROM pg_stat_database "
+                "WHERE datname LIKE %s",
+                (SITE_DATABASE_NAME_PATTERN,),
+            )
+            (queries,) = cursor.fetchone()
+    elif host_info["dbms"] == "mysql":
+        with open_admin_cursor(host_info, dbname="mysql") as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.schemata WHERE schema_name LIKE %s",
+                (SITE_DATABASE_NAME_PATTERN,),
+            )
+            (num_databases,) = cursor.fetchone()
+
+            cursor.execute(
+                "SELECT COALESCE(SUM(data_length + index_length), 0) "
+                "FROM information_schema.tables WHERE table_schema LIKE %s",
+                (SITE_DATABASE_NAME_PATTERN,),
+            )
+            (total_size,) = cursor.fetchone()
+
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(command NOT IN ('Sleep', 'Daemon')), 0) "
+                "FROM information_schema.processlist WHERE db LIKE %s",
+                (SITE_DATABASE_NAME_PATTERN,),
+            )
+            connections, active_connections = cursor.fetchone()
+
+            # MySQL doesn't keep per-database counters by default, so this is for the whole server
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+            row = cursor.fetchone()
+            queries = row[1] if row is not None else 0
+    else:
+        raise ValueError("Unknown DBMS {!r}".format(host_info["dbms"]))
+
+    return {
+        "num_databases": int(num_databases),
+        "total_size": int(total_size),
+        "connections": int(connections),
+        "active_connections": int(active_connections),
+        "queries": int(queries),
+    }
+
+
+def get_site_database_stats(host_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Collects statistics on each of the site databases on a database host, with one query.
+
+    Returns a list with a dictionary for each database, containing its name ("db_name"), its size
+    in bytes ("size"), the number of connections to it ("connections"), the number of queries that
+    have been running for more than ``settings.DATABASE_SLOW_QUERY_THRESHOLD`` seconds
+    ("slow_queries"), and a counter of the transactions run on it ("transactions"), which can be
+    compared between calls to get a rate. MySQL doesn't keep per-database transaction counts, so
+    "transactions" is None for MySQL databases.
+
+    """
+    if host_info["dbms"] == "postgres":
+        with open_admin_cursor(host_info, dbname="postgres") as cursor:
+            cursor.execute(
+                "SELECT d.datname, pg_database_size(d.datname), s.numbackends, "
+                "s.xact_commit + s.xact_rollback, COALESCE(a.slow_queries, 0) "
+                "FROM pg_database d JOIN pg_stat_database s ON s.datid = d.oid "
+                "LEFT JOIN ("
+                "SELECT datid, COUNT(*) AS slow_queries FROM pg_stat_activity "
+                "WHERE state = 'active' AND query_start < now() - %s * interval '1 second' "
+                "GROUP BY datid"
+                ") a ON a.datid = d.oid "
+                "WHERE d.datname LIKE %s",
+                (settings.DATABASE_SLOW_QUERY_THRESHOLD, SITE_DATABASE_NAME_PATTERN),
+            )
+            rows = cursor.fetchall()
+    elif host_info["dbms"] == "mysql":
+        with open_admin_cursor(host_info, dbname="mysql") as cursor:
+            cursor.execute(
+                "SELECT s.schema_name, COALESCE(t.size, 0), COALESCE(p.connections, 0), NULL, "
+                "COALESCE(p.slow_queries, 0) "
+                "FROM information_schema.schemata s "
+                "LEFT JOIN ("
+                "SELECT table_schema, SUM(data_length + index_length) AS size "
+                "FROM information_schema.tables GROUP BY table_schema"
+                ") t ON t.table_schema = s.schema_name "
+                "LEFT JOIN ("
+                "SELECT db, COUNT(*) AS connections, "
+                "SUM(command = 'Query' AND time >= %s) AS slow_queries "
+                "FROM information_schema.processlist GROUP BY db"
+                ") p ON p.db = s.schema_name "
+                "WHERE s.schema_name LIKE %s",
+                (settings.DATABASE_SLOW_QUERY_THRESHOLD, SITE_DATABASE_NAME_PATTERN),
+            )
+            rows = cursor.fetchall()
+    else:
+        raise ValueError("Unknown DBMS {!r}".format(host_info["dbms"]))
+
+    return [
+        {
+            "db_name": db_name,
+            "size": int(size),
+            "connections": int(connections),
+            "transactions": int(transactions) if transactions is not None else None,
+            "slow_queries": int(slow_queries),
+        }
+        for db_name, size, connections, transactions, slow_queries in rows
+    ]
+
+
+# Statements that can be run with a Postgres server-side cursor (DECLARE ... CURSOR FOR), unless
+# they contain one of the keywords below. Postgres rejects data-modifying statements in WITH and
+# SELECT ... INTO in a cursor, and a failed DECLARE would abort the user's transaction, so anything
+# that looks like one of those is run normally. (False positives, like a keyword in a string, are
+# just run without a cursor.)
+POSTGRES_CURSOR_STATEMENT_RE = re.compile(r"^\s*(SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+POSTGRES_CURSOR_EXCLUDED_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|INTO)\b", re.IGNORECASE)
+
+
+class QueryResultFormatter:
+    """Formats the results of a query as either TSV (with a header line and a final line noting
+    any truncation or error) or NDJSON (with one {"type": "columns"|"row"|"error"|"end", ...}
+    object per line), and enforces the row and byte limits on them."""
+
+    def __init__(self, fmt: str, *, max_rows: int, max_bytes: int) -> None:
+        if fmt not in {"tsv", "ndjson"}:
+            raise ValueError("Unknown format {!r}".format(fmt))
+
+        self.fmt = fmt
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+        self.num_rows = 0
+        self.num_bytes = 0
+        self.truncated_reason: Optional[str] = None
+
+        self.lines: List[str] = []
+
+    def _add_line(self, line: str) -> None:
+        if self.fmt == "tsv":
+            # No trailing newline, for compatibility with the old output
+            if self.num_bytes or self.lines:
+                line = "\n" + line
+        else:
+            line += "\n"
+
+        self.lines.append(line)
+        self.num_bytes += len(line.encode())
+
+    def add_columns(self, columns: List[str]) -> None:
+        if self.fmt == "tsv":
+            self._add_line("\t".join(columns))
+        else:
+            self._add_line(json.dumps({"type": "columns", "columns": columns}))
+
+    def add_row(self, row: Tuple[Any, ...]) -> bool:
+        """Adds a row. Returns False (without adding it) if a limit has been reached."""
+        if self.num_rows >= self.max_rows:
+            self.truncated_reason = "rows"
+            return False
+
+        if self.fmt == "tsv":
+            line = "\t".join(map(str, row))
+        else:
+            line = json.dumps({"type": "row", "row": list(row)}, default=str)
+
+        if self.num_bytes + len(line.encode()) + 1 > self.max_bytes:
+            self.truncated_reason = "bytes"
+            return False
+
+        self._add_line(line)
+        self.num_rows += 1
+        return True
+
+    def add_error(self, message: str) -> None:
+        if self.fmt == "tsv":
+            self._add_line(message)
+        else:
+            self._add_line(json.dumps({"type": "error", "error": message}))
+
+    def add_end(self) -> None:
+        if self.fmt == "tsv":
+            if self.truncated_reason is not None:
+                self._add_line(
+                    "[Output truncated after {} rows: {} limit reached]".format(
+                        self.num_rows, "row" if self.truncated_reason == "rows" else "size"
+                    )
+                )
+        else:
+            self._add_line(
+                json.dumps(
+                    {
+                        "type": "end",
+                        "rows": self.num_rows,
+                        "truncated": self.truncated_reason is not None,
+                        "truncated_reason": self.truncated_reason,
+                    }
+                )
+            )
+
+    def flush(self, *, force: bool = False) -> Optional[str]:
+        """Returns the output added since the last flush, if there's enough of it to be worth
+        sending (or ``force`` is True)."""
+        if not self.lines:
+            return None
+
+        if not force and sum(map(len, self.lines)) < settings.DATABASE_QUERY_CHUNK_SIZE:
+            return None
+
+        chunk = "".join(self.lines)
+        self.lines = []
+        return chunk
+
+
+def _set_query_timeout(conn: Any, dbms: str, timeout: float) -> None:
+    """Makes the database cancel statements run on the given connection after ``timeout``
+    seconds."""
+    cursor = conn.cursor()
+
+    try:
+        if dbms == "postgres":
+            cursor.execute("SET statement_timeout = %s", (int(timeout * 1000),))
+        else:
+            # max_execution_time is MySQL's (in milliseconds), max_statement_time is MariaDB's (in
+            # seconds). Each will reject the other's.
+            for variable, value in [
+                ("max_execution_time", int(timeout * 1000)),
+                ("max_statement_time", timeout),
+            ]:
+                try:
+                    cursor.execute("SET SESSION {} = %s".format(variable), (value,))
+                except MySQLdb.Error:  # pylint: disable=no-member
+                    pass
+    finally:
+        cursor.close()
+
+
+def _iter_postgres_query_results(
+    conn: Any, sql: str, formatter: QueryResultFormatter
+) -> Iterator[str]:
+    cursor = conn.cursor()
+
+    # Statements that return rows are run with a server-side cursor, so rows are only read as
+    # they're needed. Anything else has to be run normally, so the results are all fetched at
+    # once. Statements like INSERT ... RETURNING are rarely large, though.
+    server_side = (
+        POSTGRES_CURSOR_STATEMENT_RE.match(sql) is not None
+        and POSTGRES_CURSOR_EXCLUDED_RE.search(sql) is None
+    )
+    # Server-side cursors only exist inside transactions. If the user hasn't started one (in a
+    # console session), we start one of our own and commit it afterward.
+    own_transaction = (
+        server_side and conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    succeeded = False
+
+    def fetch_rows() -> List[Tuple[Any, ...]]:
+        if server_side:
+            cursor.execute("FETCH %s FROM director_console", (settings.DATABASE_QUERY_FETCH_SIZE,))
+
+        return cast(List[Tuple[Any, ...]], cursor.fetchmany(settings.DATABASE_QUERY_FETCH_SIZE))
+
+    try:
         try:
-            cursor.execute(sql)
+            if own_transaction:
+                cursor.execute("BEGIN")
+
+            if server_side:
+                cursor.execute("DECLARE director_console NO SCROLL CURSOR FOR " + sql)
+                rows = fetch_rows()
+            else:
+                cursor.execute(sql)
+                rows = fetch_rows() if cursor.description is not None else []
         except psycopg2.DatabaseError as ex:
-            return str(ex)
+            formatter.add_error(str(ex))
+            return
+
+        if cursor.description is not None:
+            formatter.add_columns([column[0] for column in cursor.description])
+
+            try:
+                while rows:
+                    if not all(map(formatter.add_row, rows)):
+                        # A limit was reached
+                        break
+
+                    chunk = formatter.flush()
+                    if chunk is not None:
+                        yield chunk
+
+                    rows = fetch_rows()
+            except psycopg2.DatabaseError as ex:
+                formatter.add_error(str(ex))
+                return
+
+        succeeded = True
+    finally:
+        try:
+            if own_transaction:
+                cursor.execute("COMMIT" if succeeded else "ROLLBACK")
+            elif (
+                server_side
+                and conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+            ):
+                # The cursor was opened in the user's transaction (and it wasn't aborted by an
+                # error)
+                cursor.execute("CLOSE director_console")
+
+            cursor.close()
+        except psycopg2.Error:
+            # Make sure the connection isn't used again in an unknown state
+            conn.close()
+
+
+def _iter_mysql_query_results(
+    conn: Any,
+    sql: str,
+    formatter: QueryResultFormatter,
+    *,
+    kill_query: Optional[Callable[[], None]] = None,
+) -> Iterator[str]:
+    # Unbuffered cursor, so rows are read from the server as they're needed
+    cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+    finished = False
+
+    try:
+        try:
+            cursor.execute(sql)
         except MySQLdb.Error as ex:  # pylint: disable=no-member
-            return str(ex.args[-1])
-        else:
-            if cursor.description is None:
-                return ""
+            formatter.add_error(str(ex.args[-1]))
+            finished = True
+            return
+
+        if cursor.description is None:
+            finished = True
+            return
+
+        formatter.add_columns([column[0] for column in cursor.description])
+
+        try:
+            while True:
+                rows = cursor.fetchmany(settings.DATABASE_QUERY_FETCH_SIZE)
+                if not rows:
+                    finished = True
+                    break
+
+                for row in rows:
+                    if not formatter.add_row(row):
+                        return
+
+                chunk = formatter.flush()
+                if chunk is not None:
+                    yield chunk
+        except MySQLdb.Error as ex:  # pylint: disable=no-member
+            formatter.add_error(str(ex.args[-1]))
+    finally:
+        if finished:
+            cursor.close()
+        elif kill_query is not None:
+            # Closing an unbuffered cursor reads (and throws away) the rest of the results, which
+            # could take a long time. Stop the query first, so there aren't many left.
+            try:
+                kill_query()
+            except MySQLdb.Error:  # pylint: disable=no-member
+                conn.close()
             else:
-                result = "\t".join(column[0] for column in cursor.description)
-                for row in cursor:
-                    result += "\n" + "\t".join(map(str, row))
+                try:
+                    cursor.close()
+                except MySQLdb.Error:  # pylint: disable=no-member
+                    pass
+        else:
+            # See above. We don't have a way to stop the query, so throw away the connection
+            # instead.
+            conn.close()
+
+
+def _make_query_result_formatter(
+    fmt: str, max_rows: Optional[int], max_bytes: Optional[int]
+) -> QueryResultFormatter:
+    return QueryResultFormatter(
+        fmt,
+        max_rows=min(
+            max_rows or settings.DATABASE_QUERY_MAX_ROWS, settings.DATABASE_QUERY_MAX_ROWS
+        ),
+        max_bytes=min(
+            max_bytes or settings.DATABASE_QUERY_MAX_BYTES, settings.DATABASE_QUERY_MAX_BYTES
+        ),
+    )
+
+
+def _iter_query_results(
+    conn: Any,
+    dbms: str,
+    sql: str,
+    formatter: QueryResultFormatter,
+    *,
+    kill_query: Optional[Callable[[], None]] = None,
+) -> Generator[str, None, None]:
+    if dbms == "postgres":
+        yield from _iter_postgres_query_results(conn, sql, formatter)
+    else:
+        yield from _iter_mysql_query_results(conn, sql, formatter, kill_query=kill_query)
+
+    formatter.add_end()
+
+    chunk = formatter.flush(force=True)
+    if chunk is not None:
+        yield chunk
+
+
+def iter_query_results(
+    database_info: Dict[str, Any],
+    sql: str,
+    *,
+    fmt: str = "tsv",
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> Iterator[str]:
+    """Runs a query on a site's database and yields the results in chunks, formatted as TSV or
+    NDJSON (see QueryResultFormatter).
+
+    Results are read from the database as they're needed (with a server-side cursor where
+    possible), and stop after ``max_rows`` rows or ``max_bytes`` bytes of output (neither of which
+    can be higher than ``settings.DATABASE_QUERY_MAX_ROWS`` or
+    ``settings.DATABASE_QUERY_MAX_BYTES``). Statements are cancelled after
+    ``settings.DATABASE_QUERY_TIMEOUT`` seconds. Errors from the database are included in the
+    output.
+
+    """
+    formatter = _make_query_result_formatter(fmt, max_rows, max_bytes)
+
+    with open_site_connection(database_info) as conn:
+        _set_query_timeout(conn, database_info["db_type"], settings.DATABASE_QUERY_TIMEOUT)
+
+        yield from _iter_query_results(conn, database_info["db_type"], sql, formatter)
+
+
+class DatabaseConsoleSession:
+    """A connection to a site's database that stays open for the life of an SQL console (or while
+    a dump is imported), so transactions, settings, temporary tables, etc. carry over from one
+    query to the next.
+
+    Unlike pooled connections, the connection is in autocommit mode for MySQL too, so transactions
+    only happen if the user starts one. Queries are run with the same limits as
+    iter_query_results(), unless another ``query_timeout`` is passed to open().
+
+    Only cancel() can be called while a query is running (from another thread).
+
+    """
+
+    def __init__(self, database_info: Dict[str, Any]) -> None:
+        self.dbms: str = database_info["db_type"]
+        self.connect_kwargs: Dict[str, Any] = {
+            "dbms": self.dbms,
+            "hostname": database_info["host"]["admin_hostname"],
+            "port": database_info["host"]["admin_port"],
+            "username": database_info["username"],
+            "password": database_info["password"],
+            "dbname": database_info["db_name"],
+        }
+
+        self.conn: Any = None
+        # For MySQL, the connection's ID on the server, so queries can be killed
+        self.thread_id: Optional[int] = None
+
+    def open(self, *, query_timeout: Optional[float] = None) -> None:
+        self.conn = _connect(**self.connect_kwargs)
+
+        try:
+            if self.dbms == "mysql":
+                self.conn.autocommit(True)
+                self.thread_id = self.conn.thread_id()
+
+            _set_query_timeout(
+                self.conn,
+                self.dbms,
+                settings.DATABASE_QUERY_TIMEOUT if query_timeout is None else query_timeout,
+            )
+        except BaseException:
+            self.close()
+            raise
+
+    @property
+    def usable(self) -> bool:
+        """Whether the connection is still open (it's closed if it breaks)."""
+        if self.conn is None:
+            return False
+        elif self.dbms == "postgres":
+            return not self.conn.closed
+        else:
+            return bool(self.conn.open)
+
+    def iter_query_results(
+        self,
+        sql: str,
+        *,
+        fmt: str = "tsv",
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> Generator[str, None, None]:
+        """Runs a query and yields the results in chunks, like iter_query_results()."""
+        assert self.conn is not None
+
+        return _iter_query_results(
+            self.conn,
+            self.dbms,
+            sql,
+            _make_query_result_formatter(fmt, max_rows, max_bytes),
+            kill_query=self.cancel,
+        )
+
+    def cancel(self) -> None:
+        """Cancels the query that's running, if any."""
+        if self.conn is None:
+            return
+
+        if self.dbms == "postgres":
+            self.conn.cancel()
+        else:
+            conn = _connect(**self.connect_kwargs)
+            try:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute("KILL QUERY %s", (self.thread_id,))
+                finally:
+                    cursor.close()
+            finally:
+                conn.close()
+
+    def close(self) -> None:
+        if self.conn is None:
+            return
+
+        try:
+            self.conn.close()
+        except (psycopg2.Error, MySQLdb.Error):  # pylint: disable=no-member
+            pass
+
+        self.conn = None
+
+
+# Site databases are exported as gzip-compressed SQL dumps
+GZIP_MAGIC = b"\x1f\x8b"
+DATABASE_DUMP_COMPRESSION_LEVEL = 6
+
+# Only this much of the output of pg_dump/mysqldump on stderr is kept for error messages
+MAX_CLIENT_ERROR_OUTPUT = 64 * 1024
+
+
+def _get_database_dump_command(database_info: Dict[str, Any]) -> Tuple[List[str], Dict[str, str]]:
+    """Returns the arguments and environment to run pg_dump/mysqldump (see
+    ``settings.DATABASE_DUMP_PROGRAMS``) on a site's database with.
+
+    The password is passed in the environment, so it doesn't show up in the process list.
+
+    """
+    dbms = database_info["db_type"]
+    path = settings.DATABASE_DUMP_PROGRAMS[dbms]
+
+    # Connect the same way as open_site_connection() does
+    hostname = database_info["host"]["admin_hostname"]
+    port = database_info["host"]["admin_port"]
+
+    env = {"PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"), "LC_ALL": "C.UTF-8"}
+
+    if dbms == "postgres":
+        args = [
+            path,
+            "--host",
+            hostname,
+            "--port",
+            str(port),
+            "--username",
+            database_info["username"],
+            "--no-password",
+            "--no-owner",
+            "--no-privileges",
+            "--dbname",
+            database_info["db_name"],
+        ]
+
+        env["PGPASSWORD"] = database_info["password"]
+        env["PGCONNECT_TIMEOUT"] = "10"
+    elif dbms == "mysql":
+        # For MySQL, we need to indicate Unix sockets specially (see _connect())
+        if hostname.startswith("/"):
+            args = [path, "--socket", hostname]
+        else:
+            args = [path, "--host", hostname, "--port", str(port)]
+
+        args += [
+            "--user",
+            database_info["username"],
+            "--connect-timeout=10",
+            "--single-transaction",
+            "--routines",
+            "--triggers",
+            "--no-tablespaces",
+            database_info["db_name"],
+        ]
+
+        env["MYSQL_PWD"] = database_info["password"]
+    else:
+        raise ValueError("Unknown DBMS {!r}".format(dbms))
+
+    return args, env
+
+
+def _format_dump_error(returncode: int, stderr: bytes) -> str:
+    errors = stderr.decode(errors="replace").strip()
+    if errors:
+        return "Error exporting database: {}".format(errors)
+    else:
+        return "Error exporting database (exit code {})".format(returncode)
+
+
+def export_database(database_info: Dict[str, Any]) -> Generator[bytes, None, None]:
+    """Streams a gzip-compressed SQL dump of a site's database.
+
+    The dump is compressed as it comes out of pg_dump/mysqldump, so it's never buffered in memory
+    or on disk. Raises OrchestratorActionError if the dump fails, if it takes more than
+    ``settings.DATABASE_EXPORT_TIMEOUT`` seconds, or if the compressed dump would be larger than
+    ``settings.DATABASE_EXPORT_MAX_BYTES``. The end of the gzip stream is only sent if the dump
+    succeeds, so a partial dump can't be mistaken for a complete one.
+
+    """
+    args, env = _get_database_dump_command(database_info)
+
+    proc = subprocess.Popen(  # pylint: disable=consider-using-with
+        args,
+        env=env,
+        bufsize=0,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    assert proc.stdout is not None
+    assert proc.stderr is not None
+
+    deadline = time.monotonic() + settings.DATABASE_EXPORT_TIMEOUT
+
+    compressor = zlib.compressobj(
+        DATABASE_DUMP_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+    )
+    size = 0
+    errors = b""
+
+    def check_size(chunk: bytes) -> bytes:
+        nonlocal size
+
+        size += len(chunk)
+        if size > settings.DATABASE_EXPORT_MAX_BYTES:
+            raise OrchestratorActionError("Database export too large")
+
+        return chunk
+
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(proc.stdout, selectors.EVENT_READ)
+            selector.register(proc.stderr, selectors.EVENT_READ)
+
+            while selector.get_map():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise OrchestratorActionError("Database export timed out")
+
+                for key, _ in selector.select(timeout=timeout):
+                    buf = os.read(key.fd, settings.FILE_STREAM_BUFSIZE)
+                    if not buf:
+                        selector.unregister(key.fileobj)
+                    elif key.fileobj is proc.stderr:
+                        errors = (errors + buf)[-MAX_CLIENT_ERROR_OUTPUT:]
+                    else:
+                        chunk = compressor.compress(buf)
+                        if chunk:
+                            yield check_size(chunk)
+
+        returncode = proc.wait(timeout=max(deadline - time.monotonic(), 0))
+        if returncode != 0:
+            raise OrchestratorActionError(_format_dump_error(returncode, errors))
+
+        yield check_size(compressor.flush())
+    except subprocess.TimeoutExpired as ex:
+        raise OrchestratorActionError("Database export timed out") from ex
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def _iter_dump_sql(data: Iterable[bytes], max_size: int) -> Generator[bytes, None, None]:
+    """Yields the SQL in an uploaded dump, decompressing it if it's gzip-compressed.
+
+    Raises OrchestratorActionError if more than ``max_size`` bytes are received, or if the
+    decompressed dump is larger than ``settings.DATABASE_IMPORT_MAX_SQL_BYTES``. Raises
+    zlib.error if the dump isn't a valid gzip file.
+
+    """
+    size = 0
+    sql_size = 0
+
+    def check_sql_size(buf: bytes) -> bytes:
+        nonlocal sql_size
+
+        sql_size += len(buf)
+        if sql_size > settings.DATABASE_IMPORT_MAX_SQL_BYTES:
+            raise OrchestratorActionError("Database import too large")
+
+        return buf
+
+    decompressor: Optional["zlib._Decompress"] = None
+    # The start of the data, until there's enough of it to see if it's compressed
+    head: Optional[bytes] = b""
+
+    for chunk in data:
+        size += len(chunk)
+        if size > max_size:
+            raise OrchestratorActionError("Database import too large")
+
+        if head is not None:
+            head += chunk
+            if len(head) < len(GZIP_MAGIC):
+                continue
+
+            chunk, head = head, None
+            if chunk.startswith(GZIP_MAGIC):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        if decompressor is None:
+            yield check_sql_size(chunk)
+            continue
+
+        # Limit how much is decompressed at once, so a small chunk that decompresses to a lot of
+        # data doesn't use a lot of memory
+        yield check_sql_size(decompressor.decompress(chunk, settings.FILE_STREAM_BUFSIZE))
+        while decompressor.unconsumed_tail:
+            yield check_sql_size(
+                decompressor.decompress(decompressor.unconsumed_tail, settings.FILE_STREAM_BUFSIZE)
+            )
+
+    if head:
+        yield check_sql_size(head)
+
+    if decompressor is not None and not decompressor.eof:
+        raise OrchestratorActionError("Database import is truncated")
+
+
+def import_database(
+    database_info: Dict[str, Any], data: Iterable[bytes], *, max_size: Optional[int] = None
+) -> None:
+    """Loads an SQL dump (optionally gzip-compressed, like the ones export_database() creates)
+    into a site's database as it arrives.
+
+    The dump is split into statements (see sql_dumps.SQLDumpReader), which are run through the
+    database driver as the site's database user, like queries from the SQL console. It's never
+    given to psql/mysql, since they would also run any client-side commands in it (like shell
+    commands) on the appserver.
+
+    Raises OrchestratorActionError if a statement fails, if loading the dump takes more than
+    ``settings.DATABASE_IMPORT_TIMEOUT`` seconds, if more than ``max_size`` (at most
+    ``settings.DATABASE_IMPORT_MAX_BYTES``) bytes are received, or if the decompressed dump is
+    larger than ``settings.DATABASE_IMPORT_MAX_SQL_BYTES``. Postgres dumps are loaded in a single
+    transaction, so nothing is changed if they fail; MySQL dumps are not.
+
+    """
+    if max_size is None:
+        max_size = settings.DATABASE_IMPORT_MAX_BYTES
+    else:
+        max_size = min(max_size, settings.DATABASE_IMPORT_MAX_BYTES)
+
+    dbms = database_info["db_type"]
+    reader = SQLDumpReader(_iter_dump_sql(data, max_size), dbms)
+
+    session = DatabaseConsoleSession(database_info)
+    session.open(query_timeout=settings.DATABASE_IMPORT_TIMEOUT)
+
+    timed_out = threading.Event()
+
+    def cancel_on_timeout() -> None:
+        timed_out.set()
+        try:
+            session.cancel()
+        except (psycopg2.Error, MySQLdb.Error):  # pylint: disable=no-member
+            pass
+
+    timer = threading.Timer(settings.DATABASE_IMPORT_TIMEOUT, cancel_on_timeout)
+    timer.start()
+
+    try:
+        cursor = session.conn.cursor()
+        try:
+            if dbms == "postgres":
+                cursor.execute("BEGIN")
+
+            for statement, copy_data in reader.iter_statements():
+                if timed_out.is_set():
+                    raise OrchestratorActionError("Database import timed out")
+
+                if copy_data is not None:
+                    cursor.copy_expert(statement, copy_data)
+                else:
+                    cursor.execute(statement)
+
+            if dbms == "postgres":
+                cursor.execute("COMMIT")
+        finally:
+            cursor.close()
+    except zlib.error as ex:
+        raise OrchestratorActionError("Database import is not a valid gzip file") from ex
+    except (psycopg2.Error, MySQLdb.Error) as ex:  # pylint: disable=no-member
+        if timed_out.is_set():
+            raise OrchestratorActionError("Database import timed out") from ex
 
-                return result
+        message = str(ex).strip() if dbms == "postgres" else str(ex.args[-1])
+        raise OrchestratorActionError(
+            "Error importing database (line {}): {}".format(reader.line_number, message)
+        ) from ex
+    finally:
+        timer.cancel()
+        session.close()
@@ -1,27 +1,15 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
-from typing import Any, Dict, Optional
+from typing import Any, Dict
 
 from docker.client import DockerClient
-from docker.models.containers import Container
 from docker.types import LogConfig
 
 from .conversions import convert_cpu_limit, convert_memory_limit
 from .shared import gen_director_shared_params
 
 
-def get_container(client: DockerClient, **filters: Any) -> Optional[Container]:
-    filtered_containers = client.containers.list(filters=filters)
-
-    if not filtered_containers:
-        return None
-    elif len(filtered_containers) == 1:
-        return filtered_containers[0]
-    else:
-        raise ValueError("Multiple containers matched")
-
-
 def gen_director_container_params(
     client: DockerClient, site_id: int, site_data: Dict[str, Any]
 ) -> Dict[str, Any]:
@@ -49,17 +37,3 @@ def gen_director_container_params(
     )
 
     return params
-
-
-def get_or_create_container(
-    client: DockerClient,
-    name: str,
-    *,
-    run_params: Dict[str, Any],
-) -> Container:
-    container = get_container(client, name=name)
-
-    if container is None:
-        container = client.containers.run(name=name, detach=True, **run_params)
-
-    return container
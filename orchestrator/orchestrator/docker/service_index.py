@@ -0,0 +1,166 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import docker
+from docker.client import DockerClient
+from docker.models.services import Service
+
+from .utils import get_shared_client
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceIndex:
+    """An index of the swarm's services by name, so services can be looked up by ID instead of
+    listing (and filtering) every service each time.
+
+    The index is built with one list of all the services, and kept up to date by following the
+    Docker events for services in a background thread. If the events stream is interrupted, the
+    index is rebuilt once it reconnects.
+
+    Lookups never trust the index blindly: services found in it are fetched by ID (and checked),
+    and services missing from it are looked up the slow way.
+
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # name -> (ID, version). The version is None if the service has been updated since it was
+        # last fetched.
+        self.services: Dict[str, Tuple[str, Optional[int]]] = {}
+        self.loaded = False
+
+        self.events_thread: Optional[threading.Thread] = None
+
+    def ensure_loaded(self, client: DockerClient) -> None:
+        if self.loaded:
+            return
+
+        with self.lock:
+            if self.events_thread is None:
+                self.events_thread = threading.Thread(
+                    target=self.events_thread_main,
+                    name="service-index-events",
+                    daemon=True,
+                )
+                self.events_thread.start()
+
+        # Don't wait for the events thread; it may take a moment to connect
+        if not self.loaded:
+            self.load(client)
+
+    def load(self, client: DockerClient) -> None:
+        services = {
+            service["Spec"]["Name"]: (service["ID"], service["Version"]["Index"])
+            for service in client.api.services()
+        }
+
+        with self.lock:
+            self.services = services
+            self.loaded = True
+
+    def events_thread_main(self) -> None:
+        while True:
+            try:
+                client = get_shared_client()
+                stream = client.events(
+                    since=int(time.time()),
+                    decode=True,
+                    filters={"type": ["service"], "event": ["create", "update", "remove"]},
+                )
+
+                # Anything could have happened while we weren't listening
+                self.load(client)
+
+                for event in stream:
+                    self.handle_event(event)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error reading Docker service events; reconnecting")
+
+            with self.lock:
+                self.loaded = False
+
+            time.sleep(5)
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        service_id = event.get("Actor", {}).get("ID")
+        name = event.get("Actor", {}).get("Attributes", {}).get("name")
+        if not service_id or not name:
+            return
+
+        with self.lock:
+            if event.get("Action") == "remove":
+                if self.services.get(name, (None,))[0] == service_id:
+                    del self.services[name]
+            else:
+                self.services[name] = (service_id, None)
+
+    def remember(self, service: Service) -> None:
+        with self.lock:
+            self.services[service.name] = (service.id, service.version)
+
+    def forget(self, name: str) -> None:
+        with self.lock:
+            self.services.pop(name, None)
+
+    def get_service_id(self, client: DockerClient, name: str) -> Optional[str]:
+        """Returns the ID of the service with the given name, or None if there is no such service.
+        If the service is in the index, no API calls are made."""
+        self.ensure_loaded(client)
+
+        with self.lock:
+            entry = self.services.get(name)
+
+        if entry is not None:
+            return entry[0]
+
+        service = self.find_service(client, name)
+        return service.id if service is not None else None
+
+    def get_service(self, client: DockerClient, name: str) -> Optional[Service]:
+        """Returns the service with the given name, or None if there is no such service."""
+        self.ensure_loaded(client)
+
+        with self.lock:
+            entry = self.services.get(name)
+
+        if entry is not None:
+            try:
+                service = client.services.get(entry[0])
+            except docker.errors.NotFound:
+                pass
+            else:
+                if service.name == name:
+                    self.remember(service)
+                    return service
+
+            # The index was out of date
+            self.forget(name)
+
+        return self.find_service(client, name)
+
+    def find_service(self, client: DockerClient, name: str) -> Optional[Service]:
+        """Looks up the service with the given name without using the index, and updates the index
+        with the result."""
+        # The "filters" appear to do an "a in b" check, not an "a == b" check.
+        # We need to confirm that they match
+        filtered_services = [
+            service
+            for service in client.services.list(filters={"name": name})
+            if service.name == name
+        ]
+        if not filtered_services:
+            return None
+        elif len(filtered_services) == 1:
+            self.remember(filtered_services[0])
+            return filtered_services[0]
+        else:
+            raise ValueError("Duplicate services")
+
+
+service_index = ServiceIndex()
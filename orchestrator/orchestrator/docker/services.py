@@ -10,8 +10,10 @@ from docker.models.services import Service
 from docker.types import EndpointSpec, Resources, RestartPolicy, ServiceMode, UpdateConfig
 
 from .. import settings
+from ..configs.nginx import write_nginx_shared_config, write_nginx_site_maps_config
 from ..exceptions import OrchestratorActionError
 from .conversions import convert_cpu_limit, convert_memory_limit
+from .service_index import service_index
 from .shared import gen_director_shared_params
 from .utils import get_swarm_node_id
 
@@ -43,19 +45,13 @@ def _wait_for_exec_exit_code(client: DockerClient, exec_id: str) -> int:
 
 
 def get_service_by_name(client: DockerClient, service_name: str) -> Optional[Service]:
-    # The "filters" appear to do an "a in b" check, not an "a == b" check.
-    # We need to confirm that they match
-    filtered_services = [
-        service
-        for service in client.services.list(filters={"name": service_name})
-        if service.name == service_name
-    ]
-    if not filtered_services:
-        return None
-    elif len(filtered_services) == 1:
-        return filtered_services[0]
-    else:
-        raise ValueError("Duplicate services")
+    return service_index.get_service(client, service_name)
+
+
+def get_service_id_by_name(client: DockerClient, service_name: str) -> Optional[str]:
+    """Like get_service_by_name(), but only returns the ID. This avoids any API calls if the
+    service is in the index."""
+    return service_index.get_service_id(client, service_name)
 
 
 def get_director_service_name(site_id: int) -> str:
@@ -149,6 +145,7 @@ def update_director_service(
 
     if service is None:
         service = client.services.create(**gen_director_service_params(client, site_id, site_data))
+        service_index.remember(service)
     else:
         service.update(**gen_director_service_params(client, site_id, site_data))
 
@@ -179,6 +176,7 @@ def remove_director_service(client: DockerClient, site_id: int) -> None:
         return
 
     service.remove()
+    service_index.forget(service.name)
 
 
 def list_service_tasks_for_node(service: Service, node_id: str) -> List[Dict[str, Any]]:
@@ -190,6 +188,11 @@ def reload_nginx_config(client: DockerClient) -> None:
     if service is None:
         raise OrchestratorActionError("Nginx service does not exist")
 
+    # Sites' entries are only gathered into the shared map config (if it's enabled) when Nginx is
+    # about to load it
+    write_nginx_shared_config()
+    write_nginx_site_maps_config()
+
     node_id = get_swarm_node_id(client)
     tasks = list_service_tasks_for_node(service, node_id=node_id)
 
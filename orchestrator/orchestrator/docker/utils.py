@@ -1,21 +1,178 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
-from typing import Any, cast
+import logging
+import re
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple, cast
 
 import docker
+import requests
 
+from .. import settings
 
-def create_client(**kwargs: Any) -> docker.client.DockerClient:
-    """Creates DockerClient instance from the environment.
+logger = logging.getLogger(__name__)
+
+# Matches the "/v1.45" at the start of API paths
+API_VERSION_PREFIX_RE = re.compile(r"^/v[\d.]+(?=/)")
+
+# Path segments made of these characters are treated as parts of the endpoint. Anything else
+# (IDs, names, etc.) is replaced with "{id}" so calls to the same endpoint are grouped together.
+ENDPOINT_SEGMENT_RE = re.compile(r"^[a-z]{1,16}$")
+
+
+def get_endpoint_name(path: str) -> str:
+    """Returns the name used to group calls to the given API path in the metrics. For example,
+    "/v1.45/services/abcdef0123456789/logs" becomes "/services/{id}/logs"."""
+    path = API_VERSION_PREFIX_RE.sub("", path)
+
+    return "/".join(
+        segment if not segment or ENDPOINT_SEGMENT_RE.match(segment) else "{id}"
+        for segment in path.split("/")
+    )
+
+
+class DockerAPIMetrics:
+    """Records how many calls are made to each Docker API endpoint, how many of them fail, and how
+    long they take. For streaming calls (logs, events, etc.), the time is how long it took to start
+    the stream."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # (method, endpoint) -> [calls, errors, total time, max time]
+        self.calls: Dict[Tuple[str, str], List[Any]] = {}
+
+    def record(self, method: str, path: str, duration: float, *, error: bool) -> None:
+        key = (method.upper(), get_endpoint_name(path))
+
+        with self.lock:
+            entry = self.calls.setdefault(key, [0, 0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += int(error)
+            entry[2] += duration
+            entry[3] = max(entry[3], duration)
+
+    def format_prometheus(self) -> str:
+        with self.lock:
+            calls = sorted(self.calls.items())
+
+        lines = []
+        for name, index in [
+            ("director4_orchestrator_docker_api_calls_total", 0),
+            ("director4_orchestrator_docker_api_errors_total", 1),
+            ("director4_orchestrator_docker_api_seconds_total", 2),
+            ("director4_orchestrator_docker_api_seconds_max", 3),
+        ]:
+            for (method, endpoint), entry in calls:
+                lines.append(
+                    '{}{{method="{}",endpoint="{}"}} {}'.format(
+                        name, method, endpoint, entry[index]
+                    )
+                )
+
+        return "".join(line + "\n" for line in lines)
+
+
+class InstrumentedAPIClient(docker.APIClient):  # type: ignore[misc]
+    """An APIClient that records metrics about every call it makes, and that reconnects (and
+    retries requests that are safe to retry) if the Docker daemon was restarted."""
+
+    def __init__(self, *args: Any, manager: "DockerClientManager", **kwargs: Any) -> None:
+        self.manager = manager
+        super().__init__(*args, **kwargs)
+
+    def request(  # pylint: disable=arguments-differ
+        self, method: str, url: str, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        path = urllib.parse.urlsplit(url).path
+
+        for attempt in range(2):
+            start_time = time.perf_counter()
+            try:
+                response = cast(requests.Response, super().request(method, url, *args, **kwargs))
+            except requests.exceptions.ConnectionError:
+                self.manager.metrics.record(
+                    method, path, time.perf_counter() - start_time, error=True
+                )
+
+                # The daemon was probably restarted. urllib3 has already thrown away the
+                # connection that failed, and checks the others before reusing them. Closing the
+                # whole client would break the streams (logs, events, etc.) other threads have
+                # open on it, so just have the next get_shared_client() call create a new one.
+                self.manager.mark_disconnected()
+
+                if attempt > 0 or method.upper() not in {"GET", "HEAD"}:
+                    raise
+
+                logger.warning("Lost connection to the Docker daemon; retrying %s %s", method, path)
+                continue
+
+            self.manager.metrics.record(
+                method, path, time.perf_counter() - start_time, error=response.status_code >= 400
+            )
+            return response
+
+        raise AssertionError("unreachable")
+
+
+class InstrumentedDockerClient(docker.DockerClient):  # type: ignore[misc]
+    def __init__(self, *args: Any, **kwargs: Any) -> None:  # pylint: disable=super-init-not-called
+        self.api = InstrumentedAPIClient(*args, **kwargs)
+
+
+class DockerClientManager:
+    """Shares one thread-safe DockerClient (and so one connection pool) across the process.
+
+    The API version is negotiated with the daemon when the client is first created (unless
+    ``settings.DOCKER_API_VERSION`` pins it), and again only after the connection to the daemon
+    has been lost, in case it was upgraded.
 
-    Returns:
-        The created DockerClient instance.
     """
 
-    kwargs.setdefault("version", "auto")
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.client: Optional[docker.client.DockerClient] = None
+        self.disconnected = False
+
+        self.metrics = DockerAPIMetrics()
+
+    def get_client(self) -> docker.client.DockerClient:
+        with self.lock:
+            if self.client is None or self.disconnected:
+                self.client = InstrumentedDockerClient(
+                    version=settings.DOCKER_API_VERSION,
+                    timeout=settings.DOCKER_CLIENT_TIMEOUT,
+                    max_pool_size=settings.DOCKER_CLIENT_MAX_POOL_SIZE,
+                    manager=self,
+                    **docker.utils.kwargs_from_env(),
+                )
+                self.disconnected = False
+
+                logger.info("Using Docker API version %s", self.client.api.api_version)
+
+            return self.client
+
+    def mark_disconnected(self) -> None:
+        """Called when the connection to the daemon is lost. The next call to get_client() will
+        negotiate the API version again.
+
+        Clients that were already handed out keep working, since they reconnect as needed. The
+        old client is never closed, since other threads may still be streaming from it; its
+        connections are closed when it is garbage collected.
+
+        """
+        self.disconnected = True
+
+
+docker_client_manager = DockerClientManager()
+
 
-    return docker.from_env(**kwargs)
+def get_shared_client() -> docker.client.DockerClient:
+    """Returns the DockerClient shared by the whole process. It is thread-safe, so it can be used
+    from the Flask views, the websocket handlers, and any threads they start."""
+    return docker_client_manager.get_client()
 
 
 def get_swarm_node_id(client: docker.client.DockerClient) -> str:
@@ -3,6 +3,7 @@
 
 import asyncio
 import json
+import logging
 import os
 import selectors
 import subprocess
@@ -15,6 +16,7 @@ from typing import (  # pylint: disable=unused-import
     Iterable,
     List,
     Optional,
+    Set,
     Tuple,
     TypeVar,
     Union,
@@ -23,6 +25,8 @@ from typing import (  # pylint: disable=unused-import
 
 from . import settings
 
+logger = logging.getLogger(__name__)
+
 HELPER_SCRIPT_PATH = os.path.join(
     os.path.dirname(os.path.dirname(__file__)),
     "helpers/files-helper.py",
@@ -205,6 +209,69 @@ def list_site_files(site_id: int, relpath: str) -> List[Dict[str, str]]:
     return cast(List[Dict[str, str]], json.loads(stdout.decode().strip()))
 
 
+def list_many_site_directories(site_id: int, relpaths: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Lists several directories with one helper invocation.
+
+    Returns a dictionary mapping each relpath to either a columnar listing (a dictionary mapping
+    "fname", "filetype", "mode", and "dest" to lists of equal length) or a dictionary with an
+    "error" key if that directory could not be listed.
+
+    """
+    site_dir = get_site_directory_path(site_id)
+
+    if any("\n" in relpath for relpath in relpaths):
+        raise SiteFilesUserViewableException("Invalid path")
+
+    proc = run_helper_script_prog(
+        ["ls-many", site_dir],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    stdout, stderr = proc.communicate("".join(relpath + "\n" for relpath in relpaths).encode())
+
+    raise_for_process_result(proc.returncode, stderr)
+
+    return cast(Dict[str, Dict[str, Any]], json.loads(stdout.decode().strip()))
+
+
+def list_site_directory_tree(
+    site_id: int,
+    relpath: str,
+    *,
+    max_depth: int = settings.FILE_TREE_MAX_DEPTH,
+    max_entries: int = settings.FILE_TREE_MAX_ENTRIES,
+    max_time: float = settings.FILE_TREE_MAX_TIME,
+) -> Dict[str, Any]:
+    """Recursively lists a directory with one helper invocation.
+
+    Returns a dictionary with a columnar "files" listing, an "errors" dictionary mapping the
+    paths of directories that could not be listed to error messages, and a "truncated" flag
+    that is set if the walk was stopped early by the entry or time limits.
+
+    """
+    site_dir = get_site_directory_path(site_id)
+
+    proc = run_helper_script_prog(
+        ["ls-tree", site_dir, relpath, str(max_depth), str(max_entries), str(max_time)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    try:
+        stdout, stderr = proc.communicate(timeout=max_time + 30)
+    except subprocess.TimeoutExpired as ex:
+        proc.kill()
+        proc.communicate()
+        raise SiteFilesUserViewableException("Timed out listing directory") from ex
+
+    raise_for_process_result(proc.returncode, stderr)
+
+    return cast(Dict[str, Any], json.loads(stdout.decode().strip()))
+
+
 def stream_site_file(site_id: int, relpath: str) -> Generator[bytes, None, None]:
     site_dir = get_site_directory_path(site_id)
 
@@ -317,18 +384,112 @@ def download_zip_site_dir(site_id: int, relpath: str) -> Generator[bytes, None,
     raise_for_process_result(proc.returncode, errors)
 
 
+def search_site_files(
+    site_id: int,
+    relpath: str,
+    pattern: str,
+    *,
+    regex: bool = False,
+    ignore_case: bool = False,
+    exclude_dirs: Optional[List[str]] = None,
+) -> Generator[bytes, None, None]:
+    """Searches the files under ``relpath`` for lines matching ``pattern``.
+
+    Yields newline-delimited JSON as the helper produces it: one object per matching line,
+    followed by a summary object with ``"done": true``.
+
+    """
+    site_dir = get_site_directory_path(site_id)
+
+    if exclude_dirs is None:
+        exclude_dirs = settings.FILE_SEARCH_EXCLUDE_DIRS
+
+    if any(not name or "/" in name for name in exclude_dirs):
+        raise SiteFilesUserViewableException("Invalid excluded directory name")
+
+    proc = run_helper_script_prog(
+        [
+            "grep",
+            site_dir,
+            relpath,
+            pattern,
+            ("r" if regex else "") + ("i" if ignore_case else ""),
+            "/".join(exclude_dirs),
+            str(settings.FILE_SEARCH_MAX_FILE_SIZE),
+            str(settings.FILE_SEARCH_MAX_MATCHES),
+            str(settings.FILE_SEARCH_MAX_TIME),
+        ],
+        bufsize=0,  # THIS IS IMPORTANT
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    assert proc.stderr is not None
+    assert proc.stdout is not None
+
+    errors = ""
+
+    selector = selectors.DefaultSelector()
+    selector.register(proc.stdout, selectors.EVENT_READ)
+    selector.register(proc.stderr, selectors.EVENT_READ)
+
+    try:
+        while proc.poll() is None:
+            ready_files = selector.select(timeout=300)
+
+            for key, _ in ready_files:
+                if key.fileobj == proc.stdout:
+                    buf = proc.stdout.read(BUFSIZE)
+                    if not buf:
+                        break
+
+                    yield buf
+                elif key.fileobj == proc.stderr:
+                    errors += proc.stderr.read(BUFSIZE).decode()
+
+        while True:
+            buf = proc.stdout.read(BUFSIZE)
+            if not buf:
+                break
+
+            yield buf
+
+        errors += proc.stderr.read().decode()
+    finally:
+        # If the client stops reading the results early, don't leave the search running
+        if proc.poll() is None:
+            proc.kill()
+
+        proc.wait()
+        selector.close()
+
+    raise_for_process_result(proc.returncode, errors)
+
+
 def write_site_file(
     site_id: int,
     relpath: str,
     data: Union[bytes, Iterable[bytes]],
     *,
     mode_str: Optional[str] = None,
+    max_size: Optional[int] = None,
 ) -> None:
+    """Writes ``data`` to the given file.
+
+    ``data`` may be an iterable of chunks, which is streamed to the helper without being
+    buffered. The helper writes to a temporary file and only renames it over the target
+    once all the data has arrived, so if iterating over ``data`` raises an exception or
+    more than ``max_size`` bytes are received, the original file is left untouched.
+
+    """
     site_dir = get_site_directory_path(site_id)
 
     args = ["write", site_dir, relpath]
-    if mode_str is not None:
-        args.append(mode_str)
+    if mode_str is not None or max_size is not None:
+        args.append(mode_str or "")
+    if max_size is not None:
+        args.append(str(max_size))
 
     proc = run_helper_script_prog(
         args,
@@ -339,17 +500,109 @@ def write_site_file(
 
     assert proc.stdin is not None
 
-    if isinstance(data, bytes):
-        proc.stdin.write(data)
-    else:
+    try:
+        if isinstance(data, bytes):
+            data = [data]
+
+        written = 0
         for chunk in data:
+            written += len(chunk)
+            if max_size is not None and written > max_size:
+                raise SiteFilesUserViewableException("File too large")
+
             proc.stdin.write(chunk)
+    except BrokenPipeError:
+        # The helper exited early; its stderr will tell us why
+        pass
+    except BaseException:
+        # Abort the upload. The helper removes its temporary file when it is terminated.
+        proc.terminate()
+        proc.communicate()
+        raise
 
     _, stderr = proc.communicate()
 
     raise_for_process_result(proc.returncode, stderr)
 
 
+def extract_site_archive(
+    site_id: int, relpath: str, data: Iterable[bytes], *, archive_format: str
+) -> Generator[bytes, None, None]:
+    """Extracts a .zip, .tar, or .tar.gz archive (streamed in as ``data``) into ``relpath``.
+
+    The whole of ``data`` is consumed before the first chunk is yielded. After that, this yields
+    the helper's progress reports (newline-delimited JSON objects, the last of which has
+    ``"done": true``) as the extraction finishes.
+
+    """
+    site_dir = get_site_directory_path(site_id)
+
+    proc = run_helper_script_prog(
+        [
+            "extract",
+            site_dir,
+            relpath,
+            archive_format,
+            str(settings.MAX_ARCHIVE_UPLOAD_BYTES),
+            str(settings.MAX_ARCHIVE_EXTRACT_BYTES),
+            str(settings.MAX_ARCHIVE_EXTRACT_FILES),
+        ],
+        bufsize=0,  # THIS IS IMPORTANT
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    assert proc.stdin is not None
+    assert proc.stdout is not None
+    assert proc.stderr is not None
+
+    selector = selectors.DefaultSelector()
+    selector.register(proc.stdout, selectors.EVENT_READ)
+
+    # The progress reports printed while the upload is still coming in are held here. They are
+    # read as we go so the helper never blocks on a full stdout pipe while we block writing to
+    # its stdin.
+    output = b""
+
+    try:
+        for chunk in data:
+            view = memoryview(chunk)
+            while view:
+                view = view[proc.stdin.write(view) or 0 :]
+
+            for _ in selector.select(timeout=0):
+                output += proc.stdout.read(BUFSIZE) or b""
+
+        proc.stdin.close()
+    except BrokenPipeError:
+        # The helper exited early; its stderr will tell us why
+        pass
+    except BaseException:
+        # Abort the extraction
+        proc.terminate()
+        proc.communicate()
+        raise
+    finally:
+        selector.close()
+
+    if output:
+        yield output
+
+    while True:
+        buf = proc.stdout.read(BUFSIZE)
+        if not buf:
+            break
+
+        yield buf
+
+    errors = proc.stderr.read().decode()
+
+    proc.wait()
+
+    raise_for_process_result(proc.returncode, errors)
+
+
 def create_site_file(site_id: int, relpath: str, *, mode_str: Optional[str] = None) -> None:
     site_dir = get_site_directory_path(site_id)
 
@@ -467,6 +720,38 @@ def chmod_path(site_id: int, relpath: str, *, mode_str: str) -> None:
     raise_for_process_result(proc.returncode, stderr)
 
 
+def run_batch_file_operations(
+    site_id: int, operations: List[Dict[str, str]], *, mode: str = "continue"
+) -> Dict[str, Any]:
+    """Performs several file operations with one helper invocation.
+
+    Each operation is a dictionary with an "op" key ("rm", "rmdir-recur", "rename", "chmod",
+    "mkdir", or "create") and a "path" key. "rename" also requires "newpath", "chmod" requires
+    "mode", and "mkdir" and "create" optionally accept "mode".
+
+    ``mode`` is one of "continue" (attempt every operation), "stop" (skip everything after the
+    first failure), or "atomic" (additionally revert the operations that succeeded if one fails).
+
+    Returns a dictionary with a "results" list containing one {"status": "ok"|"error"|"skipped"}
+    dictionary (with an "error" message for failures) per operation, and a "reverted" flag.
+
+    """
+    site_dir = get_site_directory_path(site_id)
+
+    proc = run_helper_script_prog(
+        ["batch", site_dir, mode],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    stdout, stderr = proc.communicate(json.dumps(operations).encode())
+
+    raise_for_process_result(proc.returncode, stderr)
+
+    return cast(Dict[str, Any], json.loads(stdout.decode().strip()))
+
+
 class SiteFilesMonitor:
     def __init__(self, site_id: int) -> None:
         self.site_id = site_id
@@ -524,6 +809,7 @@ class SiteFilesMonitor:
         await self.proc.stdin.drain()
 
     async def rm_watch(self, relpath: str) -> None:
+        """Stops watching ``relpath``. Watches on its subdirectories are left alone."""
         if self.proc is None:
             raise Exception("SiteFilesMonitor.start() was not called")
 
@@ -548,3 +834,197 @@ class SiteFilesMonitor:
                 break
 
             yield json.loads(line)
+
+
+class SiteFilesMonitorSubscription:
+    """One client's view of a SharedSiteFilesMonitor.
+
+    Clients add and remove watches as if they had a monitor to themselves, and only receive the
+    events for the directories they are watching. Events arrive in batches (lists of events).
+
+    """
+
+    def __init__(self, shared_monitor: "SharedSiteFilesMonitor") -> None:
+        self.shared_monitor = shared_monitor
+
+        self.watches: Set[str] = set()
+        self.pending_listings: Set[str] = set()
+
+        self.queue: "asyncio.Queue[Optional[List[Dict[str, Any]]]]" = asyncio.Queue(
+            maxsize=settings.FILE_MONITOR_SUBSCRIBER_QUEUE_SIZE
+        )
+        self.closed = False
+
+    def wants_event(self, event: Dict[str, Any]) -> bool:
+        fname = event["fname"].rstrip("/")
+        # Changes inside a watched directory, or to the watched directory itself
+        return os.path.dirname(fname) in self.watches or fname in self.watches
+
+    def put_events(self, events: List[Dict[str, Any]]) -> None:
+        if self.closed or not events:
+            return
+
+        try:
+            self.queue.put_nowait(events)
+        except asyncio.QueueFull:
+            # This client can't keep up. Disconnect it; it will reconnect and list everything
+            # again, which is better than buffering an unbounded number of events for it.
+            logger.warning(
+                "File monitor subscriber for site %d fell behind; disconnecting",
+                self.shared_monitor.site_id,
+            )
+            self.end()
+
+    def end(self) -> None:
+        if not self.closed:
+            self.closed = True
+
+            # Make room for the sentinel if necessary; the client is being disconnected anyway
+            while self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def add_watch(self, relpath: str) -> None:
+        if self.closed:
+            return
+
+        self.pending_listings.add(relpath)
+        if relpath not in self.watches:
+            self.watches.add(relpath)
+            self.shared_monitor.watch_counts[relpath] = (
+                self.shared_monitor.watch_counts.get(relpath, 0) + 1
+            )
+
+        # The helper sends the listing again even if the directory is already being watched
+        await self.shared_monitor.monitor.add_watch(relpath)
+
+    async def rm_watch(self, relpath: str) -> None:
+        """Stops watching ``relpath`` and all of its subdirectories."""
+        removed = {
+            path
+            for path in self.watches
+            if not relpath or path == relpath or path.startswith(relpath + "/")
+        }
+
+        self.watches -= removed
+        self.pending_listings -= removed
+
+        for path in removed:
+            await self.shared_monitor.release_watch(path)
+
+    async def aiter_events(self) -> AsyncGenerator[List[Dict[str, Any]], None]:
+        while True:
+            events = await self.queue.get()
+            if events is None:
+                break
+
+            yield events
+
+    async def close(self) -> None:
+        self.end()
+        await self.rm_watch("")
+        await self.shared_monitor.unsubscribe(self)
+
+
+class SharedSiteFilesMonitor:
+    """Shares one SiteFilesMonitor (and so one helper process) between every client watching the
+    same site's files.
+
+    The helper watches the union of the directories the subscribers are watching, and each batch
+    of events it sends is split up between the subscribers based on what they are watching.
+
+    """
+
+    _monitors: Dict[int, "SharedSiteFilesMonitor"] = {}
+    _lock: Optional[asyncio.Lock] = None
+
+    def __init__(self, site_id: int) -> None:
+        self.site_id = site_id
+        self.monitor = SiteFilesMonitor(site_id)
+
+        self.subscriptions: Set[SiteFilesMonitorSubscription] = set()
+        # How many subscribers are watching each directory
+        self.watch_counts: Dict[str, int] = {}
+
+        self.reader_task: Optional["asyncio.Task[None]"] = None
+
+    @classmethod
+    def _get_lock(cls) -> asyncio.Lock:
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        return cls._lock
+
+    @classmethod
+    async def subscribe(cls, site_id: int) -> SiteFilesMonitorSubscription:
+        """Returns a new subscription to the given site's monitor, starting it if necessary."""
+        async with cls._get_lock():
+            shared_monitor = cls._monitors.get(site_id)
+            if shared_monitor is None:
+                shared_monitor = cls(site_id)
+                await shared_monitor.monitor.start()
+                shared_monitor.reader_task = asyncio.create_task(shared_monitor.read_events())
+                cls._monitors[site_id] = shared_monitor
+
+            subscription = SiteFilesMonitorSubscription(shared_monitor)
+            shared_monitor.subscriptions.add(subscription)
+
+            return subscription
+
+    async def unsubscribe(self, subscription: SiteFilesMonitorSubscription) -> None:
+        async with self._get_lock():
+            self.subscriptions.discard(subscription)
+
+            if self.subscriptions or self._monitors.get(self.site_id) is not self:
+                return
+
+            del self._monitors[self.site_id]
+
+        assert self.monitor.proc is not None
+        if self.monitor.proc.returncode is None:
+            try:
+                await self.monitor.stop_wait(timeout=3)
+            except (BrokenPipeError, ConnectionResetError):
+                # It exited in the meantime
+                await self.monitor.wait()
+
+        if self.reader_task is not None:
+            await self.reader_task
+
+    async def release_watch(self, relpath: str) -> None:
+        count = self.watch_counts.get(relpath, 0) - 1
+        if count > 0:
+            self.watch_counts[relpath] = count
+            return
+
+        self.watch_counts.pop(relpath, None)
+
+        if self.monitor.proc is not None and self.monitor.proc.returncode is None:
+            try:
+                await self.monitor.rm_watch(relpath)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    async def read_events(self) -> None:
+        try:
+            async for msg in self.monitor.aiter_events():
+                events = msg.get("events", [])
+
+                if "listing" in msg:
+                    for subscription in list(self.subscriptions):
+                        if msg["listing"] in subscription.pending_listings:
+                            subscription.pending_listings.discard(msg["listing"])
+                            subscription.put_events(events)
+                else:
+                    for subscription in list(self.subscriptions):
+                        subscription.put_events(
+                            [event for event in events if subscription.wants_event(event)]
+                        )
+        finally:
+            # The helper exited. Disconnect everyone, and make sure nobody else subscribes to this
+            # monitor.
+            async with self._get_lock():
+                if self._monitors.get(self.site_id) is self:
+                    del self._monitors[self.site_id]
+
+            for subscription in list(self.subscriptions):
+                subscription.end()
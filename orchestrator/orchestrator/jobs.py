@@ -0,0 +1,310 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+import uuid
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Tuple
+
+from . import database as database_utils
+from . import settings
+from .batch import run_site_batch, validate_site_batch_steps
+from .docker.images import remove_docker_image
+from .docker.registry import remove_registry_image
+from .docker.services import reload_nginx_config, update_director_service
+from .docker.utils import get_shared_client
+from .exceptions import OrchestratorActionError
+
+logger = logging.getLogger(__name__)
+
+# Job functions are passed the job's parameters and a function to report progress with. They can
+# return a JSON-serializable dictionary with more detailed output than just success or failure.
+JobFunction = Callable[[Dict[str, Any], Callable[[str], None]], Optional[Dict[str, Any]]]
+
+
+def reload_nginx_job(params: Dict[str, Any], progress: Callable[[str], None]) -> None:
+    progress("Reloading Nginx config")
+    reload_nginx_config(get_shared_client())
+
+
+def update_docker_service_job(params: Dict[str, Any], progress: Callable[[str], None]) -> None:
+    progress("Creating/updating Docker service")
+    update_director_service(get_shared_client(), int(params["site_id"]), params["data"])
+
+
+def remove_docker_image_job(params: Dict[str, Any], progress: Callable[[str], None]) -> None:
+    progress("Removing Docker image")
+    remove_docker_image(get_shared_client(), params["name"])
+
+
+def remove_registry_image_job(params: Dict[str, Any], progress: Callable[[str], None]) -> None:
+    progress("Removing Docker image from registry")
+    remove_registry_image(params["name"])
+
+
+def create_database_job(params: Dict[str, Any], progress: Callable[[str], None]) -> None:
+    progress("Creating database")
+    database_utils.create_database(params["data"])
+
+
+def delete_database_job(params: Dict[str, Any], progress: Callable[[str], None]) -> None:
+    progress("Deleting database")
+    database_utils.delete_database(params["data"])
+
+
+def create_many_databases_job(
+    params: Dict[str, Any], progress: Callable[[str], None]
+) -> Optional[Dict[str, Any]]:
+    if len(params["databases"]) > settings.DATABASE_BULK_MAX_DATABASES:
+        raise OrchestratorActionError("Too many databases")
+
+    progress("Creating {} databases".format(len(params["databases"])))
+    return {"results": database_utils.create_many_databases(params["databases"])}
+
+
+def site_batch_job(
+    params: Dict[str, Any], progress: Callable[[str], None]
+) -> Optional[Dict[str, Any]]:
+    if not validate_site_batch_steps(params["steps"]):
+        raise OrchestratorActionError("Invalid steps")
+
+    if len(params["steps"]) > settings.SITE_BATCH_MAX_STEPS:
+        raise OrchestratorActionError("Too many steps")
+
+    return run_site_batch(
+        get_shared_client(),
+        int(params["site_id"]),
+        params["data"],
+        params["steps"],
+        progress=progress,
+    )
+
+
+JOB_TYPES: Dict[str, JobFunction] = {
+    "reload-nginx": reload_nginx_job,
+    "update-docker-service": update_docker_service_job,
+    "remove-docker-image": remove_docker_image_job,
+    "remove-registry-image": remove_registry_image_job,
+    "create-database": create_database_job,
+    "delete-database": delete_database_job,
+    "create-many-databases": create_many_databases_job,
+    "site-batch": site_batch_job,
+}
+
+
+class Job:  # pylint: disable=too-many-instance-attributes
+    """A long-running action submitted to the JobRunner.
+
+    A job is "pending" until a slot for its type frees up, then "running", and finally either
+    "succeeded" or "failed". Progress messages and state changes are pushed to any websockets
+    watching the job (see aiter_updates()).
+
+    """
+
+    def __init__(self, job_type: str, params: Dict[str, Any]) -> None:
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.params = params
+
+        self.state = "pending"
+        self.messages: List[str] = []
+        self.result: Optional[str] = None
+        self.output: Optional[Dict[str, Any]] = None
+
+        self.submit_time = time.time()
+        self.start_time: Optional[float] = None
+        self.finish_time: Optional[float] = None
+
+        self.lock = threading.Lock()
+        # Bumped on every change, so watchers can tell whether they missed anything
+        self.version = 0
+        self.watchers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.state in {"succeeded", "failed"}
+
+    def serialize(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "job_id": self.id,
+                "type": self.type,
+                "state": self.state,
+                "messages": list(self.messages),
+                "result": self.result,
+                "output": self.output,
+                "submit_time": self.submit_time,
+                "start_time": self.start_time,
+                "finish_time": self.finish_time,
+            }
+
+    def update(
+        self,
+        *,
+        state: Optional[str] = None,
+        message: Optional[str] = None,
+        result: Optional[str] = None,
+        output: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        with self.lock:
+            if state is not None:
+                self.state = state
+                if state == "running":
+                    self.start_time = time.time()
+                elif self.finished:
+                    self.finish_time = time.time()
+
+            if message is not None:
+                self.messages.append(message)
+
+            if result is not None:
+                self.result = result
+
+            if output is not None:
+                self.output = output
+
+            self.version += 1
+            watchers = list(self.watchers)
+
+        for loop, event in watchers:
+            loop.call_soon_threadsafe(event.set)
+
+    async def aiter_updates(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """Yields the serialized job now and again every time it changes, until it finishes."""
+        event = asyncio.Event()
+        watcher = (asyncio.get_running_loop(), event)
+
+        with self.lock:
+            self.watchers.append(watcher)
+
+        try:
+            while True:
+                event.clear()
+
+                data = self.serialize()
+                yield data
+
+                if data["state"] in {"succeeded", "failed"}:
+                    break
+
+                await event.wait()
+        finally:
+            with self.lock:
+                self.watchers.remove(watcher)
+
+
+class JobRunner:
+    """Runs jobs on a bounded pool of threads.
+
+    At most ``settings.JOB_MAX_WORKERS`` jobs run at once, and at most
+    ``settings.JOB_TYPE_CONCURRENCY_LIMITS[type]`` (or ``settings.JOB_DEFAULT_CONCURRENCY_LIMIT``)
+    of each type. Jobs past those limits wait in a queue for their type, so they don't tie up
+    threads that other types of jobs could use. Finished jobs are kept for
+    ``settings.JOB_RETENTION_TIME`` seconds so their results can be looked up.
+
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Job] = {}
+
+        self.queues: Dict[str, Deque[Job]] = collections.defaultdict(collections.deque)
+        self.running_counts: Dict[str, int] = collections.defaultdict(int)
+
+        self.executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def submit(self, job_type: str, params: Dict[str, Any]) -> Job:
+        """Queues a job of the given type. Raises OrchestratorActionError if the type is unknown or
+        too many jobs are already waiting."""
+        if job_type not in JOB_TYPES:
+            raise OrchestratorActionError("Unknown job type {!r}".format(job_type))
+
+        job = Job(job_type, params)
+
+        with self.lock:
+            self._prune_jobs()
+
+            num_pending = sum(len(queue) for queue in self.queues.values())
+            if num_pending >= settings.JOB_MAX_PENDING:
+                raise OrchestratorActionError("Too many jobs are waiting to run")
+
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=settings.JOB_MAX_WORKERS, thread_name_prefix="job"
+                )
+
+            self.jobs[job.id] = job
+            self.queues[job_type].append(job)
+            self._start_jobs(job_type)
+
+        logger.info("Submitted %s job %s", job_type, job.id)
+
+        return job
+
+    def _get_concurrency_limit(self, job_type: str) -> int:
+        return settings.JOB_TYPE_CONCURRENCY_LIMITS.get(
+            job_type, settings.JOB_DEFAULT_CONCURRENCY_LIMIT
+        )
+
+    def _start_jobs(self, job_type: str) -> None:
+        # Must be called with the lock held
+        assert self.executor is not None
+
+        queue = self.queues[job_type]
+        while queue and self.running_counts[job_type] < self._get_concurrency_limit(job_type):
+            self.running_counts[job_type] += 1
+            self.executor.submit(self._run_job, queue.popleft())
+
+    def _prune_jobs(self) -> None:
+        # Must be called with the lock held
+        cutoff = time.time() - settings.JOB_RETENTION_TIME
+
+        for job_id, job in list(self.jobs.items()):
+            if job.finish_time is not None and job.finish_time < cutoff:
+                del self.jobs[job_id]
+
+    def _run_job(self, job: Job) -> None:
+        job.update(state="running")
+
+        def progress(message: str) -> None:
+            job.update(message=message)
+
+        try:
+            output = JOB_TYPES[job.type](job.params, progress)
+        except OrchestratorActionError as ex:
+            logger.exception("Error running %s job %s", job.type, job.id)
+            job.update(state="failed", result=str(ex))
+        except BaseException:  # pylint: disable=broad-except
+            logger.exception("Error running %s job %s", job.type, job.id)
+            job.update(state="failed", result="Error")
+        else:
+            logger.info("Finished %s job %s", job.type, job.id)
+            job.update(state="succeeded", result="Success", output=output)
+        finally:
+            with self.lock:
+                self.running_counts[job.type] -= 1
+                self._start_jobs(job.type)
+
+    def format_prometheus(self) -> str:
+        with self.lock:
+            counts: Dict[Tuple[str, str], int] = collections.Counter(
+                (job.type, job.state) for job in self.jobs.values()
+            )
+
+        return "".join(
+            'director4_orchestrator_jobs{{type="{}",state="{}"}} {}\n'.format(
+                job_type, state, count
+            )
+            for (job_type, state), count in sorted(counts.items())
+        )
+
+
+job_runner = JobRunner()
@@ -2,120 +2,263 @@
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
 import asyncio
-import subprocess
+import collections
+import logging
+import threading
 import time
-from typing import AsyncGenerator, Optional, Union
+from typing import Any, AsyncGenerator, Deque, Dict, Iterator, Optional, Set, Union
 
+import docker
 from docker.client import DockerClient
+from docker.types.daemon import CancellableStream
+
+from . import settings
+from .docker.service_index import service_index
+from .docker.services import get_director_service_name, get_service_id_by_name
+from .docker.utils import get_shared_client
+
+logger = logging.getLogger(__name__)
+
+
+def open_service_logs_stream(
+    client: DockerClient,
+    service_id: str,
+    *,
+    since: Union[int, float, None] = None,
+    tail: Optional[int] = None,
+) -> CancellableStream:
+    """Follows the logs of the given service through the Docker API. The returned stream yields
+    chunks of bytes, and can be closed from another thread to stop following the logs.
+
+    This is what ``client.api.service_logs()`` does, except that it returns a bare generator, which
+    cannot be interrupted while it is waiting for more logs.
+
+    """
+    params: Dict[str, Any] = {
+        "follow": True,
+        "stdout": True,
+        "stderr": True,
+        "timestamps": False,
+        "details": False,
+        "tail": str(tail) if tail is not None else "all",
+    }
+    if since is not None:
+        params["since"] = "{:.9f}".format(since)
+
+    # pylint: disable=protected-access
+    res = client.api._get(
+        client.api._url("/services/{0}/logs", service_id),
+        params=params,
+        stream=True,
+        # Sites can go a long time without logging anything
+        timeout=None,
+    )
+
+    # Sites' services never have a TTY (see docker/services.py), so the output is multiplexed
+    return CancellableStream(client.api._get_result_tty(True, res, False), res)
+
+
+class SiteLogSubscription:
+    """One client's view of a SiteLogHub.
+
+    Lines are queued for the client up to ``settings.LOG_HUB_SUBSCRIBER_QUEUE_SIZE``. If the client
+    can't keep up, new lines are dropped for it (without holding up anyone else), and it is told
+    how many lines it missed once it catches up.
+
+    """
+
+    def __init__(self, hub: "SiteLogHub") -> None:
+        self.hub = hub
+
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(
+            maxsize=settings.LOG_HUB_SUBSCRIBER_QUEUE_SIZE
+        )
+        self.dropped = 0
+        self.closed = False
 
-from .docker.services import get_director_service_name, get_service_by_name
+    def put_line(self, line: str) -> None:
+        if self.closed:
+            return
 
+        if self.dropped:
+            # Leave room for the notice and the line
+            if self.queue.maxsize - self.queue.qsize() < 2:
+                self.dropped += 1
+                return
 
-class DirectorSiteLogFollower:
-    def __init__(self, client: DockerClient, site_id: int) -> None:
-        self.client = client
-        self.site_id = site_id
+            self.queue.put_nowait(
+                "[Director: {} lines were skipped because they were being produced too "
+                "quickly]\n".format(self.dropped)
+            )
+            self.dropped = 0
 
-        self.service = get_service_by_name(client, get_director_service_name(self.site_id))
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped += 1
 
-        self.stopped = True
+    def end(self) -> None:
+        if not self.closed:
+            self.closed = True
 
-        self.proc: Optional[asyncio.subprocess.Process] = None  # pylint: disable=no-member
-        self.proc_start_time = 0.0
+            # Make room for the sentinel if necessary; the client is being disconnected anyway
+            while self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
 
-        # The process will be restarted this often
-        self.proc_life_timeout = 90.0
+    async def aiter_lines(self) -> AsyncGenerator[str, None]:
+        while True:
+            line = await self.queue.get()
+            if line is None:
+                break
 
-    async def start(
-        self, *, since_time: Union[int, float, None] = None, last_n: Optional[int] = None
-    ) -> None:
-        if self.service is None:
-            self.stopped = True
-            return
+            yield line
 
-        args = ["docker", "service", "logs", "--follow", "--raw"]
+    def close(self) -> None:
+        self.end()
+        self.hub.unsubscribe(self)
 
-        if since_time is not None:
-            args.extend(("--since", str(since_time)))
-        else:
-            args.extend(("--tail", str(last_n if last_n is not None else 0)))
 
-        args.append(self.service.id)
+class SiteLogHub:
+    """Shares one stream of a site's logs between every client watching them.
 
-        self.proc = await asyncio.create_subprocess_exec(
-            *args,
-            stdin=subprocess.DEVNULL,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        )
+    The logs are followed through the Docker API in a background thread for as long as anyone is
+    subscribed. The last ``settings.LOG_HUB_REPLAY_LINES`` lines are kept so they can be sent to
+    new subscribers immediately.
 
-        self.proc_start_time = time.time()
+    """
 
-        self.stopped = False
+    _hubs: Dict[int, "SiteLogHub"] = {}
 
-    async def iter_lines(self) -> AsyncGenerator[str, None]:
-        if self.stopped:
-            return
+    def __init__(self, site_id: int) -> None:
+        self.site_id = site_id
 
-        assert self.proc is not None
-        assert self.proc.stdout is not None
+        self.subscriptions: Set[SiteLogSubscription] = set()
+        self.replay_lines: Deque[str] = collections.deque(maxlen=settings.LOG_HUB_REPLAY_LINES)
 
-        while True:
-            timeout = max(self.proc_life_timeout - (time.time() - self.proc_start_time), 0)
+        self.loop = asyncio.get_running_loop()
 
-            try:
-                yield await self._read_line(timeout=timeout)
-            except asyncio.TimeoutError:
-                since_time = time.time()
-                # Kill the process
-                await self.stop(timeout=2)
+        self.stop_event = threading.Event()
+        self.stream: Optional[CancellableStream] = None
+        self.thread = threading.Thread(
+            target=self.follow_thread_main,
+            name="site-logs-{}".format(site_id),
+            daemon=True,
+        )
 
-                # Now read the lines and yield them out
-                try:
-                    while True:
-                        line = await self._read_line(timeout=0.5)
-                        if not line:
-                            break
+    @classmethod
+    def subscribe(cls, site_id: int) -> SiteLogSubscription:
+        """Returns a new subscription to the given site's logs, starting to follow them if
+        necessary. The subscription starts with the most recent lines."""
+        hub = cls._hubs.get(site_id)
+        if hub is None:
+            hub = cls(site_id)
+            hub.thread.start()
+            cls._hubs[site_id] = hub
 
-                        yield line
-                except asyncio.TimeoutError:
-                    pass
+        subscription = SiteLogSubscription(hub)
+        for line in hub.replay_lines:
+            subscription.put_line(line)
 
-                # And start the process again
-                await self.start(since_time=since_time)
+        hub.subscriptions.add(subscription)
 
-    async def _read_line(self, *, timeout: Union[int, float, None]) -> str:
-        if self.stopped:
-            return ""
+        return subscription
 
-        assert self.proc is not None
-        assert self.proc.stdout is not None
+    def unsubscribe(self, subscription: SiteLogSubscription) -> None:
+        self.subscriptions.discard(subscription)
 
-        return (await asyncio.wait_for(self.proc.stdout.readline(), timeout=timeout)).decode()
+        if not self.subscriptions:
+            self.stop()
 
-    async def stop(self, *, timeout: Union[int, float] = 5) -> None:
-        if self.stopped:
-            return
+    def stop(self) -> None:
+        if self._hubs.get(self.site_id) is self:
+            del self._hubs[self.site_id]
 
-        assert self.proc is not None
+        self.stop_event.set()
 
-        try:
-            self.proc.terminate()
-        except ProcessLookupError:
-            pass
+        # Unblock the thread if it's waiting for more logs
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    def publish_line(self, line: str) -> None:
+        self.replay_lines.append(line)
 
-        self.stopped = True
+        for subscription in list(self.subscriptions):
+            subscription.put_line(line)
 
+    def end_subscriptions(self) -> None:
+        self.stop()
+
+        for subscription in list(self.subscriptions):
+            subscription.end()
+
+    def follow_thread_main(self) -> None:
         try:
-            await asyncio.wait_for(self.proc.wait(), timeout=timeout)
-        except asyncio.TimeoutError:
-            self.proc.kill()
-            await self.proc.wait()
-
-    async def __aenter__(self) -> "DirectorSiteLogFollower":
-        return self
-
-    async def __aexit__(  # type: ignore  # pylint: disable=invalid-name
-        self, exc_type, exc, tb
-    ) -> None:
-        await self.stop()
+            self.follow_logs(get_shared_client())
+        except RuntimeError:
+            # The event loop was closed
+            self.stop_event.set()
+
+    def follow_logs(self, client: DockerClient) -> None:
+        since: Optional[float] = None
+
+        while not self.stop_event.is_set():
+            try:
+                service_id = get_service_id_by_name(client, get_director_service_name(self.site_id))
+                if service_id is None:
+                    break
+
+                # The first time, start with the last few lines. After that, pick up where we left
+                # off.
+                self.stream = open_service_logs_stream(
+                    client,
+                    service_id,
+                    since=since,
+                    tail=settings.LOG_HUB_REPLAY_LINES if since is None else None,
+                )
+                # stop() may have been called while we were connecting
+                if self.stop_event.is_set():
+                    self.stream.close()
+                    break
+
+                for line in self.iter_stream_lines(self.stream):
+                    since = time.time()
+                    self.loop.call_soon_threadsafe(self.publish_line, line)
+            except RuntimeError:
+                raise
+            except docker.errors.NotFound:
+                # The service was removed (and maybe recreated) since it was indexed. Look it up
+                # again after the usual delay; if it's really gone, we'll stop.
+                service_index.forget(get_director_service_name(self.site_id))
+            except Exception:  # pylint: disable=broad-except
+                if not self.stop_event.is_set():
+                    logger.exception("Error following logs for site %d", self.site_id)
+            finally:
+                self.stream = None
+
+            # The stream ended (or failed) on its own. Give it a moment and reconnect.
+            if since is None:
+                since = time.time()
+            self.stop_event.wait(settings.LOG_HUB_RECONNECT_DELAY)
+
+        if not self.stop_event.is_set():
+            # The service is gone
+            self.loop.call_soon_threadsafe(self.end_subscriptions)
+
+    def iter_stream_lines(self, stream: CancellableStream) -> Iterator[str]:
+        buf = b""
+        for chunk in stream:
+            if self.stop_event.is_set():
+                break
+
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                yield (line + b"\n").decode(errors="replace")
+
+        if buf and not self.stop_event.is_set():
+            yield buf.decode(errors="replace")
@@ -14,6 +14,36 @@ SITES_DOMAIN = "sites.tjhsst.edu"
 # Location of nginx configs in containers
 NGINX_CONFIG_DIRECTORY = "/data/nginx/director.d"
 
+# If True, sites without custom Nginx config don't get their own server blocks. Instead, they're
+# served by a few shared server blocks that look each site up in map tables, which are all
+# generated into one file (NGINX_SITE_MAPS_CONFIG_NAME in NGINX_CONFIG_DIRECTORY). Nginx loads and
+# reloads this much faster when there are thousands of sites. Each site's entry is kept in
+# NGINX_SITE_DATA_DIRECTORY, and the shared file is regenerated every time Nginx is reloaded.
+# The main nginx.conf must not set map_hash_* or server_names_hash_*, since the shared file does.
+NGINX_USE_SITE_MAPS = False
+NGINX_SITE_DATA_DIRECTORY = "/data/nginx/director-sites"
+NGINX_SITE_MAPS_CONFIG_NAME = "director-sites.conf"
+
+# Name of the file in NGINX_CONFIG_DIRECTORY with the definitions shared by all the sites' configs
+# (like the map that picks the Connection header sent to sites). It's regenerated every time Nginx
+# is reloaded.
+NGINX_SHARED_CONFIG_NAME = "director-shared.conf"
+
+# DNS server Nginx uses to look up sites' Docker Swarm services (Docker's embedded DNS server), and
+# how long it caches the results for. Services keep the same virtual IP for as long as they exist,
+# so this only needs to be short enough to notice when one is recreated.
+NGINX_RESOLVER = "127.0.0.11"
+NGINX_RESOLVER_VALID = "10s"
+
+# Dynamic sites are proxied to through an `upstream` block per site, which keeps up to this many
+# idle connections to the site open (in each Nginx worker) for reuse, and re-resolves the service's
+# address in the background. This needs Nginx 1.27.3 or newer (for `server ... resolve`). If it's 0,
+# the service's address is looked up and a new connection is opened for each request instead.
+NGINX_UPSTREAM_KEEPALIVE = 8
+NGINX_UPSTREAM_KEEPALIVE_TIMEOUT = "60s"
+# Size of the shared memory zone all the sites' upstream blocks are kept in
+NGINX_UPSTREAM_ZONE_SIZE = "32m"
+
 # Name of Nginx Docker Swarm service
 NGINX_SERVICE_NAME = "director-nginx"
 
@@ -78,8 +108,62 @@ MAX_FILE_UPLOAD_BYTES = 100 * 1000 * 1000  # 100MB
 # Each file is also limited to MAX_FILE_DOWNLOAD_BYTES
 MAX_ZIP_FILES = 1000
 
+# Limits on bulk directory listings. A single request can list at most FILE_LIST_MAX_PATHS
+# directories, and recursive listings stop after FILE_TREE_MAX_ENTRIES entries or
+# FILE_TREE_MAX_TIME seconds and never go more than FILE_TREE_MAX_DEPTH levels deep.
+FILE_LIST_MAX_PATHS = 200
+FILE_TREE_MAX_DEPTH = 32
+FILE_TREE_MAX_ENTRIES = 20000
+FILE_TREE_MAX_TIME = 5.0
+
+# Limits on searching site files. Files larger than FILE_SEARCH_MAX_FILE_SIZE are skipped, and
+# searches stop after FILE_SEARCH_MAX_MATCHES matches or FILE_SEARCH_MAX_TIME seconds.
+# Directories named in FILE_SEARCH_EXCLUDE_DIRS are skipped unless the request overrides them.
+FILE_SEARCH_MAX_FILE_SIZE = 2 * 1000 * 1000  # 2MB
+FILE_SEARCH_MAX_MATCHES = 2000
+FILE_SEARCH_MAX_TIME = 15.0
+FILE_SEARCH_EXCLUDE_DIRS = ["node_modules", ".git", "__pycache__", ".venv", "venv"]
+
+# Limits on the size of an uploaded archive, and on the total size and number of files extracted
+# from it
+MAX_ARCHIVE_UPLOAD_BYTES = 100 * 1000 * 1000  # 100MB
+MAX_ARCHIVE_EXTRACT_BYTES = 500 * 1000 * 1000  # 500MB
+MAX_ARCHIVE_EXTRACT_FILES = 20000
+
+# Maximum number of operations in one batch of file operations
+FILE_BATCH_MAX_OPERATIONS = 1000
+
+# Maximum number of steps in one batch of actions on a site (see batch.py)
+SITE_BATCH_MAX_STEPS = 20
+
+# Maximum number of batches of file events that can be waiting to be sent to one client of a
+# site's file monitor before it is disconnected for being too slow
+FILE_MONITOR_SUBSCRIBER_QUEUE_SIZE = 256
+
+# How often (in seconds) to refresh the statuses of every site being watched, in case a Docker event
+# was missed (container events are only reported for containers on this node)
+SITE_STATUS_RESYNC_INTERVAL = 30.0
+# Maximum number of sites whose statuses can be requested at once
+MULTI_SITE_STATUS_MAX_SITES = 1000
+
+# The Docker API version to use. "auto" negotiates it with the daemon once per process (and again
+# if the daemon is restarted); setting a specific version skips that.
+DOCKER_API_VERSION = "auto"
+# Timeout (in seconds) for calls to the Docker API
+DOCKER_CLIENT_TIMEOUT = 60
+# Maximum number of idle connections to the Docker daemon to keep open
+DOCKER_CLIENT_MAX_POOL_SIZE = 32
+
+# How many of the most recent lines of a site's logs to send to new log viewers
+LOG_HUB_REPLAY_LINES = 100
+# Maximum number of lines of a site's logs that can be waiting to be sent to one log viewer. Lines
+# past this are dropped for that viewer.
+LOG_HUB_SUBSCRIBER_QUEUE_SIZE = 1000
+# How long (in seconds) to wait before reconnecting if following a site's logs fails
+LOG_HUB_RECONNECT_DELAY = 2.0
+
 # Size of individual chunks
-FILE_STREAM_BUFSIZE = 4096
+FILE_STREAM_BUFSIZE = 64 * 1024
 
 TIMEZONE = "America/New_York"
 
@@ -88,6 +172,90 @@ TIMEZONE = "America/New_York"
 # If set to None, it will use a sh script instead of a C program
 TERMINAL_KEEPALIVE_PROGRAM_PATH = None
 
+# How many of the sites that most recently opened terminals to keep terminal containers ready for
+TERMINAL_WARM_POOL_SIZE = 50
+# How often (in seconds) to make sure those sites' terminal containers and images are up to date
+TERMINAL_WARM_POOL_REFRESH_INTERVAL = 120
+# How long (in seconds) to trust the cached ID of a terminal container's image before pulling it
+# again when opening a terminal
+TERMINAL_IMAGE_CHECK_INTERVAL = 300
+# Terminal containers with no input or output for this long (in seconds) are removed
+TERMINAL_IDLE_TIMEOUT = 60 * 60
+# How often (in seconds) to look for idle terminal containers
+TERMINAL_REAPER_INTERVAL = 60
+# Terminal output is gathered for up to this long (in seconds) or up to this many bytes before
+# being sent, so bursts of output go out in fewer, larger websocket messages
+TERMINAL_OUTPUT_COALESCE_DELAY = 0.005
+TERMINAL_OUTPUT_COALESCE_SIZE = 64 * 1024
+
+# Whether to accept permessage-deflate compression on websocket connections
+WEBSOCKET_COMPRESSION = True
+
+# Administrator connections are pooled. Up to DATABASE_POOL_MAX_SIZE connections are open to each
+# database at once; past that, requests wait up to DATABASE_POOL_ACQUIRE_TIMEOUT seconds for one.
+# At most DATABASE_POOL_MAX_IDLE idle connections are kept (per process, across all hosts).
+# Connections idle for more than DATABASE_POOL_CHECK_INTERVAL seconds are checked before being
+# reused, and ones idle for more than DATABASE_POOL_IDLE_TIMEOUT seconds are closed (checked every
+# DATABASE_POOL_EVICTION_INTERVAL seconds).
+DATABASE_POOL_MAX_SIZE = 4
+DATABASE_POOL_MAX_IDLE = 8
+DATABASE_POOL_ACQUIRE_TIMEOUT = 10
+DATABASE_POOL_CHECK_INTERVAL = 30
+DATABASE_POOL_IDLE_TIMEOUT = 5 * 60
+DATABASE_POOL_EVICTION_INTERVAL = 30
+# Limits on the output of queries run from the SQL console. Output stops after
+# DATABASE_QUERY_MAX_ROWS rows or DATABASE_QUERY_MAX_BYTES bytes, and statements are cancelled
+# after DATABASE_QUERY_TIMEOUT seconds. Rows are fetched DATABASE_QUERY_FETCH_SIZE at a time, and
+# output is sent in chunks of about DATABASE_QUERY_CHUNK_SIZE bytes.
+DATABASE_QUERY_MAX_ROWS = 10000
+DATABASE_QUERY_MAX_BYTES = 10 * 1000 * 1000  # 10 MB
+DATABASE_QUERY_TIMEOUT = 30
+DATABASE_QUERY_FETCH_SIZE = 500
+DATABASE_QUERY_CHUNK_SIZE = 64 * 1024
+# SQL console sessions each keep a connection to the site's database open. They are closed after
+# DATABASE_CONSOLE_IDLE_TIMEOUT seconds without a query (checked every
+# DATABASE_CONSOLE_IDLE_CHECK_INTERVAL seconds while a query is running), and at most
+# DATABASE_CONSOLE_MAX_SESSIONS can be open at once.
+DATABASE_CONSOLE_IDLE_TIMEOUT = 10 * 60
+DATABASE_CONSOLE_IDLE_CHECK_INTERVAL = 5
+DATABASE_CONSOLE_MAX_SESSIONS = 100
+# Queries that have been running for longer than this many seconds are counted as slow in site
+# database statistics
+DATABASE_SLOW_QUERY_THRESHOLD = 5
+# Site databases are exported by running these programs on the appserver. Exports are
+# gzip-compressed and stop after DATABASE_EXPORT_MAX_BYTES bytes of compressed output or
+# DATABASE_EXPORT_TIMEOUT seconds.
+DATABASE_DUMP_PROGRAMS: Dict[str, str] = {"postgres": "pg_dump", "mysql": "mysqldump"}
+DATABASE_EXPORT_MAX_BYTES = 1000 * 1000 * 1000  # 1 GB
+DATABASE_EXPORT_TIMEOUT = 30 * 60
+# Imported dumps are split into statements and run through the database driver (never by psql or
+# mysql). They're limited to DATABASE_IMPORT_MAX_BYTES bytes as uploaded,
+# DATABASE_IMPORT_MAX_SQL_BYTES bytes after decompressing, DATABASE_IMPORT_MAX_STATEMENT_BYTES
+# bytes per statement, and DATABASE_IMPORT_TIMEOUT seconds.
+DATABASE_IMPORT_MAX_BYTES = 500 * 1000 * 1000  # 500 MB
+DATABASE_IMPORT_MAX_SQL_BYTES = 5 * 1000 * 1000 * 1000  # 5 GB
+DATABASE_IMPORT_MAX_STATEMENT_BYTES = 64 * 1000 * 1000  # 64 MB
+DATABASE_IMPORT_TIMEOUT = 30 * 60
+# Maximum number of databases that can be created/updated in one bulk request
+DATABASE_BULK_MAX_DATABASES = 1000
+
+# Maximum number of jobs (see jobs.py) that can run at once
+JOB_MAX_WORKERS = 8
+# Maximum number of jobs of each type that can run at once. Types not listed here use
+# JOB_DEFAULT_CONCURRENCY_LIMIT.
+JOB_TYPE_CONCURRENCY_LIMITS: Dict[str, int] = {
+    # Reloads are cheap to repeat but slow; more than one at a time doesn't help
+    "reload-nginx": 1,
+    "create-database": 2,
+    "delete-database": 2,
+    "create-many-databases": 1,
+}
+JOB_DEFAULT_CONCURRENCY_LIMIT = 4
+# Maximum number of jobs that can be waiting to run. Past this, new jobs are rejected.
+JOB_MAX_PENDING = 200
+# How long (in seconds) to keep finished jobs around so their results can be looked up
+JOB_RETENTION_TIME = 60 * 60
+
 # Logging configuration
 LOG_LEVEL = logging.INFO
 LOG_FILE = None
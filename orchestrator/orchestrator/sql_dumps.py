@@ -0,0 +1,397 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from . import settings
+from .exceptions import OrchestratorActionError
+
+# psql meta-commands that pg_dump writes to stop the rest of the dump from running any other
+# meta-commands. They don't mean anything when the statements are run directly, so they're skipped.
+PSQL_IGNORED_COMMANDS = {b"restrict", b"unrestrict"}
+
+PSQL_COMMAND_RE = re.compile(rb"^\s*\\([A-Za-z]*)")
+MYSQL_DELIMITER_COMMAND_RE = re.compile(rb"^\s*delimiter\s+(\S+)", re.IGNORECASE)
+
+COPY_FROM_STDIN_RE = re.compile(rb"^COPY\b.*\bFROM\s+STDIN\b", re.IGNORECASE | re.DOTALL)
+
+# The tokens that matter for splitting statements (outside of strings and comments). Numbers are
+# matched so the letters in them aren't taken for words.
+POSTGRES_TOKEN_RE = re.compile(
+    rb"(?P<number>[0-9][0-9A-Za-z_.]*)"
+    rb"|(?P<word>[A-Za-z_\x80-\xff][A-Za-z0-9_$\x80-\xff]*)"
+    rb"|(?P<dollar>\$(?:[A-Za-z_\x80-\xff][A-Za-z0-9_\x80-\xff]*)?\$)"
+    rb"|--|/\*|['\"();]"
+)
+POSTGRES_COMMENT_RE = re.compile(rb"/\*|\*/")
+MYSQL_COMMENT_END = b"*/"
+
+STRING_ESCAPE_RES = {quote: re.compile(rb"\\|" + re.escape(quote)) for quote in [b"'", b'"']}
+
+
+class CopyData:
+    """A file-like object that reads the data for a COPY ... FROM stdin statement from a dump, up
+    to the \\. line that ends it."""
+
+    def __init__(self, reader: "SQLDumpReader") -> None:
+        self.reader = reader
+        self.done = False
+
+    def read(self, size: int = -1) -> bytes:  # pylint: disable=unused-argument
+        if self.done:
+            return b""
+
+        line = self.reader.readline()
+        if not line or line.rstrip(b"\r\n") == b"\\.":
+            self.done = True
+            return b""
+
+        return line
+
+    readline = read
+
+
+class SQLDumpReader:
+    """Splits an SQL dump into statements the way psql (for Postgres) or mysql (for MySQL) would,
+    so they can be run through a database driver. Feeding a dump to the client programs themselves
+    would also run any client-side commands in it (like psql's \\! or mysql's system), on whatever
+    machine the client runs on.
+
+    Comments are removed, except for MySQL's /*! ... */ comments (which MySQL runs). The only psql
+    meta-commands allowed are the \\restrict and \\unrestrict commands pg_dump writes, which are
+    skipped; mysql's DELIMITER command is followed. Anything else that looks like a client-side
+    command is passed on to the database, which rejects it.
+
+    """
+
+    def __init__(self, data: Iterable[bytes], dbms: str) -> None:
+        if dbms not in {"postgres", "mysql"}:
+            raise ValueError("Unknown DBMS {!r}".format(dbms))
+
+        self.chunks = iter(data)
+        self.dbms = dbms
+
+        self.buf = b""
+        self.pos = 0
+        # Number of the last line read, for error messages
+        self.line_number = 0
+
+        self.delimiter = b";"
+        self.mysql_token_re = self._make_mysql_token_re()
+
+        # "normal", "quote", "dollar" (Postgres), or "comment"
+        self.state = "normal"
+        self.quote = b""
+        self.quote_escapes = False
+        self.dollar_tag = b""
+        self.comment_depth = 0
+
+        self._reset_statement()
+
+    def _reset_statement(self) -> None:
+        self.parts: List[bytes] = []
+        self.size = 0
+        self.has_content = False
+
+        # For Postgres. psql doesn't end statements at semicolons inside parentheses, or inside
+        # BEGIN ... END blocks in CREATE FUNCTION/PROCEDURE statements, and neither do we.
+        self.paren_depth = 0
+        self.begin_depth = 0
+        self.first_words: List[bytes] = []
+
+    def _make_mysql_token_re(self) -> "re.Pattern[bytes]":
+        return re.compile(re.escape(self.delimiter) + rb"|['\"`#]|--(?=\s|\Z)|/\*")
+
+    def readline(self) -> bytes:
+        """Returns the next line of the dump (including the newline), or b"" at the end of it."""
+        parts: List[bytes] = []
+        size = 0
+
+        while True:
+            if self.pos >= len(self.buf):
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    line = b"".join(parts)
+                    if line:
+                        self.line_number += 1
+                    return line
+
+                self.buf = chunk
+                self.pos = 0
+                continue
+
+            index = self.buf.find(b"\n", self.pos)
+            if index >= 0:
+                parts.append(self.buf[self.pos : index + 1])
+                self.pos = index + 1
+                self.line_number += 1
+                return b"".join(parts)
+
+            parts.append(self.buf[self.pos :])
+            size += len(self.buf) - self.pos
+            self.pos = len(self.buf)
+
+            if size > settings.DATABASE_IMPORT_MAX_STATEMENT_BYTES:
+                raise OrchestratorActionError(
+                    "Database import has a line that is too long (line {})".format(
+                        self.line_number + 1
+                    )
+                )
+
+    def iter_statements(self) -> Iterator[Tuple[bytes, Optional[CopyData]]]:
+        """Yields each statement in the dump (without the delimiter at the end).
+
+        For Postgres COPY ... FROM stdin statements, a CopyData object that reads the statement's
+        data is yielded with it; otherwise that's None. The data is skipped if it hasn't been read
+        by the time the next statement is requested.
+
+        """
+        while True:
+            line = self.readline()
+            if not line:
+                break
+
+            if self.state == "normal" and not self.has_content and self._run_client_command(line):
+                continue
+
+            for statement in self._scan_line(line):
+                if self.dbms == "postgres" and COPY_FROM_STDIN_RE.search(statement) is not None:
+                    copy_data = CopyData(self)
+                    yield statement, copy_data
+
+                    while copy_data.read():
+                        pass
+                else:
+                    yield statement, None
+
+        # Like psql and mysql, run whatever is left at the end even if it isn't terminated
+        last_statement = self._finish_statement()
+        if last_statement is not None:
+            yield last_statement, None
+
+    def _run_client_command(self, line: bytes) -> bool:
+        """Handles a client-side command at the start of a statement. Returns whether the line was
+        one."""
+        if self.dbms == "postgres":
+            match = PSQL_COMMAND_RE.search(line)
+            if match is None:
+                return False
+
+            if match.group(1) not in PSQL_IGNORED_COMMANDS:
+                raise OrchestratorActionError(
+                    "Database import has an unsupported psql command \\{} (line {})".format(
+                        match.group(1).decode(errors="replace"), self.line_number
+                    )
+                )
+
+            return True
+        else:
+            match = MYSQL_DELIMITER_COMMAND_RE.search(line)
+            if match is None:
+                return False
+
+            self.delimiter = match.group(1)
+            self.mysql_token_re = self._make_mysql_token_re()
+            return True
+
+    def _add(self, data: bytes) -> None:
+        if not data:
+            return
+
+        self.parts.append(data)
+        self.size += len(data)
+
+        if self.size > settings.DATABASE_IMPORT_MAX_STATEMENT_BYTES:
+            raise OrchestratorActionError(
+                "Database import has a statement that is too large (line {})".format(
+                    self.line_number
+                )
+            )
+
+        if not self.has_content and data.strip():
+            self.has_content = True
+
+    def _finish_statement(self) -> Optional[bytes]:
+        statement = b"".join(self.parts).strip()
+        self._reset_statement()
+        return statement or None
+
+    def _scan_line(self, line: bytes) -> Iterator[bytes]:
+        """Scans a line of the dump, yielding any statements that end in it."""
+        pos = 0
+        # Start of the text that hasn't been added to the statement yet
+        start = 0
+
+        while pos < len(line):
+            if self.state == "quote":
+                pos = self._scan_quote(line, pos)
+            elif self.state == "dollar":
+                index = line.find(self.dollar_tag, pos)
+                if index < 0:
+                    pos = len(line)
+                else:
+                    pos = index + len(self.dollar_tag)
+                    self.state = "normal"
+            elif self.state == "comment":
+                # Comments are left out of statements
+                pos = self._scan_comment(line, pos)
+                start = pos
+            elif self.dbms == "postgres":
+                match = POSTGRES_TOKEN_RE.search(line, pos)
+                if match is None:
+                    pos = len(line)
+                    break
+
+                token = match.group()
+                pos = match.end()
+
+                if match.group("word") is not None:
+                    self._add_postgres_word(token)
+                    if token in {b"E", b"e"} and line[pos : pos + 1] == b"'":
+                        # E'...' strings allow backslash escapes
+                        self._start_quote(b"'", escapes=True)
+                        pos += 1
+                elif match.group("dollar") is not None:
+                    self.state = "dollar"
+                    self.dollar_tag = token
+                elif token in {b"'", b'"'}:
+                    self._start_quote(token, escapes=False)
+                elif token == b"(":
+                    self.paren_depth += 1
+                elif token == b")":
+                    self.paren_depth = max(self.paren_depth - 1, 0)
+                elif token == b"/*":
+                    self._add(line[start : match.start()] + b" ")
+                    self.state = "comment"
+                    self.comment_depth = 1
+                    start = pos
+                elif token == b"--":
+                    self._add(line[start : match.start()] + b"\n")
+                    pos = start = len(line)
+                elif token == b";" and self.paren_depth == 0 and self.begin_depth == 0:
+                    self._add(line[start : match.start()])
+                    start = pos
+                    statement = self._finish_statement()
+                    if statement is not None:
+                        yield statement
+            else:
+                match = self.mysql_token_re.search(line, pos)
+                if match is None:
+                    pos = len(line)
+                    break
+
+                token = match.group()
+                pos = match.end()
+
+                if token == self.delimiter:
+                    self._add(line[start : match.start()])
+                    start = pos
+                    statement = self._finish_statement()
+                    if statement is not None:
+                        yield statement
+                elif token in {b"'", b'"'}:
+                    self._start_quote(token, escapes=True)
+                elif token == b"`":
+                    self._start_quote(token, escapes=False)
+                elif token == b"/*":
+                    # MySQL runs the contents of /*! ... */ and /*M! ... */ comments, so those
+                    # stay (and are scanned like anything else)
+                    if line[pos : pos + 1] != b"!" and line[pos : pos + 2] != b"M!":
+                        self._add(line[start : match.start()] + b" ")
+                        self.state = "comment"
+                        start = pos
+                else:
+                    # A # or -- comment, to the end of the line
+                    self._add(line[start : match.start()] + b"\n")
+                    pos = start = len(line)
+
+        if self.state != "comment":
+            self._add(line[start:])
+
+    def _start_quote(self, quote: bytes, *, escapes: bool) -> None:
+        self.state = "quote"
+        self.quote = quote
+        self.quote_escapes = escapes
+
+    def _scan_quote(self, line: bytes, pos: int) -> int:
+        """Scans the inside of a quoted string or identifier, returning where to continue from."""
+        while True:
+            if self.quote_escapes:
+                match = STRING_ESCAPE_RES[self.quote].search(line, pos)
+                index = -1 if match is None else match.start()
+            else:
+                index = line.find(self.quote, pos)
+
+            if index < 0:
+                return len(line)
+
+            if line[index : index + 1] == b"\\":
+                # Skip the escaped character
+                pos = index + 2
+            elif line[index + 1 : index + 2] == self.quote:
+                # A doubled quote
+                pos = index + 2
+            else:
+                self.state = "normal"
+                return index + 1
+
+    def _scan_comment(self, line: bytes, pos: int) -> int:
+        """Scans the inside of a /* ... */ comment, returning where to continue from."""
+        if self.dbms == "mysql":
+            index = line.find(MYSQL_COMMENT_END, pos)
+            if index < 0:
+                return len(line)
+
+            self.state = "normal"
+            return index + len(MYSQL_COMMENT_END)
+
+        # Postgres comments nest
+        while True:
+            match = POSTGRES_COMMENT_RE.search(line, pos)
+            if match is None:
+                return len(line)
+
+            pos = match.end()
+            if match.group() == b"/*":
+                self.comment_depth += 1
+            else:
+                self.comment_depth -= 1
+                if self.comment_depth == 0:
+                    self.state = "normal"
+                    return pos
+
+    def _add_postgres_word(self, word: bytes) -> None:
+        # Follows psql's heuristic for finding the end of CREATE FUNCTION/PROCEDURE statements with
+        # BEGIN ATOMIC ... END bodies: inside those, BEGIN (and CASE in a BEGIN) open blocks that
+        # END closes.
+        if len(self.first_words) < 4:
+            lowered = word.lower()
+            self.first_words.append(
+                lowered[:1]
+                if lowered in {b"create", b"function", b"procedure", b"or", b"replace"}
+                else b""
+            )
+
+        first_words = self.first_words + [b""] * (4 - len(self.first_words))
+        if (
+            first_words[0] == b"c"
+            and (
+                first_words[1] in {b"f", b"p"}
+                or (
+                    first_words[1] == b"o"
+                    and first_words[2] == b"r"
+                    and first_words[3] in {b"f", b"p"}
+                )
+            )
+            and self.paren_depth == 0
+        ):
+            lowered = word.lower()
+            if lowered == b"begin":
+                self.begin_depth += 1
+            elif lowered == b"case":
+                if self.begin_depth >= 1:
+                    self.begin_depth += 1
+            elif lowered == b"end":
+                if self.begin_depth > 0:
+                    self.begin_depth -= 1
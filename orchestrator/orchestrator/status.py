@@ -0,0 +1,346 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from typing import Any, AsyncGenerator, Dict, Iterable, List, Optional, Set, Tuple
+
+from docker.client import DockerClient
+
+from . import settings
+from .docker.services import get_director_service_name
+from .docker.utils import get_shared_client
+from .files import check_run_sh_exists
+
+logger = logging.getLogger(__name__)
+
+DIRECTOR_SERVICE_NAME_RE = re.compile(r"^site_(\d+)$")
+
+# The service and container events that can mean a site's status changed
+STATUS_DOCKER_EVENTS = [
+    # Services
+    "create",
+    "update",
+    "remove",
+    # Containers
+    "start",
+    "restart",
+    "die",
+    "kill",
+    "oom",
+    "stop",
+    "destroy",
+]
+
+# After an event, the tasks' states may take a little while to settle, so the status is also
+# refreshed again after these delays.
+STATUS_REFRESH_DELAYS = (0.2, 1.0, 10.0)
+
+
+def serialize_site_status(site_id: int, tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    data = {
+        "running": False,
+        "starting": False,
+        "start_time": None,
+        "run_sh_exists": check_run_sh_exists(site_id),
+    }
+
+    if any(task["Status"]["State"] == "running" for task in tasks):
+        data["running"] = True
+
+        # Date() in JavaScript can parse the default date format
+        data["start_time"] = max(
+            (task["Status"]["Timestamp"] for task in tasks if task["Status"]["State"] == "running"),
+            default=None,
+        )
+
+    if any(
+        # Not running, but supposed to be
+        task["DesiredState"] in {"running", "ready"} and task["Status"]["State"] != "running"
+        for task in tasks
+    ):
+        data["starting"] = True
+
+    return data
+
+
+def fetch_site_statuses(
+    client: DockerClient, site_ids: Iterable[int]
+) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Fetches the statuses of several sites with one call to list their services and one call to
+    list their tasks. Sites without a service have a status of None."""
+    site_ids_by_name = {get_director_service_name(site_id): site_id for site_id in site_ids}
+
+    statuses: Dict[int, Optional[Dict[str, Any]]] = dict.fromkeys(site_ids_by_name.values())
+    if not site_ids_by_name:
+        return statuses
+
+    # The "name" filter does a prefix match, so check the names
+    site_ids_by_service_id = {
+        service["ID"]: site_ids_by_name[service["Spec"]["Name"]]
+        for service in client.api.services(filters={"name": list(site_ids_by_name)})
+        if service["Spec"]["Name"] in site_ids_by_name
+    }
+    if not site_ids_by_service_id:
+        return statuses
+
+    tasks_by_site_id: Dict[int, List[Dict[str, Any]]] = {
+        site_id: [] for site_id in site_ids_by_service_id.values()
+    }
+    for task in client.api.tasks(filters={"service": list(site_ids_by_service_id)}):
+        if task["ServiceID"] in site_ids_by_service_id:
+            tasks_by_site_id[site_ids_by_service_id[task["ServiceID"]]].append(task)
+
+    for site_id, tasks in tasks_by_site_id.items():
+        statuses[site_id] = serialize_site_status(site_id, tasks)
+
+    return statuses
+
+
+def get_event_site_id(event: Dict[str, Any]) -> Optional[int]:
+    attributes = event.get("Actor", {}).get("Attributes", {})
+
+    if event.get("Type") == "service":
+        name = attributes.get("name", "")
+    else:
+        name = attributes.get("com.docker.swarm.service.name", "")
+
+    match = DIRECTOR_SERVICE_NAME_RE.match(name)
+    return int(match.group(1)) if match is not None else None
+
+
+class SiteStatusSubscription:
+    """Receives status changes for a set of sites from the SiteStatusEngine.
+
+    If the client falls behind, only the latest status of each site is kept.
+
+    """
+
+    def __init__(self, engine: "SiteStatusEngine", site_ids: Iterable[int]) -> None:
+        self.engine = engine
+        self.site_ids = set(site_ids)
+
+        self.pending: Dict[int, Optional[Dict[str, Any]]] = {}
+        self.pending_event = asyncio.Event()
+        self.closed = False
+
+    def put(self, site_id: int, status: Optional[Dict[str, Any]]) -> None:
+        self.pending[site_id] = status
+        self.pending_event.set()
+
+    async def aiter_updates(
+        self,
+    ) -> AsyncGenerator[Tuple[int, Optional[Dict[str, Any]]], None]:
+        """Yields (site_id, status) pairs. The status is None if the site has no service."""
+        while not self.closed:
+            await self.pending_event.wait()
+            self.pending_event.clear()
+
+            updates, self.pending = self.pending, {}
+            for site_id, status in updates.items():
+                yield site_id, status
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.pending_event.set()
+            self.engine.unsubscribe(self)
+
+
+class SiteStatusEngine:
+    """Keeps track of the statuses of every site that someone is watching.
+
+    One subscription to the Docker events API (run in a background thread) tells us when a site's
+    service or containers change, and the affected sites' statuses are then refreshed in bulk and
+    pushed to the subscribers watching them. Since container events are only reported for this
+    node, the statuses of all watched sites are also refreshed every
+    ``settings.SITE_STATUS_RESYNC_INTERVAL`` seconds. The cost of all this depends on how many
+    sites are being watched, not on how many clients are watching them.
+
+    """
+
+    def __init__(self) -> None:
+        self.statuses: Dict[int, Optional[Dict[str, Any]]] = {}
+        self.subscriptions: Set[SiteStatusSubscription] = set()
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.client: Optional[DockerClient] = None
+
+        self.refresh_pending: Set[int] = set()
+        self.refresh_task: Optional["asyncio.Task[None]"] = None
+        self.resync_task: Optional["asyncio.Task[None]"] = None
+
+        self.events_stop_event: Optional[threading.Event] = None
+        self.events_stream: Any = None
+        self.running = False
+
+    @property
+    def watched_site_ids(self) -> Set[int]:
+        return set().union(*(subscription.site_ids for subscription in self.subscriptions))
+
+    def subscribe(self, site_ids: Iterable[int]) -> SiteStatusSubscription:
+        """Subscribes to status changes for the given sites. The current status of each site is
+        sent as soon as it is known."""
+        subscription = SiteStatusSubscription(self, site_ids)
+        self.subscriptions.add(subscription)
+
+        if not self.running:
+            self.start()
+
+        unknown_site_ids = set()
+        for site_id in subscription.site_ids:
+            if site_id in self.statuses:
+                subscription.put(site_id, self.statuses[site_id])
+            else:
+                unknown_site_ids.add(site_id)
+
+        if unknown_site_ids:
+            self.queue_refresh(unknown_site_ids)
+
+        return subscription
+
+    def unsubscribe(self, subscription: SiteStatusSubscription) -> None:
+        self.subscriptions.discard(subscription)
+
+        watched_site_ids = self.watched_site_ids
+        for site_id in list(self.statuses):
+            if site_id not in watched_site_ids:
+                del self.statuses[site_id]
+
+        if not self.subscriptions:
+            self.stop()
+
+    def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.client = get_shared_client()
+        self.running = True
+
+        # Each thread gets its own stop event so that a thread from a previous start() that has
+        # not exited yet can't be confused with the new one.
+        self.events_stop_event = threading.Event()
+        threading.Thread(
+            target=self.events_thread_main,
+            args=(self.events_stop_event,),
+            name="site-status-events",
+            daemon=True,
+        ).start()
+
+        self.resync_task = asyncio.create_task(self.resync_loop())
+
+    def stop(self) -> None:
+        self.running = False
+
+        if self.resync_task is not None:
+            self.resync_task.cancel()
+            self.resync_task = None
+
+        if self.events_stop_event is not None:
+            self.events_stop_event.set()
+            self.events_stop_event = None
+
+        # Unblock the events thread so it notices we've stopped
+        if self.events_stream is not None:
+            try:
+                self.events_stream.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            self.events_stream = None
+
+        self.statuses.clear()
+
+    def events_thread_main(self, stop_event: threading.Event) -> None:
+        assert self.loop is not None
+        loop = self.loop
+
+        client = get_shared_client()
+
+        while not stop_event.is_set():
+            try:
+                stream = client.events(
+                    since=int(time.time()),
+                    decode=True,
+                    filters={"type": ["service", "container"], "event": STATUS_DOCKER_EVENTS},
+                )
+                self.events_stream = stream
+
+                # Any events that happened while we were (re)connecting were missed
+                loop.call_soon_threadsafe(self.queue_refresh_all)
+
+                for event in stream:
+                    if stop_event.is_set():
+                        break
+
+                    loop.call_soon_threadsafe(self.handle_docker_event, event)
+            except RuntimeError:
+                # The event loop has been closed
+                break
+            except Exception:  # pylint: disable=broad-except
+                if not stop_event.is_set():
+                    logger.exception("Error reading Docker events; reconnecting")
+                    stop_event.wait(5)
+
+    def handle_docker_event(self, event: Dict[str, Any]) -> None:
+        site_id = get_event_site_id(event)
+        if site_id is None or site_id not in self.watched_site_ids:
+            return
+
+        assert self.loop is not None
+        for delay in STATUS_REFRESH_DELAYS:
+            self.loop.call_later(delay, self.queue_refresh, {site_id})
+
+    async def resync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.SITE_STATUS_RESYNC_INTERVAL)
+            self.queue_refresh_all()
+
+    def queue_refresh_all(self) -> None:
+        self.queue_refresh(self.watched_site_ids)
+
+    def queue_refresh(self, site_ids: Iterable[int]) -> None:
+        if not self.running:
+            return
+
+        self.refresh_pending.update(site_ids)
+
+        # Refreshes requested while one is in progress are batched into the next one
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self.refresh())
+
+    async def refresh(self) -> None:
+        assert self.loop is not None
+        assert self.client is not None
+
+        while self.refresh_pending and self.running:
+            site_ids = self.refresh_pending & self.watched_site_ids
+            self.refresh_pending.clear()
+
+            try:
+                statuses = await self.loop.run_in_executor(
+                    None, fetch_site_statuses, self.client, site_ids
+                )
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error refreshing site statuses")
+                continue
+
+            for site_id, status in statuses.items():
+                changed = site_id not in self.statuses or self.statuses[site_id] != status
+                self.statuses[site_id] = status
+
+                for subscription in self.subscriptions:
+                    if changed and site_id in subscription.site_ids:
+                        subscription.put(site_id, status)
+
+
+_engine: Optional[SiteStatusEngine] = None
+
+
+def get_site_status_engine() -> SiteStatusEngine:
+    global _engine  # pylint: disable=global-statement
+
+    if _engine is None:
+        _engine = SiteStatusEngine()
+
+    return _engine
@@ -3,17 +3,14 @@
 
 import asyncio
 import socket
-import time
 from typing import Any, Dict, List, Optional, cast
 
 from docker.client import DockerClient
-from docker.errors import APIError, ImageNotFound, NotFound
 from docker.models.containers import Container
-from docker.types import Mount
 
 from . import settings
-from .docker import containers
 from .docker.shared import gen_director_container_env
+from .terminal_pool import get_terminal_container_name, terminal_reaper, terminal_warm_pool
 from .utils import run_in_executor
 
 
@@ -31,7 +28,7 @@ class TerminalContainer:  # pylint: disable=too-many-instance-attributes
         self.site_id = site_id
         self.site_data = site_data
 
-        self.container_name = "site_{:04d}_terminal".format(site_id)
+        self.container_name = get_terminal_container_name(site_id)
 
         self.container: Optional[Container] = None
 
@@ -42,142 +39,43 @@ class TerminalContainer:  # pylint: disable=too-many-instance-attributes
         self.reader: Optional[asyncio.StreamReader] = None
         self.writer: Optional[asyncio.StreamWriter] = None
 
+        # Attached to the keepalive process's stdin; see heartbeat()
+        self.heartbeat_socket: Optional[socket.SocketIO] = None
+        self.heartbeat_writer: Optional[asyncio.StreamWriter] = None
+
         self.closed = False
 
-    def _raw_socket(self) -> socket.socket:
-        assert self.socket is not None
-        raw_socket = cast(Any, self.socket)._sock  # pylint: disable=protected-access
+    def _raw_socket(self, sock: Optional[socket.SocketIO] = None) -> socket.socket:
+        if sock is None:
+            sock = self.socket
+        assert sock is not None
+        raw_socket = cast(Any, sock)._sock  # pylint: disable=protected-access
         return cast(socket.socket, raw_socket)
 
     async def start(self, *, command: Optional[List[str]] = None) -> None:
         await self._start_attach(command)
 
         assert self.socket is not None
-        # The default timeout is 60 seconds, which is way too low
-        # 1 day is probably overkill, but why not?
-        self._raw_socket().settimeout(24 * 60 * 60)
+        assert self.heartbeat_socket is not None
 
+        # From here on, all terminal I/O goes through the event loop (which puts the sockets in
+        # non-blocking mode), so it doesn't tie up executor threads no matter how many terminals
+        # are open.
         # We have to do this here because the executor doesn't have a running event loop
         self.reader, self.writer = await asyncio.open_connection(sock=self._raw_socket())
+        _, self.heartbeat_writer = await asyncio.open_connection(
+            sock=self._raw_socket(self.heartbeat_socket)
+        )
 
         await self.resize(24, 80)
 
         await self.heartbeat()
 
-    def _launch_container(self, run_params: Dict[str, Any]) -> None:
-        while True:
-            try:
-                self.container = containers.get_or_create_container(
-                    self.client,
-                    self.container_name,
-                    run_params=run_params,
-                )
-            except APIError as ex:
-                msg = str(ex).lower()
-                if "conflict" in msg and "already in use" in msg:
-                    # The container is in the process of being launched; sleep and try again
-                    time.sleep(2)
-                else:
-                    raise
-            else:
-                break
-
     @run_in_executor(None)
     def _start_attach(self, command: Optional[List[str]]) -> None:
         """Internal function that runs in an executor and performs all the long-running synchronous
         operations needed to create the container (if necessary) and attach to it."""
-        run_params = containers.gen_director_container_params(
-            self.client, self.site_id, self.site_data
-        )
-
-        # Allows for the use of a C program to perform keepalive instead of using `sh`
-        # Using a C program allows greater control of low-level interactions
-        # (e.g. niceness, disk I/O priority).
-        if settings.TERMINAL_KEEPALIVE_PROGRAM_PATH is not None:
-            keepalive_command = [
-                "/terminal-keepalive",
-                str(settings.SITE_TERMINAL_KEEPALIVE_TIMEOUT),
-            ]
-            run_params["mounts"].append(
-                Mount(
-                    "/terminal-keepalive",
-                    settings.TERMINAL_KEEPALIVE_PROGRAM_PATH,
-                    type="bind",
-                    read_only=True,
-                )
-            )
-        else:
-            keepalive_command = [
-                "sh",
-                "-c",
-                'while timeout "$1" head -n 1 &>/dev/null; do true; done',
-                "sh",
-                str(settings.SITE_TERMINAL_KEEPALIVE_TIMEOUT),
-            ]
-
-        run_params.update(
-            {
-                "command": keepalive_command,
-                "read_only": True,
-                "auto_remove": True,
-                "stdin_open": True,
-            }
-        )
-
-        self._launch_container(run_params)
-
-        assert self.container is not None
-
-        orig_image_name = run_params["image"]
-
-        if "/" in orig_image_name:
-            # One of these formats:
-            # - hostname/image
-            # - hostname:port/image
-            # - hostname/image:tag
-            # - hostname:port/image:tag
-
-            # Split out the hostname/port combo if present
-            server, image_name_with_tag = orig_image_name.split("/")
-
-            if ":" in image_name_with_tag:
-                # It has a tag name
-                image_name, tag_name = image_name_with_tag.split(":")
-                image_name = server + "/" + image_name
-            else:
-                # No tag name
-                image_name = orig_image_name
-                tag_name = "latest"
-
-            # This format means it's from our custom registry. Unconditionally pull so we always get
-            # the latest built image.
-            image = self.client.images.pull(image_name, tag_name)
-        else:
-            # One of these formats:
-            # - image
-            # - image:tag
-
-            if ":" in orig_image_name:
-                image_name, tag_name = orig_image_name.split(":")
-            else:
-                image_name = orig_image_name
-                tag_name = "latest"
-
-            # This format means it's from DockerHub. To avoid hitting the rate limit, only pull if
-            # it's not present.
-            try:
-                image = self.client.images.get(orig_image_name)
-            except ImageNotFound:
-                image = self.client.images.pull(image_name, tag_name)
-
-        if self.container.image.id != image.id:
-            self.container.stop()
-            try:
-                self.container.wait()
-            except NotFound:
-                pass
-
-            self._launch_container(run_params)
+        self.container = terminal_warm_pool.acquire(self.client, self.site_id, self.site_data)
 
         env = gen_director_container_env(self.client, self.site_id, self.site_data)
 
@@ -221,27 +119,85 @@ class TerminalContainer:  # pylint: disable=too-many-instance-attributes
             socket=True,
         )
 
-    @run_in_executor(None)
-    def heartbeat(self) -> None:
-        assert self.container is not None
-
-        with self.container.attach_socket(params={"stdin": 1, "stream": 1}, ws=False) as sock:
-            # We have to pry into the internals of docker-py a little. There is no known way around
-            # this.
-            # Sources:
-            # https://stackoverflow.com/q/26843625
-            # https://github.com/docker/docker-py/pull/239#issuecomment-246149032
+        # Kept open for the life of the terminal, so heartbeats don't need a new connection (and
+        # an executor thread) each time
+        self.heartbeat_socket = self.container.attach_socket(
+            params={"stdin": 1, "stream": 1}, ws=False
+        )
 
-            sock._sock.send(b"\n")  # pylint: disable=protected-access
+    async def heartbeat(self) -> None:
+        """Keeps the container alive by sending a line to the keepalive process's stdin."""
+        # We have to pry into the internals of docker-py a little to get at the attached socket.
+        # There is no known way around this.
+        # Sources:
+        # https://stackoverflow.com/q/26843625
+        # https://github.com/docker/docker-py/pull/239#issuecomment-246149032
+        assert self.heartbeat_writer is not None
+
+        if self.closed:
+            return
+
+        try:
+            self.heartbeat_writer.write(b"\n")
+            await self.heartbeat_writer.drain()
+        except OSError:
+            # The container went away; reading from the terminal will notice
+            pass
 
     async def read(self, bufsize: int) -> bytes:
         if self.reader is None or self.closed:
             return b""
 
-        return await self.reader.read(bufsize)
+        data = await self.reader.read(bufsize)
+        terminal_reaper.touch(self.container_name)
+        return data
+
+    async def read_coalesced(self) -> bytes:
+        """Reads output from the terminal, like read(), but after the first chunk keeps reading for
+        up to ``settings.TERMINAL_OUTPUT_COALESCE_DELAY`` seconds (or until there are
+        ``settings.TERMINAL_OUTPUT_COALESCE_SIZE`` bytes) so that bursts of output can be sent in
+        fewer, larger messages. Returns b"" at EOF.
+
+        Callers should send each chunk (waiting for the websocket's write buffer to drain) before
+        reading the next one. That way a slow client stops us from reading more output; once the
+        stream buffer fills up, the event loop stops reading from the exec socket, and the
+        backpressure propagates to the process itself.
+
+        """
+        data = await self.read(settings.TERMINAL_OUTPUT_COALESCE_SIZE)
+        if not data:
+            return data
+
+        buf = bytearray(data)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.TERMINAL_OUTPUT_COALESCE_DELAY
+
+        while len(buf) < settings.TERMINAL_OUTPUT_COALESCE_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                # Cancelling a StreamReader read doesn't lose any data
+                chunk = await asyncio.wait_for(
+                    self.read(settings.TERMINAL_OUTPUT_COALESCE_SIZE - len(buf)), timeout=timeout
+                )
+            except (asyncio.TimeoutError, OSError):
+                # If it was an error, the next read will raise it again
+                break
+
+            if not chunk:
+                # EOF; the next read will return b"" too
+                break
+
+            buf += chunk
+
+        return bytes(buf)
 
     async def write(self, data: bytes) -> None:
         assert self.writer is not None
+        terminal_reaper.touch(self.container_name)
         self.writer.write(data)
         await self.writer.drain()
 
@@ -251,13 +207,29 @@ class TerminalContainer:  # pylint: disable=too-many-instance-attributes
 
         self.client.api.exec_resize(self.exec_id, height=rows, width=cols)
 
-    @run_in_executor(None)
-    def close(self) -> None:
-        if self.socket is not None and not self.closed:
+    async def close(self) -> None:
+        if self.closed:
+            return
+
+        self.closed = True
+
+        for sock, writer in [
+            (self.socket, self.writer),
+            (self.heartbeat_socket, self.heartbeat_writer),
+        ]:
+            if sock is None:
+                continue
+
             # It's not enough to close the socket; to force-interrupt read()s we need to shut
-            # it down first.
-            raw_socket = self._raw_socket()
-            raw_socket.shutdown(socket.SHUT_RDWR)
-            raw_socket.close()
+            # it down first. Neither of these block.
+            raw_socket = self._raw_socket(sock)
+            try:
+                raw_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # Already disconnected
+                pass
 
-            self.closed = True
+            if writer is not None:
+                writer.close()
+            else:
+                raw_socket.close()
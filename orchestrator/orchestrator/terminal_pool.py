@@ -0,0 +1,485 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import collections
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from docker.client import DockerClient
+from docker.errors import APIError, ImageNotFound, NotFound
+from docker.models.containers import Container
+from docker.types import Mount
+
+from . import settings
+from .docker import containers
+from .docker.utils import get_shared_client
+
+logger = logging.getLogger(__name__)
+
+# Label recording a hash of the parameters a terminal container was created with, so containers
+# created with outdated parameters (a different image, resource limits, etc.) can be recognized
+TERMINAL_PARAMS_HASH_LABEL = "director.terminal-params-hash"
+
+TERMINAL_CONTAINER_NAME_RE = re.compile(r"^site_\d+_terminal$")
+
+
+def get_terminal_container_name(site_id: int) -> str:
+    return "site_{:04d}_terminal".format(site_id)
+
+
+def gen_terminal_run_params(
+    client: DockerClient, site_id: int, site_data: Dict[str, Any]
+) -> Dict[str, Any]:
+    run_params = containers.gen_director_container_params(client, site_id, site_data)
+
+    # Allows for the use of a C program to perform keepalive instead of using `sh`
+    # Using a C program allows greater control of low-level interactions
+    # (e.g. niceness, disk I/O priority).
+    if settings.TERMINAL_KEEPALIVE_PROGRAM_PATH is not None:
+        keepalive_command = [
+            "/terminal-keepalive",
+            str(settings.SITE_TERMINAL_KEEPALIVE_TIMEOUT),
+        ]
+        run_params["mounts"].append(
+            Mount(
+                "/terminal-keepalive",
+                settings.TERMINAL_KEEPALIVE_PROGRAM_PATH,
+                type="bind",
+                read_only=True,
+            )
+        )
+    else:
+        keepalive_command = [
+            "sh",
+            "-c",
+            'while timeout "$1" head -n 1 &>/dev/null; do true; done',
+            "sh",
+            str(settings.SITE_TERMINAL_KEEPALIVE_TIMEOUT),
+        ]
+
+    run_params.update(
+        {
+            "command": keepalive_command,
+            "read_only": True,
+            "auto_remove": True,
+            "stdin_open": True,
+        }
+    )
+
+    return run_params
+
+
+def hash_run_params(run_params: Dict[str, Any]) -> str:
+    # Mounts and LogConfigs are dictionaries, so they serialize fine
+    return hashlib.sha256(
+        json.dumps(run_params, sort_keys=True, default=repr).encode()
+    ).hexdigest()[:32]
+
+
+def pull_terminal_image(client: DockerClient, orig_image_name: str) -> str:
+    """Makes sure the latest version of the given image is present, and returns its ID."""
+    if "/" in orig_image_name:
+        # One of these formats:
+        # - hostname/image
+        # - hostname:port/image
+        # - hostname/image:tag
+        # - hostname:port/image:tag
+
+        # Split out the hostname/port combo if present
+        server, image_name_with_tag = orig_image_name.split("/")
+
+        if ":" in image_name_with_tag:
+            # It has a tag name
+            image_name, tag_name = image_name_with_tag.split(":")
+            image_name = server + "/" + image_name
+        else:
+            # No tag name
+            image_name = orig_image_name
+            tag_name = "latest"
+
+        # This format means it's from our custom registry. Unconditionally pull so we always get
+        # the latest built image.
+        image = client.images.pull(image_name, tag_name)
+    else:
+        # One of these formats:
+        # - image
+        # - image:tag
+
+        if ":" in orig_image_name:
+            image_name, tag_name = orig_image_name.split(":")
+        else:
+            image_name = orig_image_name
+            tag_name = "latest"
+
+        # This format means it's from DockerHub. To avoid hitting the rate limit, only pull if
+        # it's not present.
+        try:
+            image = client.images.get(orig_image_name)
+        except ImageNotFound:
+            image = client.images.pull(image_name, tag_name)
+
+    return str(image.id)
+
+
+class TerminalWarmPool:
+    """Keeps terminal containers ready so that opening a terminal is fast.
+
+    Docker can't add the site directory to a container after it has been created, so the pool
+    can't hand out generic containers. Instead, it remembers the last
+    ``settings.TERMINAL_WARM_POOL_SIZE`` sites that opened terminals, and a background thread makes
+    sure each of them has a terminal container (created, but not started, if there isn't a running
+    one) whose image and parameters are up to date. It also keeps the images those containers use
+    up to date, so opening a terminal usually doesn't have to wait for a pull from the registry.
+
+    Opening a terminal then only takes starting the container (if necessary) and creating the
+    exec.
+
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.name_locks: Dict[str, threading.Lock] = {}
+
+        # site ID -> site data, least recently used first
+        self.recent_sites: "collections.OrderedDict[int, Dict[str, Any]]" = (
+            collections.OrderedDict()
+        )
+        # image name -> (image ID, time it was last pulled)
+        self.image_ids: Dict[str, Tuple[str, float]] = {}
+
+        self.refill_thread: Optional[threading.Thread] = None
+
+    def get_name_lock(self, name: str) -> threading.Lock:
+        with self.lock:
+            return self.name_locks.setdefault(name, threading.Lock())
+
+    def get_image_id(self, client: DockerClient, image_name: str, *, max_age: float) -> str:
+        with self.lock:
+            image_id, pull_time = self.image_ids.get(image_name, ("", 0.0))
+
+        if not image_id or time.monotonic() - pull_time > max_age:
+            image_id = pull_terminal_image(client, image_name)
+
+            with self.lock:
+                self.image_ids[image_name] = (image_id, time.monotonic())
+
+        return image_id
+
+    def invalidate_image(self, image_name: str) -> None:
+        """Forgets the cached ID of the given image, so it will be pulled again before it is next
+        used. Call this when a new version of an image is pushed."""
+        with self.lock:
+            self.image_ids.pop(image_name, None)
+
+    def acquire(self, client: DockerClient, site_id: int, site_data: Dict[str, Any]) -> Container:
+        """Returns a running, up-to-date terminal container for the given site."""
+        self.remember_site(site_id, site_data)
+
+        run_params = gen_terminal_run_params(client, site_id, site_data)
+        image_id = self.get_image_id(
+            client, run_params["image"], max_age=settings.TERMINAL_IMAGE_CHECK_INTERVAL
+        )
+
+        name = get_terminal_container_name(site_id)
+        with self.get_name_lock(name):
+            container = self.prepare_container(
+                client, name, run_params, image_id, replace_running=True
+            )
+            assert container is not None
+
+            if container.status != "running":
+                container.start()
+                container.reload()
+
+            # So the reaper doesn't remove it before the terminal is attached
+            terminal_reaper.touch(name)
+
+        return container
+
+    def prepare_container(
+        self,
+        client: DockerClient,
+        name: str,
+        run_params: Dict[str, Any],
+        image_id: str,
+        *,
+        replace_running: bool,
+    ) -> Optional[Container]:
+        """Makes sure the named container exists with the given parameters and image, creating
+        (but not starting) it if necessary.
+
+        If the container is running with outdated parameters and ``replace_running`` is False, it
+        is left alone and None is returned.
+
+        """
+        params_hash = hash_run_params(run_params)
+
+        container = self.get_container(client, name)
+        if container is not None and (
+            container.attrs["Image"] != image_id
+            # Containers from before the pool existed don't have the label
+            or container.labels.get(TERMINAL_PARAMS_HASH_LABEL, params_hash) != params_hash
+        ):
+            if container.status == "running" and not replace_running:
+                return None
+
+            self.remove_container(container)
+            container = None
+
+        if container is None:
+            try:
+                container = client.containers.create(
+                    name=name,
+                    labels={TERMINAL_PARAMS_HASH_LABEL: params_hash},
+                    **run_params,
+                )
+            except APIError as ex:
+                msg = str(ex).lower()
+                if "conflict" in msg and "already in use" in msg:
+                    # Another process created it first (or the old one is still being removed)
+                    container = self.wait_for_container(client, name)
+                else:
+                    raise
+
+        return container
+
+    def get_container(self, client: DockerClient, name: str) -> Optional[Container]:
+        try:
+            return client.containers.get(name)
+        except NotFound:
+            return None
+
+    def wait_for_container(self, client: DockerClient, name: str) -> Container:
+        deadline = time.monotonic() + 10
+        while True:
+            container = self.get_container(client, name)
+            if container is not None and container.status not in {"removing", "dead"}:
+                return container
+
+            if time.monotonic() >= deadline:
+                raise APIError("Timed out waiting for container {}".format(name))
+
+            time.sleep(0.1)
+
+    def remove_container(self, container: Container) -> None:
+        try:
+            container.remove(force=True)
+        except NotFound:
+            pass
+        except APIError as ex:
+            # Running containers are auto-removed when they're stopped, which can race with us
+            if "already in progress" not in str(ex):
+                raise
+
+        # Wait for it to disappear so its name is free
+        try:
+            container.wait(condition="removed", timeout=10)
+        except Exception:  # pylint: disable=broad-except
+            # It's already gone, or we timed out
+            pass
+
+    def remember_site(self, site_id: int, site_data: Dict[str, Any]) -> None:
+        with self.lock:
+            self.recent_sites[site_id] = site_data
+            self.recent_sites.move_to_end(site_id)
+
+            evicted = []
+            while len(self.recent_sites) > settings.TERMINAL_WARM_POOL_SIZE:
+                evicted.append(self.recent_sites.popitem(last=False)[0])
+
+            if self.refill_thread is None and settings.TERMINAL_WARM_POOL_SIZE > 0:
+                self.refill_thread = threading.Thread(
+                    target=self.refill_thread_main, name="terminal-warm-pool", daemon=True
+                )
+                self.refill_thread.start()
+
+        for evicted_site_id in evicted:
+            self.release_site(get_shared_client(), evicted_site_id)
+
+    def release_site(self, client: DockerClient, site_id: int) -> None:
+        """Removes a site's terminal container if it was created by the pool and never used."""
+        name = get_terminal_container_name(site_id)
+        with self.get_name_lock(name):
+            try:
+                container = self.get_container(client, name)
+                if container is not None and container.status == "created":
+                    self.remove_container(container)
+            except APIError:
+                logger.exception("Error removing unused terminal container %s", name)
+
+    def refill_thread_main(self) -> None:
+        while True:
+            time.sleep(settings.TERMINAL_WARM_POOL_REFRESH_INTERVAL)
+
+            try:
+                self.refill(get_shared_client())
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error refilling terminal warm pool")
+
+    def refill(self, client: DockerClient) -> None:
+        with self.lock:
+            sites = list(self.recent_sites.items())
+
+        for site_id, site_data in sites:
+            name = get_terminal_container_name(site_id)
+
+            try:
+                run_params = gen_terminal_run_params(client, site_id, site_data)
+                # Pull images in the background so opening a terminal doesn't have to
+                image_id = self.get_image_id(
+                    client,
+                    run_params["image"],
+                    max_age=settings.TERMINAL_WARM_POOL_REFRESH_INTERVAL / 2,
+                )
+
+                with self.get_name_lock(name):
+                    # Don't kill running terminals; they'll be replaced when they're next opened
+                    self.prepare_container(
+                        client, name, run_params, image_id, replace_running=False
+                    )
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error preparing terminal container %s", name)
+
+
+class TerminalReaper:
+    """Stops and removes terminal containers that have been idle for too long.
+
+    Terminals report input and output with touch(). A running terminal container with no activity
+    for ``settings.TERMINAL_IDLE_TIMEOUT`` seconds (even if a browser tab still has it open) is
+    removed, which also closes any sessions attached to it. Containers nobody has touched since
+    this process started (left behind by a crashed process, for example) count as idle from when
+    this process started.
+
+    At startup, every terminal container on this node is removed, since none of them can have
+    sessions attached.
+
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # Container name -> time.time() of the last activity
+        self.last_activity: Dict[str, float] = {}
+        self.start_time = time.time()
+
+        self.thread: Optional[threading.Thread] = None
+
+        # Stats from the last sweep, for the metrics
+        self.container_counts: Dict[str, int] = {}
+        self.memory_usage = 0
+        self.reaped_count = 0
+
+    def touch(self, name: str) -> None:
+        with self.lock:
+            self.last_activity[name] = time.time()
+
+    def get_idle_time(self, name: str) -> float:
+        with self.lock:
+            return time.time() - self.last_activity.get(name, self.start_time)
+
+    def start(self) -> None:
+        """Sweeps out orphaned containers and starts reaping idle containers in the background."""
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.thread_main, name="terminal-reaper", daemon=True
+            )
+            self.thread.start()
+
+    def thread_main(self) -> None:
+        try:
+            self.sweep(get_shared_client(), orphans=True)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error sweeping orphaned terminal containers")
+
+        while True:
+            time.sleep(settings.TERMINAL_REAPER_INTERVAL)
+
+            try:
+                self.sweep(get_shared_client(), orphans=False)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error reaping idle terminal containers")
+
+    def list_terminal_containers(self, client: DockerClient) -> List[Container]:
+        # The "name" filter does a substring match
+        return [
+            container
+            for container in client.containers.list(all=True, filters={"name": "_terminal"})
+            if TERMINAL_CONTAINER_NAME_RE.match(container.name)
+        ]
+
+    def sweep(self, client: DockerClient, *, orphans: bool) -> None:
+        counts: Dict[str, int] = {}
+        memory_usage = 0
+
+        for container in self.list_terminal_containers(client):
+            if orphans or (
+                container.status == "running"
+                and self.get_idle_time(container.name) > settings.TERMINAL_IDLE_TIMEOUT
+            ):
+                if self.reap(client, container.name, orphans=orphans):
+                    continue
+
+            counts[container.status] = counts.get(container.status, 0) + 1
+
+            if container.status == "running":
+                memory_usage += self.get_memory_usage(client, container.id)
+
+        self.container_counts = counts
+        self.memory_usage = memory_usage
+
+    def reap(self, client: DockerClient, name: str, *, orphans: bool) -> bool:
+        with terminal_warm_pool.get_name_lock(name):
+            # A terminal may have been opened in the meantime
+            if orphans:
+                with self.lock:
+                    if name in self.last_activity:
+                        return False
+            elif self.get_idle_time(name) <= settings.TERMINAL_IDLE_TIMEOUT:
+                return False
+
+            container = terminal_warm_pool.get_container(client, name)
+            if container is None:
+                return True
+
+            logger.info(
+                "Removing %s terminal container %s",
+                "orphaned" if orphans else "idle",
+                name,
+            )
+            terminal_warm_pool.remove_container(container)
+
+        with self.lock:
+            self.last_activity.pop(name, None)
+            self.reaped_count += 1
+
+        return True
+
+    def get_memory_usage(self, client: DockerClient, container_id: str) -> int:
+        try:
+            stats = client.api.stats(container_id, stream=False, one_shot=True)
+        except APIError:
+            return 0
+
+        return int(stats.get("memory_stats", {}).get("usage", 0))
+
+    def format_prometheus(self) -> str:
+        lines = [
+            'director4_orchestrator_terminal_containers{{state="{}"}} {}'.format(state, count)
+            for state, count in sorted(self.container_counts.items())
+        ]
+        lines.append(
+            "director4_orchestrator_terminal_containers_memory_bytes {}".format(self.memory_usage)
+        )
+        lines.append(
+            "director4_orchestrator_terminal_containers_reaped_total {}".format(self.reaped_count)
+        )
+
+        return "".join(line + "\n" for line in lines)
+
+
+terminal_warm_pool = TerminalWarmPool()
+terminal_reaper = TerminalReaper()
@@ -0,0 +1,445 @@
+import datetime
+import gzip
+import json
+import unittest
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+import psycopg2
+
+from .. import database
+from ..app import app
+from ..exceptions import OrchestratorActionError
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConnection") -> None:
+        self.conn = conn
+        self.description: Optional[List[Any]] = None
+
+    def execute(self, sql: Any, args: Any = None) -> None:
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+        sql = sql if isinstance(sql, bytes) else sql.encode()
+        self.conn.log.append(sql)
+
+        if self.conn.error_sql is not None and sql.startswith(self.conn.error_sql):
+            raise psycopg2.ProgrammingError("query failed")
+
+        if sql.startswith((b"FETCH", b"SELECT")):
+            self.description = [("a",), ("b",)]
+
+    def fetchall(self) -> List[Any]:
+        return []
+
+    def fetchmany(self, size: int) -> List[Any]:
+        return self.conn.rows.pop(0) if self.conn.rows else []
+
+    def copy_expert(self, sql: bytes, file: Any) -> None:
+        data = b"".join(iter(lambda: file.read(8192), b""))
+        self.conn.log.append(sql + b" <- " + data)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.log: List[bytes] = []
+        self.closed = False
+        self.broken = False
+        self.transaction_status: int = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        # Batches of rows returned by fetchmany(), and a statement that fails
+        self.rows: List[List[Any]] = []
+        self.error_sql: Optional[bytes] = None
+
+    def cursor(self, *args: Any) -> FakeCursor:
+        return FakeCursor(self)
+
+    def get_transaction_status(self) -> int:
+        return self.transaction_status
+
+    @property
+    def open(self) -> bool:
+        # MySQLdb's equivalent of psycopg2's "closed"
+        return not self.closed
+
+    def commit(self) -> None:
+        assert not self.closed
+        self.log.append(b"COMMIT")
+
+    def close(self) -> None:
+        self.closed = True
+
+
+POSTGRES_DATABASE_INFO = {
+    "db_type": "postgres",
+    "db_name": "site_1",
+    "username": "site_1",
+    "password": "password",
+    "host": {"admin_hostname": "postgres", "admin_port": 5432},
+}
+
+
+class QueryResultFormatterTest(unittest.TestCase):
+    def format_rows(self, fmt: str, rows: List[Any], **kwargs: Any) -> str:
+        formatter = database.QueryResultFormatter(fmt, **kwargs)
+        formatter.add_columns(["a", "b"])
+        all(map(formatter.add_row, rows))
+        formatter.add_end()
+
+        output = formatter.flush(force=True)
+        assert output is not None
+        return output
+
+    def test_tsv(self) -> None:
+        self.assertEqual(
+            self.format_rows("tsv", [(1, "x"), (2, None)], max_rows=10, max_bytes=1000),
+            "a\tb\n1\tx\n2\tNone",
+        )
+
+        self.assertEqual(
+            self.format_rows("tsv", [(1, "x"), (2, "y"), (3, "z")], max_rows=2, max_bytes=1000),
+            "a\tb\n1\tx\n2\ty\n[Output truncated after 2 rows: row limit reached]",
+        )
+
+        # The header is 3 bytes, and each row takes 4 more with its newline
+        self.assertEqual(
+            self.format_rows("tsv", [(1, "x"), (2, "y"), (3, "z")], max_rows=10, max_bytes=10),
+            "a\tb\n1\tx\n[Output truncated after 1 rows: size limit reached]",
+        )
+
+    def test_ndjson(self) -> None:
+        output = self.format_rows(
+            "ndjson", [(1, "x"), (2, datetime.date(2020, 1, 1))], max_rows=1, max_bytes=1000
+        )
+
+        self.assertTrue(output.endswith("\n"))
+        self.assertEqual(
+            [json.loads(line) for line in output.splitlines()],
+            [
+                {"type": "columns", "columns": ["a", "b"]},
+                {"type": "row", "row": [1, "x"]},
+                {"type": "end", "rows": 1, "truncated": True, "truncated_reason": "rows"},
+            ],
+        )
+
+        output = self.format_rows(
+            "ndjson", [(1, datetime.date(2020, 1, 1))], max_rows=10, max_bytes=1000
+        )
+        self.assertEqual(
+            [json.loads(line) for line in output.splitlines()][1:],
+            [
+                {"type": "row", "row": [1, "2020-01-01"]},
+                {"type": "end", "rows": 1, "truncated": False, "truncated_reason": None},
+            ],
+        )
+
+    def test_flush(self) -> None:
+        formatter = database.QueryResultFormatter("tsv", max_rows=10, max_bytes=1000)
+
+        with mock.patch("orchestrator.settings.DATABASE_QUERY_CHUNK_SIZE", 3):
+            formatter.add_columns(["a"])
+            self.assertIsNone(formatter.flush())
+
+            formatter.add_row((1,))
+            self.assertEqual(formatter.flush(), "a\n1")
+            self.assertIsNone(formatter.flush(force=True))
+
+            formatter.add_error("error")
+            self.assertEqual(formatter.flush(), "\nerror")
+
+        with self.assertRaises(ValueError):
+            database.QueryResultFormatter("csv", max_rows=10, max_bytes=1000)
+
+
+class PostgresQueryResultsTest(unittest.TestCase):
+    def run_query(self, conn: FakeConnection, sql: str) -> List[Any]:
+        formatter = database.QueryResultFormatter("ndjson", max_rows=10, max_bytes=1000)
+        output = "".join(database._iter_query_results(conn, "postgres", sql, formatter))
+        return [json.loads(line) for line in output.splitlines()]
+
+    def test_own_transaction(self) -> None:
+        conn = FakeConnection()
+        conn.rows = [[(1, "x")], [(2, "y")]]
+
+        output = self.run_query(conn, "SELECT a, b FROM t")
+
+        self.assertEqual(
+            [line["row"] for line in output if line["type"] == "row"], [[1, "x"], [2, "y"]]
+        )
+        self.assertEqual(
+            conn.log,
+            [
+                b"BEGIN",
+                b"DECLARE director_console NO SCROLL CURSOR FOR SELECT a, b FROM t",
+                b"FETCH %s FROM director_console",
+                b"FETCH %s FROM director_console",
+                b"FETCH %s FROM director_console",
+                b"COMMIT",
+            ],
+        )
+
+    def test_own_transaction_error(self) -> None:
+        conn = FakeConnection()
+        conn.rows = [[(1, "x")]]
+        conn.error_sql = b"FETCH"
+
+        output = self.run_query(conn, "SELECT a, b FROM t")
+
+        self.assertEqual(output[0], {"type": "error", "error": "query failed"})
+        self.assertEqual(conn.log[-1], b"ROLLBACK")
+        self.assertFalse(conn.closed)
+
+    def test_own_transaction_interrupted(self) -> None:
+        conn = FakeConnection()
+        conn.rows = [[(1, "x")]]
+
+        formatter = database.QueryResultFormatter("tsv", max_rows=10, max_bytes=1000)
+        with mock.patch("orchestrator.settings.DATABASE_QUERY_CHUNK_SIZE", 1):
+            results = database._iter_query_results(conn, "postgres", "SELECT 1", formatter)
+            self.assertEqual(next(results), "a\tb\n1\tx")
+
+        # The client stopped reading the results
+        results.close()
+        self.assertEqual(conn.log[-1], b"ROLLBACK")
+
+    def test_user_transaction(self) -> None:
+        conn = FakeConnection()
+        conn.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+        self.run_query(conn, "SELECT 1")
+
+        # The user's transaction is left alone
+        self.assertEqual(
+            conn.log,
+            [
+                b"DECLARE director_console NO SCROLL CURSOR FOR SELECT 1",
+                b"FETCH %s FROM director_console",
+                b"CLOSE director_console",
+            ],
+        )
+
+        # Other statements don't need a cursor (or a transaction)
+        conn = FakeConnection()
+        self.run_query(conn, "UPDATE t SET a = 1")
+        self.assertEqual(conn.log, [b"UPDATE t SET a = 1"])
+
+    def test_no_cursor(self) -> None:
+        # Postgres doesn't allow these in DECLARE
+        for sql in [
+            "WITH d AS (DELETE FROM t RETURNING a) SELECT a FROM d",
+            "with u as (update t set a = 1 returning a) select * from u",
+            "SELECT a INTO u FROM t",
+        ]:
+            conn = FakeConnection()
+            self.run_query(conn, sql)
+            self.assertEqual(conn.log, [sql.encode()])
+
+
+class ImportDatabaseTest(unittest.TestCase):
+    def import_dump(self, dump: bytes) -> FakeConnection:
+        conn = FakeConnection()
+        with mock.patch.object(database, "_connect", return_value=conn):
+            try:
+                database.import_database(POSTGRES_DATABASE_INFO, [dump[:3], dump[3:]])
+            finally:
+                self.assertTrue(conn.closed)
+
+        return conn
+
+    def test_import_database(self) -> None:
+        dump = b"\\restrict x\nCREATE TABLE t (a text);\nCOPY t (a) FROM stdin;\nb\n\\.\n"
+
+        for data in [dump, gzip.compress(dump)]:
+            conn = self.import_dump(data)
+            self.assertEqual(
+                conn.log,
+                [
+                    b"SET statement_timeout = %s",
+                    b"BEGIN",
+                    b"CREATE TABLE t (a text)",
+                    b"COPY t (a) FROM stdin <- b\n",
+                    b"COMMIT",
+                ],
+            )
+
+    def test_import_database_meta_command(self) -> None:
+        with self.assertRaisesRegex(OrchestratorActionError, "unsupported psql command"):
+            self.import_dump(b"CREATE TABLE t (a text);\n\\! touch /tmp/pwned\n")
+
+    def test_import_database_invalid(self) -> None:
+        with self.assertRaisesRegex(OrchestratorActionError, "not a valid gzip file"):
+            self.import_dump(b"\x1f\x8bnot gzip")
+
+        with self.assertRaisesRegex(OrchestratorActionError, "truncated"):
+            self.import_dump(gzip.compress(b"SELECT 1;\n" * 100)[:-10])
+
+        with mock.patch("orchestrator.settings.DATABASE_IMPORT_MAX_SQL_BYTES", 50):
+            with self.assertRaisesRegex(OrchestratorActionError, "too large"):
+                self.import_dump(gzip.compress(b"SELECT 1;\n" * 100))
+
+
+class DatabaseDumpCommandTest(unittest.TestCase):
+    def test_admin_host(self) -> None:
+        args, env = database._get_database_dump_command(POSTGRES_DATABASE_INFO)
+        self.assertEqual(args[1:5], ["--host", "postgres", "--port", "5432"])
+        self.assertEqual(env["PGPASSWORD"], "password")
+
+        mysql_info = {
+            **POSTGRES_DATABASE_INFO,
+            "db_type": "mysql",
+            "host": {"admin_hostname": "mysql", "admin_port": 3306},
+        }
+        args, env = database._get_database_dump_command(mysql_info)
+        self.assertEqual(args[1:5], ["--host", "mysql", "--port", "3306"])
+        self.assertEqual(env["MYSQL_PWD"], "password")
+
+        mysql_info["host"] = {"admin_hostname": "/run/mysqld/mysqld.sock", "admin_port": 3306}
+        args, env = database._get_database_dump_command(mysql_info)
+        self.assertEqual(args[1:3], ["--socket", "/run/mysqld/mysqld.sock"])
+        self.assertNotIn("--host", args)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.conns: List[FakeConnection] = []
+
+        def connect(**kwargs: Any) -> FakeConnection:
+            conn = FakeConnection()
+            self.conns.append(conn)
+            return conn
+
+        patcher = mock.patch.object(database, "_connect", connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reset(self) -> None:
+        pool = database.ConnectionPool(dbms="postgres")
+
+        with pool.connection() as conn:
+            pass
+        self.assertEqual(conn.log, [b"DISCARD ALL"])
+
+        # Reused, since it was reset
+        with pool.connection() as conn2:
+            self.assertIs(conn2, conn)
+            # Left in a transaction, so it can't be reused
+            conn.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        self.assertTrue(conn.closed)
+        self.assertFalse(pool.idle)
+
+        # Closed after an error
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                raise ValueError
+        self.assertTrue(conn.closed)
+        self.assertFalse(pool.idle)
+
+        mysql_pool = database.ConnectionPool(dbms="mysql")
+        with mysql_pool.connection() as conn:
+            pass
+        self.assertEqual(conn.log, [b"COMMIT"])
+        self.assertEqual(len(mysql_pool.idle), 1)
+
+    def test_check(self) -> None:
+        pool = database.ConnectionPool(dbms="postgres")
+
+        with pool.connection() as conn:
+            pass
+
+        # Connections idle for a while are checked before being reused
+        with mock.patch("orchestrator.settings.DATABASE_POOL_CHECK_INTERVAL", 0):
+            with pool.connection() as conn2:
+                self.assertIs(conn2, conn)
+            self.assertIn(b"SELECT 1", conn.log)
+
+            conn.broken = True
+            with pool.connection() as conn2:
+                self.assertIsNot(conn2, conn)
+            self.assertTrue(conn.closed)
+
+    def test_manager(self) -> None:
+        manager = database.ConnectionPoolManager()
+
+        with mock.patch("orchestrator.settings.DATABASE_POOL_MAX_IDLE", 2):
+            for dbname in ["a", "b", "c"]:
+                with manager.connection(dbms="postgres", dbname=dbname):
+                    pass
+
+        # Only the two most recently used connections are kept
+        self.assertEqual([conn.closed for conn in self.conns], [True, False, False])
+
+        with mock.patch("orchestrator.settings.DATABASE_POOL_IDLE_TIMEOUT", 0):
+            with manager.connection(dbms="postgres", dbname="c"):
+                manager.evict_idle()
+
+                # The pool in use is kept, and the others are removed once they're empty
+                self.assertEqual(len(manager.pools), 1)
+
+        self.assertEqual(len(manager.pools), 1)
+        self.assertEqual([conn.closed for conn in self.conns], [True, True, False])
+
+    def test_site_connections_unpooled(self) -> None:
+        mysql_info = {**POSTGRES_DATABASE_INFO, "db_type": "mysql"}
+
+        with database.open_site_connection(mysql_info) as conn:
+            pass
+        self.assertEqual(conn.log, [b"COMMIT"])
+        self.assertTrue(conn.closed)
+
+        with self.assertRaises(ValueError):
+            with database.open_site_connection(mysql_info) as conn:
+                raise ValueError
+        self.assertEqual(conn.log, [])
+        self.assertTrue(conn.closed)
+
+    def test_mysql_query_truncated(self) -> None:
+        mysql_info = {**POSTGRES_DATABASE_INFO, "db_type": "mysql"}
+
+        def connect(**kwargs: Any) -> FakeConnection:
+            conn = FakeConnection()
+            conn.rows = [[(1, "x"), (2, "y")]]
+            self.conns.append(conn)
+            return conn
+
+        with mock.patch.object(database, "_connect", connect):
+            output = "".join(database.iter_query_results(mysql_info, "SELECT a, b", max_rows=1))
+
+        self.assertEqual(output, "a\tb\n1\tx\n[Output truncated after 1 rows: row limit reached]")
+
+        # The query couldn't be stopped, so the connection was closed instead of committed
+        self.assertNotIn(b"COMMIT", self.conns[0].log)
+        self.assertTrue(self.conns[0].closed)
+
+
+class DatabaseHostStatsViewTest(unittest.TestCase):
+    def test_run_on_each_host(self) -> None:
+        client = app.test_client()
+
+        def get_site_database_stats(host_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+            if host_info["id"] == 2:
+                raise psycopg2.OperationalError
+
+            return [{"db_name": "site_1"}]
+
+        with mock.patch.object(database, "get_site_database_stats", get_site_database_stats):
+            response = client.post(
+                "/sites/databases/stats", data={"hosts": json.dumps([{"id": 1}, {"id": 2}])}
+            )
+
+        self.assertEqual(
+            response.get_json(),
+            {
+                "results": [
+                    {"status": "ok", "databases": [{"db_name": "site_1"}]},
+                    {"status": "error"},
+                ]
+            },
+        )
+
+        self.assertEqual(client.post("/sites/databases/host-stats").status_code, 400)
+        self.assertEqual(
+            client.post("/sites/databases/host-stats", data={"hosts": "{}"}).status_code, 400
+        )
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import threading
+import unittest
+from typing import Any, Dict, Generator, List
+from unittest import mock
+
+# Normally imported by the websocket server
+import websockets.exceptions  # noqa: F401  # pylint: disable=unused-import
+
+from ..consumers.database import is_valid_query_message, run_console_session
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.incoming: "asyncio.Queue[str]" = asyncio.Queue()
+        self.sent: List[Any] = []
+
+    async def recv(self) -> str:
+        return await self.incoming.get()
+
+    async def send(self, frame: str) -> None:
+        self.sent.append(json.loads(frame))
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeSession:
+    usable = True
+
+    def __init__(self) -> None:
+        self.cancelled = threading.Event()
+        self.cancel_calls = 0
+        self.closed = False
+
+    def open(self) -> None:
+        pass
+
+    def iter_query_results(self, sql: str, **kwargs: Any) -> Generator[str, None, None]:
+        # Blocks like a long-running query until it's cancelled
+        self.cancelled.wait(timeout=5)
+        yield "output"
+
+    def cancel(self) -> None:
+        self.cancel_calls += 1
+        # The first cancellation is missed, like one sent just before the query started
+        if self.cancel_calls > 1:
+            self.cancelled.set()
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class DatabaseConsoleTest(unittest.TestCase):
+    def test_stop_during_query(self) -> None:
+        session = FakeSession()
+
+        async def run() -> None:
+            websock = FakeWebSocket()
+            stop_event = asyncio.Event()
+
+            task = asyncio.ensure_future(
+                run_console_session(websock, 1, session, stop_event)  # type: ignore[arg-type]
+            )
+
+            await websock.incoming.put(json.dumps({"query": "SELECT pg_sleep(60)"}))
+            while session.cancel_calls == 0:
+                await asyncio.sleep(0.01)
+
+            # The query is still running after timing out, so closing the session has to cancel
+            # it again and wait for the read in the executor to finish
+            stop_event.set()
+            await asyncio.wait_for(task, timeout=5)
+
+        with mock.patch("orchestrator.settings.DATABASE_QUERY_TIMEOUT", -5):
+            asyncio.run(run())
+
+        self.assertTrue(session.cancelled.is_set())
+        self.assertTrue(session.closed)
+
+    def test_invalid_query(self) -> None:
+        session = FakeSession()
+
+        async def run() -> List[Any]:
+            websock = FakeWebSocket()
+            stop_event = asyncio.Event()
+
+            task = asyncio.ensure_future(
+                run_console_session(websock, 1, session, stop_event)  # type: ignore[arg-type]
+            )
+
+            await websock.incoming.put(json.dumps({"query": "SELECT 1", "max_rows": "10"}))
+            while len(websock.sent) < 2:
+                await asyncio.sleep(0.01)
+
+            stop_event.set()
+            await asyncio.wait_for(task, timeout=5)
+            return websock.sent
+
+        self.assertEqual(asyncio.run(run()), [{"connected": True}, {"error": "Invalid query"}])
+        self.assertTrue(session.closed)
+
+    def test_is_valid_query_message(self) -> None:
+        self.assertTrue(is_valid_query_message({"query": "SELECT 1"}))
+        self.assertTrue(
+            is_valid_query_message(
+                {"query": "SELECT 1", "format": "ndjson", "max_rows": 10, "max_bytes": None}
+            )
+        )
+
+        invalid_msgs: List[Dict[str, Any]] = [
+            {"query": 1},
+            {"query": "SELECT 1", "format": "csv"},
+            {"query": "SELECT 1", "max_rows": "10"},
+            {"query": "SELECT 1", "max_rows": 1.5},
+            {"query": "SELECT 1", "max_bytes": True},
+            {"query": "SELECT 1", "max_bytes": 0},
+            {"query": "SELECT 1", "max_rows": -1},
+        ]
+        for msg in invalid_msgs:
+            self.assertFalse(is_valid_query_message(msg), msg)
@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+
+import docker
+import requests
+
+from ..docker.utils import DockerClientManager
+
+
+class InstrumentedAPIClientTest(unittest.TestCase):
+    def test_connection_error(self) -> None:
+        manager = DockerClientManager()
+        with (
+            mock.patch("docker.utils.kwargs_from_env", return_value={}),
+            mock.patch("orchestrator.settings.DOCKER_API_VERSION", "1.45"),
+        ):
+            client = manager.get_client()
+
+        response = requests.Response()
+        response.status_code = 200
+
+        with (
+            mock.patch.object(
+                docker.APIClient,
+                "request",
+                side_effect=[requests.exceptions.ConnectionError, response],
+            ) as request_patch,
+            mock.patch.object(client.api, "close") as close_patch,
+        ):
+            # GET requests are retried
+            self.assertIs(client.api.request("GET", "http+docker://localhost/v1.45/info"), response)
+            self.assertEqual(request_patch.call_count, 2)
+
+        # The shared client isn't closed (other threads could be using it), but a new one is
+        # created for the next caller
+        close_patch.assert_not_called()
+        with (
+            mock.patch("docker.utils.kwargs_from_env", return_value={}),
+            mock.patch("orchestrator.settings.DOCKER_API_VERSION", "1.45"),
+        ):
+            self.assertIsNot(manager.get_client(), client)
+
+        with mock.patch.object(
+            docker.APIClient, "request", side_effect=requests.exceptions.ConnectionError
+        ):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.api.request("POST", "http+docker://localhost/v1.45/services/create")
+
+        calls = manager.metrics.calls
+        self.assertEqual(calls[("GET", "/info")][:2], [2, 1])
+        self.assertEqual(calls[("POST", "/services/create")][:2], [1, 1])
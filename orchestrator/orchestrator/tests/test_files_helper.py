@@ -0,0 +1,220 @@
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+from contextlib import redirect_stdout
+from typing import Any, Dict, List
+from unittest import mock
+
+from ..files import HELPER_SCRIPT_PATH, HELPER_SCRIPT_VENDOR_PATH
+
+
+def load_helper() -> Any:
+    spec = importlib.util.spec_from_file_location("files_helper", HELPER_SCRIPT_PATH)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+
+    meta_path = list(sys.meta_path)
+    try:
+        with mock.patch.object(sys, "path", [HELPER_SCRIPT_VENDOR_PATH, *sys.path]):
+            spec.loader.exec_module(module)
+    finally:
+        # Don't leave the helper's import hook installed
+        sys.meta_path[:] = meta_path
+
+    return module
+
+
+helper = load_helper()
+
+
+class FilesHelperBatchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.old_cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.site_dir = self.tmpdir.name
+
+        os.mkdir(os.path.join(self.site_dir, "dir"))
+        for path in ["file", "dir/nested"]:
+            with open(os.path.join(self.site_dir, path), "w") as f_obj:
+                f_obj.write(path)
+
+    def tearDown(self) -> None:
+        os.chdir(self.old_cwd)
+        self.tmpdir.cleanup()
+
+    def run_batch(self, operations: List[Dict[str, str]], mode: str) -> Dict[str, Any]:
+        stdout = io.StringIO()
+        with (
+            mock.patch.object(helper, "chroot_into", os.chdir),
+            mock.patch.object(sys, "stdin", io.StringIO(json.dumps(operations))),
+            redirect_stdout(stdout),
+        ):
+            helper.batch_cmd(self.site_dir, mode)
+
+        result: Dict[str, Any] = json.loads(stdout.getvalue())
+        return result
+
+    def assert_unchanged(self) -> None:
+        self.assertEqual(sorted(os.listdir(self.site_dir)), ["dir", "file"])
+        self.assertEqual(os.listdir(os.path.join(self.site_dir, "dir")), ["nested"])
+        self.assertEqual(os.stat(os.path.join(self.site_dir, "file")).st_mode & 0o777, 0o644)
+
+    def test_atomic_revert(self) -> None:
+        os.chmod(os.path.join(self.site_dir, "file"), 0o644)
+
+        result = self.run_batch(
+            [
+                {"op": "rm", "path": "file"},
+                {"op": "rmdir-recur", "path": "dir"},
+                {"op": "mkdir", "path": "new/sub"},
+                {"op": "rename", "path": "missing", "newpath": "other"},
+                {"op": "create", "path": "skipped"},
+            ],
+            "atomic",
+        )
+
+        self.assertEqual(
+            [item["status"] for item in result["results"]], ["ok", "ok", "ok", "error", "skipped"]
+        )
+        self.assertTrue(result["reverted"])
+        self.assert_unchanged()
+
+    def test_invalid_mode(self) -> None:
+        os.chmod(os.path.join(self.site_dir, "file"), 0o644)
+
+        for mode in ["continue", "atomic"]:
+            with (
+                mock.patch.object(helper, "chroot_into", os.chdir),
+                mock.patch.object(
+                    sys,
+                    "stdin",
+                    io.StringIO(json.dumps([{"op": "chmod", "path": "file", "mode": "u+x"}])),
+                ),
+                redirect_stdout(io.StringIO()),
+                mock.patch.object(sys, "stderr", io.StringIO()),
+            ):
+                with self.assertRaises(SystemExit):
+                    helper.batch_cmd(self.site_dir, mode)
+
+        self.assert_unchanged()
+
+        with self.assertRaisesRegex(ValueError, "Invalid mode string"):
+            helper.get_new_mode(0o644, "u+x")
+
+    def test_interrupted(self) -> None:
+        os.chmod(os.path.join(self.site_dir, "file"), 0o644)
+
+        run_batch_operation = helper.run_batch_operation
+
+        def interrupt(operation: Dict[str, str], *args: Any) -> None:
+            if operation["op"] == "chmod":
+                raise KeyboardInterrupt
+
+            run_batch_operation(operation, *args)
+
+        with mock.patch.object(helper, "run_batch_operation", interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_batch(
+                    [{"op": "rm", "path": "file"}, {"op": "chmod", "path": "dir", "mode": "700"}],
+                    "atomic",
+                )
+
+        # The removed file was restored and the staging directory was cleaned up
+        self.assert_unchanged()
+
+
+class FilesHelperExtractTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.old_cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.site_dir = self.tmpdir.name
+
+    def tearDown(self) -> None:
+        os.chdir(self.old_cwd)
+        self.tmpdir.cleanup()
+
+    def extract(self, data: bytes, max_archive_size: int) -> str:
+        stdin = io.TextIOWrapper(io.BytesIO(data))
+        stdout = io.StringIO()
+        with (
+            mock.patch.object(helper, "chroot_into", os.chdir),
+            mock.patch.object(helper.signal, "signal"),
+            mock.patch.object(sys, "stdin", stdin),
+            redirect_stdout(stdout),
+        ):
+            helper.extract_cmd(self.site_dir, "", "zip", str(max_archive_size), "1000", "10")
+
+        return stdout.getvalue()
+
+    def test_archive_size_limit(self) -> None:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zip_file:
+            zip_file.writestr("file", "a" * 1000)
+        data = buf.getvalue()
+
+        stderr = io.StringIO()
+        with mock.patch.object(sys, "stderr", stderr), self.assertRaises(SystemExit):
+            self.extract(data, len(data) - 1)
+
+        self.assertEqual(stderr.getvalue(), "Archive is too large\n")
+        self.assertEqual(os.listdir(self.site_dir), [])
+
+        output = self.extract(data, len(data))
+        self.assertTrue(json.loads(output.splitlines()[-1])["done"])
+        self.assertEqual(os.listdir(self.site_dir), ["file"])
+
+
+# Run in a separate process, since the CPU time limit is set on the whole process
+GREP_SCRIPT = """
+import os, sys
+from unittest import mock
+from orchestrator.tests.test_files_helper import helper
+with mock.patch.object(helper, "chroot_into", os.chdir):
+    helper.grep_cmd(*sys.argv[1:])
+"""
+
+
+class FilesHelperGrepTest(unittest.TestCase):
+    def test_cpu_time_limit(self) -> None:
+        with tempfile.TemporaryDirectory() as site_dir:
+            with open(os.path.join(site_dir, "file"), "w") as f_obj:
+                f_obj.write("a" * 40 + "b\n")
+
+            # This regex takes far too long to fail to match, and the deadline is only checked
+            # between lines
+            proc = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    GREP_SCRIPT,
+                    site_dir,
+                    "",
+                    "(a+)+$",
+                    "r",
+                    "",
+                    "1000",
+                    "10",
+                    "0.5",
+                ],
+                env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+                stdout=subprocess.PIPE,
+                check=True,
+                timeout=30,
+            )
+
+        self.assertEqual(
+            json.loads(proc.stdout),
+            {
+                "done": True,
+                "stopped": "time",
+                "matches": 0,
+                "files_searched": 1,
+                "files_skipped": 0,
+            },
+        )
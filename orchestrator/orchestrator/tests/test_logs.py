@@ -0,0 +1,41 @@
+import asyncio
+import unittest
+from typing import Any, List, Optional
+from unittest import mock
+
+import docker
+
+from .. import logs, settings
+from ..docker.service_index import service_index
+
+
+class SiteLogHubTest(unittest.TestCase):
+    def test_service_removed(self) -> None:
+        service_ids: List[Optional[str]] = ["old-id", None]
+
+        def get_service_id_by_name(client: Any, name: str) -> Optional[str]:
+            return service_ids.pop(0)
+
+        async def run() -> None:
+            hub = logs.SiteLogHub(1)
+
+            with (
+                mock.patch.object(logs, "get_service_id_by_name", get_service_id_by_name),
+                mock.patch.object(
+                    logs, "open_service_logs_stream", side_effect=docker.errors.NotFound("")
+                ),
+                mock.patch.object(service_index, "forget") as forget,
+                mock.patch.object(hub.stop_event, "wait") as wait,
+                mock.patch.object(hub, "end_subscriptions") as end_subscriptions,
+            ):
+                hub.follow_logs(mock.Mock())
+                # Let the callback scheduled by the thread run
+                await asyncio.sleep(0)
+
+            # The stale ID was forgotten, and the service was looked up again after a delay
+            forget.assert_called_once_with("site_0001")
+            wait.assert_called_once_with(settings.LOG_HUB_RECONNECT_DELAY)
+            end_subscriptions.assert_called_once_with()
+
+        asyncio.run(run())
+        self.assertEqual(service_ids, [])
@@ -0,0 +1,149 @@
+import os
+import re
+import tempfile
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+from ..configs import nginx
+
+
+def make_site(site_id: int, kind: str = "dynamic", **kwargs: Any) -> Dict[str, Any]:
+    return {
+        "id": site_id,
+        "hostname": "site{}.sites.tjhsst.edu".format(site_id),
+        "kind": kind,
+        "site_dir": "/data/sites/{}".format(site_id),
+        "client_body_limit": "1m",
+        "primary_url_base": None,
+        "no_redirect_domains": [],
+        **kwargs,
+    }
+
+
+def get_server_names(text: str) -> List[List[str]]:
+    return [
+        match.group(1).split()
+        for match in re.finditer(r"^    server_name\s+([^;]*);", text, flags=re.MULTILINE)
+    ]
+
+
+class NginxSiteMapsConfigTest(unittest.TestCase):
+    def render(self, sites: List[Dict[str, Any]]) -> str:
+        with mock.patch("orchestrator.settings.SITES_DOMAIN", "sites.tjhsst.edu"):
+            return nginx.render_nginx_site_maps_config(sites)
+
+    def test_no_sites(self) -> None:
+        self.assertNotIn("server {", self.render([]))
+
+    def test_groups(self) -> None:
+        text = self.render(
+            [
+                make_site(3),
+                make_site(1),
+                make_site(2, kind="static"),
+                make_site(4, client_body_limit="10m"),
+                make_site(5, kind="disabled"),
+            ]
+        )
+
+        # One server block per (kind, client body limit), and the largest group (the dynamic
+        # sites with the default limit) is matched by the wildcard instead of being listed
+        self.assertEqual(
+            get_server_names(text),
+            [
+                ["site5.sites.tjhsst.edu"],
+                ["site4.sites.tjhsst.edu"],
+                ["*.sites.tjhsst.edu"],
+                ["site2.sites.tjhsst.edu"],
+            ],
+        )
+        self.assertEqual(
+            re.findall(r"client_max_body_size (\S+);", text), ["1m", "10m", "1m", "1m"]
+        )
+
+        # Every site is in the site directory map, ordered by ID; only dynamic sites have
+        # backends
+        self.assertEqual(
+            re.findall(r'"site(\d)\.sites\.tjhsst\.edu" "/data/sites/\d"', text),
+            ["1", "2", "3", "4", "5"],
+        )
+        self.assertEqual(
+            re.findall(r'"site(\d)\.sites\.tjhsst\.edu" "http://site_\d+"', text),
+            ["1", "3", "4"],
+        )
+
+    def test_redirects(self) -> None:
+        text = self.render(
+            [
+                make_site(
+                    1,
+                    primary_url_base="https://example.com",
+                    no_redirect_domains=["example.com", "www.example.com"],
+                ),
+                make_site(2, no_redirect_domains=["ignored.example.com"]),
+            ]
+        )
+
+        self.assertIn('"site1.sites.tjhsst.edu" "https://example.com";', text)
+        self.assertIn('"site1.sites.tjhsst.edu example.com" 1;', text)
+        self.assertIn('"site1.sites.tjhsst.edu www.example.com" 1;', text)
+        # Sites without a primary URL are never redirected, so their domains aren't needed
+        self.assertNotIn("ignored.example.com", text)
+        self.assertNotIn('"site2.sites.tjhsst.edu" "https://', text)
+
+    def test_disabled_removes_stale_config(self) -> None:
+        with (
+            tempfile.TemporaryDirectory() as config_dir,
+            mock.patch("orchestrator.settings.NGINX_CONFIG_DIRECTORY", config_dir),
+        ):
+            path = os.path.join(config_dir, "director-sites.conf")
+            with open(path, "w") as f_obj:
+                f_obj.write("upstream site_0001 {}\n")
+
+            with mock.patch("orchestrator.settings.NGINX_USE_SITE_MAPS", False):
+                self.assertIsNone(nginx.write_nginx_site_maps_config())
+                self.assertFalse(os.path.exists(path))
+
+                # Nothing to remove
+                self.assertIsNone(nginx.write_nginx_site_maps_config())
+
+
+class NginxSharedConfigTest(unittest.TestCase):
+    def test_connection_map(self) -> None:
+        site_data: Dict[str, Any] = {
+            "name": "site1",
+            "no_redirect_domains": [],
+            "primary_url_base": None,
+            "type": "dynamic",
+            "resource_limits": {"client_body_limit": "1m"},
+            "is_being_served": True,
+            "custom_nginx_config": "",
+        }
+
+        with (
+            tempfile.TemporaryDirectory() as config_dir,
+            mock.patch("orchestrator.settings.NGINX_CONFIG_DIRECTORY", config_dir),
+            mock.patch("orchestrator.settings.NGINX_USE_SITE_MAPS", False),
+        ):
+            nginx.update_nginx_config(1, site_data)
+            nginx.update_nginx_config(2, {**site_data, "name": "site2"})
+
+            with open(nginx.write_nginx_shared_config()) as f_obj:
+                shared_text = f_obj.read()
+
+            site_texts = []
+            for site_id in [1, 2]:
+                with open(nginx.get_site_nginx_config_path(site_id)) as f_obj:
+                    site_texts.append(f_obj.read())
+
+        # The map is only defined once, in the shared config, and the sites' configs use it
+        self.assertEqual(shared_text.count("map $http_upgrade $director_site_connection {"), 1)
+        for text in site_texts:
+            self.assertNotIn("map $http_upgrade", text)
+            self.assertIn("proxy_set_header Connection $director_site_connection;", text)
+
+        with mock.patch("orchestrator.settings.SITES_DOMAIN", "sites.tjhsst.edu"):
+            maps_text = nginx.render_nginx_site_maps_config([make_site(1)])
+        self.assertNotIn("map $http_upgrade", maps_text)
+        self.assertIn("proxy_set_header Connection $director_site_connection;", maps_text)
@@ -1,4 +1,6 @@
+import json
 import unittest
+from unittest import mock
 
 from ..app import app
 
@@ -11,3 +13,23 @@ class OrchestratorTest(unittest.TestCase):
     def test_ping(self) -> None:
         request = self.client.get("/ping")
         self.assertIn(b"Pong", request.data)
+
+    def test_multi_site_status(self) -> None:
+        site_ids = list(range(1000))
+
+        with (
+            mock.patch("orchestrator.views.docker.get_shared_client"),
+            mock.patch(
+                "orchestrator.views.docker.fetch_site_statuses",
+                side_effect=lambda client, ids: {site_id: None for site_id in ids},
+            ),
+        ):
+            response = self.client.post("/sites/status", data={"site_ids": json.dumps(site_ids)})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.get_json(), [{"site_id": site_id, "status": None} for site_id in site_ids]
+        )
+
+        for data in [{}, {"site_ids": "[]"}, {"site_ids": '["1"]'}, {"site_ids": "1"}]:
+            self.assertEqual(self.client.post("/sites/status", data=data).status_code, 400)
@@ -0,0 +1,154 @@
+import unittest
+from typing import List, Optional, Tuple
+from unittest import mock
+
+from ..exceptions import OrchestratorActionError
+from ..sql_dumps import SQLDumpReader
+
+
+def split(dump: bytes, dbms: str, *, chunk_size: Optional[int] = None) -> List[Tuple[bytes, bytes]]:
+    """Splits the dump, returning (statement, COPY data) pairs."""
+    if chunk_size is None:
+        chunks = [dump]
+    else:
+        chunks = [dump[i : i + chunk_size] for i in range(0, len(dump), chunk_size)]
+
+    results = []
+    for statement, copy_data in SQLDumpReader(chunks, dbms).iter_statements():
+        data = b""
+        if copy_data is not None:
+            for buf in iter(lambda: copy_data.read(8192), b""):
+                data += buf
+
+        results.append((statement, data))
+
+    return results
+
+
+POSTGRES_DUMP = b"""--
+-- PostgreSQL database dump
+--
+
+\\restrict abcdef123456
+
+SET statement_timeout = 0;
+SET standard_conforming_strings = on;
+SELECT pg_catalog.set_config('search_path', '', false);
+
+CREATE FUNCTION public.add(a integer, b integer) RETURNS integer
+    LANGUAGE plpgsql
+    AS $_$
+BEGIN
+    RETURN a + b; -- not a comment to us
+END;
+$_$;
+
+CREATE FUNCTION public.one() RETURNS integer
+    LANGUAGE sql
+    BEGIN ATOMIC
+ SELECT CASE WHEN true THEN 1 ELSE 0 END;
+END;
+
+CREATE TABLE public.notes (
+    id integer NOT NULL,
+    body text DEFAULT 'a;b' /* a ; comment /* nested */ still */
+);
+
+COPY public.notes (id, body) FROM stdin;
+1\tsemi;colon
+2\t\\N
+\\.
+
+INSERT INTO public.notes VALUES (3, E'it\\'s; fine');
+CREATE RULE r AS ON INSERT TO public.notes DO INSTEAD (SELECT 1; SELECT 2);
+
+\\unrestrict abcdef123456
+SELECT 'unterminated'"""
+
+MYSQL_DUMP = b"""-- MySQL dump
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+# A comment; with a semicolon
+INSERT INTO `notes` VALUES (1,'it\\'s; \\\\'),(2,"say ""hi"";"),(3,'--not a comment');
+/* a comment; */ SELECT 1;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50003 TRIGGER `t` BEFORE INSERT ON `notes` FOR EACH ROW BEGIN
+SET NEW.id = NEW.id + 1;
+END */;;
+DELIMITER ;
+system ls;
+SELECT `odd;name` FROM `notes`;
+"""
+
+
+class SQLDumpReaderTest(unittest.TestCase):
+    def test_postgres(self) -> None:
+        for chunk_size in [None, 1, 7]:
+            statements = split(POSTGRES_DUMP, "postgres", chunk_size=chunk_size)
+
+            self.assertEqual(
+                [statement for statement, _ in statements],
+                [
+                    b"SET statement_timeout = 0",
+                    b"SET standard_conforming_strings = on",
+                    b"SELECT pg_catalog.set_config('search_path', '', false)",
+                    b"CREATE FUNCTION public.add(a integer, b integer) RETURNS integer\n"
+                    b"    LANGUAGE plpgsql\n    AS $_$\nBEGIN\n"
+                    b"    RETURN a + b; -- not a comment to us\nEND;\n$_$",
+                    b"CREATE FUNCTION public.one() RETURNS integer\n    LANGUAGE sql\n"
+                    b"    BEGIN ATOMIC\n SELECT CASE WHEN true THEN 1 ELSE 0 END;\nEND",
+                    b"CREATE TABLE public.notes (\n    id integer NOT NULL,\n"
+                    b"    body text DEFAULT 'a;b'  \n)",
+                    b"COPY public.notes (id, body) FROM stdin",
+                    b"INSERT INTO public.notes VALUES (3, E'it\\'s; fine')",
+                    b"CREATE RULE r AS ON INSERT TO public.notes DO INSTEAD (SELECT 1; SELECT 2)",
+                    b"SELECT 'unterminated'",
+                ],
+            )
+
+            copy_data = [data for statement, data in statements if statement.startswith(b"COPY")]
+            self.assertEqual(copy_data, [b"1\tsemi;colon\n2\t\\N\n"])
+
+    def test_postgres_meta_commands(self) -> None:
+        for command in [b"\\! rm -rf /", b"\\copy t from '/etc/passwd'", b"\\i /etc/passwd"]:
+            with self.assertRaises(OrchestratorActionError):
+                split(b"SELECT 1;\n" + command + b"\nSELECT 2;\n", "postgres")
+
+        # Backslashes inside statements are sent to the database, which rejects them
+        self.assertEqual(split(b"SELECT 1\n\\! ls;\n", "postgres"), [(b"SELECT 1\n\\! ls", b"")])
+
+    def test_mysql(self) -> None:
+        for chunk_size in [None, 1, 5]:
+            statements = split(MYSQL_DUMP, "mysql", chunk_size=chunk_size)
+
+            self.assertEqual(
+                [statement for statement, _ in statements],
+                [
+                    b"/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */",
+                    b'INSERT INTO `notes` VALUES (1,\'it\\\'s; \\\\\'),(2,"say ""hi"";"),'
+                    b"(3,'--not a comment')",
+                    b"SELECT 1",
+                    b"/*!50003 CREATE*/ /*!50003 TRIGGER `t` BEFORE INSERT ON `notes` FOR EACH ROW "
+                    b"BEGIN\nSET NEW.id = NEW.id + 1;\nEND */",
+                    # Sent to the database (which rejects it), not run as a client command
+                    b"system ls",
+                    b"SELECT `odd;name` FROM `notes`",
+                ],
+            )
+            self.assertTrue(all(data == b"" for _, data in statements))
+
+    def test_skips_unread_copy_data(self) -> None:
+        reader = SQLDumpReader([b"COPY t FROM stdin;\n1\n2\n\\.\nSELECT 1;\n"], "postgres")
+        self.assertEqual(
+            [statement for statement, _ in reader.iter_statements()],
+            [b"COPY t FROM stdin", b"SELECT 1"],
+        )
+
+    def test_statement_too_large(self) -> None:
+        with mock.patch("orchestrator.settings.DATABASE_IMPORT_MAX_STATEMENT_BYTES", 100):
+            split((b"SELECT '" + b"a" * 50 + b"';\n") * 5, "mysql")
+
+            with self.assertRaises(OrchestratorActionError):
+                split(b"SELECT '" + b"a\n" * 100 + b"';\n", "mysql")
+
+            with self.assertRaises(OrchestratorActionError):
+                split(b"SELECT '" + b"a" * 200 + b"';\n", "postgres", chunk_size=10)
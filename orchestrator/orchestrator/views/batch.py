@@ -0,0 +1,50 @@
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+import json
+import traceback
+from typing import Tuple, Union
+
+from flask import Blueprint, Response, current_app, request
+
+from .. import settings
+from ..batch import run_site_batch, validate_site_batch_steps
+from ..docker.utils import get_shared_client
+
+batch_blueprint = Blueprint("batch", __name__)
+
+
+@batch_blueprint.route("/sites/<int:site_id>/batch", methods=["POST"])
+def site_batch_page(site_id: int) -> Union[Tuple[str, int], Response]:
+    """Runs a list of actions on a site in order, stopping at the first one that fails, and
+    returns the results of each one.
+
+    The site's data is passed once in the "data" parameter (like for update-nginx and
+    update-docker-service), and the steps in the "steps" parameter. See batch.py for the format.
+    """
+
+    if "data" not in request.form:
+        return "data parameter not passed", 400
+
+    if "steps" not in request.form:
+        return "steps parameter not passed", 400
+
+    try:
+        site_data = json.loads(request.form["data"])
+        steps = json.loads(request.form["steps"])
+    except ValueError:
+        return "Invalid data or steps", 400
+
+    if not validate_site_batch_steps(steps):
+        return "Invalid steps", 400
+
+    if len(steps) > settings.SITE_BATCH_MAX_STEPS:
+        return "Too many steps", 400
+
+    try:
+        result = run_site_batch(get_shared_client(), site_id, site_data, steps)
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Internal error", 500
+    else:
+        return Response(json.dumps(result), mimetype="application/json")
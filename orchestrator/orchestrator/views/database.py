@@ -2,11 +2,15 @@
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
 import json
-from typing import Tuple, Union
+import traceback
+from typing import Any, Callable, Dict, Generator, List, Tuple, Union
 
-from flask import Blueprint, current_app, request
+from flask import Blueprint, Response, current_app, request, stream_with_context
 
 from .. import database as database_utils
+from .. import settings
+from ..exceptions import OrchestratorActionError
+from ..utils import iter_chunks
 
 database_blueprint = Blueprint("databases", __name__)
 
@@ -30,6 +34,42 @@ def create_database_page() -> Union[str, Tuple[str, int]]:
         return "Success"
 
 
+@database_blueprint.route("/sites/databases/create-many", methods=["POST"])
+def create_many_databases_page() -> Union[Response, Tuple[str, int]]:
+    """Creates (or updates) many databases at once, using one connection per database host.
+
+    The "databases" parameter is a JSON list of the same objects /sites/databases/create takes.
+    Returns a JSON object with a "results" list containing one {"status": "ok"|"error"} object
+    per database.
+    """
+    if "databases" not in request.form:
+        return "databases parameter not passed", 400
+
+    try:
+        databases_info = json.loads(request.form["databases"])
+    except ValueError:
+        return "Invalid databases", 400
+
+    if not isinstance(databases_info, list):
+        return "Invalid databases", 400
+
+    if len(databases_info) > settings.DATABASE_BULK_MAX_DATABASES:
+        return "Too many databases", 400
+
+    try:
+        results = database_utils.create_many_databases(databases_info)
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.exception(
+            "Error creating site databases for path=%s remote_addr=%s content_length=%s",
+            request.path,
+            request.remote_addr,
+            request.content_length,
+        )
+        return "Error", 500
+    else:
+        return Response(json.dumps({"results": results}), mimetype="application/json")
+
+
 @database_blueprint.route("/sites/databases/delete", methods=["POST"])
 def delete_database_page() -> Union[str, Tuple[str, int]]:
     if "data" not in request.form:
@@ -49,23 +89,192 @@ def delete_database_page() -> Union[str, Tuple[str, int]]:
         return "Success"
 
 
+def _run_on_each_host(
+    func: Callable[[Dict[str, Any]], Any], result_key: str, description: str
+) -> Union[Response, Tuple[str, int]]:
+    """Runs ``func`` on each of the database hosts in the "hosts" parameter (a JSON list of
+    serialized DatabaseHosts), so the manager can collect statistics on all of them with one
+    request.
+
+    Returns a JSON object with a "results" list containing one {"status": "ok", result_key: ...}
+    or {"status": "error"} object per host.
+    """
+    if "hosts" not in request.form:
+        return "hosts parameter not passed", 400
+
+    try:
+        hosts_info = json.loads(request.form["hosts"])
+    except ValueError:
+        return "Invalid hosts", 400
+
+    if not isinstance(hosts_info, list):
+        return "Invalid hosts", 400
+
+    results: List[Dict[str, Any]] = []
+    for host_info in hosts_info:
+        try:
+            result = func(host_info)
+        except BaseException:  # pylint: disable=broad-except
+            current_app.logger.exception(
+                "Error getting %s for path=%s remote_addr=%s",
+                description,
+                request.path,
+                request.remote_addr,
+            )
+            results.append({"status": "error"})
+        else:
+            results.append({"status": "ok", result_key: result})
+
+    return Response(json.dumps({"results": results}), mimetype="application/json")
+
+
+@database_blueprint.route("/sites/databases/host-stats", methods=["POST"])
+def database_host_stats_page() -> Union[Response, Tuple[str, int]]:
+    """Collects statistics on the site databases on one or more database hosts (see
+    database.get_database_host_stats() and _run_on_each_host()).
+    """
+    return _run_on_each_host(database_utils.get_database_host_stats, "stats", "database host stats")
+
+
+@database_blueprint.route("/sites/databases/stats", methods=["POST"])
+def site_database_stats_page() -> Union[Response, Tuple[str, int]]:
+    """Collects statistics on each of the site databases on one or more database hosts (see
+    database.get_site_database_stats() and _run_on_each_host()), with one query per host.
+    """
+    return _run_on_each_host(
+        database_utils.get_site_database_stats, "databases", "site database stats"
+    )
+
+
 @database_blueprint.route("/sites/databases/query", methods=["POST"])
-def query_database_page() -> Union[str, Tuple[str, int]]:
+def query_database_page() -> Union[Response, Tuple[str, int]]:
+    """Runs a query on a site's database and streams the results.
+
+    The results are TSV by default, or NDJSON if the "format" parameter is "ndjson" (see
+    database.QueryResultFormatter). The "max_rows" and "max_bytes" parameters can lower the
+    limits on the output.
+    """
     if "database_info" not in request.form:
         return "database_info parameter not passed", 400
 
     if "sql" not in request.form:
         return "sql parameter not passed", 400
 
+    fmt = request.form.get("format", "tsv")
+    if fmt not in {"tsv", "ndjson"}:
+        return "Invalid format", 400
+
     try:
-        return database_utils.run_single_query(
-            json.loads(request.form["database_info"]), request.form["sql"]
-        )
-    except BaseException:  # pylint: disable=broad-except
+        max_rows = int(request.form["max_rows"]) if "max_rows" in request.form else None
+        max_bytes = int(request.form["max_bytes"]) if "max_bytes" in request.form else None
+    except ValueError:
+        return "Invalid limits", 400
+
+    def log_error() -> None:
         current_app.logger.exception(
             "Error running site database query for path=%s remote_addr=%s content_length=%s",
             request.path,
             request.remote_addr,
             request.content_length,
         )
+
+    try:
+        stream = database_utils.iter_query_results(
+            json.loads(request.form["database_info"]),
+            request.form["sql"],
+            fmt=fmt,
+            max_rows=max_rows,
+            max_bytes=max_bytes,
+        )
+
+        # Get the first chunk so we can see if there are any errors connecting
+        first_chunk = next(stream, "")
+    except BaseException:  # pylint: disable=broad-except
+        log_error()
         return "Error", 500
+
+    def stream_wrapper() -> Generator[str, None, None]:
+        yield first_chunk
+
+        try:
+            yield from stream
+        except Exception:  # pylint: disable=broad-except
+            # Too late to change the status code
+            log_error()
+
+    return Response(
+        stream_with_context(stream_wrapper()),
+        mimetype="application/x-ndjson" if fmt == "ndjson" else "text/plain",
+    )
+
+
+@database_blueprint.route("/sites/databases/export", methods=["POST"])
+def export_database_page() -> Union[Response, Tuple[str, int]]:
+    """Streams a gzip-compressed SQL dump of a site's database (see database.export_database())."""
+    if "database_info" not in request.form:
+        return "database_info parameter not passed", 400
+
+    try:
+        stream = database_utils.export_database(json.loads(request.form["database_info"]))
+
+        # Get the first chunk so we can see if there are any errors
+        try:
+            first_chunk = next(stream)
+        except StopIteration:
+            first_chunk = b""
+    except OrchestratorActionError as ex:
+        current_app.logger.error("%s", traceback.format_exc())
+        return str(ex), 500
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Error", 500
+
+    def stream_wrapper() -> Generator[bytes, None, None]:
+        if first_chunk:
+            yield first_chunk
+
+        try:
+            yield from stream
+        except Exception:  # pylint: disable=broad-except
+            # Too late to change the status code. The dump will be missing the end of the gzip
+            # stream, so it can't be mistaken for a complete one.
+            current_app.logger.error("%s", traceback.format_exc())
+
+    return Response(stream_with_context(stream_wrapper()), mimetype="application/gzip")
+
+
+@database_blueprint.route("/sites/databases/import", methods=["POST"])
+def import_database_page() -> Union[str, Tuple[str, int]]:
+    """Loads an SQL dump (sent as the request body, optionally gzip-compressed) into a site's
+    database (see database.import_database()).
+
+    The database's info is passed in the "Director-Database-Info" header, since the body is the
+    dump. The "max_size" parameter can lower the limit on the size of the dump.
+    """
+    if "Director-Database-Info" not in request.headers:
+        return "Director-Database-Info header not passed", 400
+
+    max_size = settings.DATABASE_IMPORT_MAX_BYTES
+    if "max_size" in request.args:
+        try:
+            max_size = min(int(request.args["max_size"]), max_size)
+        except ValueError:
+            return "Invalid max_size parameter", 400
+
+    if request.content_length is not None and request.content_length > max_size:
+        return "Database import too large", 413
+
+    try:
+        database_utils.import_database(
+            json.loads(request.headers["Director-Database-Info"]),
+            iter_chunks(request.stream, settings.FILE_STREAM_BUFSIZE),
+            max_size=max_size,
+        )
+    except OrchestratorActionError as ex:
+        current_app.logger.error("%s", traceback.format_exc())
+        return str(ex), 500
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Error", 500
+    else:
+        return "Success"
@@ -5,8 +5,9 @@ import json
 import traceback
 from typing import Tuple, Union
 
-from flask import Blueprint, current_app, request
+from flask import Blueprint, Response, current_app, request
 
+from .. import settings
 from ..docker.images import remove_docker_image
 from ..docker.registry import remove_registry_image
 from ..docker.services import (
@@ -14,8 +15,9 @@ from ..docker.services import (
     restart_director_service,
     update_director_service,
 )
-from ..docker.utils import create_client
+from ..docker.utils import get_shared_client
 from ..exceptions import OrchestratorActionError
+from ..status import fetch_site_statuses
 
 docker_blueprint = Blueprint("docker", __name__)
 
@@ -34,7 +36,7 @@ def update_docker_service_page(site_id: int) -> Union[str, Tuple[str, int]]:
         return "Error", 400
 
     try:
-        update_director_service(create_client(), site_id, json.loads(request.form["data"]))
+        update_director_service(get_shared_client(), site_id, json.loads(request.form["data"]))
     except OrchestratorActionError as ex:
         current_app.logger.error("%s", traceback.format_exc())
         return str(ex), 500
@@ -50,7 +52,7 @@ def restart_docker_service_page(site_id: int) -> Union[str, Tuple[str, int]]:
     """Restarts the Docker service for a given site."""
 
     try:
-        restart_director_service(create_client(), site_id)
+        restart_director_service(get_shared_client(), site_id)
     except OrchestratorActionError as ex:
         current_app.logger.error("%s", traceback.format_exc())
         return str(ex), 500
@@ -66,7 +68,7 @@ def remove_docker_service_page(site_id: int) -> Union[str, Tuple[str, int]]:
     """Removes the Docker service for a given site."""
 
     try:
-        remove_director_service(create_client(), site_id)
+        remove_director_service(get_shared_client(), site_id)
     except OrchestratorActionError as ex:
         current_app.logger.error("%s", traceback.format_exc())
         return str(ex), 500
@@ -77,6 +79,43 @@ def remove_docker_service_page(site_id: int) -> Union[str, Tuple[str, int]]:
         return "Success"
 
 
+@docker_blueprint.route("/sites/status", methods=["POST"])
+def multi_site_status_page() -> Union[Response, Tuple[str, int]]:
+    """Returns the statuses of several sites at once.
+
+    The sites are given as a JSON list of IDs in the "site_ids" form parameter (not the query
+    string, which can't hold enough of them). Returns a JSON list of {"site_id": ..., "status": ...}
+    objects (the same format as the multi-status websocket), where the status is null if the site
+    has no Docker service.
+    """
+
+    try:
+        site_ids = json.loads(request.form["site_ids"])
+    except (KeyError, ValueError):
+        return "Error", 400
+
+    if not isinstance(site_ids, list) or not all(
+        isinstance(site_id, int) and not isinstance(site_id, bool) for site_id in site_ids
+    ):
+        return "Error", 400
+
+    if not site_ids or len(site_ids) > settings.MULTI_SITE_STATUS_MAX_SITES:
+        return "Error", 400
+
+    try:
+        statuses = fetch_site_statuses(get_shared_client(), site_ids)
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Error", 500
+
+    return Response(
+        json.dumps(
+            [{"site_id": site_id, "status": status} for site_id, status in statuses.items()]
+        ),
+        mimetype="application/json",
+    )
+
+
 @docker_blueprint.route("/sites/remove-docker-image", methods=["POST"])
 def remove_docker_image_page() -> Union[str, Tuple[str, int]]:
     """Removes the Docker image with the given name."""
@@ -85,7 +124,7 @@ def remove_docker_image_page() -> Union[str, Tuple[str, int]]:
         return "Error", 400
 
     try:
-        remove_docker_image(create_client(), request.args["name"])
+        remove_docker_image(get_shared_client(), request.args["name"])
     except OrchestratorActionError as ex:
         current_app.logger.error("%s", traceback.format_exc())
         return str(ex), 500
@@ -1,6 +1,7 @@
 # SPDX-License-Identifier: MIT
 # (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
 
+import json
 import traceback
 from typing import Generator, Tuple, Union
 
@@ -14,10 +15,15 @@ from ..files import (
     create_site_file,
     download_zip_site_dir,
     ensure_site_directories_exist,
+    extract_site_archive,
+    list_many_site_directories,
+    list_site_directory_tree,
     make_site_directory,
     remove_site_directory_recur,
     remove_site_file,
     rename_path,
+    run_batch_file_operations,
+    search_site_files,
     stream_site_file,
     write_site_file,
 )
@@ -40,6 +46,62 @@ def ensure_site_directories_exist_page(site_id: int) -> Union[str, Tuple[str, in
         return "Success"
 
 
+@files.route("/sites/<int:site_id>/files/ls-many", methods=["POST"])
+def list_many_directories_page(site_id: int) -> Union[Tuple[str, int], Response]:
+    """List several directories in a site's directory at once"""
+
+    relpaths = request.form.getlist("path")
+    if not relpaths:
+        return "path parameter not passed", 400
+
+    if len(relpaths) > settings.FILE_LIST_MAX_PATHS:
+        return "Too many paths", 400
+
+    try:
+        listings = list_many_site_directories(site_id, relpaths)
+    except SiteFilesUserViewableException as ex:
+        current_app.logger.error("%s", traceback.format_exc())
+        return str(ex), 500
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Internal error", 500
+    else:
+        return Response(json.dumps(listings, separators=(",", ":")), mimetype="application/json")
+
+
+@files.route("/sites/<int:site_id>/files/ls-tree", methods=["GET"])
+def list_directory_tree_page(site_id: int) -> Union[Tuple[str, int], Response]:
+    """Recursively list a directory in a site's directory"""
+
+    try:
+        max_depth = min(
+            int(request.args.get("max_depth", settings.FILE_TREE_MAX_DEPTH)),
+            settings.FILE_TREE_MAX_DEPTH,
+        )
+        max_entries = min(
+            int(request.args.get("max_entries", settings.FILE_TREE_MAX_ENTRIES)),
+            settings.FILE_TREE_MAX_ENTRIES,
+        )
+    except ValueError:
+        return "Invalid limits", 400
+
+    if max_depth < 1 or max_entries < 1:
+        return "Invalid limits", 400
+
+    try:
+        tree = list_site_directory_tree(
+            site_id, request.args.get("path", ""), max_depth=max_depth, max_entries=max_entries
+        )
+    except SiteFilesUserViewableException as ex:
+        current_app.logger.error("%s", traceback.format_exc())
+        return str(ex), 500
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Internal error", 500
+    else:
+        return Response(json.dumps(tree, separators=(",", ":")), mimetype="application/json")
+
+
 @files.route("/sites/<int:site_id>/files/get", methods=["GET"])
 def get_file_page(site_id: int) -> Union[Tuple[str, int], Response]:
     """Stream a file from a site's directory"""
@@ -112,6 +174,53 @@ def download_zip_page(site_id: int) -> Union[Tuple[str, int], Response]:
         return Response(stream_wrapper(), mimetype="text/plain")
 
 
+@files.route("/sites/<int:site_id>/files/search", methods=["GET"])
+def search_files_page(site_id: int) -> Union[Tuple[str, int], Response]:
+    """Search the contents of files in a site's directory, streaming the results as NDJSON"""
+
+    if "q" not in request.args:
+        return "q parameter not passed", 400
+
+    # Passing "exclude" (even with an empty value) replaces the default list of excluded directories
+    exclude_dirs = None
+    if "exclude" in request.args:
+        exclude_dirs = [name for name in request.args.getlist("exclude") if name]
+
+    try:
+        stream = search_site_files(
+            site_id,
+            request.args.get("path", ""),
+            request.args["q"],
+            regex=bool(request.args.get("regex")),
+            ignore_case=bool(request.args.get("ignore_case")),
+            exclude_dirs=exclude_dirs,
+        )
+
+        # Get the first chunk so we can see if there are any errors
+        try:
+            first_chunk = next(stream)
+        except StopIteration:
+            first_chunk = b""
+    except SiteFilesUserViewableException as ex:
+        current_app.logger.error("%s", traceback.format_exc())
+        return str(ex), 500
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Internal error", 500
+    else:
+
+        def stream_wrapper() -> Generator[bytes, None, None]:
+            if first_chunk:
+                yield first_chunk
+
+            try:
+                yield from stream
+            except SiteFilesException:
+                pass
+
+        return Response(stream_wrapper(), mimetype="application/x-ndjson")
+
+
 @files.route("/sites/<int:site_id>/files/write", methods=["POST"])
 def write_file_page(site_id: int) -> Union[str, Tuple[str, int]]:
     """Write a file to a site's directory"""
@@ -119,12 +228,24 @@ def write_file_page(site_id: int) -> Union[str, Tuple[str, int]]:
     if "path" not in request.args:
         return "path parameter not passed", 400
 
+    # The manager passes the site's client body limit so it is enforced as the data streams in
+    max_size = settings.MAX_FILE_UPLOAD_BYTES
+    if "max_size" in request.args:
+        try:
+            max_size = min(int(request.args["max_size"]), max_size)
+        except ValueError:
+            return "Invalid max_size parameter", 400
+
+    if request.content_length is not None and request.content_length > max_size:
+        return "File too large", 413
+
     try:
         write_site_file(
             site_id,
             request.args["path"],
             iter_chunks(request.stream, settings.FILE_STREAM_BUFSIZE),
             mode_str=request.args.get("mode", None),
+            max_size=max_size,
         )
     except SiteFilesUserViewableException as ex:
         current_app.logger.error("%s", traceback.format_exc())
@@ -136,6 +257,50 @@ def write_file_page(site_id: int) -> Union[str, Tuple[str, int]]:
         return "Success"
 
 
+@files.route("/sites/<int:site_id>/files/extract", methods=["POST"])
+def extract_archive_page(site_id: int) -> Union[Tuple[str, int], Response]:
+    """Extract an uploaded archive into a directory in a site's directory, streaming progress
+    reports as NDJSON"""
+
+    if "format" not in request.args:
+        return "format parameter not passed", 400
+
+    try:
+        stream = extract_site_archive(
+            site_id,
+            request.args.get("path", ""),
+            iter_chunks(request.stream, settings.FILE_STREAM_BUFSIZE),
+            archive_format=request.args["format"],
+        )
+
+        # This consumes the whole upload, so errors in the archive usually show up here
+        try:
+            first_chunk = next(stream)
+        except StopIteration:
+            first_chunk = b""
+    except SiteFilesUserViewableException as ex:
+        current_app.logger.error("%s", traceback.format_exc())
+        return str(ex), 500
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Internal error", 500
+    else:
+
+        def stream_wrapper() -> Generator[bytes, None, None]:
+            if first_chunk:
+                yield first_chunk
+
+            # The status code has already been sent, so report errors in the stream instead
+            try:
+                yield from stream
+            except SiteFilesUserViewableException as ex:
+                yield json.dumps({"error": str(ex)}).encode() + b"\n"
+            except SiteFilesException:
+                yield json.dumps({"error": "Internal error"}).encode() + b"\n"
+
+        return Response(stream_wrapper(), mimetype="application/x-ndjson")
+
+
 @files.route("/sites/<int:site_id>/files/create", methods=["POST"])
 def create_file_page(site_id: int) -> Union[str, Tuple[str, int]]:
     """Create a file in a site's directory"""
@@ -246,3 +411,35 @@ def remove_directory_recur_page(site_id: int) -> Union[str, Tuple[str, int]]:
         return "Internal error", 500
     else:
         return "Success"
+
+
+@files.route("/sites/<int:site_id>/files/batch", methods=["POST"])
+def batch_page(site_id: int) -> Union[Tuple[str, int], Response]:
+    """Perform a list of file operations in one go, returning the results of each one"""
+
+    if "operations" not in request.form:
+        return "operations parameter not passed", 400
+
+    try:
+        operations = json.loads(request.form["operations"])
+    except ValueError:
+        return "Invalid operations", 400
+
+    if not isinstance(operations, list):
+        return "Invalid operations", 400
+
+    if len(operations) > settings.FILE_BATCH_MAX_OPERATIONS:
+        return "Too many operations", 400
+
+    try:
+        result = run_batch_file_operations(
+            site_id, operations, mode=request.form.get("mode", "continue")
+        )
+    except SiteFilesUserViewableException as ex:
+        current_app.logger.error("%s", traceback.format_exc())
+        return str(ex), 500
+    except BaseException:  # pylint: disable=broad-except
+        current_app.logger.error("%s", traceback.format_exc())
+        return "Internal error", 500
+    else:
+        return Response(json.dumps(result), mimetype="application/json")
@@ -9,7 +9,7 @@ from flask import Blueprint, current_app, request
 
 from ..configs.nginx import disable_nginx_config, remove_nginx_config, update_nginx_config
 from ..docker.services import reload_nginx_config
-from ..docker.utils import create_client
+from ..docker.utils import get_shared_client
 from ..exceptions import OrchestratorActionError
 
 nginx = Blueprint("nginx", __name__)
@@ -43,7 +43,7 @@ def update_nginx_page(site_id: int) -> Union[str, Tuple[str, int]]:
 def reload_nginx_page() -> Union[str, Tuple[str, int]]:
     """Reload the Nginx service's configuration."""
     try:
-        reload_nginx_config(create_client())
+        reload_nginx_config(get_shared_client())
     except OrchestratorActionError as ex:
         current_app.logger.error("%s", traceback.format_exc())
         return str(ex), 500
@@ -6,6 +6,8 @@ from __future__ import annotations
 import argparse
 import asyncio
 import concurrent.futures
+import http
+import json
 import logging
 import os
 import re
@@ -15,17 +17,26 @@ import sys
 from typing import Any, Awaitable, Callable, Dict, List, Optional, Pattern, Tuple
 
 import websockets
+from websockets.asyncio.server import ServerConnection
+from websockets.http11 import Request, Response
 
+from . import settings
 from .consumers import (
     build_image_handler,
+    database_console_handler,
     file_monitor_handler,
+    job_status_handler,
     logs_handler,
     multi_status_handler,
     remove_all_site_files_dangerous_handler,
     ssh_shell_handler,
     status_handler,
+    submit_job_handler,
     web_terminal_handler,
 )
+from .docker.utils import docker_client_manager
+from .jobs import job_runner
+from .terminal_pool import terminal_reaper
 from .websockets_types import WebSocketClientProtocol
 
 logger = logging.getLogger(__package__)  # Since this is run with "python -m orchestrator.ws"
@@ -81,9 +92,15 @@ async def route(
             remove_all_site_files_dangerous_handler,
         ),
         (re.compile(r"^/ws/sites/(?P<site_id>\d+)/logs/?$"), logs_handler),
+        (
+            re.compile(r"^/ws/sites/(?P<site_id>\d+)/database/console/?$"),
+            database_console_handler,
+        ),
         (re.compile(r"^/ws/sites/build-docker-image/?$"), build_image_handler),
         (re.compile(r"^/ws/sites/multi-status/?$"), multi_status_handler),
         (re.compile(r"^/ws/shell-server/(?P<site_id>\d+)/ssh-shell/?$"), ssh_shell_handler),
+        (re.compile(r"^/ws/jobs/submit/?$"), submit_job_handler),
+        (re.compile(r"^/ws/jobs/(?P<job_id>[0-9a-f]+)/?$"), job_status_handler),
     ]
 
     for route_re, handler in routes:
@@ -100,6 +117,36 @@ async def route(
             return
 
 
+JOB_PATH_RE = re.compile(r"^/jobs/(?P<job_id>[0-9a-f]+)/?$")
+
+
+def process_request(connection: ServerConnection, request: Request) -> Optional[Response]:
+    """Serves a few things over plain HTTP:
+    - Metrics for this process at /metrics
+    - The state of a job (as JSON) at /jobs/<job_id>, so clients can poll for it
+    Everything else goes on to the websocket handshake."""
+    if request.path == "/metrics":
+        return connection.respond(
+            http.HTTPStatus.OK,
+            docker_client_manager.metrics.format_prometheus()
+            + terminal_reaper.format_prometheus()
+            + job_runner.format_prometheus(),
+        )
+
+    match = JOB_PATH_RE.match(request.path)
+    if match is not None:
+        job = job_runner.get_job(match.group("job_id"))
+        if job is None:
+            return connection.respond(http.HTTPStatus.NOT_FOUND, "Job not found")
+
+        response = connection.respond(http.HTTPStatus.OK, json.dumps(job.serialize()))
+        del response.headers["Content-Type"]
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    return None
+
+
 stop_event = asyncio.Event()
 
 
@@ -157,11 +204,23 @@ def main(argv: List[str]) -> None:
     loop.add_signal_handler(signal.SIGTERM, sigterm_handler)
     loop.add_signal_handler(signal.SIGINT, sigint_handler)
 
+    # Terminals are only opened from here, so this is the process that cleans them up
+    terminal_reaper.start()
+
     loop.set_default_executor(
         concurrent.futures.ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 2) * 3))
     )
 
-    loop.run_until_complete(run_server(route, options.bind, options.port, ssl=ssl_context))
+    loop.run_until_complete(
+        run_server(
+            route,
+            options.bind,
+            options.port,
+            ssl=ssl_context,
+            process_request=process_request,
+            compression="deflate" if settings.WEBSOCKET_COMPRESSION else None,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+"""Compares the per-site server block Nginx config with the shared map config
+(settings.NGINX_USE_SITE_MAPS) at different numbers of sites.
+
+For each number of sites and each style, this generates the configs with the orchestrator's own
+code into a temporary directory, then measures:
+- How long generating them takes
+- How long `nginx -t` takes
+- How long a reload (SIGHUP) takes, from sending the signal until all the old workers have been
+  replaced by new ones
+- The memory used by the master and worker processes (RSS, and PSS if available) after starting
+  and after reloading
+
+Run it from the orchestrator directory, like:
+
+    pipenv run python scripts/benchmark-nginx-config.py --sites 1000 5000 10000
+
+It needs an `nginx` binary (see --nginx). Nginx is started as the current user, listening on
+--port instead of the port in the generated configs. Use --no-nginx to only time generating the
+configs.
+
+"""
+
+import argparse
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orchestrator import settings  # noqa: E402
+from orchestrator.configs import nginx as nginx_configs  # noqa: E402
+
+NGINX_CONF = """
+worker_processes {workers};
+pid {prefix}/nginx.pid;
+error_log {prefix}/error.log warn;
+
+events {{
+    worker_connections 1024;
+}}
+
+http {{
+    access_log off;
+    client_body_temp_path {prefix}/tmp;
+    proxy_temp_path {prefix}/tmp;
+    fastcgi_temp_path {prefix}/tmp;
+    uwsgi_temp_path {prefix}/tmp;
+    scgi_temp_path {prefix}/tmp;
+
+    include {prefix}/director.d/*.conf;
+}}
+"""
+
+
+def make_site_data(site_id: int, rand: random.Random) -> Dict[str, Any]:
+    """Makes up a site's data (in the format the manager sends), with a mix of types and
+    settings roughly like a real deployment."""
+    name = "site-{}".format(site_id)
+
+    roll = rand.random()
+    site_type = "static" if roll < 0.1 else "dynamic"
+    is_being_served = roll < 0.95 or roll >= 0.97
+
+    no_redirect_domains = ["{}.{}".format(name, settings.SITES_DOMAIN)]
+    primary_url_base = "https://{}.{}".format(name, settings.SITES_DOMAIN)
+    if rand.random() < 0.2:
+        domain = "{}.example.com".format(name)
+        no_redirect_domains.append(domain)
+        primary_url_base = "https://{}".format(domain)
+
+    return {
+        "name": name,
+        "type": site_type,
+        "is_being_served": is_being_served,
+        "no_redirect_domains": no_redirect_domains,
+        "primary_url_base": primary_url_base,
+        "resource_limits": {"client_body_limit": "50M" if rand.random() < 0.05 else "5M"},
+        "custom_nginx_config": (
+            "add_header X-Benchmark 1;" if site_type == "dynamic" and rand.random() < 0.02 else ""
+        ),
+    }
+
+
+def generate_configs(prefix: str, num_sites: int, use_site_maps: bool) -> float:
+    """Generates the configs for the given number of sites, returning how long it took."""
+    settings.NGINX_CONFIG_DIRECTORY = os.path.join(prefix, "director.d")
+    settings.NGINX_SITE_DATA_DIRECTORY = os.path.join(prefix, "director-sites")
+    settings.SITES_DIRECTORY = os.path.join(prefix, "sites")
+    settings.NGINX_USE_SITE_MAPS = use_site_maps
+    settings.DEBUG = True
+
+    os.makedirs(settings.NGINX_CONFIG_DIRECTORY)
+    os.makedirs(os.path.join(prefix, "tmp"))
+
+    rand = random.Random(num_sites)
+    sites_data = [make_site_data(site_id, rand) for site_id in range(1, num_sites + 1)]
+
+    start = time.perf_counter()
+    for site_id, site_data in enumerate(sites_data, 1):
+        nginx_configs.update_nginx_config(site_id, site_data)
+    nginx_configs.write_nginx_shared_config()
+    nginx_configs.write_nginx_site_maps_config()
+    return time.perf_counter() - start
+
+
+def use_port(prefix: str, port: int) -> None:
+    """Makes the generated configs listen on the given port (and only on IPv4)."""
+    config_dir = os.path.join(prefix, "director.d")
+    for filename in os.listdir(config_dir):
+        path = os.path.join(config_dir, filename)
+        with open(path) as f_obj:
+            text = f_obj.read()
+
+        text = text.replace("listen [::]:80;", "").replace("listen 80;", "listen {};".format(port))
+
+        with open(path, "w") as f_obj:
+            f_obj.write(text)
+
+
+def get_child_pids(pid: int) -> Set[int]:
+    children = set()
+    for task in os.listdir("/proc/{}/task".format(pid)):
+        try:
+            with open("/proc/{}/task/{}/children".format(pid, task)) as f_obj:
+                children.update(int(child) for child in f_obj.read().split())
+        except FileNotFoundError:
+            pass
+
+    return children
+
+
+def get_memory_usage(pids: Set[int]) -> Tuple[int, Optional[int]]:
+    """Returns the total RSS and PSS (None if it isn't available) of the given processes, in
+    bytes."""
+    rss = 0
+    pss: Optional[int] = 0
+    for pid in pids:
+        try:
+            with open("/proc/{}/status".format(pid)) as f_obj:
+                for line in f_obj:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+        except FileNotFoundError:
+            continue
+
+        try:
+            with open("/proc/{}/smaps_rollup".format(pid)) as f_obj:
+                for line in f_obj:
+                    if line.startswith("Pss:") and pss is not None:
+                        pss += int(line.split()[1]) * 1024
+        except (FileNotFoundError, PermissionError):
+            pss = None
+
+    return rss, pss
+
+
+def wait_for(condition: Any, timeout: float) -> float:
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("Timed out")
+        time.sleep(0.005)
+
+    return time.perf_counter() - start
+
+
+def benchmark_nginx(
+    nginx: str, prefix: str, workers: int, reloads: int, tests: int
+) -> Dict[str, Any]:
+    conf_path = os.path.join(prefix, "nginx.conf")
+    with open(conf_path, "w") as f_obj:
+        f_obj.write(NGINX_CONF.format(prefix=prefix, workers=workers))
+
+    results: Dict[str, Any] = {}
+
+    test_times = []
+    for _ in range(tests):
+        start = time.perf_counter()
+        subprocess.run(
+            [nginx, "-t", "-q", "-p", prefix, "-c", conf_path],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        test_times.append(time.perf_counter() - start)
+    results["test_time"] = statistics.median(test_times)
+
+    proc = subprocess.Popen(  # pylint: disable=consider-using-with
+        [nginx, "-p", prefix, "-c", conf_path, "-g", "daemon off;"],
+        stdin=subprocess.DEVNULL,
+    )
+    try:
+        results["start_time"] = wait_for(lambda: len(get_child_pids(proc.pid)) >= workers, 600)
+        results["memory"] = get_memory_usage({proc.pid} | get_child_pids(proc.pid))
+
+        reload_times = []
+        for _ in range(reloads):
+            old_workers = get_child_pids(proc.pid)
+
+            def reloaded(old_workers: Set[int] = old_workers) -> bool:
+                workers_now = get_child_pids(proc.pid)
+                return not workers_now & old_workers and len(workers_now) >= workers
+
+            os.kill(proc.pid, signal.SIGHUP)
+            reload_times.append(wait_for(reloaded, 600))
+
+        results["reload_time"] = statistics.median(reload_times)
+        results["memory_after_reload"] = get_memory_usage({proc.pid} | get_child_pids(proc.pid))
+    finally:
+        proc.send_signal(signal.SIGQUIT)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    return results
+
+
+def format_memory(memory: Tuple[int, Optional[int]]) -> str:
+    rss, pss = memory
+    if pss is None:
+        return "{:.1f} MiB RSS".format(rss / 2**20)
+
+    return "{:.1f} MiB RSS / {:.1f} MiB PSS".format(rss / 2**20, pss / 2**20)
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    parser.add_argument("--sites", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--nginx", default="nginx", help="Path to the nginx binary")
+    parser.add_argument("--no-nginx", action="store_true", help="Only time generating configs")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--reloads", type=int, default=5)
+    parser.add_argument("--tests", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    for num_sites in args.sites:
+        for style, use_site_maps in [("server blocks", False), ("maps", True)]:
+            with tempfile.TemporaryDirectory(prefix="director-nginx-benchmark-") as prefix:
+                generate_time = generate_configs(prefix, num_sites, use_site_maps)
+
+                print("{} sites, {}:".format(num_sites, style))
+                print("    generate configs:   {:.3f}s".format(generate_time))
+
+                if args.no_nginx:
+                    continue
+
+                use_port(prefix, args.port)
+                results = benchmark_nginx(
+                    args.nginx, prefix, args.workers, args.reloads, args.tests
+                )
+
+                print("    nginx -t:           {:.3f}s".format(results["test_time"]))
+                print("    start:              {:.3f}s".format(results["start_time"]))
+                print("    reload:             {:.3f}s".format(results["reload_time"]))
+                print("    memory:             {}".format(format_memory(results["memory"])))
+                print(
+                    "    memory (reloaded):  {}".format(
+                        format_memory(results["memory_after_reload"])
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# (c) 2019 The TJHSST Director 4.0 Development Team & Contributors
+
+"""Compares proxying to dynamic sites through per-site upstream blocks with keepalive connections
+(settings.NGINX_UPSTREAM_KEEPALIVE) against looking up the site's service and opening a new
+connection for every request.
+
+For each style, this generates the configs for a number of dynamic sites with the orchestrator's
+own code into a temporary directory and starts Nginx with them. The sites' "services" are all
+served by one small HTTP server, and their names are resolved by a small DNS server (standing in
+for Docker's). Requests are then sent to a random few of the sites for a while, and this reports:
+- Requests per second
+- The median and 99th percentile latency
+- How many connections Nginx opened to the sites, and how many DNS queries it sent
+
+Run it from the orchestrator directory, like:
+
+    pipenv run python scripts/benchmark-nginx-proxy.py --sites 1000 --concurrency 50
+
+It needs an `nginx` binary (see --nginx), version 1.27.3 or newer for the keepalive style. Nginx is
+started as the current user, listening on --port instead of the port in the generated configs.
+The load is generated from Python, so use several --processes if it can't keep up with Nginx.
+
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import signal
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orchestrator import settings  # noqa: E402
+from orchestrator.configs import nginx as nginx_configs  # noqa: E402
+
+NGINX_CONF = """
+worker_processes {workers};
+worker_rlimit_nofile 20000;
+pid {prefix}/nginx.pid;
+error_log {prefix}/error.log warn;
+
+events {{
+    worker_connections 8192;
+}}
+
+http {{
+    access_log off;
+    client_body_temp_path {prefix}/tmp;
+    proxy_temp_path {prefix}/tmp;
+    fastcgi_temp_path {prefix}/tmp;
+    uwsgi_temp_path {prefix}/tmp;
+    scgi_temp_path {prefix}/tmp;
+
+    include {prefix}/director.d/*.conf;
+}}
+"""
+
+DNS_TTL = 600
+
+
+class DNSProtocol(asyncio.DatagramProtocol):
+    """Answers every A query with 127.0.0.1 (and every other query with no records), like
+    Docker's DNS server answering for the sites' services."""
+
+    def __init__(self, counters: Dict[str, Any]) -> None:
+        self.counters = counters
+        self.transport: Any = None
+
+    def connection_made(self, transport: Any) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        with self.counters["dns_queries"].get_lock():
+            self.counters["dns_queries"].value += 1
+
+        query_id, _, qdcount = struct.unpack("!HHH", data[:6])
+        if qdcount != 1:
+            return
+
+        # Skip over the name's labels to find the question's type
+        pos = 12
+        while data[pos]:
+            pos += data[pos] + 1
+        qtype = struct.unpack("!H", data[pos + 1 : pos + 3])[0]
+        question = data[12 : pos + 5]
+
+        answers = b""
+        if qtype == 1:
+            address = socket.inet_aton("127.0.0.1")
+            answers = struct.pack("!HHHIH", 0xC00C, 1, 1, DNS_TTL, len(address)) + address
+
+        header = struct.pack("!HHHHHH", query_id, 0x8180, 1, 1 if answers else 0, 0, 0)
+        self.transport.sendto(header + question + answers, addr)
+
+
+async def handle_backend_connection(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, counters: Dict[str, Any]
+) -> None:
+    with counters["backend_connections"].get_lock():
+        counters["backend_connections"].value += 1
+
+    try:
+        while True:
+            request = await reader.readuntil(b"\r\n\r\n")
+
+            headers = request.decode("latin-1").lower()
+            match = re.search(r"^content-length:\s*(\d+)", headers, re.MULTILINE)
+            if match is not None:
+                await reader.readexactly(int(match.group(1)))
+
+            if counters["backend_delay"]:
+                await asyncio.sleep(counters["backend_delay"])
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n\r\nok"
+            )
+            await writer.drain()
+
+            if re.search(r"^connection:\s*close", headers, re.MULTILINE):
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def run_backend(backend_port: int, dns_port: int, counters: Dict[str, Any]) -> None:
+    """Runs the sites' HTTP server and the DNS server until terminated."""
+
+    async def main() -> None:
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(
+            lambda: DNSProtocol(counters), local_addr=("127.0.0.1", dns_port)
+        )
+        server = await asyncio.start_server(
+            lambda reader, writer: handle_backend_connection(reader, writer, counters),
+            "127.0.0.1",
+            backend_port,
+            backlog=4096,
+        )
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+async def send_requests(
+    port: int, hostnames: List[str], concurrency: int, warmup: float, duration: float
+) -> Tuple[int, int, List[float]]:
+    """Sends requests to the given sites over ``concurrency`` keepalive connections to Nginx.
+
+    Returns the number of successful and failed requests and the successful requests' latencies
+    (leaving out the first ``warmup`` seconds).
+
+    """
+    start = time.perf_counter()
+    measure_start = start + warmup
+    end = measure_start + duration
+
+    completed = 0
+    errors = 0
+    latencies: List[float] = []
+
+    async def worker() -> None:
+        nonlocal completed, errors
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while True:
+                request_start = time.perf_counter()
+                if request_start >= end:
+                    break
+
+                try:
+                    writer.write(
+                        "GET / HTTP/1.1\r\nHost: {0}\r\nOriginal-Host: {0}\r\n\r\n".format(
+                            random.choice(hostnames)
+                        ).encode()
+                    )
+                    response = await reader.readuntil(b"\r\n\r\n")
+                    match = re.search(rb"(?im)^content-length:\s*(\d+)", response)
+                    if match is not None:
+                        await reader.readexactly(int(match.group(1)))
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    errors += 1
+                    writer.close()
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                    continue
+
+                request_end = time.perf_counter()
+                if request_start < measure_start:
+                    continue
+
+                if response.startswith(b"HTTP/1.1 200 "):
+                    completed += 1
+                    latencies.append(request_end - request_start)
+                else:
+                    errors += 1
+
+                if re.search(rb"(?im)^connection:\s*close", response) or match is None:
+                    writer.close()
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return completed, errors, latencies
+
+
+def run_client(args: Tuple[int, List[str], int, float, float]) -> Tuple[int, int, List[float]]:
+    return asyncio.run(send_requests(*args))
+
+
+def generate_configs(prefix: str, args: argparse.Namespace, keepalive: int) -> None:
+    settings.NGINX_CONFIG_DIRECTORY = os.path.join(prefix, "director.d")
+    settings.NGINX_SITE_DATA_DIRECTORY = os.path.join(prefix, "director-sites")
+    settings.SITES_DIRECTORY = os.path.join(prefix, "sites")
+    settings.NGINX_USE_SITE_MAPS = args.site_maps
+    settings.NGINX_UPSTREAM_KEEPALIVE = keepalive
+    settings.NGINX_RESOLVER = "127.0.0.1:{}".format(args.dns_port)
+    settings.DEBUG = True
+
+    os.makedirs(settings.NGINX_CONFIG_DIRECTORY)
+    os.makedirs(os.path.join(prefix, "tmp"))
+
+    for site_id in range(1, args.sites + 1):
+        nginx_configs.update_nginx_config(
+            site_id,
+            {
+                "name": "site-{}".format(site_id),
+                "type": "dynamic",
+                "is_being_served": True,
+                "no_redirect_domains": [],
+                "primary_url_base": None,
+                "resource_limits": {"client_body_limit": "5M"},
+                "custom_nginx_config": "",
+            },
+        )
+    nginx_configs.write_nginx_shared_config()
+    nginx_configs.write_nginx_site_maps_config()
+
+    # Listen on --port, and send requests to the backend's port instead of the services' port 80.
+    # With upstream blocks, proxy_pass has to name the upstream exactly, so only the upstream
+    # servers' ports are changed.
+    config_dir = settings.NGINX_CONFIG_DIRECTORY
+    for filename in os.listdir(config_dir):
+        path = os.path.join(config_dir, filename)
+        with open(path) as f_obj:
+            text = f_obj.read()
+
+        text = text.replace("listen [::]:80;", "").replace(
+            "listen 80;", "listen {};".format(args.port)
+        )
+        text = re.sub(
+            r"server (site_\d+) resolve;", r"server \1:{} resolve;".format(args.backend_port), text
+        )
+        if not keepalive:
+            text = re.sub(r'"http://(site_\d+)"', r'"http://\1:{}"'.format(args.backend_port), text)
+
+        with open(path, "w") as f_obj:
+            f_obj.write(text)
+
+    with open(os.path.join(prefix, "nginx.conf"), "w") as f_obj:
+        f_obj.write(NGINX_CONF.format(prefix=prefix, workers=args.workers))
+
+
+def benchmark(args: argparse.Namespace, keepalive: int) -> Dict[str, Any]:
+    counters = {
+        "dns_queries": multiprocessing.Value("l", 0),
+        "backend_connections": multiprocessing.Value("l", 0),
+        "backend_delay": args.backend_delay / 1000,
+    }
+
+    backend = multiprocessing.Process(
+        target=run_backend, args=(args.backend_port, args.dns_port, counters), daemon=True
+    )
+    backend.start()
+
+    with tempfile.TemporaryDirectory(prefix="director-nginx-benchmark-") as prefix:
+        generate_configs(prefix, args, keepalive)
+
+        conf_path = os.path.join(prefix, "nginx.conf")
+        proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            [args.nginx, "-p", prefix, "-c", conf_path, "-g", "daemon off;"],
+            stdin=subprocess.DEVNULL,
+        )
+        try:
+            time.sleep(1)
+            if proc.poll() is not None:
+                raise RuntimeError("Nginx exited with status {}".format(proc.returncode))
+
+            rand = random.Random(args.sites)
+            hostnames = [
+                "site-{}.{}".format(site_id, settings.SITES_DOMAIN)
+                for site_id in rand.sample(
+                    range(1, args.sites + 1), min(args.active_sites, args.sites)
+                )
+            ]
+
+            counts_before = {
+                name: counters[name].value for name in ["dns_queries", "backend_connections"]
+            }
+
+            per_process = max(1, args.concurrency // args.processes)
+            with multiprocessing.Pool(args.processes) as pool:
+                client_results = pool.map(
+                    run_client,
+                    [(args.port, hostnames, per_process, args.warmup, args.duration)]
+                    * args.processes,
+                )
+        finally:
+            proc.send_signal(signal.SIGQUIT)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+            backend.terminate()
+            backend.join()
+
+    latencies = sorted(latency for _, _, result in client_results for latency in result)
+    completed = sum(result[0] for result in client_results)
+
+    return {
+        "requests_per_second": completed / args.duration,
+        "errors": sum(result[1] for result in client_results),
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p99": latencies[int(len(latencies) * 0.99)] if latencies else float("nan"),
+        # These include the warmup
+        "backend_connections": counters["backend_connections"].value
+        - counts_before["backend_connections"],
+        "dns_queries": counters["dns_queries"].value - counts_before["dns_queries"],
+    }
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    parser.add_argument("--sites", type=int, default=1000, help="Number of dynamic sites")
+    parser.add_argument(
+        "--active-sites", type=int, default=100, help="Number of sites requests are sent to"
+    )
+    parser.add_argument("--site-maps", action="store_true", help="Use NGINX_USE_SITE_MAPS")
+    parser.add_argument("--keepalive", type=int, default=settings.NGINX_UPSTREAM_KEEPALIVE)
+    parser.add_argument("--nginx", default="nginx", help="Path to the nginx binary")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--backend-port", type=int, default=8081)
+    parser.add_argument("--dns-port", type=int, default=8053)
+    parser.add_argument(
+        "--backend-delay", type=float, default=0, help="Milliseconds the sites take to respond"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args(argv)
+
+    for style, keepalive in [("current", 0), ("keepalive", args.keepalive)]:
+        results = benchmark(args, keepalive)
+
+        print("{} sites ({} active), {}:".format(args.sites, args.active_sites, style))
+        print("    requests/s:          {:.0f}".format(results["requests_per_second"]))
+        print("    errors:              {}".format(results["errors"]))
+        print("    p50 latency:         {:.2f}ms".format(results["p50"] * 1000))
+        print("    p99 latency:         {:.2f}ms".format(results["p99"] * 1000))
+        print("    backend connections: {}".format(results["backend_connections"]))
+        print("    DNS queries:         {}".format(results["dns_queries"]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
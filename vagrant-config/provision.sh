@@ -82,6 +82,8 @@ apt-get -y install libssl-dev libcrypto++-dev
 apt-get -y install htop
 # Build tooling for mysqlclient
 apt-get -y install build-essential pkg-config libmariadb-dev libmariadb-dev-compat
+# Used by the orchestrator to export and import site databases (pg_dump/psql come with PostgreSQL)
+apt-get -y install mariadb-client
 
 # Install pipenv/fabric in an isolated venv to avoid breaking system pip
 python3.13 -m venv /opt/pipenv